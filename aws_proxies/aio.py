@@ -0,0 +1,1045 @@
+# -*- coding: utf-8 -*-
+"""Asyncio engine (Python 3.5+)
+
+The AsyncProxies counterpart of Proxies runs the independent EC2 calls of each
+phase (vpc shards, subnets, network interfaces, elastic ips, instances...)
+concurrently on one event loop with an aiobotocore client, bounded by a semaphore.
+It shares the planner, the settings, the state store and the tracer with Proxies.
+
+It requires the optional aiobotocore dependency: pip install aws_proxies[async]
+"""
+import asyncio
+from botocore.exceptions import ClientError
+import logging
+from .base_resources import BaseResources
+from .launch_templates import LaunchTemplates
+from .proxies import Proxies
+from .security_groups import SecurityGroups
+from .state import VPC, INTERNET_GATEWAY, SUBNET, SECURITY_GROUP, ROUTE_TABLE, NETWORK_ACL, \
+    NETWORK_INTERFACE, ADDRESS, INSTANCE, LAUNCH_TEMPLATE
+from .utils import setup_logger, create_suffix, get_fleet_instances_filter, merge_config, \
+    get_network_interface_proxies_ips, iter_filters_batches, DESCRIBE_RESULT_KEYS
+
+
+class AsyncResources(BaseResources):
+    """Base asyncio ec2 resources representation
+    """
+
+    def __init__(self, ec2_client, tag_base_name, semaphore, **kwargs):
+        """Constructor
+
+        Args:
+            ec2_client (object): Aiobotocore ec2 client
+            tag_base_name (string): Tag base name
+            semaphore (object): Asyncio semaphore bounding the concurrent calls
+            **kwargs: Multiple arguments
+
+        Raises:
+            TypeError: Description
+        """
+        BaseResources.__init__(self, None, ec2_client, tag_base_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
+        self.semaphore = semaphore
+        log_level = kwargs.pop("log_level", logging.WARNING)
+        boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
+
+        if kwargs:
+            raise TypeError("Unexpected **kwargs: %r" % kwargs)
+        self.logger = setup_logger(__name__, log_level, boto_log_level)
+
+    async def call(self, operation, **params):
+        """Call an ec2 client operation
+
+        Args:
+            operation (string): Client method name
+            **params: Operation parameters
+
+        Returns:
+            dict: Operation response
+        """
+        async with self.semaphore:
+            with self.tracer.detached_span(operation):
+                return await getattr(self.ec2_client, operation)(**params)
+
+    async def tag(self, resource_id, type, index):
+        """Tag a resource using name with a suffix
+
+        Args:
+            resource_id (string): Resource ID
+            type (string): Resource type
+            index (integer): Resource index number
+        """
+        await self.call("create_tags", Resources=[resource_id], Tags=[
+            {
+                "Key": "Name",
+                "Value": self.tag_base_name + "-" + create_suffix(type, index)
+            }
+        ])
+
+    async def describe_resources(self, operation, filters):
+        """Describe resources, page by page (see utils.iter_resources)
+
+        With more filters values than EC2 accepts, the filter with the most
+        values is split into several calls.
+
+        Args:
+            operation (string): Describe operation (see utils.DESCRIBE_RESULT_KEYS)
+            filters (dict): Filter value(s) indexed by filter name. A filter without values matches nothing
+
+        Returns:
+            list: Resources descriptions, the instances out of their reservations
+        """
+        if any(filter_value == [] for filter_value in filters.values()):
+            return []
+
+        result_key = DESCRIBE_RESULT_KEYS[operation]
+        resources = []
+        for filters_batch in iter_filters_batches(filters):
+            if self.ec2_client.can_paginate(operation):
+                pages = [page async for page in self.ec2_client.get_paginator(operation).paginate(
+                    Filters=filters_batch)]
+            else:
+                pages = [await self.call(operation, Filters=filters_batch)]
+
+            for page in pages:
+                for description in page.get(result_key, []):
+                    resources.extend(description["Instances"] if result_key == "Reservations" else [description])
+
+        return resources
+
+    async def describe_fleet_resources(self, operation, resource_type, id_filter_name):
+        """Describe the fleet resources, starting from the state store
+
+        Args:
+            operation (string): Describe operation (see utils.DESCRIBE_RESULT_KEYS)
+            resource_type (string): Resource type
+            id_filter_name (string): Resource ID filter name
+
+        Returns:
+            list: Fleet resources descriptions
+        """
+        resources_ids = self.state_store.get_resource_ids(self.tag_base_name, resource_type)
+        if resources_ids:
+            resources = await self.describe_resources(operation, {id_filter_name: resources_ids})
+            if resources:
+                return resources
+
+        return await self.describe_resources(operation, {"tag:Name": self.tag_base_name + "-*"})
+
+
+class AsyncVpcs(AsyncResources):
+    """Asyncio vpcs representation
+    """
+
+    async def get_or_create(self, config):
+        """Get or create vpcs
+
+        Args:
+            config (list): Base vpcs config
+
+        Returns:
+            dict: Vpcs config indexed by vpc ID
+        """
+        async def get_or_create_vpc(index, vpc_config):
+            aws_vpcs = (await self.call("describe_vpcs", Filters=[
+                {
+                    "Name": "cidrBlock",
+                    "Values": [vpc_config["CidrBlock"]]
+                },
+                {
+                    "Name": "tag:Name",
+                    "Values": [self.tag_base_name + "-vpc-*"]
+                }
+            ]))["Vpcs"]
+
+            if aws_vpcs:
+                vpc_id = aws_vpcs[0]["VpcId"]
+            else:
+                vpc_id = (await self.call("create_vpc", CidrBlock=vpc_config["CidrBlock"]))["Vpc"]["VpcId"]
+
+            await self.tag(vpc_id, "vpc", vpc_config.get("Index", index))
+            self.record_resource(VPC, vpc_id, attributes={"CidrBlock": vpc_config["CidrBlock"]})
+
+            self.logger.info("A vpc with ID '%s' and cidr block '%s' has been created or already exists",
+                             vpc_id,
+                             vpc_config["CidrBlock"]
+                             )
+
+            vpc_config["VpcId"] = vpc_id
+            return vpc_config
+
+        vpcs_config = await asyncio.gather(*[
+            get_or_create_vpc(index, vpc_config) for index, vpc_config in enumerate(config)
+        ])
+
+        return dict((vpc_config["VpcId"], vpc_config) for vpc_config in vpcs_config)
+
+    async def delete(self):
+        """Delete vpcs
+        """
+        async def delete_vpc(aws_vpc):
+            await self.call("delete_vpc", VpcId=aws_vpc["VpcId"])
+            self.forget_resource(VPC, aws_vpc["VpcId"])
+            self.logger.info("The vpc with ID '%s' has been deleted ", aws_vpc["VpcId"])
+
+        aws_vpcs = await self.describe_fleet_resources("describe_vpcs", VPC, "vpc-id")
+        await asyncio.gather(*[delete_vpc(aws_vpc) for aws_vpc in aws_vpcs])
+
+
+class AsyncInternetGateways(AsyncResources):
+    """Asyncio internet gateways representation
+    """
+
+    async def get_or_create(self, config):
+        """Get or create internet gateways
+
+        Args:
+            config (dict): Vpcs config
+
+        Returns:
+            dict: Internet gateways config
+        """
+        async def get_or_create_internet_gateway(index, vpc_config):
+            aws_internet_gateways = (await self.call("describe_internet_gateways", Filters=[
+                {
+                    "Name": "attachment.vpc-id",
+                    "Values": [vpc_config["VpcId"]]
+                }
+            ]))["InternetGateways"]
+
+            if aws_internet_gateways:
+                internet_gateway_id = aws_internet_gateways[0]["InternetGatewayId"]
+            else:
+                internet_gateway_id = (await self.call("create_internet_gateway"))["InternetGateway"][
+                    "InternetGatewayId"]
+                await self.call("attach_internet_gateway", InternetGatewayId=internet_gateway_id,
+                                VpcId=vpc_config["VpcId"])
+
+            await self.tag(internet_gateway_id, "ig", vpc_config.get("Index", index))
+            self.record_resource(INTERNET_GATEWAY, internet_gateway_id, parent_id=vpc_config["VpcId"])
+
+            self.logger.info(
+                "An internet gateway with ID '%s' attached to vpc '%s' has been created or already exists",
+                internet_gateway_id,
+                vpc_config["VpcId"]
+            )
+
+            return vpc_config["VpcId"], {
+                "InternetGateways": [
+                    {
+                        "InternetGatewayId": internet_gateway_id
+                    }
+                ]
+            }
+
+        created_resources = dict(
+            (vpc_config["VpcId"], {"InternetGateways": []}) for vpc_config in config.values()
+        )
+        created_resources.update(await asyncio.gather(*[
+            get_or_create_internet_gateway(index, vpc_config)
+            for index, vpc_config in enumerate(config.values()) if "CreateInternetGateway" in vpc_config
+        ]))
+
+        return created_resources
+
+    async def delete(self):
+        """Delete internet gateways
+        """
+        async def delete_internet_gateway(aws_internet_gateway):
+            for attachment in aws_internet_gateway.get("Attachments", []):
+                await self.call("detach_internet_gateway",
+                                InternetGatewayId=aws_internet_gateway["InternetGatewayId"],
+                                VpcId=attachment["VpcId"])
+
+            await self.call("delete_internet_gateway", InternetGatewayId=aws_internet_gateway["InternetGatewayId"])
+            self.forget_resource(INTERNET_GATEWAY, aws_internet_gateway["InternetGatewayId"])
+            self.logger.info("The internet_gateway with ID '%s' has been deleted ",
+                             aws_internet_gateway["InternetGatewayId"])
+
+        aws_internet_gateways = await self.describe_fleet_resources(
+            "describe_internet_gateways", INTERNET_GATEWAY, "internet-gateway-id")
+        await asyncio.gather(*[
+            delete_internet_gateway(aws_internet_gateway) for aws_internet_gateway in aws_internet_gateways
+        ])
+
+
+class AsyncSubnets(AsyncResources):
+    """Asyncio subnets representation
+    """
+
+    async def get_or_create(self, config):
+        """Get or create subnets
+
+        Args:
+            config (dict): Vpcs config
+
+        Returns:
+            dict: Subnets configs
+        """
+        async def get_or_create_subnet(vpc_id, index, subnet_config):
+            aws_subnets = (await self.call("describe_subnets", Filters=[
+                {
+                    "Name": "vpc-id",
+                    "Values": [vpc_id]
+                },
+                {
+                    "Name": "cidrBlock",
+                    "Values": [subnet_config["CidrBlock"]]
+                }
+            ]))["Subnets"]
+
+            if aws_subnets:
+                aws_subnet = aws_subnets[0]
+            else:
+                subnet_params = {
+                    "VpcId": vpc_id,
+                    "CidrBlock": subnet_config["CidrBlock"]
+                }
+                if subnet_config.get("AvailabilityZone"):
+                    subnet_params["AvailabilityZone"] = subnet_config["AvailabilityZone"]
+
+                aws_subnet = (await self.call("create_subnet", **subnet_params))["Subnet"]
+
+            await self.tag(aws_subnet["SubnetId"], "subnet", index)
+            self.record_resource(SUBNET, aws_subnet["SubnetId"], parent_id=vpc_id,
+                                 attributes={"CidrBlock": subnet_config["CidrBlock"]})
+
+            self.logger.info(
+                "A subnet with ID '%s', cidr block '%s' and attached to vpc '%s' has been created or already exists",
+                aws_subnet["SubnetId"],
+                subnet_config["CidrBlock"],
+                vpc_id
+            )
+
+            return {
+                "SubnetId": aws_subnet["SubnetId"],
+                "CidrBlock": subnet_config["CidrBlock"],
+                "AvailabilityZone": aws_subnet["AvailabilityZone"],
+                "NetworkInterfaces": subnet_config["NetworkInterfaces"]
+            }
+
+        async def get_or_create_vpc_subnets(vpc_config):
+            subnets = await asyncio.gather(*[
+                get_or_create_subnet(vpc_config["VpcId"], index, subnet_config)
+                for index, subnet_config in enumerate(vpc_config.get("Subnets", []))
+            ])
+            return vpc_config["VpcId"], {
+                "Subnets": list(subnets)
+            }
+
+        return dict(await asyncio.gather(*[
+            get_or_create_vpc_subnets(vpc_config) for vpc_config in config.values()
+        ]))
+
+    async def delete(self):
+        """Delete subnets
+        """
+        async def delete_subnet(aws_subnet):
+            await self.call("delete_subnet", SubnetId=aws_subnet["SubnetId"])
+            self.forget_resource(SUBNET, aws_subnet["SubnetId"])
+
+        aws_subnets = await self.describe_fleet_resources("describe_subnets", SUBNET, "subnet-id")
+        await asyncio.gather(*[delete_subnet(aws_subnet) for aws_subnet in aws_subnets])
+
+
+class AsyncSecurityGroups(AsyncResources):
+    """Asyncio security groups representation
+    """
+
+    async def get_or_create(self, config):
+        """Get or create security groups and reconcile their rules
+
+        Args:
+            config (dict): Vpcs config
+
+        Returns:
+            dict: Security groups configs
+        """
+        async def reconcile_rules(group_id, configured_permissions, existing_permissions, direction):
+            missing_rules, stale_rules = SecurityGroups.diff_rules(configured_permissions, existing_permissions)
+            if missing_rules:
+                await self.call("authorize_security_group_" + direction, GroupId=group_id,
+                                IpPermissions=SecurityGroups.build_ip_permissions(missing_rules))
+            if stale_rules:
+                await self.call("revoke_security_group_" + direction, GroupId=group_id,
+                                IpPermissions=SecurityGroups.build_ip_permissions(stale_rules))
+
+        async def get_or_create_security_group(vpc_id, index, sg, aws_security_groups):
+            if sg["GroupName"] in aws_security_groups:
+                aws_security_group = aws_security_groups[sg["GroupName"]]
+            else:
+                group_id = (await self.call("create_security_group", VpcId=vpc_id, GroupName=sg["GroupName"],
+                                            Description=sg["Description"]))["GroupId"]
+                # New security groups allow all the outbound traffic only
+                aws_security_group = {
+                    "GroupId": group_id,
+                    "IpPermissions": [],
+                    "IpPermissionsEgress": [
+                        {
+                            "IpProtocol": "-1",
+                            "IpRanges": [
+                                {
+                                    "CidrIp": "0.0.0.0/0"
+                                }
+                            ]
+                        }
+                    ]
+                }
+
+            group_id = aws_security_group["GroupId"]
+            if "IngressRules" in sg:
+                await reconcile_rules(group_id, sg["IngressRules"], aws_security_group["IpPermissions"], "ingress")
+            if "EgressRules" in sg:
+                await reconcile_rules(group_id, sg["EgressRules"], aws_security_group["IpPermissionsEgress"], "egress")
+
+            await self.tag(group_id, "sg", index)
+            self.record_resource(SECURITY_GROUP, group_id, parent_id=vpc_id, attributes={"GroupName": sg["GroupName"]})
+
+            return {
+                "SecurityGroupId": group_id,
+                "GroupName": sg["GroupName"],
+                "Description": sg["Description"]
+            }
+
+        async def get_or_create_vpc_security_groups(vpc_config):
+            aws_security_groups = dict(
+                (aws_security_group["GroupName"], aws_security_group)
+                for aws_security_group in (await self.call("describe_security_groups", Filters=[
+                    {
+                        "Name": "vpc-id",
+                        "Values": [vpc_config["VpcId"]]
+                    }
+                ]))["SecurityGroups"]
+            )
+            security_groups = await asyncio.gather(*[
+                get_or_create_security_group(vpc_config["VpcId"], index, sg, aws_security_groups)
+                for index, sg in enumerate(vpc_config.get("SecurityGroups", []))
+            ])
+            return vpc_config["VpcId"], {
+                "SecurityGroups": list(security_groups)
+            }
+
+        return dict(await asyncio.gather(*[
+            get_or_create_vpc_security_groups(vpc_config) for vpc_config in config.values()
+        ]))
+
+    async def delete(self):
+        """Delete security groups
+        """
+        async def delete_security_group(aws_security_group):
+            await self.call("delete_security_group", GroupId=aws_security_group["GroupId"])
+            self.forget_resource(SECURITY_GROUP, aws_security_group["GroupId"])
+
+        aws_security_groups = await self.describe_fleet_resources(
+            "describe_security_groups", SECURITY_GROUP, "group-id")
+        await asyncio.gather(*[
+            delete_security_group(aws_security_group) for aws_security_group in aws_security_groups
+            if aws_security_group["GroupName"] != "default"
+        ])
+
+
+class AsyncRouteTables(AsyncResources):
+    """Asyncio route tables representation
+    """
+
+    async def get_or_create(self, config):
+        """Get or create the vpcs route tables, associate the subnets and route the internet gateways
+
+        Args:
+            config (dict): Vpcs config
+
+        Returns:
+            dict: Route tables configs
+        """
+        async def get_or_create_route_table(index, vpc_config):
+            vpc_id = vpc_config["VpcId"]
+            aws_route_tables = (await self.call("describe_route_tables", Filters=[
+                {
+                    "Name": "vpc-id",
+                    "Values": [vpc_id]
+                }
+            ]))["RouteTables"]
+
+            if aws_route_tables:
+                aws_route_table = aws_route_tables[0]
+            else:
+                aws_route_table = (await self.call("create_route_table", VpcId=vpc_id))["RouteTable"]
+                aws_route_tables = [aws_route_table]
+
+            route_table_id = aws_route_table["RouteTableId"]
+            await self.tag(route_table_id, "rt", vpc_config.get("Index", index))
+            self.record_resource(ROUTE_TABLE, route_table_id, parent_id=vpc_id)
+
+            associated_subnets_ids = set(
+                association["SubnetId"]
+                for route_table in aws_route_tables
+                for association in route_table.get("Associations", [])
+                if association.get("SubnetId")
+            )
+            await asyncio.gather(*[
+                self.call("associate_route_table", RouteTableId=route_table_id, SubnetId=subnet["SubnetId"])
+                for subnet in vpc_config.get("Subnets", []) if subnet["SubnetId"] not in associated_subnets_ids
+            ])
+
+            if vpc_config.get("InternetGateways"):
+                internet_gateway_id = vpc_config["InternetGateways"][0]["InternetGatewayId"]
+                default_routes = [
+                    route for route in aws_route_table.get("Routes", [])
+                    if route.get("DestinationCidrBlock") == "0.0.0.0/0"
+                ]
+                if not default_routes:
+                    await self.call("create_route", RouteTableId=route_table_id,
+                                    DestinationCidrBlock="0.0.0.0/0", GatewayId=internet_gateway_id)
+                elif default_routes[0].get("GatewayId") != internet_gateway_id:
+                    await self.call("replace_route", RouteTableId=route_table_id,
+                                    DestinationCidrBlock="0.0.0.0/0", GatewayId=internet_gateway_id)
+
+            return vpc_id, {
+                "RouteTables": [
+                    {
+                        "RouteTableId": route_table_id
+                    }
+                ]
+            }
+
+        return dict(await asyncio.gather(*[
+            get_or_create_route_table(index, vpc_config) for index, vpc_config in enumerate(config.values())
+        ]))
+
+    async def delete(self):
+        """Delete route tables
+        """
+        async def delete_route_table(aws_route_table):
+            is_main_route_table = True
+            for association in aws_route_table.get("Associations", []):
+                if not association.get("Main"):
+                    is_main_route_table = False
+                    await self.call("disassociate_route_table",
+                                    AssociationId=association["RouteTableAssociationId"])
+
+            await asyncio.gather(*[
+                self.call("delete_route", RouteTableId=aws_route_table["RouteTableId"],
+                          DestinationCidrBlock=route["DestinationCidrBlock"])
+                for route in aws_route_table.get("Routes", [])
+                if route.get("GatewayId") != "local" and "DestinationCidrBlock" in route
+            ])
+
+            if not is_main_route_table:
+                await self.call("delete_route_table", RouteTableId=aws_route_table["RouteTableId"])
+                self.forget_resource(ROUTE_TABLE, aws_route_table["RouteTableId"])
+
+        aws_route_tables = await self.describe_fleet_resources("describe_route_tables", ROUTE_TABLE, "route-table-id")
+        await asyncio.gather(*[delete_route_table(aws_route_table) for aws_route_table in aws_route_tables])
+
+
+class AsyncNetworkAcls(AsyncResources):
+    """Asyncio network acls representation
+    """
+
+    async def get_or_create(self, config):
+        """Get or create network acls
+
+        Args:
+            config (dict): Vpcs config
+
+        Returns:
+            dict: Network acls configs
+        """
+        async def get_or_create_network_acl(index, vpc_config):
+            vpc_id = vpc_config["VpcId"]
+            aws_network_acls = (await self.call("describe_network_acls", Filters=[
+                {
+                    "Name": "vpc-id",
+                    "Values": [vpc_id]
+                }
+            ]))["NetworkAcls"]
+
+            if aws_network_acls:
+                network_acl_id = aws_network_acls[0]["NetworkAclId"]
+            else:
+                network_acl_id = (await self.call("create_network_acl", VpcId=vpc_id))["NetworkAcl"]["NetworkAclId"]
+
+            await self.tag(network_acl_id, "netacl", vpc_config.get("Index", index))
+            self.record_resource(NETWORK_ACL, network_acl_id, parent_id=vpc_id)
+
+            return vpc_id, {
+                "NetworkAcls": [
+                    {
+                        "NetworkAclId": network_acl_id
+                    }
+                ]
+            }
+
+        return dict(await asyncio.gather(*[
+            get_or_create_network_acl(index, vpc_config) for index, vpc_config in enumerate(config.values())
+        ]))
+
+    async def delete(self):
+        """Delete network acls
+        """
+        async def delete_network_acl(aws_network_acl):
+            await self.call("delete_network_acl", NetworkAclId=aws_network_acl["NetworkAclId"])
+            self.forget_resource(NETWORK_ACL, aws_network_acl["NetworkAclId"])
+
+        aws_network_acls = await self.describe_fleet_resources("describe_network_acls", NETWORK_ACL, "network-acl-id")
+        await asyncio.gather(*[
+            delete_network_acl(aws_network_acl) for aws_network_acl in aws_network_acls
+            if not aws_network_acl.get("IsDefault")
+        ])
+
+
+class AsyncNetworkInterfaces(AsyncResources):
+    """Asyncio network interfaces representation
+    """
+
+    async def create(self, config):
+        """Create the network interfaces, reusing the recorded ones
+
+        Args:
+            config (dict): Vpcs config
+        """
+        recorded_enis = self.state_store.get_resources_by_uid(self.tag_base_name, NETWORK_INTERFACE)
+        aws_enis = await self.describe_resources("describe_network_interfaces", {
+            "network-interface-id": [recorded_eni["ResourceId"] for recorded_eni in recorded_enis.values()]
+        })
+        existing_enis_ids = set(aws_eni["NetworkInterfaceId"] for aws_eni in aws_enis)
+
+        async def create_eni(subnet, index, eni):
+            recorded_eni = recorded_enis.get(eni["uid"])
+            if recorded_eni is not None and recorded_eni["ResourceId"] in existing_enis_ids:
+                eni_id = recorded_eni["ResourceId"]
+            else:
+                eni_id = (await self.call(
+                    "create_network_interface",
+                    SubnetId=subnet["SubnetId"],
+                    SecondaryPrivateIpAddressCount=eni["Ips"]["SecondaryPrivateIpAddressCount"],
+                    TagSpecifications=[
+                        {
+                            "ResourceType": "network-interface",
+                            "Tags": [
+                                {
+                                    "Key": "Name",
+                                    "Value": self.tag_base_name + "-" + create_suffix("eni", index)
+                                },
+                                {
+                                    "Key": "uid",
+                                    "Value": eni["uid"]
+                                }
+                            ]
+                        }
+                    ]
+                ))["NetworkInterface"]["NetworkInterfaceId"]
+
+            self.record_resource(NETWORK_INTERFACE, eni_id, uid=eni["uid"], parent_id=subnet["SubnetId"])
+
+        enis = []
+        for vpc_config in config.values():
+            index = 0
+            for subnet in vpc_config["Subnets"]:
+                for eni in subnet["NetworkInterfaces"]:
+                    enis.append(create_eni(subnet, index, eni))
+                    index = index + 1
+
+        await asyncio.gather(*enis)
+
+    async def associate_public_ips_to_enis(self):
+        """Allocate and associate an elastic ip to every private ip without one
+        """
+        async def allocate_and_associate_address(aws_eni, private_ip_address):
+            aws_eip_alloc = await self.call("allocate_address", Domain="vpc")
+            # Record the allocation before associating it so that it is not leaked on failure
+            self.record_resource(
+                ADDRESS, aws_eip_alloc["AllocationId"], parent_id=aws_eni["NetworkInterfaceId"], attributes={
+                    "PublicIp": aws_eip_alloc["PublicIp"],
+                    "PrivateIpAddress": private_ip_address
+                })
+            await self.call("associate_address", AllocationId=aws_eip_alloc["AllocationId"],
+                            NetworkInterfaceId=aws_eni["NetworkInterfaceId"], PrivateIpAddress=private_ip_address)
+
+        aws_enis = await self.describe_fleet_resources(
+            "describe_network_interfaces", NETWORK_INTERFACE, "network-interface-id")
+        await asyncio.gather(*[
+            allocate_and_associate_address(aws_eni, aws_private_ip_address["PrivateIpAddress"])
+            for aws_eni in aws_enis
+            for aws_private_ip_address in aws_eni["PrivateIpAddresses"]
+            if "Association" not in aws_private_ip_address
+        ])
+
+    async def release_public_ips(self):
+        """Dissociate and release the elastic ips, including the recorded unassociated ones
+        """
+        async def release_address(allocation_id, association_id=None):
+            try:
+                if association_id is not None:
+                    await self.call("disassociate_address", AssociationId=association_id)
+                await self.call("release_address", AllocationId=allocation_id)
+            except ClientError as e:
+                self.logger.info("The public IP allocation '%s' can not be released (%s)", allocation_id, e)
+            self.forget_resource(ADDRESS, allocation_id)
+
+        aws_enis = await self.describe_fleet_resources(
+            "describe_network_interfaces", NETWORK_INTERFACE, "network-interface-id")
+        aws_addresses = await self.describe_resources("describe_addresses", {
+            "network-interface-id": [aws_eni["NetworkInterfaceId"] for aws_eni in aws_enis]
+        })
+
+        allocations = dict(
+            (aws_address["AllocationId"], aws_address.get("AssociationId")) for aws_address in aws_addresses
+        )
+        for address in self.state_store.get_resources(self.tag_base_name, ADDRESS):
+            allocations.setdefault(address["ResourceId"], None)
+
+        await asyncio.gather(*[
+            release_address(allocation_id, association_id) for allocation_id, association_id in allocations.items()
+        ])
+
+    async def delete(self):
+        """Detach and delete the network interfaces
+        """
+        async def delete_eni(aws_eni):
+            attachment = aws_eni.get("Attachment")
+            if attachment is not None and attachment.get("Status") in ("attaching", "attached"):
+                await self.call("detach_network_interface", AttachmentId=attachment["AttachmentId"])
+            await self.call("delete_network_interface", NetworkInterfaceId=aws_eni["NetworkInterfaceId"])
+            self.forget_resource(NETWORK_INTERFACE, aws_eni["NetworkInterfaceId"])
+
+        aws_enis = await self.describe_fleet_resources(
+            "describe_network_interfaces", NETWORK_INTERFACE, "network-interface-id")
+        await asyncio.gather(*[delete_eni(aws_eni) for aws_eni in aws_enis])
+
+
+class AsyncInstances(AsyncResources):
+    """Asyncio instances representation
+    """
+
+    async def get_or_create_launch_template(self, instance_group, group_index=0):
+        """Get or create the launch template version of an instances group
+
+        Args:
+            instance_group (dict): Instances group config
+            group_index (integer, optional): Instances group index
+
+        Returns:
+            dict: Launch template specification
+        """
+        launch_template_name = self.tag_base_name + "-lt-" + str(group_index)
+        launch_template_data = LaunchTemplates.get_launch_template_data(instance_group)
+        launch_template_hash = LaunchTemplates.get_launch_template_hash(launch_template_data)
+
+        aws_launch_templates = (await self.call("describe_launch_templates", Filters=[
+            {
+                "Name": "launch-template-name",
+                "Values": [launch_template_name]
+            }
+        ]))["LaunchTemplates"]
+
+        version = None
+        if not aws_launch_templates:
+            aws_launch_template = (await self.call(
+                "create_launch_template", LaunchTemplateName=launch_template_name,
+                VersionDescription=launch_template_hash, LaunchTemplateData=launch_template_data
+            ))["LaunchTemplate"]
+            launch_template_id = aws_launch_template["LaunchTemplateId"]
+            version = aws_launch_template["LatestVersionNumber"]
+        else:
+            launch_template_id = aws_launch_templates[0]["LaunchTemplateId"]
+            for aws_version in (await self.call("describe_launch_template_versions",
+                                                LaunchTemplateId=launch_template_id))["LaunchTemplateVersions"]:
+                if aws_version.get("VersionDescription") == launch_template_hash:
+                    version = aws_version["VersionNumber"]
+                    break
+
+            if version is None:
+                version = (await self.call(
+                    "create_launch_template_version", LaunchTemplateId=launch_template_id,
+                    VersionDescription=launch_template_hash, LaunchTemplateData=launch_template_data
+                ))["LaunchTemplateVersion"]["VersionNumber"]
+
+        self.record_resource(LAUNCH_TEMPLATE, launch_template_id, uid=launch_template_name, attributes={
+            "Version": version,
+            "Hash": launch_template_hash
+        })
+
+        return {
+            "LaunchTemplateId": launch_template_id,
+            "Version": str(version)
+        }
+
+    async def create(self, instances_groups_config):
+        """Launch the instances concurrently, skipping the recorded running ones
+
+        The fleet launch mode, placement groups and availability zone spill-over
+        are only supported by Proxies.
+
+        Args:
+            instances_groups_config (list): Instances groups config
+
+        Returns:
+            list: Launched instances config
+        """
+        recorded_instances = self.state_store.get_resources_by_uid(self.tag_base_name, INSTANCE)
+        aws_instances = await self.describe_resources("describe_instances", {
+            "instance-id": [recorded_instance["ResourceId"] for recorded_instance in recorded_instances.values()],
+            "instance-state-name": ["pending", "running"]
+        })
+        alive_instances_ids = set(aws_instance["InstanceId"] for aws_instance in aws_instances)
+
+        recorded_enis = self.state_store.get_resources_by_uid(self.tag_base_name, NETWORK_INTERFACE)
+
+        async def launch(launch_template, instance_index, instance):
+            instance_config = {
+                "LaunchTemplate": launch_template,
+                "MinCount": 1,
+                "MaxCount": 1,
+                "NetworkInterfaces": [
+                    {
+                        "NetworkInterfaceId": recorded_enis[eni["uid"]]["ResourceId"],
+                        "DeviceIndex": index
+                    }
+                    for index, eni in enumerate(instance["NetworkInterfaces"])
+                ],
+                "TagSpecifications": [
+                    {
+                        "ResourceType": "instance",
+                        "Tags": [
+                            {
+                                "Key": "Name",
+                                "Value": self.tag_base_name + "-" + create_suffix("i", instance_index)
+                            }
+                        ]
+                    }
+                ]
+            }
+            aws_reservation = await self.call("run_instances", **instance_config)
+            instance_id = aws_reservation["Instances"][0]["InstanceId"]
+            self.record_resource(INSTANCE, instance_id, uid="i-" + str(instance_index), attributes={
+                "NetworkInterfaceIds": [eni["NetworkInterfaceId"] for eni in instance_config["NetworkInterfaces"]],
+                "AvailabilityZone": instance.get("AvailabilityZone")
+            })
+            instance_config["InstanceId"] = instance_id
+
+            return instance_config
+
+        launches = []
+        for group_index, instance_group in enumerate(instances_groups_config):
+            if instance_group.get("LaunchMode") == "fleet" or instance_group.get("PlacementStrategy"):
+                raise ValueError("The fleet launch mode and placement groups are only supported by Proxies")
+
+            launch_template = await self.get_or_create_launch_template(instance_group, group_index)
+            for instance_index, instance in enumerate(instance_group["Instances"]):
+                recorded_instance = recorded_instances.get("i-" + str(instance_index))
+                if recorded_instance is not None and recorded_instance["ResourceId"] in alive_instances_ids:
+                    continue
+                launches.append(launch(launch_template, instance_index, instance))
+
+        return list(await asyncio.gather(*launches))
+
+    async def terminate(self):
+        """Terminate the fleet instances and wait for them to be terminated
+        """
+        instances_ids = []
+        filters = get_fleet_instances_filter(self.state_store, self.tag_base_name)
+        filters["instance-state-name"] = ["pending", "running", "stopping", "stopped"]
+        paginator = self.ec2_client.get_paginator("describe_instances")
+        for filters_batch in iter_filters_batches(filters):
+            async for page in paginator.paginate(Filters=filters_batch):
+                for reservation in page["Reservations"]:
+                    instances_ids.extend(aws_instance["InstanceId"] for aws_instance in reservation["Instances"])
+
+        if instances_ids:
+            await self.call("terminate_instances", InstanceIds=instances_ids)
+            with self.tracer.detached_span("waiter.instance_terminated"):
+                await self.ec2_client.get_waiter("instance_terminated").wait(InstanceIds=instances_ids)
+
+            self.logger.info("Instances %s are now terminated", ", ".join(instances_ids))
+
+        for instance_id in self.state_store.get_resource_ids(self.tag_base_name, INSTANCE):
+            self.forget_resource(INSTANCE, instance_id)
+
+    async def get_running_proxies_ips(self):
+        """Get the public and private ips of the running proxy instances
+
+        Returns:
+            list: Tuples of public and private ips
+        """
+        ips = []
+        filters = get_fleet_instances_filter(self.state_store, self.tag_base_name)
+        filters["instance-state-name"] = "running"
+        paginator = self.ec2_client.get_paginator("describe_instances")
+        for filters_batch in iter_filters_batches(filters):
+            async for page in paginator.paginate(Filters=filters_batch):
+                for reservation in page["Reservations"]:
+                    for aws_instance in reservation["Instances"]:
+                        for eni in aws_instance["NetworkInterfaces"]:
+                            ips.extend(get_network_interface_proxies_ips(eni))
+
+        return ips
+
+
+class AsyncProxies(object):
+    """Asyncio proxies
+
+    Usage:
+        async with AsyncProxies(profile="default") as proxies:
+            await proxies.create(proxies_config)
+            ips = await proxies.get_running_proxies_ips()
+    """
+
+    def __init__(self, profile=None, max_concurrency=50, **kwargs):
+        """Constructor
+
+        Args:
+            profile (string, optional): AWS profile
+            max_concurrency (integer, optional): Maximum number of concurrent EC2 calls
+            **kwargs: Proxies arguments (tag_base_name, state_store, tracer, log_level...)
+        """
+        self.proxies = Proxies(profile, **kwargs)
+        self.max_concurrency = max_concurrency
+        self.tag_base_name = self.proxies.tag_base_name
+        self.state_store = self.proxies.state_store
+        self.tracer = self.proxies.tracer
+        self.logger = setup_logger(__name__, self.proxies.log_level, self.proxies.boto_log_level)
+        self.ec2_client = None
+        self._client_context = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        """Create the aiobotocore ec2 client and the resources managers
+
+        Raises:
+            ImportError: aiobotocore is not installed
+        """
+        try:
+            from aiobotocore.config import AioConfig
+            from aiobotocore.session import AioSession
+        except ImportError:
+            raise ImportError("AsyncProxies requires aiobotocore: pip install aws_proxies[async]")
+
+        session = AioSession(profile=self.proxies.profile)
+        self._client_context = session.create_client(
+            "ec2", config=AioConfig(max_pool_connections=self.max_concurrency))
+        self.ec2_client = await self._client_context.__aenter__()
+
+        resources_params = {
+            "ec2_client": self.ec2_client,
+            "tag_base_name": self.tag_base_name,
+            "semaphore": asyncio.Semaphore(self.max_concurrency),
+            "tracer": self.tracer,
+            "state_store": self.state_store,
+            "log_level": self.proxies.log_level,
+            "boto_log_level": self.proxies.boto_log_level
+        }
+        self.vpcs = AsyncVpcs(**resources_params)
+        self.internet_gateways = AsyncInternetGateways(**resources_params)
+        self.subnets = AsyncSubnets(**resources_params)
+        self.security_groups = AsyncSecurityGroups(**resources_params)
+        self.route_tables = AsyncRouteTables(**resources_params)
+        self.network_acls = AsyncNetworkAcls(**resources_params)
+        self.network_interfaces = AsyncNetworkInterfaces(**resources_params)
+        self.instances = AsyncInstances(**resources_params)
+
+    async def close(self):
+        """Close the aiobotocore ec2 client
+        """
+        if self._client_context is not None:
+            await self._client_context.__aexit__(None, None, None)
+            self._client_context = None
+            self.ec2_client = None
+
+    async def create(self, proxies_config):
+        """Create proxies and its infrastructure
+
+        Args:
+            proxies_config (dict): Proxies config
+
+        Returns:
+            list: Launched instances config
+
+        Raises:
+            AttributeError
+            ValueError: The ipv6 mode is only supported by Proxies
+        """
+        if "instances_config" not in proxies_config:
+            raise AttributeError("The proxies config is missing the 'instances_config' attribute")
+
+        if "available_ips" not in proxies_config:
+            raise AttributeError("The proxies config is missing the 'available_ips' attribute")
+
+        if Proxies.is_ipv6(proxies_config["instances_config"]):
+            raise ValueError("The ipv6 mode is only supported by Proxies")
+
+        await self.delete()
+
+        with self.tracer.detached_span("create", available_ips=proxies_config["available_ips"]):
+            plan = self.proxies.plan(proxies_config)
+            self.proxies.config["instances_groups"] = plan["instances_groups"]
+
+            vpcs_config = {}
+            for vpc_config in await asyncio.gather(*[
+                self.__bootstrap_vpc_infrastructure(base_vpc_config) for base_vpc_config in plan["vpcs"]
+            ]):
+                vpcs_config.update(vpc_config)
+            self.proxies.config["vpcs"] = vpcs_config
+
+            await self.network_interfaces.create(vpcs_config)
+            await self.network_interfaces.associate_public_ips_to_enis()
+            return await self.instances.create(plan["instances_groups"])
+
+    async def __bootstrap_vpc_infrastructure(self, base_vpc_config):
+        """Bootstrap a vpc infrastructure
+
+        Args:
+            base_vpc_config (dict): Base vpc config
+
+        Returns:
+            dict: Vpc config indexed by vpc ID
+        """
+        vpc_config = await self.vpcs.get_or_create([base_vpc_config])
+
+        internet_gateways, subnets = await asyncio.gather(
+            self.internet_gateways.get_or_create(vpc_config),
+            self.subnets.get_or_create(vpc_config)
+        )
+        merge_config(vpc_config, internet_gateways)
+        merge_config(vpc_config, subnets)
+
+        security_groups, route_tables, network_acls = await asyncio.gather(
+            self.security_groups.get_or_create(vpc_config),
+            self.route_tables.get_or_create(vpc_config),
+            self.network_acls.get_or_create(vpc_config)
+        )
+        merge_config(vpc_config, security_groups)
+        merge_config(vpc_config, route_tables)
+        merge_config(vpc_config, network_acls)
+
+        return vpc_config
+
+    async def delete(self):
+        """Delete proxies and its infrastructure
+        """
+        with self.tracer.detached_span("delete", tag_base_name=self.tag_base_name):
+            await self.network_interfaces.release_public_ips()
+            await self.instances.terminate()
+            await self.network_interfaces.delete()
+            await self.security_groups.delete()
+            await self.subnets.delete()
+            await self.route_tables.delete()
+            await self.network_acls.delete()
+            await self.internet_gateways.delete()
+            await self.vpcs.delete()
+
+            self.state_store.clear(self.tag_base_name)
+
+    async def get_running_proxies_ips(self):
+        """Get the public and private ips of the running proxy instances
+
+        Returns:
+            list: Tuples of public and private ips
+        """
+        return await self.instances.get_running_proxies_ips()
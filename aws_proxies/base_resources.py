@@ -1,18 +1,92 @@
 # -*- coding: utf-8 -*-
 
+from .state import MemoryStateStore
+from .tracing import Tracer
+from .utils import create_suffix, iter_resources
+
 
 class BaseResources(object):
     """Base aws ec2 resources representation
     """
 
-    def __init__(self, ec2, ec2_client, tag_base_name):
+    def __init__(self, ec2, ec2_client, tag_base_name, tracer=None, state_store=None):
         """Constructor
 
         Args:
             ec2 (object): Aws Ec2 session
             ec2_client (object): Aws Ec2 client
             tag_base_name (dict): Resource tag base name
+            tracer (object, optional): Tracer
+            state_store (object, optional): Fleet state store
         """
         self.ec2 = ec2
         self.ec2_client = ec2_client
         self.tag_base_name = tag_base_name
+        self.tracer = tracer if tracer is not None else Tracer(enabled=False)
+        self.state_store = state_store if state_store is not None else MemoryStateStore()
+
+    def record_resource(self, resource_type, resource_id, uid=None, parent_id=None, attributes=None):
+        """Record a fleet resource in the state store
+
+        Args:
+            resource_type (string): Resource type
+            resource_id (string): AWS resource ID
+            uid (string, optional): Proxies config uid
+            parent_id (string, optional): Parent AWS resource ID
+            attributes (dict, optional): Resource attributes
+        """
+        self.state_store.record_resource(
+            self.tag_base_name, resource_type, resource_id, uid, parent_id, attributes)
+
+    def forget_resource(self, resource_type, resource_id):
+        """Remove a fleet resource from the state store
+
+        Args:
+            resource_type (string): Resource type
+            resource_id (string): AWS resource ID
+        """
+        self.state_store.remove_resource(self.tag_base_name, resource_type, resource_id)
+
+    def iter_fleet_resources(self, operation, resource_type, id_filter_name, projection=None):
+        """Iterate over the fleet resources descriptions, starting from the state store
+
+        The recorded IDs are verified with a targeted describe. The fleet tag scan
+        is only used when nothing is recorded or when the recorded resources are gone.
+
+        Args:
+            operation (string): Describe operation (see utils.DESCRIBE_RESULT_KEYS)
+            resource_type (string): Resource type
+            id_filter_name (string): Resource ID filter name
+            projection (list, optional): Description keys to keep. Defaults to the whole descriptions
+
+        Yields:
+            dict: Fleet resource description
+        """
+        resources_ids = self.state_store.get_resource_ids(self.tag_base_name, resource_type)
+        if resources_ids:
+            found = False
+            for resource in iter_resources(self.ec2_client, operation, {id_filter_name: resources_ids},
+                                           projection=projection):
+                found = True
+                yield resource
+            if found:
+                return
+
+        for resource in iter_resources(self.ec2_client, operation, {"tag:Name": self.tag_base_name + "-*"},
+                                       projection=projection):
+            yield resource
+
+    def tag(self, resource_id, type, index):
+        """Tag a resource using name with a suffix
+
+        Args:
+            resource_id (string): Resource ID
+            type (string): Resource type
+            index (integer): Resource index number
+        """
+        self.ec2_client.create_tags(Resources=[resource_id], Tags=[
+            {
+                "Key": "Name",
+                "Value": self.tag_base_name + "-" + create_suffix(type, index)
+            }
+        ])
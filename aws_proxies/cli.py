@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+from .daemon import ProxiesDaemon
+import logging
+from .proxies import Proxies
+from . import settings
+
+
+def serve(args):
+    """Run the proxies daemon
+
+    Args:
+        args (object): Parsed arguments
+    """
+    proxies = Proxies(
+        profile=args.profile,
+        tag_base_name=args.tag_base_name,
+        log_level=args.log_level,
+    )
+    proxies_daemon = ProxiesDaemon(
+        proxies,
+        refresh_interval=args.refresh_interval,
+        reconcile_interval=args.reconcile_interval,
+        endpoints_path=args.endpoints_path,
+        health_check_port=args.health_check_port,
+        log_level=args.log_level
+    )
+    try:
+        proxies_daemon.serve_forever(host=args.host, port=args.port, socket_path=args.socket)
+    except KeyboardInterrupt:
+        pass
+
+
+def gateway(args):
+    """Run the egress gateway (Python 3.5+)
+
+    Args:
+        args (object): Parsed arguments
+    """
+    from .gateway import Gateway
+
+    upstreams = []
+    for upstream in args.upstream or []:
+        host, _, port = upstream.rpartition(":")
+        upstreams.append((host, int(port)))
+
+    egress_gateway = Gateway(
+        upstreams=upstreams,
+        endpoints_path=args.endpoints_path,
+        upstream_port=args.upstream_port,
+        policy=args.policy,
+        max_connections_per_upstream=args.max_connections_per_upstream,
+        log_level=args.log_level
+    )
+    try:
+        egress_gateway.serve_forever(host=args.host, port=args.port)
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    """aws-proxies command line entry point
+
+    Args:
+        argv (list, optional): Arguments. Defaults to the command line ones
+    """
+    parser = argparse.ArgumentParser(prog="aws-proxies", description="Manage AWS instances running as proxies")
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="Run a daemon keeping the fleet inventory in memory behind a local HTTP API")
+    serve_parser.add_argument("--profile", default=None, help="AWS profile")
+    serve_parser.add_argument("--tag-base-name", default=settings.TAG_BASE_NAME, help="Fleet tag base name")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Host to listen to")
+    serve_parser.add_argument("--port", type=int, default=8765, help="Port to listen to")
+    serve_parser.add_argument("--socket", default=None, help="Unix socket path to listen to instead of host and port")
+    serve_parser.add_argument("--refresh-interval", type=int, default=60, help="Seconds between inventory refreshes")
+    serve_parser.add_argument("--reconcile-interval", type=int, default=None,
+                              help="Seconds between failed instances replacements (disabled by default)")
+    serve_parser.add_argument("--endpoints-path", default=None,
+                              help="JSON file the rollovers publish the proxies endpoints to")
+    serve_parser.add_argument("--health-check-port", type=int, default=None,
+                              help="Proxy port the rollovers check on every public ip")
+    serve_parser.add_argument("--log-level", type=int, default=logging.INFO, help="Logging level")
+    serve_parser.set_defaults(func=serve)
+
+    gateway_parser = subparsers.add_parser(
+        "gateway", help="Run a local forward proxy spreading the connections across the fleet proxies")
+    gateway_parser.add_argument("--endpoints-path", default=None,
+                                help="JSON file the proxies endpoints are published to, followed as it changes")
+    gateway_parser.add_argument("--upstream", action="append", default=None,
+                                help="Upstream proxy HOST:PORT (repeatable), without an endpoints file")
+    gateway_parser.add_argument("--upstream-port", type=int, default=8888, help="Endpoints file proxies port")
+    gateway_parser.add_argument("--policy", default="round_robin",
+                                choices=["round_robin", "least_connections", "random"], help="Upstream picking policy")
+    gateway_parser.add_argument("--max-connections-per-upstream", type=int, default=100,
+                                help="Concurrent connections limit per upstream proxy")
+    gateway_parser.add_argument("--host", default="127.0.0.1", help="Host to listen to")
+    gateway_parser.add_argument("--port", type=int, default=3128, help="Port to listen to")
+    gateway_parser.add_argument("--log-level", type=int, default=logging.INFO, help="Logging level")
+    gateway_parser.set_defaults(func=gateway)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+try:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import TCPServer, ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import TCPServer, ThreadingMixIn
+from .utils import setup_logger, get_fleet_instances_filter, get_network_interface_proxies_ips, iter_resources
+
+
+class ProxiesDaemon(object):
+    """Long-running proxies daemon
+
+    It keeps a Proxies object (and so its AWS session and clients) warm and an
+    in-memory inventory of the fleet instances, refreshed periodically and after
+    each operation. Queries are answered from the inventory, operations (create,
+    scale, rotate, reconcile, rollover, delete) run one at a time in the background.
+    """
+
+    def __init__(self, proxies, refresh_interval=60, reconcile_interval=None, endpoints_path=None,
+                 health_check_port=None, **kwargs):
+        """Constructor
+
+        Args:
+            proxies (object): Proxies
+            refresh_interval (integer, optional): Seconds between inventory refreshes
+            reconcile_interval (integer, optional): Seconds between failed instances replacements.
+                Disabled by default
+            endpoints_path (string, optional): JSON file the rollovers publish the proxies endpoints to
+            health_check_port (integer, optional): Proxy port the rollovers check on every public ip
+            **kwargs: Multiple arguments
+
+        Raises:
+            TypeError: Description
+        """
+        self.proxies = proxies
+        self.refresh_interval = refresh_interval
+        self.reconcile_interval = reconcile_interval
+        self.endpoints_path = endpoints_path
+        self.health_check_port = health_check_port
+        log_level = kwargs.pop("log_level", logging.WARNING)
+        boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
+
+        if kwargs:
+            raise TypeError("Unexpected **kwargs: %r" % kwargs)
+        self.logger = setup_logger(__name__, log_level, boto_log_level)
+
+        self.inventory = {}
+        self.refreshed_at = None
+        self.operation = None
+        self.last_operation = None
+        self.server = None
+        self._lock = threading.Lock()
+        self._operation_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def refresh(self):
+        """Refresh the fleet instances inventory with a describe call
+
+        Returns:
+            dict: Added and removed instances counts
+        """
+        filters = get_fleet_instances_filter(self.proxies.state_store, self.proxies.tag_base_name)
+        filters["instance-state-name"] = ["pending", "running"]
+
+        inventory = {}
+        for aws_instance in iter_resources(self.proxies.ec2_client, "describe_instances", filters):
+            inventory[aws_instance["InstanceId"]] = ProxiesDaemon.__get_inventory_instance(aws_instance)
+
+        with self._lock:
+            added = len(set(inventory) - set(self.inventory))
+            removed = len(set(self.inventory) - set(inventory))
+            self.inventory = inventory
+            self.refreshed_at = time.time()
+
+        if added or removed:
+            self.logger.info("Inventory refreshed: %s instances added, %s removed", added, removed)
+
+        return {
+            "Added": added,
+            "Removed": removed
+        }
+
+    @staticmethod
+    def __get_inventory_instance(aws_instance):
+        """Get the inventory entry of a described instance
+
+        Args:
+            aws_instance (dict): Described instance
+
+        Returns:
+            dict: Inventory instance
+        """
+        ips = []
+        for eni in aws_instance.get("NetworkInterfaces", []):
+            ips.extend([public_ip, private_ip] for public_ip, private_ip in get_network_interface_proxies_ips(eni))
+
+        return {
+            "InstanceId": aws_instance["InstanceId"],
+            "InstanceType": aws_instance.get("InstanceType"),
+            "State": aws_instance["State"]["Name"],
+            "AvailabilityZone": aws_instance.get("Placement", {}).get("AvailabilityZone"),
+            "Lifecycle": aws_instance.get("InstanceLifecycle", "on-demand"),
+            "Ips": ips
+        }
+
+    def get_proxies_ips(self):
+        """Get the public and private ips of the running proxies from the inventory
+
+        Returns:
+            list: Public and private ips pairs
+        """
+        with self._lock:
+            return [
+                ips
+                for instance in self.inventory.values() if instance["State"] == "running"
+                for ips in instance["Ips"]
+            ]
+
+    def get_instances(self):
+        """Get the inventory instances
+
+        Returns:
+            list: Inventory instances
+        """
+        with self._lock:
+            return sorted(self.inventory.values(), key=lambda instance: instance["InstanceId"])
+
+    def get_status(self):
+        """Get the daemon status
+
+        Returns:
+            dict: Status
+        """
+        with self._lock:
+            return {
+                "TagBaseName": self.proxies.tag_base_name,
+                "InstancesCount": len(self.inventory),
+                "RefreshedAt": self.refreshed_at,
+                "Operation": self.operation,
+                "LastOperation": self.last_operation
+            }
+
+    def start_operation(self, name, func, *args, **kwargs):
+        """Run an operation in the background, unless another one is running
+
+        Args:
+            name (string): Operation name
+            func (function): Operation
+            *args: Operation arguments
+            **kwargs: Operation keyword arguments
+
+        Returns:
+            bool: Whether the operation has been started
+        """
+        if not self._operation_lock.acquire(False):
+            return False
+
+        with self._lock:
+            self.operation = name
+
+        def run():
+            started_at = time.time()
+            error = None
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                self.logger.exception("The operation '%s' failed", name)
+                error = repr(e)
+            finally:
+                with self._lock:
+                    self.operation = None
+                    self.last_operation = {
+                        "Name": name,
+                        "StartedAt": started_at,
+                        "FinishedAt": time.time(),
+                        "Error": error
+                    }
+                self._operation_lock.release()
+
+            try:
+                self.refresh()
+            except Exception:
+                self.logger.exception("The inventory refresh failed")
+
+        thread = threading.Thread(target=run, name="aws-proxies-" + name)
+        thread.daemon = True
+        thread.start()
+
+        return True
+
+    def create(self, proxies_config):
+        """Create the proxies in the background
+
+        Args:
+            proxies_config (dict): Proxies config
+
+        Returns:
+            bool: Whether the operation has been started
+        """
+        return self.start_operation("create", self.proxies.create, proxies_config, ask_confirm=False, silent=True)
+
+    def scale(self, available_ips):
+        """Scale the proxies in the background (see Proxies.scale)
+
+        Args:
+            available_ips (integer): Available ips
+
+        Returns:
+            bool: Whether the operation has been started
+        """
+        return self.start_operation("scale", self.proxies.scale, available_ips, silent=True)
+
+    def rotate(self):
+        """Rotate the proxies public ips in the background
+
+        Returns:
+            bool: Whether the operation has been started
+        """
+        return self.start_operation("rotate", self.proxies.rotate_public_ips)
+
+    def reconcile(self):
+        """Replace the failed proxies instances in the background
+
+        Returns:
+            bool: Whether the operation has been started
+        """
+        return self.start_operation("reconcile", self.proxies.reconcile)
+
+    def rollover(self, proxies_config=None):
+        """Replace the proxies with a new generation in the background (see Proxies.rollover)
+
+        Args:
+            proxies_config (dict, optional): Proxies config. Defaults to the current generation one
+
+        Returns:
+            bool: Whether the operation has been started
+        """
+        return self.start_operation("rollover", self.proxies.rollover, proxies_config,
+                                    endpoints_path=self.endpoints_path, health_check_port=self.health_check_port,
+                                    silent=True)
+
+    def delete(self):
+        """Delete the proxies in the background
+
+        Returns:
+            bool: Whether the operation has been started
+        """
+        return self.start_operation("delete", self.proxies.delete, ask_confirm=False, silent=True)
+
+    def __refresh_periodically(self):
+        """Refresh the inventory until the daemon is stopped
+        """
+        while not self._stopped.is_set():
+            try:
+                if self.operation is None:
+                    self.refresh()
+            except Exception:
+                self.logger.exception("The inventory refresh failed")
+            self._stopped.wait(self.refresh_interval)
+
+    def __reconcile_periodically(self):
+        """Replace the failed instances until the daemon is stopped, unless an operation is running
+        """
+        while not self._stopped.wait(self.reconcile_interval):
+            self.reconcile()
+
+    def serve_forever(self, host="127.0.0.1", port=8765, socket_path=None):
+        """Serve the local HTTP API until shutdown
+
+        Args:
+            host (string, optional): Host to listen to. Keep it local, the API is not authenticated
+            port (integer, optional): Port to listen to
+            socket_path (string, optional): Unix socket path to listen to instead of host and port
+        """
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            self.server = UnixHTTPServer(socket_path, DaemonRequestHandler)
+        else:
+            self.server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+        self.server.proxies_daemon = self
+
+        refresh_thread = threading.Thread(target=self.__refresh_periodically, name="aws-proxies-refresh")
+        refresh_thread.daemon = True
+        refresh_thread.start()
+
+        if self.reconcile_interval:
+            reconcile_thread = threading.Thread(target=self.__reconcile_periodically, name="aws-proxies-reconcile")
+            reconcile_thread.daemon = True
+            reconcile_thread.start()
+
+        self.logger.info("Serving on %s", socket_path or "{0}:{1}".format(host, port))
+        try:
+            self.server.serve_forever()
+        finally:
+            self._stopped.set()
+            self.server.server_close()
+            if socket_path is not None and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+    def shutdown(self):
+        """Stop serving
+        """
+        self._stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handling each request in a thread
+    """
+    daemon_threads = True
+
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    """HTTP server listening to a Unix socket
+    """
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """Proxies daemon local API
+
+    GET /proxies, /instances and /status are answered from memory.
+    POST /create (proxies config), /scale ({"available_ips": n}), /rotate,
+    /reconcile, /rollover (optional proxies config) and /delete start an operation
+    and answer 202, or 409 when one is already running.
+    """
+
+    def address_string(self):
+        # Unix socket clients have no address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format, *args):
+        self.server.proxies_daemon.logger.debug("%s - " + format, self.address_string(), *args)
+
+    def send_json(self, status, body):
+        """Send a JSON response
+
+        Args:
+            status (integer): HTTP status
+            body (object): JSON serializable body
+        """
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def read_json(self):
+        """Read the JSON request body
+
+        Returns:
+            object: Request body or None
+        """
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length).decode("utf-8"))
+
+    def do_GET(self):
+        proxies_daemon = self.server.proxies_daemon
+        routes = {
+            "/proxies": proxies_daemon.get_proxies_ips,
+            "/instances": proxies_daemon.get_instances,
+            "/status": proxies_daemon.get_status
+        }
+
+        path = self.path.split("?")[0].rstrip("/")
+        if path not in routes:
+            self.send_json(404, {"Error": "Unknown path '{0}'".format(self.path)})
+            return
+
+        self.send_json(200, routes[path]())
+
+    def do_POST(self):
+        proxies_daemon = self.server.proxies_daemon
+        path = self.path.split("?")[0].rstrip("/")
+
+        try:
+            body = self.read_json()
+        except ValueError as e:
+            self.send_json(400, {"Error": "Invalid JSON body: {0}".format(e)})
+            return
+
+        if path == "/create":
+            if not body:
+                self.send_json(400, {"Error": "The proxies config is missing"})
+                return
+            started = proxies_daemon.create(body)
+        elif path == "/scale":
+            if not body or "available_ips" not in body:
+                self.send_json(400, {"Error": "The 'available_ips' attribute is missing"})
+                return
+            try:
+                available_ips = int(body["available_ips"])
+            except (TypeError, ValueError):
+                self.send_json(400, {"Error": "The 'available_ips' attribute must be an integer"})
+                return
+            started = proxies_daemon.scale(available_ips)
+        elif path == "/rotate":
+            started = proxies_daemon.rotate()
+        elif path == "/reconcile":
+            started = proxies_daemon.reconcile()
+        elif path == "/rollover":
+            started = proxies_daemon.rollover(body or None)
+        elif path == "/delete":
+            started = proxies_daemon.delete()
+        else:
+            self.send_json(404, {"Error": "Unknown path '{0}'".format(self.path)})
+            return
+
+        if not started:
+            self.send_json(409, {"Error": "The operation '{0}' is running".format(proxies_daemon.operation)})
+            return
+
+        self.send_json(202, {"Operation": path.lstrip("/")})
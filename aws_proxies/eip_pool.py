@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+
+from .base_resources import BaseResources
+from botocore.exceptions import ClientError
+import logging
+import threading
+from .state import ADDRESS
+from .tracing import traced
+from .utils import iter_resources, setup_logger, run_concurrently
+
+# Tag key identifying the elastic ips of a pool, the tag value being the pool name
+POOL_TAG_KEY = "aws-proxies-eip-pool"
+
+
+class EipPool(BaseResources):
+    """Warm pool of elastic ips
+
+    The pool keeps pre-allocated, unassociated elastic ips, tagged with the pool
+    name rather than the fleet one, so that they survive fleet deletions. They
+    are handed out to associate public ips and given back to the pool on
+    teardown instead of being released. The pool addresses are recorded in the
+    state store under the pool name.
+    """
+
+    def __init__(self, ec2, ec2_client, tag_base_name, **kwargs):
+        """Constructor
+
+        Args:
+            ec2 (object): Aws Ec2 session
+            ec2_client (object): Aws ec2 session
+            tag_base_name (string): Tag base name
+            **kwargs: Multiple arguments (pool_name, size, max_size, max_workers...)
+
+        Raises:
+            TypeError: Description
+        """
+        self.pool_name = kwargs.pop("pool_name", None) or tag_base_name + "-eip-pool"
+        BaseResources.__init__(self, ec2, ec2_client, self.pool_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
+        # Unassociated elastic ips to keep warm
+        self.size = kwargs.pop("size", 0)
+        # Unassociated elastic ips above which given back elastic ips are released
+        self.max_size = kwargs.pop("max_size", None)
+        self.max_workers = kwargs.pop("max_workers", 10)
+        log_level = kwargs.pop("log_level", logging.WARNING)
+        boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
+
+        if kwargs:
+            raise TypeError("Unexpected **kwargs: %r" % kwargs)
+        self.logger = setup_logger(__name__, log_level, boto_log_level)
+
+        # Unassociated elastic ips, loaded on first use
+        self._available = None
+        self._lock = threading.Lock()
+        self._refill_thread = None
+
+    def get_addresses(self):
+        """Describe the pool elastic ips
+
+        The elastic ips recorded in the state store are described too, in case
+        their tagging failed.
+
+        Returns:
+            list: Described addresses
+        """
+        aws_addresses = list(iter_resources(self.ec2_client, "describe_addresses", {
+            "tag:" + POOL_TAG_KEY: self.pool_name
+        }))
+        tagged_allocation_ids = set(aws_address["AllocationId"] for aws_address in aws_addresses)
+        untagged_allocation_ids = [
+            allocation_id for allocation_id in self.state_store.get_resource_ids(self.pool_name, ADDRESS)
+            if allocation_id not in tagged_allocation_ids
+        ]
+        if untagged_allocation_ids:
+            aws_addresses.extend(iter_resources(self.ec2_client, "describe_addresses", {
+                "allocation-id": untagged_allocation_ids
+            }))
+
+        return aws_addresses
+
+    def __load(self):
+        """Load the unassociated pool elastic ips, once
+
+        Must be called with the lock held.
+        """
+        if self._available is None:
+            self._available = [
+                {
+                    "AllocationId": aws_address["AllocationId"],
+                    "PublicIp": aws_address["PublicIp"]
+                }
+                for aws_address in self.get_addresses() if "AssociationId" not in aws_address
+            ]
+
+    def available_count(self):
+        """Get the number of unassociated pool elastic ips
+
+        Returns:
+            integer: Unassociated elastic ips count
+        """
+        with self._lock:
+            self.__load()
+            return len(self._available)
+
+    def __allocate(self, count):
+        """Allocate elastic ips concurrently and tag them with the pool name in one call
+
+        When an allocation fails (e.g. AddressLimitExceeded), the elastic ips
+        allocated by the others are still tagged, and added to the pool.
+
+        Args:
+            count (integer): Elastic ips count
+
+        Returns:
+            list: Allocated addresses with 'AllocationId' and 'PublicIp' keys
+        """
+        if count <= 0:
+            return []
+
+        addresses = []
+
+        def allocate_address(index):
+            aws_eip_alloc = self.ec2_client.allocate_address(Domain="vpc")
+            # Recorded until tagged, the pool describing its recorded elastic ips too
+            self.record_resource(ADDRESS, aws_eip_alloc["AllocationId"], attributes={
+                "PublicIp": aws_eip_alloc["PublicIp"]
+            })
+            address = {
+                "AllocationId": aws_eip_alloc["AllocationId"],
+                "PublicIp": aws_eip_alloc["PublicIp"]
+            }
+            addresses.append(address)
+            return address
+
+        try:
+            return run_concurrently(allocate_address, range(count), self.max_workers)
+        except Exception:
+            with self._lock:
+                if self._available is not None:
+                    self._available.extend(addresses)
+            raise
+        finally:
+            if addresses:
+                self.ec2_client.create_tags(
+                    Resources=[address["AllocationId"] for address in addresses],
+                    Tags=[
+                        {
+                            "Key": POOL_TAG_KEY,
+                            "Value": self.pool_name
+                        },
+                        {
+                            "Key": "Name",
+                            "Value": self.pool_name
+                        }
+                    ]
+                )
+
+    @traced("eip_pool.refill")
+    def refill(self, size=None):
+        """Allocate the elastic ips missing for the pool to have its size of unassociated ones
+
+        Args:
+            size (integer, optional): Unassociated elastic ips to have. Defaults to the pool size
+
+        Returns:
+            integer: Allocated elastic ips count
+        """
+        size = self.size if size is None else size
+        with self._lock:
+            self.__load()
+            missing_count = size - len(self._available)
+
+        addresses = self.__allocate(missing_count)
+        with self._lock:
+            self._available.extend(addresses)
+
+        if addresses:
+            self.tracer.current_span().set_attribute("allocated_count", len(addresses))
+            self.logger.info("%s elastic ips have been allocated to the pool '%s'", len(addresses), self.pool_name)
+
+        return len(addresses)
+
+    def refill_in_background(self, size=None):
+        """Refill the pool in a background thread, unless a refill is running
+
+        Args:
+            size (integer, optional): Unassociated elastic ips to have. Defaults to the pool size
+
+        Returns:
+            object: Refill thread
+        """
+        if self._refill_thread is not None and self._refill_thread.is_alive():
+            return self._refill_thread
+
+        def refill():
+            try:
+                self.refill(size)
+            except Exception:
+                self.logger.exception("The elastic ips pool '%s' refill failed", self.pool_name)
+
+        self._refill_thread = threading.Thread(target=refill, name="aws-proxies-eip-pool-refill")
+        self._refill_thread.start()
+
+        return self._refill_thread
+
+    def wait(self):
+        """Wait for the background refill to be done
+        """
+        if self._refill_thread is not None:
+            self._refill_thread.join()
+
+    @traced("eip_pool.acquire")
+    def acquire(self, count):
+        """Hand out unassociated elastic ips
+
+        The missing ones are allocated (and tagged for the pool) when the pool
+        does not have enough of them.
+
+        Args:
+            count (integer): Elastic ips count
+
+        Returns:
+            list: Addresses with 'AllocationId' and 'PublicIp' keys
+        """
+        with self._lock:
+            self.__load()
+            addresses = self._available[:count]
+            del self._available[:count]
+
+        if len(addresses) < count:
+            self.logger.info(
+                "The elastic ips pool '%s' is short of %s elastic ips, allocating them",
+                self.pool_name,
+                count - len(addresses)
+            )
+            addresses.extend(self.__allocate(count - len(addresses)))
+
+        for address in addresses:
+            self.forget_resource(ADDRESS, address["AllocationId"])
+
+        self.tracer.current_span().set_attribute("acquired_count", len(addresses))
+
+        return addresses
+
+    @traced("eip_pool.give_back")
+    def give_back(self, aws_addresses):
+        """Dissociate elastic ips and give them back to the pool
+
+        They are handed out before the other pool elastic ips. Elastic ips above the
+        pool max size are released. Elastic ips which are not tagged for the pool yet
+        are tagged.
+
+        Args:
+            aws_addresses (list): Described addresses
+
+        Returns:
+            list: Released allocation ids
+        """
+        for aws_address in aws_addresses:
+            if aws_address.get("AssociationId"):
+                self.ec2_client.disassociate_address(AssociationId=aws_address["AssociationId"])
+
+        untagged_allocation_ids = [
+            aws_address["AllocationId"] for aws_address in aws_addresses
+            if not any(tag["Key"] == POOL_TAG_KEY for tag in aws_address.get("Tags", []))
+        ]
+        if untagged_allocation_ids:
+            self.ec2_client.create_tags(
+                Resources=untagged_allocation_ids,
+                Tags=[
+                    {
+                        "Key": POOL_TAG_KEY,
+                        "Value": self.pool_name
+                    },
+                    {
+                        "Key": "Name",
+                        "Value": self.pool_name
+                    }
+                ]
+            )
+
+        with self._lock:
+            self.__load()
+            kept_count = len(aws_addresses)
+            if self.max_size is not None:
+                kept_count = max(0, min(kept_count, self.max_size - len(self._available)))
+            kept_addresses = aws_addresses[:kept_count]
+            released_addresses = aws_addresses[kept_count:]
+            # Given back elastic ips are handed out first, so that a rebuilt fleet gets its public ips back
+            self._available[0:0] = [
+                {
+                    "AllocationId": aws_address["AllocationId"],
+                    "PublicIp": aws_address["PublicIp"]
+                }
+                for aws_address in kept_addresses
+            ]
+
+        for aws_address in kept_addresses:
+            self.record_resource(ADDRESS, aws_address["AllocationId"], attributes={
+                "PublicIp": aws_address["PublicIp"]
+            })
+
+        released_allocation_ids = []
+        for aws_address in released_addresses:
+            try:
+                self.ec2_client.release_address(AllocationId=aws_address["AllocationId"])
+                released_allocation_ids.append(aws_address["AllocationId"])
+            except ClientError as e:
+                self.logger.info("The public IP allocation '%s' can not be released (%s)",
+                                 aws_address["AllocationId"], e)
+
+        self.logger.info(
+            "%s elastic ips have been given back to the pool '%s', %s released",
+            len(kept_addresses),
+            self.pool_name,
+            len(released_allocation_ids)
+        )
+
+        return released_allocation_ids
+
+    @traced("eip_pool.delete")
+    def delete(self):
+        """Release the unassociated pool elastic ips
+        """
+        self.wait()
+        with self._lock:
+            self._available = None
+
+        for aws_address in self.get_addresses():
+            if "AssociationId" in aws_address:
+                continue
+
+            try:
+                self.ec2_client.release_address(AllocationId=aws_address["AllocationId"])
+                self.tracer.current_span().add_attribute_value("allocation_ids", aws_address["AllocationId"])
+            except ClientError as e:
+                self.logger.info("The public IP allocation '%s' can not be released (%s)",
+                                 aws_address["AllocationId"], e)
+            self.forget_resource(ADDRESS, aws_address["AllocationId"])
+
+        self.logger.info("The elastic ips pool '%s' has been released", self.pool_name)
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+
+from .base_resources import BaseResources
+from botocore.exceptions import ClientError
+import logging
+import threading
+from .state import ADDRESS, NETWORK_INTERFACE
+from .tracing import traced
+from .utils import iter_resources, setup_logger, run_concurrently
+
+# Tag key identifying the network interfaces of a pool, the tag value being the fleet tag base name
+POOL_TAG_KEY = "aws-proxies-eni-pool"
+
+
+class EniPool(BaseResources):
+    """Warm pool of network interfaces
+
+    The pool keeps network interfaces pre-created in the fleet subnets, already
+    holding their secondary private ips and an elastic ip for each of them, so
+    that a proxy can be launched by only attaching them. Network interfaces are
+    bound to their subnet, so the pool is deleted with the fleet.
+
+    The pool network interfaces are tagged with the pool tag and named
+    '<tag base name>.eni-pool', which does not match the fleet '<tag base name>-*'
+    names. They are recorded in the state store under that name too.
+    """
+
+    def __init__(self, ec2, ec2_client, tag_base_name, **kwargs):
+        """Constructor
+
+        Args:
+            ec2 (object): Aws Ec2 session
+            ec2_client (object): Aws ec2 session
+            tag_base_name (string): Fleet tag base name
+            **kwargs: Multiple arguments (size, eip_pool, max_workers...)
+
+        Raises:
+            TypeError: Description
+        """
+        self.fleet_tag_base_name = tag_base_name
+        self.pool_name = tag_base_name + ".eni-pool"
+        BaseResources.__init__(self, ec2, ec2_client, self.pool_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
+        # Available network interfaces to keep warm per subnet
+        self.size = kwargs.pop("size", 0)
+        # Elastic ips pool to take the elastic ips from and give them back to
+        self.eip_pool = kwargs.pop("eip_pool", None)
+        self.max_workers = kwargs.pop("max_workers", 10)
+        log_level = kwargs.pop("log_level", logging.WARNING)
+        boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
+
+        if kwargs:
+            raise TypeError("Unexpected **kwargs: %r" % kwargs)
+        self.logger = setup_logger(__name__, log_level, boto_log_level)
+
+        # Available network interfaces indexed by subnet ID and private ips count, loaded on first use
+        self._available = None
+        self._lock = threading.Lock()
+        self._refill_thread = None
+
+    def get_network_interfaces(self):
+        """Describe the pool network interfaces
+
+        Returns:
+            list: Described network interfaces
+        """
+        return list(iter_resources(self.ec2_client, "describe_network_interfaces", {
+            "tag:" + POOL_TAG_KEY: self.fleet_tag_base_name
+        }))
+
+    @staticmethod
+    def __get_pool_eni(aws_eni):
+        """Get the pool entry of a described network interface
+
+        Args:
+            aws_eni (dict): Described network interface
+
+        Returns:
+            dict: Network interface ID, subnet ID and private ips with their public ip and allocation ID
+        """
+        return {
+            "NetworkInterfaceId": aws_eni["NetworkInterfaceId"],
+            "SubnetId": aws_eni["SubnetId"],
+            "PrivateIpAddresses": [
+                {
+                    "PrivateIpAddress": aws_private_ip_address["PrivateIpAddress"],
+                    "PublicIp": aws_private_ip_address.get("Association", {}).get("PublicIp"),
+                    "AllocationId": aws_private_ip_address.get("Association", {}).get("AllocationId")
+                }
+                for aws_private_ip_address in sorted(
+                    aws_eni["PrivateIpAddresses"], key=lambda ip: not ip.get("Primary"))
+            ]
+        }
+
+    def __load(self):
+        """Load the available pool network interfaces, once
+
+        Must be called with the lock held.
+        """
+        if self._available is None:
+            self._available = {}
+            for aws_eni in self.get_network_interfaces():
+                if aws_eni["Status"] != "available":
+                    continue
+                pool_eni = EniPool.__get_pool_eni(aws_eni)
+                self._available.setdefault(
+                    (pool_eni["SubnetId"], len(pool_eni["PrivateIpAddresses"])), []).append(pool_eni)
+
+    def available_count(self, subnet_id=None, private_ips_count=None):
+        """Get the number of available pool network interfaces
+
+        Args:
+            subnet_id (string, optional): Only count the network interfaces of this subnet
+            private_ips_count (integer, optional): Only count the network interfaces with this private ips count
+
+        Returns:
+            integer: Available network interfaces count
+        """
+        with self._lock:
+            self.__load()
+            return sum(
+                len(pool_enis) for (eni_subnet_id, eni_private_ips_count), pool_enis in self._available.items()
+                if subnet_id in (None, eni_subnet_id) and private_ips_count in (None, eni_private_ips_count)
+            )
+
+    def __create(self, subnet_id, private_ips_count, count):
+        """Create network interfaces with an elastic ip per private ip
+
+        Args:
+            subnet_id (string): Subnet ID
+            private_ips_count (integer): Private ips count per network interface
+            count (integer): Network interfaces count
+
+        Returns:
+            list: Pool network interfaces
+        """
+        def create_eni(index):
+            aws_eni = self.ec2_client.create_network_interface(
+                SubnetId=subnet_id,
+                SecondaryPrivateIpAddressCount=private_ips_count - 1
+            )["NetworkInterface"]
+            self.record_resource(NETWORK_INTERFACE, aws_eni["NetworkInterfaceId"], parent_id=subnet_id)
+            return EniPool.__get_pool_eni(aws_eni)
+
+        pool_enis = run_concurrently(create_eni, range(count), self.max_workers)
+        self.ec2_client.create_tags(
+            Resources=[pool_eni["NetworkInterfaceId"] for pool_eni in pool_enis],
+            Tags=[
+                {
+                    "Key": POOL_TAG_KEY,
+                    "Value": self.fleet_tag_base_name
+                },
+                {
+                    "Key": "Name",
+                    "Value": self.pool_name
+                }
+            ]
+        )
+
+        private_ips = [
+            (pool_eni, private_ip)
+            for pool_eni in pool_enis
+            for private_ip in pool_eni["PrivateIpAddresses"]
+        ]
+        if self.eip_pool is not None:
+            addresses = self.eip_pool.acquire(len(private_ips))
+        else:
+            addresses = run_concurrently(
+                lambda index: self.ec2_client.allocate_address(Domain="vpc"), range(len(private_ips)), self.max_workers)
+
+        def associate_address(item):
+            (pool_eni, private_ip), address = item
+            # Record the allocation before associating it so that it is not leaked on failure
+            self.record_resource(
+                ADDRESS, address["AllocationId"], parent_id=pool_eni["NetworkInterfaceId"], attributes={
+                    "PublicIp": address["PublicIp"],
+                    "PrivateIpAddress": private_ip["PrivateIpAddress"]
+                })
+            self.ec2_client.associate_address(
+                AllocationId=address["AllocationId"],
+                NetworkInterfaceId=pool_eni["NetworkInterfaceId"],
+                PrivateIpAddress=private_ip["PrivateIpAddress"]
+            )
+            private_ip["PublicIp"] = address["PublicIp"]
+            private_ip["AllocationId"] = address["AllocationId"]
+
+        run_concurrently(associate_address, zip(private_ips, addresses), self.max_workers)
+
+        return pool_enis
+
+    @traced("eni_pool.refill")
+    def refill(self, subnets_ids, private_ips_count, size=None):
+        """Create the network interfaces missing for each subnet to have its size of available ones
+
+        Only the network interfaces for which a subnet has free private ips left are created.
+
+        Args:
+            subnets_ids (list): Subnets IDs
+            private_ips_count (integer): Private ips count per network interface
+            size (integer, optional): Available network interfaces to have per subnet. Defaults to the pool size
+
+        Returns:
+            integer: Created network interfaces count
+        """
+        size = self.size if size is None else size
+        with self._lock:
+            self.__load()
+            missing_counts = dict(
+                (subnet_id, size - len(self._available.get((subnet_id, private_ips_count), [])))
+                for subnet_id in subnets_ids
+            )
+        missing_subnets_ids = [subnet_id for subnet_id in subnets_ids if missing_counts[subnet_id] > 0]
+        free_ips = {}
+        if missing_subnets_ids:
+            free_ips = dict(
+                (aws_subnet["SubnetId"], aws_subnet["AvailableIpAddressCount"])
+                for aws_subnet in iter_resources(self.ec2_client, "describe_subnets", {
+                    "subnet-id": missing_subnets_ids
+                }, projection=["SubnetId", "AvailableIpAddressCount"])
+            )
+
+        created_count = 0
+        for subnet_id in missing_subnets_ids:
+            missing_count = min(missing_counts[subnet_id], free_ips.get(subnet_id, 0) // private_ips_count)
+            if missing_count < missing_counts[subnet_id]:
+                self.logger.warning("The subnet '%s' only has room for %s of the %s network interfaces missing "
+                                    "from the pool '%s'", subnet_id, missing_count, missing_counts[subnet_id],
+                                    self.pool_name)
+            if missing_count <= 0:
+                continue
+
+            pool_enis = self.__create(subnet_id, private_ips_count, missing_count)
+            with self._lock:
+                self._available.setdefault((subnet_id, private_ips_count), []).extend(pool_enis)
+            created_count = created_count + len(pool_enis)
+
+        if created_count:
+            self.tracer.current_span().set_attribute("created_count", created_count)
+            self.logger.info("%s network interfaces have been added to the pool '%s'", created_count, self.pool_name)
+
+        return created_count
+
+    def refill_in_background(self, subnets_ids, private_ips_count, size=None):
+        """Refill the pool in a background thread, unless a refill is running
+
+        Args:
+            subnets_ids (list): Subnets IDs
+            private_ips_count (integer): Private ips count per network interface
+            size (integer, optional): Available network interfaces to have per subnet. Defaults to the pool size
+
+        Returns:
+            object: Refill thread
+        """
+        if self._refill_thread is not None and self._refill_thread.is_alive():
+            return self._refill_thread
+
+        def refill():
+            try:
+                self.refill(subnets_ids, private_ips_count, size)
+            except Exception:
+                self.logger.exception("The network interfaces pool '%s' refill failed", self.pool_name)
+
+        self._refill_thread = threading.Thread(target=refill, name="aws-proxies-eni-pool-refill")
+        self._refill_thread.start()
+
+        return self._refill_thread
+
+    def wait(self):
+        """Wait for the background refill to be done
+        """
+        if self._refill_thread is not None:
+            self._refill_thread.join()
+
+    @traced("eni_pool.acquire")
+    def acquire(self, subnet_id, private_ips_count, count):
+        """Hand out available network interfaces of a subnet
+
+        The network interfaces leave the pool: their pool tags are removed and
+        they are forgotten from the pool state, the caller tagging and recording
+        them for the fleet.
+
+        Args:
+            subnet_id (string): Subnet ID
+            private_ips_count (integer): Private ips count per network interface
+            count (integer): Network interfaces count
+
+        Returns:
+            list: Pool network interfaces, possibly fewer than count
+        """
+        with self._lock:
+            self.__load()
+            available = self._available.get((subnet_id, private_ips_count), [])
+            pool_enis = available[:count]
+            del available[:count]
+
+        if not pool_enis:
+            return []
+
+        self.ec2_client.delete_tags(
+            Resources=[pool_eni["NetworkInterfaceId"] for pool_eni in pool_enis],
+            Tags=[
+                {
+                    "Key": POOL_TAG_KEY
+                }
+            ]
+        )
+        for pool_eni in pool_enis:
+            self.forget_resource(NETWORK_INTERFACE, pool_eni["NetworkInterfaceId"])
+            for private_ip in pool_eni["PrivateIpAddresses"]:
+                if private_ip["AllocationId"] is not None:
+                    self.forget_resource(ADDRESS, private_ip["AllocationId"])
+
+        self.tracer.current_span().set_attribute("acquired_count", len(pool_enis))
+
+        return pool_enis
+
+    @traced("eni_pool.delete")
+    def delete(self):
+        """Release the elastic ips of the pool network interfaces and delete them
+
+        The elastic ips are given back to the elastic ips pool, if any.
+        """
+        self.wait()
+        with self._lock:
+            self._available = None
+
+        aws_enis = self.get_network_interfaces()
+        aws_addresses = list(iter_resources(self.ec2_client, "describe_addresses", {
+            "network-interface-id": [aws_eni["NetworkInterfaceId"] for aws_eni in aws_enis]
+        }))
+
+        if self.eip_pool is not None:
+            self.eip_pool.give_back(aws_addresses)
+        else:
+            for aws_address in aws_addresses:
+                try:
+                    self.ec2_client.disassociate_address(AssociationId=aws_address["AssociationId"])
+                    self.ec2_client.release_address(AllocationId=aws_address["AllocationId"])
+                except ClientError as e:
+                    self.logger.info("The public IP allocation '%s' can not be released (%s)",
+                                     aws_address["AllocationId"], e)
+
+        for aws_eni in aws_enis:
+            self.ec2_client.delete_network_interface(NetworkInterfaceId=aws_eni["NetworkInterfaceId"])
+            self.tracer.current_span().add_attribute_value("network_interface_ids", aws_eni["NetworkInterfaceId"])
+
+        self.state_store.clear(self.pool_name)
+
+        self.logger.info("The network interfaces pool '%s' has been deleted", self.pool_name)
@@ -0,0 +1,742 @@
+# -*- coding: utf-8 -*-
+"""Egress gateway (Python 3.5+)
+
+The Gateway is a local asyncio forward proxy (HTTP CONNECT and plain HTTP)
+which spreads the upstream connections across the fleet proxies, so that the
+consumers only point at one endpoint. The upstreams are either given or read
+from the endpoints file published by Proxies.publish_endpoints (and so follow
+the rollovers).
+
+The upstreams are picked with a policy (round robin, least connections or
+random), their concurrent connections are bounded, their idle plain HTTP
+connections are reused, and the upstreams failing consecutively are ejected
+for a while.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from .utils import setup_logger
+
+POLICIES = ["round_robin", "least_connections", "random"]
+
+# Headers which only apply to one connection, and so are not forwarded as is
+HOP_BY_HOP_HEADERS = ["connection", "keep-alive", "proxy-connection", "te", "trailer", "upgrade"]
+
+# Relayed bodies read size
+BUFFER_SIZE = 65536
+
+
+class UpstreamError(Exception):
+    """An upstream can not be connected to or dropped the connection before responding
+    """
+
+    def __init__(self, message, retriable=True):
+        """Constructor
+
+        Args:
+            message (string): Error message
+            retriable (boolean, optional): Whether the request can be sent to another upstream
+        """
+        Exception.__init__(self, message)
+        self.retriable = retriable
+
+
+class ClientRequestError(Exception):
+    """A client dropped its request, or sent a malformed one, while it was relayed to an upstream
+    """
+
+
+class ClientReader(object):
+    """Client request body reader raising ClientRequestError on read errors, so that they are not
+    taken for upstream failures
+
+    The relayed request bodies being framed, the end of the stream is a read error too.
+    """
+
+    def __init__(self, reader):
+        """Constructor
+
+        Args:
+            reader (object): Client stream reader
+        """
+        self.reader = reader
+
+    async def read(self, n=-1):
+        data = await self.__guard(self.reader.read(n))
+        if not data and n:
+            raise ClientRequestError("The client closed its connection before the end of its request")
+        return data
+
+    async def readexactly(self, n):
+        return await self.__guard(self.reader.readexactly(n))
+
+    async def readuntil(self, separator=b"\n"):
+        return await self.__guard(self.reader.readuntil(separator))
+
+    async def __guard(self, read):
+        try:
+            return await read
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            raise ClientRequestError("The client dropped its request ({0!r})".format(e))
+
+
+class Upstream(object):
+    """Fleet proxy the gateway forwards the connections to
+    """
+
+    def __init__(self, host, port, max_connections):
+        """Constructor
+
+        Args:
+            host (string): Proxy host (e.g. its public ip)
+            port (integer): Proxy port
+            max_connections (integer): Concurrent connections limit
+        """
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.semaphore = asyncio.Semaphore(max_connections)
+        # Connections picked, waiting for the semaphore or forwarding
+        self.active_connections = 0
+        # Consecutive failures, the upstream being ejected until ejected_until once there are too many
+        self.failures = 0
+        self.ejected_until = 0
+        # Idle plain HTTP connections, with their idle since time
+        self.idle_connections = []
+        self.requests_count = 0
+        self.failures_count = 0
+
+    def __repr__(self):
+        return "Upstream({0!r}, {1!r})".format(self.host, self.port)
+
+    def is_ejected(self, now):
+        return self.ejected_until > now
+
+    def close_idle_connections(self):
+        """Close the idle connections
+        """
+        for reader, writer, idle_since in self.idle_connections:
+            writer.close()
+        self.idle_connections = []
+
+    def get_stats(self):
+        """Get the upstream counters
+
+        Returns:
+            dict: Upstream counters
+        """
+        return {
+            "Host": self.host,
+            "Port": self.port,
+            "ActiveConnections": self.active_connections,
+            "IdleConnections": len(self.idle_connections),
+            "Requests": self.requests_count,
+            "Failures": self.failures_count,
+            "Ejected": self.is_ejected(time.time())
+        }
+
+
+class Gateway(object):
+    """Asyncio forward proxy load-balancing across the fleet proxies
+    """
+
+    def __init__(self, upstreams=None, endpoints_path=None, **kwargs):
+        """Constructor
+
+        Args:
+            upstreams (list, optional): Upstreams (host, port) tuples
+            endpoints_path (string, optional): Endpoints JSON file (see Proxies.publish_endpoints) to read the
+                upstreams from, reloaded when it changes
+            **kwargs: Multiple arguments (upstream_port, policy, max_connections_per_upstream...)
+
+        Raises:
+            TypeError: Description
+            ValueError: Unknown policy
+        """
+        self.endpoints_path = endpoints_path
+        # Proxy port of the endpoints file public ips
+        self.upstream_port = kwargs.pop("upstream_port", 8888)
+        self.policy = kwargs.pop("policy", "round_robin")
+        self.max_connections_per_upstream = kwargs.pop("max_connections_per_upstream", 100)
+        self.max_idle_connections_per_upstream = kwargs.pop("max_idle_connections_per_upstream", 10)
+        self.idle_timeout = kwargs.pop("idle_timeout", 30)
+        self.connect_timeout = kwargs.pop("connect_timeout", 5)
+        # Seconds to wait for an upstream response head
+        self.response_timeout = kwargs.pop("response_timeout", 60)
+        # Consecutive failures after which an upstream is ejected, and for how many seconds
+        self.max_failures = kwargs.pop("max_failures", 3)
+        self.ejection_time = kwargs.pop("ejection_time", 30)
+        # Other upstreams to try when an upstream can not be connected to
+        self.retries = kwargs.pop("retries", 2)
+        self.reload_interval = kwargs.pop("reload_interval", 5)
+        self.backlog = kwargs.pop("backlog", 1024)
+        log_level = kwargs.pop("log_level", logging.WARNING)
+
+        if kwargs:
+            raise TypeError("Unexpected **kwargs: %r" % kwargs)
+        if self.policy not in POLICIES:
+            raise ValueError("Unknown policy '{0}', expected one of {1}".format(self.policy, ", ".join(POLICIES)))
+        self.logger = setup_logger(__name__, log_level)
+
+        self.upstreams = []
+        self.server = None
+        self._next_upstream = 0
+        self._endpoints_mtime = None
+        self._reload_task = None
+        if upstreams:
+            self.set_upstreams(upstreams)
+
+    def set_upstreams(self, endpoints):
+        """Replace the upstreams, keeping the state of the ones which are still there
+
+        Args:
+            endpoints (list): Upstreams (host, port) tuples
+        """
+        upstreams = dict(((upstream.host, upstream.port), upstream) for upstream in self.upstreams)
+        self.upstreams = []
+        for host, port in endpoints:
+            upstream = upstreams.pop((host, int(port)), None)
+            if upstream is None:
+                upstream = Upstream(host, int(port), self.max_connections_per_upstream)
+            self.upstreams.append(upstream)
+
+        for upstream in upstreams.values():
+            upstream.close_idle_connections()
+
+        self.logger.info("The gateway forwards to %s upstreams", len(self.upstreams))
+
+    def reload_endpoints(self):
+        """Read the upstreams from the endpoints file when it has changed
+
+        Returns:
+            boolean: Whether the upstreams have been replaced
+        """
+        try:
+            mtime = os.stat(self.endpoints_path).st_mtime
+        except OSError as e:
+            self.logger.warning("The endpoints file '%s' can not be read (%s)", self.endpoints_path, e)
+            return False
+
+        if mtime == self._endpoints_mtime:
+            return False
+
+        with open(self.endpoints_path) as f:
+            endpoints = json.load(f)
+        self._endpoints_mtime = mtime
+        self.set_upstreams([(public_ip, self.upstream_port) for public_ip, private_ip in endpoints["Proxies"]])
+
+        return True
+
+    async def __reload_endpoints_periodically(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                self.reload_endpoints()
+            except (OSError, ValueError, KeyError) as e:
+                self.logger.warning("The endpoints file '%s' can not be reloaded (%s)", self.endpoints_path, e)
+
+    def pick_upstream(self, excluded=()):
+        """Pick an upstream with the policy
+
+        The ejected upstreams are skipped, unless they all are, and the upstreams
+        with free connections are preferred.
+
+        Args:
+            excluded (list, optional): Upstreams not to pick (e.g. already tried)
+
+        Returns:
+            object: Upstream, None when there is none left
+        """
+        candidates = [upstream for upstream in self.upstreams if upstream not in excluded]
+        if not candidates:
+            return None
+
+        now = time.time()
+        candidates = [upstream for upstream in candidates if not upstream.is_ejected(now)] or candidates
+        candidates = [
+            upstream for upstream in candidates if upstream.active_connections < upstream.max_connections
+        ] or candidates
+
+        if self.policy == "random":
+            return random.choice(candidates)
+        if self.policy == "least_connections":
+            return min(candidates, key=lambda upstream: (upstream.active_connections, random.random()))
+
+        self._next_upstream = self._next_upstream + 1
+        return candidates[self._next_upstream % len(candidates)]
+
+    def record_success(self, upstream):
+        upstream.failures = 0
+
+    def record_failure(self, upstream, error):
+        """Count an upstream failure and eject the upstream after too many consecutive ones
+
+        Args:
+            upstream (object): Upstream
+            error (object): Failure
+        """
+        upstream.failures = upstream.failures + 1
+        upstream.failures_count = upstream.failures_count + 1
+        if upstream.failures >= self.max_failures and not upstream.is_ejected(time.time()):
+            upstream.ejected_until = time.time() + self.ejection_time
+            upstream.close_idle_connections()
+            self.logger.warning("The upstream %s:%s is ejected for %s seconds after %s failures (%s)",
+                                upstream.host, upstream.port, self.ejection_time, upstream.failures, error)
+
+    async def __open_connection(self, upstream, reuse=True):
+        """Get an idle connection to an upstream, or open one
+
+        Args:
+            upstream (object): Upstream
+            reuse (boolean, optional): Whether an idle connection can be used
+
+        Returns:
+            tuple: Reader, writer and whether the connection is a reused one
+
+        Raises:
+            UpstreamError: The upstream can not be connected to
+        """
+        now = time.time()
+        while reuse and upstream.idle_connections:
+            reader, writer, idle_since = upstream.idle_connections.pop()
+            if now - idle_since < self.idle_timeout and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(upstream.host, upstream.port, limit=BUFFER_SIZE), self.connect_timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise UpstreamError("{0}:{1} can not be connected to ({2!r})".format(upstream.host, upstream.port, e))
+
+        return reader, writer, False
+
+    def __release_connection(self, upstream, reader, writer, reusable):
+        """Keep a connection to an upstream for reuse, or close it
+
+        Args:
+            upstream (object): Upstream
+            reader (object): Stream reader
+            writer (object): Stream writer
+            reusable (boolean): Whether the connection can be reused
+        """
+        if reusable and len(upstream.idle_connections) < self.max_idle_connections_per_upstream:
+            upstream.idle_connections.append((reader, writer, time.time()))
+        else:
+            writer.close()
+
+    async def handle_client(self, client_reader, client_writer):
+        """Serve a client connection: a tunnel, or plain HTTP requests as long as it is kept alive
+
+        Args:
+            client_reader (object): Client stream reader
+            client_writer (object): Client stream writer
+        """
+        try:
+            while True:
+                head = await read_head(client_reader)
+                if head is None:
+                    break
+
+                request_line, headers = head
+                try:
+                    method, target, version = request_line.split(" ", 2)
+                except ValueError:
+                    await send_error(client_writer, 400, "Bad Request")
+                    break
+
+                if method == "CONNECT":
+                    await self.tunnel(client_reader, client_writer, request_line, headers)
+                    break
+
+                if not target.startswith("http://"):
+                    # Only proxy requests (absolute URIs) are forwarded
+                    await send_error(client_writer, 400, "Bad Request")
+                    break
+
+                if not await self.forward(client_reader, client_writer, method, request_line, headers, version):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError,
+                ClientRequestError) as e:
+            self.logger.debug("Client connection error (%r)", e)
+        finally:
+            client_writer.close()
+
+    async def __with_upstream(self, handler):
+        """Run a handler with an upstream, trying other upstreams when it can not be connected to
+
+        Args:
+            handler (function): Coroutine function taking the upstream
+
+        Returns:
+            object: Handler result
+
+        Raises:
+            UpstreamError: No upstream could be connected to
+        """
+        tried_upstreams = []
+        error = UpstreamError("There is no upstream")
+        for attempt in range(self.retries + 1):
+            upstream = self.pick_upstream(tried_upstreams)
+            if upstream is None:
+                break
+            tried_upstreams.append(upstream)
+
+            upstream.active_connections = upstream.active_connections + 1
+            try:
+                async with upstream.semaphore:
+                    upstream.requests_count = upstream.requests_count + 1
+                    result = await handler(upstream)
+                self.record_success(upstream)
+                return result
+            except UpstreamError as e:
+                self.record_failure(upstream, e)
+                if not e.retriable:
+                    raise
+                error = e
+            finally:
+                upstream.active_connections = upstream.active_connections - 1
+
+        raise error
+
+    async def tunnel(self, client_reader, client_writer, request_line, headers):
+        """Open a tunnel (HTTP CONNECT) through an upstream and relay it
+
+        Args:
+            client_reader (object): Client stream reader
+            client_writer (object): Client stream writer
+            request_line (string): Client request line
+            headers (list): Client request headers tuples
+        """
+        async def connect(upstream):
+            reader, writer, reused = await self.__open_connection(upstream, reuse=False)
+            try:
+                writer.write(build_head(request_line, headers))
+                head = await asyncio.wait_for(read_head(reader), self.response_timeout)
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                writer.close()
+                raise UpstreamError("{0}:{1} dropped the tunnel ({2!r})".format(upstream.host, upstream.port, e))
+            if head is None:
+                writer.close()
+                raise UpstreamError("{0}:{1} closed the tunnel".format(upstream.host, upstream.port))
+
+            status_line, response_headers = head
+            client_writer.write(build_head(status_line, response_headers))
+            if get_status(status_line) == 200:
+                await asyncio.gather(relay(client_reader, writer), relay(reader, client_writer))
+            writer.close()
+
+        try:
+            await self.__with_upstream(connect)
+        except UpstreamError as e:
+            self.logger.info("The tunnel '%s' can not be opened (%s)", request_line, e)
+            await send_error(client_writer, 502, "Bad Gateway")
+
+    async def forward(self, client_reader, client_writer, method, request_line, headers, version):
+        """Forward a plain HTTP request through an upstream and relay its response
+
+        Args:
+            client_reader (object): Client stream reader
+            client_writer (object): Client stream writer
+            method (string): Request method
+            request_line (string): Client request line
+            headers (list): Client request headers tuples
+            version (string): Client HTTP version
+
+        Returns:
+            boolean: Whether the client connection can be kept alive
+        """
+        client_keep_alive = is_keep_alive(version, headers)
+        has_body = get_header(headers, "content-length") not in (None, "0") or \
+            get_header(headers, "transfer-encoding") is not None
+        upstream_headers = [
+            (name, value) for name, value in headers if name.lower() not in HOP_BY_HOP_HEADERS
+        ] + [("Connection", "keep-alive")]
+
+        async def send(upstream):
+            # A reused connection may have been closed by the upstream meanwhile: without a body to
+            # replay, the request is sent again on a new connection
+            reuse = True
+            while True:
+                reader, writer, reused = await self.__open_connection(upstream, reuse=reuse)
+                try:
+                    writer.write(build_head(request_line, upstream_headers))
+                    await relay_body(ClientReader(client_reader), writer, headers)
+                    head = await asyncio.wait_for(read_head(reader), self.response_timeout)
+                    if head is None:
+                        raise asyncio.IncompleteReadError(b"", None)
+                    return reader, writer, head
+                except ClientRequestError:
+                    # Not an upstream failure: the client connection is closed
+                    writer.close()
+                    raise
+                except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                    writer.close()
+                    if reused and not has_body:
+                        reuse = False
+                        continue
+                    # The request body has been consumed, so it can not be sent to another upstream
+                    raise UpstreamError("{0}:{1} dropped the request ({2!r})".format(upstream.host, upstream.port, e),
+                                        retriable=not has_body)
+
+        async def exchange(upstream):
+            reader, writer, (status_line, response_headers) = await send(upstream)
+            status = get_status(status_line)
+            has_response_body = method != "HEAD" and status not in (204, 304) and status >= 200
+            framed = not has_response_body or get_header(response_headers, "content-length") is not None or \
+                get_header(response_headers, "transfer-encoding") is not None
+            upstream_keep_alive = framed and is_keep_alive(status_line.split(" ", 1)[0], response_headers)
+            keep_alive = client_keep_alive and framed
+
+            client_writer.write(build_head(status_line, [
+                (name, value) for name, value in response_headers if name.lower() not in HOP_BY_HOP_HEADERS
+            ] + [("Connection", "keep-alive" if keep_alive else "close")]))
+            try:
+                if has_response_body:
+                    await relay_body(reader, client_writer, response_headers, until_eof=not framed)
+                else:
+                    await client_writer.drain()
+            except BaseException:
+                writer.close()
+                raise
+
+            self.__release_connection(upstream, reader, writer, upstream_keep_alive)
+            return keep_alive
+
+        try:
+            return await self.__with_upstream(exchange)
+        except UpstreamError as e:
+            self.logger.info("The request '%s' can not be forwarded (%s)", request_line, e)
+            await send_error(client_writer, 502, "Bad Gateway")
+            return False
+
+    async def start(self, host="127.0.0.1", port=3128):
+        """Start listening
+
+        Args:
+            host (string, optional): Host to listen to
+            port (integer, optional): Port to listen to
+
+        Returns:
+            object: Asyncio server
+        """
+        if self.endpoints_path is not None:
+            self.reload_endpoints()
+            self._reload_task = asyncio.ensure_future(self.__reload_endpoints_periodically())
+
+        self.server = await asyncio.start_server(
+            self.handle_client, host, port, backlog=self.backlog, limit=BUFFER_SIZE)
+        self.logger.info("The gateway listens to %s:%s", host, port)
+
+        return self.server
+
+    async def stop(self):
+        """Stop listening and close the idle upstream connections
+        """
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for upstream in self.upstreams:
+            upstream.close_idle_connections()
+
+    def serve_forever(self, host="127.0.0.1", port=3128):
+        """Run the gateway until interrupted
+
+        Args:
+            host (string, optional): Host to listen to
+            port (integer, optional): Port to listen to
+        """
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.start(host, port))
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(self.stop())
+
+    def get_stats(self):
+        """Get the upstreams counters
+
+        Returns:
+            list: Upstreams counters
+        """
+        return [upstream.get_stats() for upstream in self.upstreams]
+
+
+async def read_head(reader):
+    """Read a request or response head
+
+    Args:
+        reader (object): Stream reader
+
+    Returns:
+        tuple: First line and headers tuples, None when the connection is closed before a head
+    """
+    try:
+        data = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise
+
+    lines = data.decode("latin-1").split("\r\n")
+    headers = []
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers.append((name.strip(), value.strip()))
+
+    return lines[0], headers
+
+
+def build_head(first_line, headers):
+    """Build a request or response head
+
+    Args:
+        first_line (string): Request or status line
+        headers (list): Headers tuples
+
+    Returns:
+        bytes: Head
+    """
+    return "\r\n".join([first_line] + [name + ": " + value for name, value in headers] + ["", ""]).encode("latin-1")
+
+
+def get_header(headers, name):
+    """Get a header value
+
+    Args:
+        headers (list): Headers tuples
+        name (string): Lower case header name
+
+    Returns:
+        string: Header value, None when missing
+    """
+    for header_name, value in headers:
+        if header_name.lower() == name:
+            return value
+    return None
+
+
+def get_status(status_line):
+    """Get a status line status code
+
+    Args:
+        status_line (string): Status line
+
+    Returns:
+        integer: Status code, 0 when the status line is malformed
+    """
+    try:
+        return int(status_line.split(" ", 2)[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def is_keep_alive(version, headers):
+    """Get whether a connection is kept alive after a message
+
+    Args:
+        version (string): Message HTTP version
+        headers (list): Message headers tuples
+
+    Returns:
+        boolean: Whether the connection is kept alive
+    """
+    connection = (get_header(headers, "connection") or get_header(headers, "proxy-connection") or "").lower()
+    if version == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+async def send_error(writer, status, reason):
+    """Send an error response and close the connection
+
+    Args:
+        writer (object): Stream writer
+        status (integer): Status code
+        reason (string): Reason phrase
+    """
+    writer.write(build_head("HTTP/1.1 {0} {1}".format(status, reason), [
+        ("Content-Length", "0"),
+        ("Connection", "close")
+    ]))
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+
+
+async def relay(reader, writer):
+    """Relay a stream until it is closed
+
+    Args:
+        reader (object): Source stream reader
+        writer (object): Destination stream writer
+    """
+    try:
+        while True:
+            data = await reader.read(BUFFER_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        if writer.can_write_eof():
+            try:
+                writer.write_eof()
+            except OSError:
+                pass
+
+
+async def relay_body(reader, writer, headers, until_eof=False):
+    """Relay a message body, framed by its content length or chunked encoding
+
+    Args:
+        reader (object): Source stream reader
+        writer (object): Destination stream writer
+        headers (list): Message headers tuples
+        until_eof (boolean, optional): Whether an unframed body goes on until the connection is closed
+    """
+    transfer_encoding = (get_header(headers, "transfer-encoding") or "").lower()
+    content_length = get_header(headers, "content-length")
+
+    if "chunked" in transfer_encoding:
+        while True:
+            size_line = await reader.readuntil(b"\r\n")
+            writer.write(size_line)
+            size = int(size_line.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                # Trailers, up to an empty line
+                while True:
+                    line = await reader.readuntil(b"\r\n")
+                    writer.write(line)
+                    if line == b"\r\n":
+                        break
+                break
+            writer.write(await reader.readexactly(size + 2))
+            await writer.drain()
+    elif content_length is not None:
+        remaining = int(content_length)
+        while remaining > 0:
+            data = await reader.read(min(remaining, BUFFER_SIZE))
+            if not data:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            writer.write(data)
+            remaining = remaining - len(data)
+            await writer.drain()
+    elif until_eof:
+        while True:
+            data = await reader.read(BUFFER_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+
+    await writer.drain()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import time
+from .utils import write_json_atomically
+
+
+class ImageCache(object):
+    """Resolved images cache
+
+    The images resolved by name or ID (ID and virtualization type) are kept in
+    memory and, with a path, in a JSON file shared by the processes, so that
+    repeated creates make no describe call. The entries expire after the TTL.
+    """
+
+    def __init__(self, path=None, ttl=None):
+        """Constructor
+
+        Args:
+            path (string, optional): JSON file path, the cache is kept in memory only without one.
+                Parent directories are created on first write
+            ttl (integer, optional): Seconds the entries are valid for, forever without one
+        """
+        self.path = os.path.expanduser(path) if path else None
+        self.ttl = ttl
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def __load(self):
+        """Load the cache file entries on first use
+
+        Returns:
+            dict: Entries indexed by key
+        """
+        if self._entries is None:
+            self._entries = {}
+            if self.path and os.path.isfile(self.path):
+                try:
+                    with open(self.path) as f:
+                        self._entries = json.load(f)
+                except (IOError, OSError, ValueError):
+                    # An unreadable cache is rebuilt
+                    self._entries = {}
+
+        return self._entries
+
+    def get(self, key):
+        """Get a cached image
+
+        Args:
+            key (string): Cache key
+
+        Returns:
+            dict: Image, None when it is missing or expired
+        """
+        with self._lock:
+            entry = self.__load().get(key)
+
+        if entry is None or (self.ttl is not None and time.time() - entry["CachedAt"] > self.ttl):
+            return None
+
+        return entry["Image"]
+
+    def update(self, images):
+        """Cache images
+
+        Args:
+            images (dict): Images indexed by cache key
+        """
+        with self._lock:
+            entries = self.__load()
+            cached_at = time.time()
+            if self.ttl is not None:
+                for key in [key for key, entry in entries.items() if cached_at - entry["CachedAt"] > self.ttl]:
+                    del entries[key]
+            for key, image in images.items():
+                entries[key] = {
+                    "Image": image,
+                    "CachedAt": cached_at
+                }
+
+            if self.path:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                write_json_atomically(self.path, entries)
@@ -1,8 +1,23 @@
 # -*- coding: utf-8 -*-
-
-from base_resources import BaseResources
+from __future__ import print_function
+from .base_resources import BaseResources
+from botocore.exceptions import ClientError
+from .launch_templates import LaunchTemplates
 import logging
-from utils import setup_logger, filter_resources, tag_with_name_with_suffix
+from .models import Topology
+from .state import INSTANCE, NETWORK_INTERFACE
+from .tracing import traced
+from .utils import setup_logger, get_cidr_block_gateway_ip, get_fleet_instances_filter, iter_resources, \
+    get_network_interface_proxies_ips, iter_filters_batches
+
+# Run instances error codes on which the launch spills over to another availability zone
+CAPACITY_ERROR_CODES = ["InsufficientInstanceCapacity", "InsufficientCapacity", "Unsupported"]
+
+# Running instances of a spread placement group per availability zone
+SPREAD_MAX_INSTANCES_PER_ZONE = 7
+
+# Instance states of the instances which no longer serve as proxies
+FAILED_INSTANCE_STATES = ["shutting-down", "terminated", "stopping", "stopped"]
 
 
 class Instances(BaseResources):
@@ -21,31 +36,48 @@ class Instances(BaseResources):
         Raises:
             TypeError: Description
         """
-        BaseResources.__init__(self, ec2, ec2_client, tag_base_name)
+        BaseResources.__init__(self, ec2, ec2_client, tag_base_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
         log_level = kwargs.pop("log_level", logging.WARNING)
         boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
 
         if kwargs:
             raise TypeError("Unexpected **kwargs: %r" % kwargs)
         self.logger = setup_logger(__name__, log_level, boto_log_level)
+        self.launch_templates = LaunchTemplates(ec2, ec2_client, tag_base_name,
+                                                tracer=self.tracer, state_store=self.state_store,
+                                                log_level=log_level, boto_log_level=boto_log_level)
+
+    def fleet_filter(self):
+        """Get the filter matching the fleet instances
 
+        The instances IDs recorded in the state store are used when there are
+        some, otherwise the instances are matched by tag name.
+
+        Returns:
+            dict: Filter value(s) indexed by filter name (see iter_resources)
+        """
+        return get_fleet_instances_filter(self.state_store, self.tag_base_name)
+
+    @traced("instances.terminate")
     def terminate(self):
         """Terminate instances
         """
-        aws_instances_ids = []
-        aws_instances = self.ec2.instances.filter(Filters=[
-            {
-                "Name": "tag:Name",
-                "Values": [self.tag_base_name + '-*']
-            },
-            {
-                "Name": "instance-state-name",
-                "Values": ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
-            },
-        ])
-
-        for aws_instance in aws_instances:
-            aws_instances_ids.append(aws_instance.id)
+        states = ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
+        fleet_filter = self.fleet_filter()
+        fleet_filter["instance-state-name"] = states
+        aws_instances_ids = [
+            aws_instance["InstanceId"] for aws_instance in iter_resources(
+                self.ec2_client, "describe_instances", fleet_filter, projection=["InstanceId"])
+        ]
+
+        if not aws_instances_ids:
+            aws_instances_ids = [
+                aws_instance["InstanceId"] for aws_instance in iter_resources(self.ec2_client, "describe_instances", {
+                    "tag:Name": self.tag_base_name + '-*',
+                    "instance-state-name": states
+                }, projection=["InstanceId"])
+            ]
 
         aws_instances_ids_str = str(aws_instances_ids).strip('[]')
         if aws_instances_ids:
@@ -54,18 +86,113 @@ class Instances(BaseResources):
                 aws_instances_ids_str
             )
 
+            self.tracer.current_span().set_attribute("instance_ids", aws_instances_ids)
+
             self.ec2_client.terminate_instances(
                 InstanceIds=aws_instances_ids
             )
 
-            waiter = self.ec2_client.get_waiter('instance_terminated')
-            waiter.wait(InstanceIds=aws_instances_ids)
+            with self.tracer.span("waiter.instance_terminated", instance_ids=aws_instances_ids):
+                waiter = self.ec2_client.get_waiter('instance_terminated')
+                waiter.wait(InstanceIds=aws_instances_ids)
 
             self.logger.info(
                 "Instances %s are now terminated",
                 aws_instances_ids_str
             )
 
+        for instance_id in self.state_store.get_resource_ids(self.tag_base_name, INSTANCE):
+            self.forget_resource(INSTANCE, instance_id)
+
+    @traced("instances.get_failed_instances")
+    def get_failed_instances(self):
+        """Get the recorded instances which are gone, stopped or impaired
+
+        The instances states are described with calls filtered on up to 200 instances
+        IDs, then the status checks of the running ones are described in batches of
+        100 instances.
+
+        Returns:
+            dict: Failure reason ('missing', instance state name or 'impaired') indexed by instance uid
+        """
+        recorded_instances = self.state_store.get_resources_by_uid(self.tag_base_name, INSTANCE)
+        if not recorded_instances:
+            return {}
+
+        aws_instances_states = dict(
+            (aws_instance["InstanceId"], aws_instance["State"]["Name"])
+            for aws_instance in iter_resources(self.ec2_client, "describe_instances", {
+                "instance-id": [recorded_instance["ResourceId"] for recorded_instance in recorded_instances.values()]
+            }, projection=["InstanceId", "State"])
+        )
+
+        # Unknown instances ids fail the whole status call, so only the existing running ones are asked for
+        running_instances_ids = [
+            instance_id for instance_id, state in aws_instances_states.items() if state == "running"
+        ]
+        impaired_instances_ids = set()
+        for i in range(0, len(running_instances_ids), 100):
+            aws_instances_statuses = self.ec2_client.describe_instance_status(
+                InstanceIds=running_instances_ids[i:i + 100])["InstanceStatuses"]
+            for aws_instance_status in aws_instances_statuses:
+                if "impaired" in (aws_instance_status.get("InstanceStatus", {}).get("Status"),
+                                  aws_instance_status.get("SystemStatus", {}).get("Status")):
+                    impaired_instances_ids.add(aws_instance_status["InstanceId"])
+
+        failed_instances = {}
+        for uid, recorded_instance in recorded_instances.items():
+            state = aws_instances_states.get(recorded_instance["ResourceId"])
+            if state is None:
+                failed_instances[uid] = "missing"
+            elif state in FAILED_INSTANCE_STATES:
+                failed_instances[uid] = state
+            elif recorded_instance["ResourceId"] in impaired_instances_ids:
+                failed_instances[uid] = "impaired"
+
+        self.tracer.current_span().set_attribute("failed_instances", failed_instances)
+
+        return failed_instances
+
+    @traced("instances.discard")
+    def discard(self, instances_uids):
+        """Terminate recorded instances and forget them, keeping their network interfaces
+
+        The network interfaces attached by the launch are not deleted on termination,
+        so that they can be attached to replacement instances along with their private
+        and public ips.
+
+        Args:
+            instances_uids (list): Instances uids
+        """
+        recorded_instances = self.state_store.get_resources_by_uid(self.tag_base_name, INSTANCE)
+        aws_instances_ids = [
+            recorded_instances[uid]["ResourceId"] for uid in instances_uids if uid in recorded_instances
+        ]
+        if not aws_instances_ids:
+            return
+
+        self.tracer.current_span().set_attribute("instance_ids", aws_instances_ids)
+
+        aws_alive_instances_ids = [
+            aws_instance["InstanceId"] for aws_instance in iter_resources(self.ec2_client, "describe_instances", {
+                "instance-id": aws_instances_ids,
+                "instance-state-name": ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
+            }, projection=["InstanceId"])
+        ]
+        if aws_alive_instances_ids:
+            self.ec2_client.terminate_instances(InstanceIds=aws_alive_instances_ids)
+
+            # The network interfaces are only released once the instances are terminated
+            with self.tracer.span("waiter.instance_terminated", instance_ids=aws_alive_instances_ids):
+                waiter = self.ec2_client.get_waiter('instance_terminated')
+                waiter.wait(InstanceIds=aws_alive_instances_ids)
+
+        for instance_id in aws_instances_ids:
+            self.forget_resource(INSTANCE, instance_id)
+
+        self.logger.info("Instances %s have been discarded", str(aws_instances_ids).strip('[]'))
+
+    @traced("instances.get_running_proxies_ips")
     def get_running_proxies_ips(self, silent=False):
         """Get the public and private ips of all running proxy instances
 
@@ -73,96 +200,531 @@ class Instances(BaseResources):
             silent (bool, optional): Silent
 
         Returns:
-            Dict: Dictionnary of tuple public/private ips
-        """
-        filter = [
-            {
-                "Name": "tag:Name",
-                "Values": [self.tag_base_name + '-*']
-            },
-            {
-                "Name": "instance-state-name",
-                "Values": ['running']
-            },
-        ]
+            Dict: Dictionnary of tuple public/private ips, the ipv6 addresses being both
+        """
+        filters = self.fleet_filter()
 
         if not silent:
-            print "Waiting for all proxies to be running..."
+            print("Waiting for all proxies to be running...")
 
-        waiter = self.ec2_client.get_waiter('instance_running')
-        waiter.wait(Filters=filter)
+        # The pending instances are waited for too, the waiter only checking the instances it describes
+        filters["instance-state-name"] = ['pending', 'running']
+        with self.tracer.span("waiter.instance_running"):
+            waiter = self.ec2_client.get_waiter('instance_running')
+            for filters_batch in iter_filters_batches(filters):
+                waiter.wait(Filters=filters_batch)
+
+        filters["instance-state-name"] = 'running'
 
-        instances = self.ec2.instances.filter(Filters=filter)
         ips = []
-        for instance in list(instances):
-            for eni in instance.network_interfaces_attribute:
-                for private_ip_addresses in eni['PrivateIpAddresses']:
-                    ips.append(
-                        (private_ip_addresses['Association']['PublicIp'], private_ip_addresses['PrivateIpAddress'])
-                    )
+        for aws_instance in iter_resources(self.ec2_client, "describe_instances", filters,
+                                           projection=["NetworkInterfaces"]):
+            for eni in aws_instance.get("NetworkInterfaces", []):
+                # The primary network interface of fleet instances has no elastic ip
+                ips.extend(get_network_interface_proxies_ips(eni))
 
         return ips
 
-    def create(self, instances_groups_config, vpcs_config):
+    @traced("instances.create")
+    def create(self, instances_groups_config, vpcs_config, network_interfaces=None):
         """Create instances
 
+        Instances already recorded in the state store (e.g. by an interrupted create)
+        which are still pending or running are not launched again. When an instance
+        can not be launched for lack of capacity in its availability zone, its
+        network interfaces are moved to another zone subnet of its vpc with enough
+        free private ips and the launch is retried there.
+
+        The instances of a 'spread' PlacementStrategy group are split across as many
+        placement groups as needed to have at most SPREAD_MAX_INSTANCES_PER_ZONE
+        instances per availability zone in each.
+
+        Instances groups with a 'fleet' LaunchMode are launched with create_fleet
+        instead (see create_fleet).
+
         Args:
             instances_groups_config (dict): Instances groups config
             vpcs_config (dict): Vpcs config
+            network_interfaces (object, optional): Network interfaces resources, needed to spill over
+
+        Returns:
+            list: Launched instances config
         """
+        recorded_instances = self.state_store.get_resources_by_uid(self.tag_base_name, INSTANCE)
+        alive_instances_ids = set()
+        if recorded_instances:
+            recorded_instances_ids = [
+                recorded_instance["ResourceId"] for recorded_instance in recorded_instances.values()
+            ]
+            alive_instances_ids = set(
+                aws_instance["InstanceId"] for aws_instance in iter_resources(self.ec2_client, "describe_instances", {
+                    "instance-id": recorded_instances_ids,
+                    "instance-state-name": ['pending', 'running']
+                }, projection=["InstanceId"])
+            )
+
+        topology = Topology.from_config(vpcs_config)
+
         instances_config = []
-        user_data = "#!/bin/bash\n"
-        for instance_group in instances_groups_config:
+        for group_index, instance_group in enumerate(instances_groups_config):
+            placement_strategy = instance_group.get("PlacementStrategy")
+            placement_groups_names = {}
+            # Spread placement groups indexes of the instances, in order per availability zone
+            placement_groups_indexes = {}
+            zones_instances_counts = {}
+            if placement_strategy == "spread":
+                for instance_index, instance in enumerate(instance_group['Instances']):
+                    availability_zone = instance.get("AvailabilityZone")
+                    zone_instances_count = zones_instances_counts.get(availability_zone, 0)
+                    placement_groups_indexes[instance_index] = zone_instances_count // SPREAD_MAX_INSTANCES_PER_ZONE
+                    zones_instances_counts[availability_zone] = zone_instances_count + 1
+
+            pending_instances = []
             for instance_index, instance in enumerate(instance_group['Instances']):
-                instance_config = {
-                    'ImageId': instance_group['ImageId'],
-                    'MinCount': 1,
-                    'MaxCount': 1,
-                    'InstanceType': instance_group['InstanceType'],
-                    'DisableApiTermination': False,
-                    'InstanceInitiatedShutdownBehavior': 'terminate',
-                    'NetworkInterfaces': [],
-                }
+                recorded_instance = recorded_instances.get("i-" + str(instance_index))
+                if recorded_instance is not None and recorded_instance["ResourceId"] in alive_instances_ids:
+                    self.logger.info("The instance '%s' already exists", recorded_instance["ResourceId"])
+                    continue
+                pending_instances.append((instance_index, instance))
+
+            if instance_group.get("LaunchMode") == "fleet":
+                instances_config.extend(self.create_fleet(
+                    instance_group, pending_instances, vpcs_config, network_interfaces, group_index, topology))
+                continue
+
+            for instance_index, instance in pending_instances:
+                placement_group_name = None
+                if placement_strategy:
+                    placement_group_name = self.__get_placement_group_name(
+                        placement_strategy, placement_groups_indexes.get(instance_index, 0), placement_groups_names)
+
+                # Subnets of the other availability zones of the instance vpc to spill over to
+                spill_over_subnets = []
+                if instance["CidrBlock"] in topology.subnets_by_cidr_block:
+                    spill_over_subnets = [
+                        subnet for subnet in topology.subnets_by_cidr_block[instance["CidrBlock"]].vpc.subnets
+                        if subnet.cidr_block != instance["CidrBlock"] and
+                        subnet.availability_zone != instance.get("AvailabilityZone")
+                    ]
+
+                while True:
+                    try:
+                        instance_config = self.launch(
+                            instance_group, instance, instance_index, placement_group_name, group_index)
+                        break
+                    except ClientError as e:
+                        if e.response["Error"]["Code"] not in CAPACITY_ERROR_CODES or network_interfaces is None:
+                            raise
+
+                        # The zones without room for the instance network interfaces are skipped
+                        subnets_free_ips = self.get_subnets_free_ips(
+                            [subnet.subnet_id for subnet in spill_over_subnets])
+                        instance_ips_count = Instances.get_instance_private_ips_count(instance)
+                        spill_over_subnets = [
+                            subnet for subnet in spill_over_subnets
+                            if subnets_free_ips.get(subnet.subnet_id, 0) >= instance_ips_count
+                        ]
+                        if not spill_over_subnets:
+                            raise
+
+                        subnet = spill_over_subnets.pop(0)
+                        self.logger.warning(
+                            "The instance %s can not be launched in availability zone '%s' (%s). "
+                            "Spilling over to availability zone '%s'",
+                            instance_index,
+                            instance.get("AvailabilityZone"),
+                            e.response["Error"]["Code"],
+                            subnet.availability_zone
+                        )
+                        network_interfaces.relocate(
+                            [eni["uid"] for eni in instance["NetworkInterfaces"]], subnet.subnet_id)
+                        instance["CidrBlock"] = subnet.cidr_block
+                        instance["AvailabilityZone"] = subnet.availability_zone
+                        instance["SubnetCidrSuffix"] = "/" + subnet.cidr_block.split("/")[1]
+                        instance["GatewayIP"] = get_cidr_block_gateway_ip(subnet.cidr_block)
+
+                        if placement_strategy == "spread":
+                            # The instance comes after the planned instances of its new zone
+                            zone_instances_count = zones_instances_counts.get(subnet.availability_zone, 0)
+                            zones_instances_counts[subnet.availability_zone] = zone_instances_count + 1
+                            placement_group_name = self.__get_placement_group_name(
+                                placement_strategy, zone_instances_count // SPREAD_MAX_INSTANCES_PER_ZONE,
+                                placement_groups_names)
 
-                for index, eni in enumerate(instance['NetworkInterfaces']):
-                    found_eni = filter_resources(self.ec2.network_interfaces, "tag-value", eni["uid"])
-                    if found_eni:
-                        instance_config['NetworkInterfaces'].append({
-                            'NetworkInterfaceId': found_eni[0].id,
-                            'DeviceIndex': index
-                        })
-
-                    if index > 0:
-                        user_data += "\n\nsudo bash -c \"echo 'auto eth{0}' >> /etc/network/interfaces\"\n" \
-                            "sudo bash -c \"echo 'iface eth{0} inet dhcp' >> /etc/network/interfaces\"\n" \
-                            "sudo ifup eth{0}\n" \
-                            "sudo bash -c \"echo '40{0} eth{0}_rt' >> /etc/iproute2/rt_tables\"\n".format(index)
-
-                    for private_ip_address in found_eni[0].private_ip_addresses:
-                        if not private_ip_address['Primary']:
-                            user_data += "\n# Add the primary ip address to the network interface\n"
-                            user_data += "sudo ip addr add {0}{1} dev eth{2}\n".format(
-                                private_ip_address['PrivateIpAddress'], instance['SubnetCidrSuffix'], index
-                            )
-                        if index > 0:
-                            user_data += "\n# Add an ip rule to a routing table\n"
-                            user_data += "sudo ip rule add from {0} lookup eth{1}_rt\n".format(
-                                private_ip_address['PrivateIpAddress'],
-                                index
-                            )
-
-                    if index > 0:
-                        user_data += "\n# Add a route\n"
-                        user_data += "sudo ip route add default via {0} dev " \
-                            "eth{1} table eth{1}_rt\n".format(instance['GatewayIP'], index)
-
-                instance_config['UserData'] = user_data
-
-                aws_reservation = self.ec2_client.run_instances(**instance_config)
-                aws_instance_config = aws_reservation['Instances'][0]
-                aws_instance = self.ec2.Instance(aws_instance_config['InstanceId'])
-                tag_with_name_with_suffix(aws_instance, "i", instance_index, self.tag_base_name)
-                instance_config['InstanceId'] = aws_instance_config['InstanceId']
                 instances_config.append(instance_config)
 
         return instances_config
+
+    def get_subnets_free_ips(self, subnets_ids):
+        """Get the free private ips counts of subnets
+
+        Args:
+            subnets_ids (list): Subnets IDs
+
+        Returns:
+            dict: Free private ips count indexed by subnet ID
+        """
+        return dict(
+            (aws_subnet["SubnetId"], aws_subnet["AvailableIpAddressCount"])
+            for aws_subnet in iter_resources(self.ec2_client, "describe_subnets", {
+                "subnet-id": subnets_ids
+            }, projection=["SubnetId", "AvailableIpAddressCount"])
+        )
+
+    @staticmethod
+    def get_instance_private_ips_count(instance):
+        """Get the private ips count of a planned instance network interfaces
+
+        Args:
+            instance (dict): Instance config
+
+        Returns:
+            integer: Private ips count
+        """
+        return sum(eni["Ips"]["SecondaryPrivateIpAddressCount"] + 1 for eni in instance["NetworkInterfaces"])
+
+    def launch(self, instance_group, instance, instance_index, placement_group_name=None, group_index=0):
+        """Launch an instance bound to its network interfaces
+
+        The instance is launched from the instances group launch template, only
+        its network interfaces (and placement) being passed along.
+
+        Args:
+            instance_group (dict): Instances group config
+            instance (dict): Instance config
+            instance_index (integer): Instance index in the group
+            placement_group_name (string, optional): Placement group name
+            group_index (integer, optional): Instances group index
+
+        Returns:
+            dict: Launched instance config
+        """
+        instance_config = {
+            'LaunchTemplate': self.launch_templates.get_or_create(instance_group, group_index),
+            'MinCount': 1,
+            'MaxCount': 1,
+            'NetworkInterfaces': [],
+        }
+
+        if placement_group_name is not None:
+            instance_config['Placement'] = {
+                'GroupName': placement_group_name
+            }
+
+        recorded_enis = self.state_store.get_resources_by_uid(self.tag_base_name, NETWORK_INTERFACE)
+        for index, eni in enumerate(instance['NetworkInterfaces']):
+            if eni["uid"] in recorded_enis:
+                eni_id = recorded_enis[eni["uid"]]["ResourceId"]
+            else:
+                eni_id = next(iter_resources(self.ec2_client, "describe_network_interfaces", {
+                    "tag:uid": eni["uid"]
+                }, projection=["NetworkInterfaceId"]))["NetworkInterfaceId"]
+
+            instance_config['NetworkInterfaces'].append({
+                'NetworkInterfaceId': eni_id,
+                'DeviceIndex': index
+            })
+
+        with self.tracer.span("run_instances", instance_index=instance_index,
+                              availability_zone=instance.get("AvailabilityZone")) as span:
+            aws_reservation = self.ec2_client.run_instances(**instance_config)
+            span.set_attribute("instance_id", aws_reservation['Instances'][0]['InstanceId'])
+            span.set_attribute("network_interface_ids", [
+                eni['NetworkInterfaceId'] for eni in instance_config['NetworkInterfaces']
+            ])
+        aws_instance_config = aws_reservation['Instances'][0]
+        self.tag(aws_instance_config['InstanceId'], "i", instance_index)
+        instance_config['InstanceId'] = aws_instance_config['InstanceId']
+        self.record_resource(
+            INSTANCE, aws_instance_config['InstanceId'], uid="i-" + str(instance_index), attributes={
+                "NetworkInterfaceIds": [eni['NetworkInterfaceId'] for eni in instance_config['NetworkInterfaces']],
+                "AvailabilityZone": instance.get("AvailabilityZone")
+            })
+
+        return instance_config
+
+    @traced("instances.create_fleet")
+    def create_fleet(self, instance_group, pending_instances, vpcs_config, network_interfaces=None, group_index=0,
+                     topology=None):
+        """Launch an instances group with EC2 Fleet, one instant fleet per vpc
+
+        The instances are launched with their own primary network interface, mixing
+        spot and on-demand capacity across the group instance types and the vpc subnets.
+        The planned network interfaces (and their elastic ips) are then attached to the
+        launched instances, being moved to the instance availability zone when EC2
+        picked another one than planned.
+
+        Instances group config keys:
+            InstanceTypes (list, optional): Instance types to pick from. Defaults to InstanceType
+            OnDemandPercentage (integer, optional): Percentage of on-demand instances. Defaults to 0
+            SpotAllocationStrategy (string, optional): Defaults to 'capacity-optimized'
+
+        Args:
+            instance_group (dict): Instances group config
+            pending_instances (list): Tuples of instance index and instance config to launch
+            vpcs_config (dict): Vpcs config
+            network_interfaces (object, optional): Network interfaces resources, needed to move
+                network interfaces across availability zones
+            group_index (integer, optional): Instances group index
+            topology (object, optional): Vpcs topology. Built from the vpcs config by default
+
+        Returns:
+            list: Launched instances config
+        """
+        if not pending_instances:
+            return []
+
+        if topology is None:
+            topology = Topology.from_config(vpcs_config)
+
+        launch_template = self.launch_templates.get_or_create(instance_group, group_index)
+        instance_types = instance_group.get("InstanceTypes") or [instance_group["InstanceType"]]
+
+        vpcs_pending_instances = {}
+        for instance_index, instance in pending_instances:
+            if instance["CidrBlock"] in topology.subnets_by_cidr_block:
+                vpc_id = topology.subnets_by_cidr_block[instance["CidrBlock"]].vpc.vpc_id
+                vpcs_pending_instances.setdefault(vpc_id, []).append((instance_index, instance))
+
+        instances_config = []
+        for vpc_id, vpc_pending_instances in vpcs_pending_instances.items():
+            vpc_subnets = vpcs_config[vpc_id]["Subnets"]
+            total_capacity = len(vpc_pending_instances)
+            on_demand_capacity = int(round(total_capacity * instance_group.get("OnDemandPercentage", 0) / 100.0))
+
+            with self.tracer.span("create_fleet", vpc_id=vpc_id, target_capacity=total_capacity) as span:
+                aws_fleet = self.ec2_client.create_fleet(
+                    Type="instant",
+                    LaunchTemplateConfigs=[
+                        {
+                            "LaunchTemplateSpecification": launch_template,
+                            "Overrides": [
+                                {
+                                    "InstanceType": instance_type,
+                                    "SubnetId": subnet["SubnetId"]
+                                }
+                                for instance_type in instance_types
+                                for subnet in vpc_subnets
+                            ]
+                        }
+                    ],
+                    TargetCapacitySpecification={
+                        "TotalTargetCapacity": total_capacity,
+                        "OnDemandTargetCapacity": on_demand_capacity,
+                        "SpotTargetCapacity": total_capacity - on_demand_capacity,
+                        "DefaultTargetCapacityType": "spot"
+                    },
+                    SpotOptions={
+                        "AllocationStrategy": instance_group.get("SpotAllocationStrategy", "capacity-optimized")
+                    },
+                    OnDemandOptions={
+                        "AllocationStrategy": "lowest-price"
+                    }
+                )
+                span.set_attribute("fleet_id", aws_fleet.get("FleetId"))
+
+            for error in aws_fleet.get("Errors", []):
+                self.logger.warning(
+                    "The fleet could not launch an instance: %s (%s)",
+                    error.get("ErrorMessage"),
+                    error.get("ErrorCode")
+                )
+
+            launched_instances_ids = []
+            lifecycles = {}
+            for aws_fleet_instances in aws_fleet.get("Instances", []):
+                for instance_id in aws_fleet_instances["InstanceIds"]:
+                    launched_instances_ids.append(instance_id)
+                    lifecycles[instance_id] = aws_fleet_instances.get("Lifecycle")
+
+            if len(launched_instances_ids) < total_capacity:
+                self.logger.warning(
+                    "%s instances out of %s have been launched in vpc '%s'",
+                    len(launched_instances_ids),
+                    total_capacity,
+                    vpc_id
+                )
+
+            if not launched_instances_ids:
+                continue
+
+            # Network interfaces can only be attached once the instances are running
+            with self.tracer.span("waiter.instance_running"):
+                waiter = self.ec2_client.get_waiter('instance_running')
+                waiter.wait(InstanceIds=launched_instances_ids)
+
+            for aws_instance in self.ec2.instances.filter(InstanceIds=launched_instances_ids):
+                instance_index, instance = self.__pop_fleet_instance(
+                    vpc_pending_instances, aws_instance, topology, network_interfaces)
+                instances_config.append(
+                    self.__bind_fleet_instance(aws_instance, instance_index, instance, lifecycles.get(aws_instance.id))
+                )
+
+        return instances_config
+
+    def __pop_fleet_instance(self, pending_instances, aws_instance, topology, network_interfaces):
+        """Pick the planned instance a fleet launched instance stands for
+
+        The planned instances whose network interfaces are in the instance availability
+        zone come first. Otherwise the network interfaces of the first planned instance
+        are moved to the instance subnet.
+
+        Args:
+            pending_instances (list): Tuples of instance index and instance config, updated
+            aws_instance (object): Launched instance
+            topology (object): Vpcs topology
+            network_interfaces (object): Network interfaces resources
+
+        Returns:
+            tuple: Instance index and instance config
+        """
+        subnet = topology.subnets[aws_instance.subnet_id]
+        availability_zone = aws_instance.placement["AvailabilityZone"]
+
+        for position, (instance_index, instance) in enumerate(pending_instances):
+            instance_subnet = topology.subnets_by_cidr_block.get(instance["CidrBlock"])
+            if instance_subnet is not None and instance_subnet.availability_zone == availability_zone:
+                return pending_instances.pop(position)
+
+        instance_index, instance = pending_instances.pop(0)
+        if network_interfaces is None:
+            raise ValueError(
+                "The instance '{0}' has been launched in availability zone '{1}' and no network interfaces "
+                "can be moved there".format(aws_instance.id, availability_zone))
+
+        network_interfaces.relocate(
+            [eni["uid"] for eni in instance["NetworkInterfaces"]], subnet.subnet_id)
+        instance["CidrBlock"] = subnet.cidr_block
+        instance["AvailabilityZone"] = availability_zone
+        instance["SubnetCidrSuffix"] = "/" + subnet.cidr_block.split("/")[1]
+        instance["GatewayIP"] = get_cidr_block_gateway_ip(subnet.cidr_block)
+
+        return instance_index, instance
+
+    def __bind_fleet_instance(self, aws_instance, instance_index, instance, lifecycle=None):
+        """Attach the planned network interfaces to a fleet launched instance
+
+        Args:
+            aws_instance (object): Launched instance
+            instance_index (integer): Instance index in the group
+            instance (dict): Instance config
+            lifecycle (string, optional): 'spot' or 'on-demand'
+
+        Returns:
+            dict: Launched instance config
+        """
+        recorded_enis = self.state_store.get_resources_by_uid(self.tag_base_name, NETWORK_INTERFACE)
+        instance_config = {
+            'InstanceId': aws_instance.id,
+            'InstanceType': aws_instance.instance_type,
+            'Lifecycle': lifecycle,
+            'NetworkInterfaces': []
+        }
+
+        for index, eni in enumerate(instance['NetworkInterfaces']):
+            if eni["uid"] in recorded_enis:
+                eni_id = recorded_enis[eni["uid"]]["ResourceId"]
+            else:
+                eni_id = next(iter_resources(self.ec2_client, "describe_network_interfaces", {
+                    "tag:uid": eni["uid"]
+                }, projection=["NetworkInterfaceId"]))["NetworkInterfaceId"]
+
+            # The device index 0 is the instance own primary network interface
+            self.ec2_client.attach_network_interface(
+                DeviceIndex=index + 1,
+                InstanceId=aws_instance.id,
+                NetworkInterfaceId=eni_id
+            )
+            instance_config['NetworkInterfaces'].append({
+                'NetworkInterfaceId': eni_id,
+                'DeviceIndex': index + 1
+            })
+
+        self.tag(aws_instance.id, "i", instance_index)
+        self.record_resource(
+            INSTANCE, aws_instance.id, uid="i-" + str(instance_index), attributes={
+                "NetworkInterfaceIds": [eni['NetworkInterfaceId'] for eni in instance_config['NetworkInterfaces']],
+                "AvailabilityZone": instance.get("AvailabilityZone"),
+                "Lifecycle": lifecycle
+            })
+        self.tracer.current_span().add_attribute_value("instance_ids", aws_instance.id)
+
+        self.logger.info(
+            "The %s instance '%s' has been launched with network interfaces %s",
+            lifecycle,
+            aws_instance.id,
+            [eni['NetworkInterfaceId'] for eni in instance_config['NetworkInterfaces']]
+        )
+
+        return instance_config
+
+    def get_or_create_placement_group(self, strategy, index=0):
+        """Get or create a fleet placement group of a strategy
+
+        Args:
+            strategy (string): Placement strategy (spread, partition or cluster)
+            index (integer, optional): Placement group index, for the strategies with several groups
+
+        Returns:
+            string: Placement group name
+        """
+        group_name = self.tag_base_name + "-pg-" + strategy
+        if index:
+            group_name = group_name + "-" + str(index)
+        aws_placement_groups = self.ec2_client.describe_placement_groups(
+            Filters=[
+                {
+                    "Name": "group-name",
+                    "Values": [group_name]
+                }
+            ]
+        )["PlacementGroups"]
+
+        if not aws_placement_groups:
+            self.ec2_client.create_placement_group(
+                GroupName=group_name,
+                Strategy=strategy
+            )
+
+        self.logger.info("A placement group '%s' has been created or already exists", group_name)
+
+        return group_name
+
+    def __get_placement_group_name(self, strategy, index, placement_groups_names):
+        """Get the name of a placement group, creating it on first use
+
+        Args:
+            strategy (string): Placement strategy
+            index (integer): Placement group index
+            placement_groups_names (dict): Names of the placement groups already used, indexed by index
+
+        Returns:
+            string: Placement group name
+        """
+        if index not in placement_groups_names:
+            placement_groups_names[index] = self.get_or_create_placement_group(strategy, index)
+
+        return placement_groups_names[index]
+
+    @traced("instances.delete_placement_groups")
+    def delete_placement_groups(self):
+        """Delete the fleet placement groups
+        """
+        aws_placement_groups = self.ec2_client.describe_placement_groups(
+            Filters=[
+                {
+                    "Name": "group-name",
+                    "Values": [self.tag_base_name + "-pg-*"]
+                }
+            ]
+        )["PlacementGroups"]
+
+        for aws_placement_group in aws_placement_groups:
+            self.ec2_client.delete_placement_group(
+                GroupName=aws_placement_group["GroupName"]
+            )
+
+            self.logger.info(
+                "The placement group '%s' has been deleted",
+                aws_placement_group["GroupName"]
+            )
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from base_resources import BaseResources
+from .base_resources import BaseResources
 import logging
-from utils import setup_logger, filter_resources, tag_with_name_with_suffix
+from .state import INTERNET_GATEWAY
+from .tracing import traced
+from .utils import setup_logger, iter_resources
 
 
 class InternetGateways(BaseResources):
@@ -21,7 +23,8 @@ class InternetGateways(BaseResources):
         Raises:
             TypeError: Description
         """
-        BaseResources.__init__(self, ec2, ec2_client, tag_base_name)
+        BaseResources.__init__(self, ec2, ec2_client, tag_base_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
         log_level = kwargs.pop("log_level", logging.WARNING)
         boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
 
@@ -29,6 +32,7 @@ class InternetGateways(BaseResources):
             raise TypeError("Unexpected **kwargs: %r" % kwargs)
         self.logger = setup_logger(__name__, log_level, boto_log_level)
 
+    @traced("internet_gateways.get_or_create")
     def get_or_create(self, config):
         """Get or create internet gateways
 
@@ -38,71 +42,75 @@ class InternetGateways(BaseResources):
         Returns:
             dict: Internet gateways config
         """
-        created_resources = []
+        created_resources = {}
+        # The internet gateways of all the vpcs are described at once
+        aws_internet_gateways = {}
+        for aws_internet_gateway in iter_resources(self.ec2_client, "describe_internet_gateways", {
+            "attachment.vpc-id": [
+                vpc_config["VpcId"] for vpc_config in config.values() if "CreateInternetGateway" in vpc_config
+            ]
+        }, projection=["InternetGatewayId", "Attachments"]):
+            for attachment in aws_internet_gateway.get("Attachments", []):
+                aws_internet_gateways.setdefault(attachment["VpcId"], aws_internet_gateway)
+
         index = 0
-        for vpc_id, vpc_config in config.iteritems():
+        for vpc_id, vpc_config in config.items():
+            created_resources[vpc_config["VpcId"]] = {
+                "InternetGateways": []
+            }
             if "CreateInternetGateway" in vpc_config:
-                internet_gateways = filter_resources(
-                    self.ec2.internet_gateways, "attachment.vpc-id", vpc_config["VpcId"])
-
-                if not internet_gateways:
-                    internet_gateway = self.ec2.create_internet_gateway()
-                    self.ec2.Vpc(vpc_config["VpcId"]).attach_internet_gateway(
-                        InternetGatewayId=internet_gateway.id,
+                aws_internet_gateway = aws_internet_gateways.get(vpc_config["VpcId"])
+
+                if aws_internet_gateway is None:
+                    internet_gateway_id = self.ec2_client.create_internet_gateway()["InternetGateway"][
+                        "InternetGatewayId"]
+                    self.ec2_client.attach_internet_gateway(
+                        InternetGatewayId=internet_gateway_id,
+                        VpcId=vpc_config["VpcId"]
                     )
                 else:
-                    internet_gateway = self.ec2.InternetGateway(internet_gateways[0].id)
-
-                    for attachment in internet_gateway.attachments:
-                        vpc_already_attached = False
-                        if attachment["VpcId"] == vpc_config["VpcId"]:
-                            vpc_already_attached = True
+                    internet_gateway_id = aws_internet_gateway["InternetGatewayId"]
 
-                        if not vpc_already_attached:
-                            self.ec2.Vpc(vpc_config["VpcId"]).attach_internet_gateway(
-                                InternetGatewayId=internet_gateway.id,
-                            )
+                self.tracer.current_span().add_attribute_value("internet_gateway_ids", internet_gateway_id)
+                self.record_resource(INTERNET_GATEWAY, internet_gateway_id, parent_id=vpc_config["VpcId"])
 
-                tag_with_name_with_suffix(
-                    internet_gateway, "ig", index, self.tag_base_name)
+                self.tag(internet_gateway_id, "ig", vpc_config.get("Index", index))
 
                 self.logger.info(
                     "An internet gateway with ID '%s' attached to vpc '%s' has been created or already exists",
-                    internet_gateway.id,
+                    internet_gateway_id,
                     vpc_config["VpcId"]
                 )
 
-                created_resources.append(
+                created_resources[vpc_config["VpcId"]]["InternetGateways"].append(
                     {
-                        "InternetGatewayId": internet_gateway.id,
+                        "InternetGatewayId": internet_gateway_id,
                     }
                 )
 
                 index = index + 1
 
-        return {
-            vpc_config["VpcId"]: {
-                "InternetGateways": created_resources
-            }
-        }
+        return created_resources
 
+    @traced("internet_gateways.delete")
     def delete(self):
         """Delete internet gateways
         """
-        internet_gateways = filter_resources(
-            self.ec2.internet_gateways,
-            "tag:Name",
-            self.tag_base_name + '-*'
-        )
-
-        for internet_gateway in internet_gateways:
-            if hasattr(internet_gateway, 'attachments'):
-                for attachment in internet_gateway.attachments:
-                    internet_gateway.detach_from_vpc(VpcId=attachment['VpcId'])
+        for aws_internet_gateway in self.iter_fleet_resources(
+                "describe_internet_gateways", INTERNET_GATEWAY, "internet-gateway-id",
+                projection=["InternetGatewayId", "Attachments"]):
+            internet_gateway_id = aws_internet_gateway["InternetGatewayId"]
+            for attachment in aws_internet_gateway.get("Attachments", []):
+                self.ec2_client.detach_internet_gateway(
+                    InternetGatewayId=internet_gateway_id,
+                    VpcId=attachment["VpcId"]
+                )
 
-            internet_gateway.delete()
+            self.ec2_client.delete_internet_gateway(InternetGatewayId=internet_gateway_id)
+            self.forget_resource(INTERNET_GATEWAY, internet_gateway_id)
+            self.tracer.current_span().add_attribute_value("internet_gateway_ids", internet_gateway_id)
 
             self.logger.info(
                 "The internet_gateway with ID '%s' has been deleted ",
-                internet_gateway.id,
+                internet_gateway_id,
             )
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from .base_resources import BaseResources
+from botocore.exceptions import BotoCoreError, ClientError
+from .eip_pool import POOL_TAG_KEY as EIP_POOL_TAG_KEY
+from .eni_pool import POOL_TAG_KEY as ENI_POOL_TAG_KEY
+import logging
+from .state import ADDRESS, INSTANCE, INTERNET_GATEWAY, NETWORK_ACL, NETWORK_INTERFACE, ROUTE_TABLE, \
+    SECURITY_GROUP, SUBNET, VPC
+from .tracing import traced
+from .utils import setup_logger
+
+# Fleet resources types and their Resource Groups Tagging API types, in teardown order
+TEARDOWN_ORDER = [
+    (ADDRESS, "ec2:elastic-ip"),
+    (INSTANCE, "ec2:instance"),
+    (NETWORK_INTERFACE, "ec2:network-interface"),
+    (SECURITY_GROUP, "ec2:security-group"),
+    (SUBNET, "ec2:subnet"),
+    (ROUTE_TABLE, "ec2:route-table"),
+    (NETWORK_ACL, "ec2:network-acl"),
+    (INTERNET_GATEWAY, "ec2:internet-gateway"),
+    (VPC, "ec2:vpc"),
+]
+
+
+class Inventory(BaseResources):
+    """Fleet inventory from the Resource Groups Tagging API
+
+    Every fleet resource (named '<tag base name>-*') is listed in one paginated
+    sweep across the resources types, instead of one tag filtered describe per
+    resource type. The pools resources are left out.
+    """
+
+    def __init__(self, ec2, ec2_client, tag_base_name, **kwargs):
+        """Constructor
+
+        Args:
+            ec2 (object): Aws Ec2 session
+            ec2_client (object): Aws ec2 session
+            tag_base_name (string): Tag base name
+            **kwargs: Multiple arguments (tagging_client...)
+
+        Raises:
+            TypeError: Description
+        """
+        BaseResources.__init__(self, ec2, ec2_client, tag_base_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
+        # Resource Groups Tagging API client
+        self.tagging_client = kwargs.pop("tagging_client")
+        log_level = kwargs.pop("log_level", logging.WARNING)
+        boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
+
+        if kwargs:
+            raise TypeError("Unexpected **kwargs: %r" % kwargs)
+        self.logger = setup_logger(__name__, log_level, boto_log_level)
+
+    @traced("inventory.sweep")
+    def sweep(self):
+        """List the fleet resources IDs, grouped by type and ordered for teardown
+
+        The Tagging API does not match tag values with wildcards, so the named
+        resources are listed and the fleet ones are selected by name prefix.
+
+        Returns:
+            list: Tuples of resource type and resources IDs, in teardown order (see TEARDOWN_ORDER)
+        """
+        resources_types = dict((tagging_type.split(":")[1], resource_type)
+                               for resource_type, tagging_type in TEARDOWN_ORDER)
+        resources_ids = dict((resource_type, []) for resource_type, tagging_type in TEARDOWN_ORDER)
+
+        paginator = self.tagging_client.get_paginator("get_resources")
+        for page in paginator.paginate(
+            TagFilters=[
+                {
+                    "Key": "Name"
+                }
+            ],
+            ResourceTypeFilters=[tagging_type for resource_type, tagging_type in TEARDOWN_ORDER]
+        ):
+            for tagged_resource in page["ResourceTagMappingList"]:
+                tags = dict((tag["Key"], tag["Value"]) for tag in tagged_resource.get("Tags", []))
+                if not tags.get("Name", "").startswith(self.tag_base_name + "-"):
+                    continue
+                if EIP_POOL_TAG_KEY in tags or ENI_POOL_TAG_KEY in tags:
+                    continue
+
+                # e.g. arn:aws:ec2:us-east-1:123456789012:network-interface/eni-0123456789abcdef0
+                arn_resource = tagged_resource["ResourceARN"].split(":", 5)[5]
+                arn_resource_type, _, resource_id = arn_resource.partition("/")
+                if arn_resource_type in resources_types:
+                    resources_ids[resources_types[arn_resource_type]].append(resource_id)
+
+        self.tracer.current_span().set_attribute("resources_count", sum(len(ids) for ids in resources_ids.values()))
+
+        return [(resource_type, resources_ids[resource_type]) for resource_type, tagging_type in TEARDOWN_ORDER]
+
+    @traced("inventory.discover")
+    def discover(self):
+        """Sweep the fleet resources and record the ones missing from the state store
+
+        Only the resources types which have records are completed (e.g. with the
+        resources of an interrupted create): the Tagging API being eventually
+        consistent, the sweep may miss resources, so the types without records
+        are left to the managers tag scans. When the Tagging API can not be used
+        (e.g. without the tag:GetResources permission), nothing is recorded.
+
+        Returns:
+            list: Tuples of resource type and resources IDs, in teardown order (see TEARDOWN_ORDER)
+        """
+        recorded_ids = dict(
+            (resource_type, set(self.state_store.get_resource_ids(self.tag_base_name, resource_type)))
+            for resource_type, tagging_type in TEARDOWN_ORDER
+        )
+        if not any(recorded_ids.values()):
+            return []
+
+        try:
+            inventory = self.sweep()
+        except (BotoCoreError, ClientError) as e:
+            self.logger.info("The fleet '%s' can not be listed with the Tagging API (%s)", self.tag_base_name, e)
+            return []
+
+        recorded_count = 0
+        for resource_type, resources_ids in inventory:
+            if not recorded_ids[resource_type]:
+                continue
+            for resource_id in resources_ids:
+                if resource_id not in recorded_ids[resource_type]:
+                    self.record_resource(resource_type, resource_id)
+                    recorded_count = recorded_count + 1
+
+        if recorded_count:
+            self.logger.info("%s resources of the fleet '%s' missing from the state store have been recorded",
+                             recorded_count, self.tag_base_name)
+
+        return inventory
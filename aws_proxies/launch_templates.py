@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+import base64
+from .base_resources import BaseResources
+import hashlib
+import json
+import logging
+from .state import LAUNCH_TEMPLATE
+from .tracing import traced
+from .utils import setup_logger
+
+# Proxy instances user data. It does not depend on the instance, the network interfaces
+# being configured from the instance metadata as they show up (at launch or attached later).
+# The traffic counters are exposed on the metrics.EXPORTER_PORT port.
+USER_DATA = """#!/bin/bash
+TOKEN=$(curl -s -X PUT http://169.254.169.254/latest/api/token -H "X-aws-ec2-metadata-token-ttl-seconds: 21600")
+metadata() {
+    curl -s -H "X-aws-ec2-metadata-token: $TOKEN" http://169.254.169.254/latest/meta-data/$1
+}
+
+# Per source ip counters of the proxied traffic (bytes, connections, resets received and plain HTTP
+# responses status classes), kept by iptables (ip6tables for the ipv6 addresses) rules and exposed
+# in the Prometheus text format
+PROXY_PORT=8888
+EXPORTER_PORT=9100
+EXPORTER_DIR=/var/lib/aws-proxies-exporter
+for tables in iptables ip6tables; do
+    $tables -N AWS_PROXIES_IN
+    $tables -N AWS_PROXIES_OUT
+    $tables -I INPUT -j AWS_PROXIES_IN
+    $tables -I OUTPUT -j AWS_PROXIES_OUT
+done
+
+account() {
+    local address=$1
+    local tables=iptables
+    case $address in *:*) tables=ip6tables;; esac
+    $tables -A AWS_PROXIES_OUT -s $address -p tcp ! --sport $PROXY_PORT \\
+        -m comment --comment "aws-proxies bytes_sent $address"
+    $tables -A AWS_PROXIES_OUT -s $address -p tcp --syn \\
+        -m comment --comment "aws-proxies connections $address"
+    $tables -A AWS_PROXIES_IN -d $address -p tcp ! --dport $PROXY_PORT \\
+        -m comment --comment "aws-proxies bytes_received $address"
+    $tables -A AWS_PROXIES_IN -d $address -p tcp ! --dport $PROXY_PORT --tcp-flags RST RST \\
+        -m comment --comment "aws-proxies resets $address"
+    for class in 2 3 4 5; do
+        for version in 1.0 1.1; do
+            $tables -A AWS_PROXIES_IN -d $address -p tcp --sport 80 \\
+                -m string --algo bm --to 120 --string "HTTP/$version $class" \\
+                -m comment --comment "aws-proxies responses_${class}xx $address"
+        done
+    done
+}
+
+mkdir -p $EXPORTER_DIR
+(
+    while true; do
+        (for tables in iptables ip6tables; do
+            $tables -nvxL AWS_PROXIES_IN; $tables -nvxL AWS_PROXIES_OUT
+        done) 2> /dev/null | awk '
+            match($0, /aws-proxies [a-z0-9_]+ [0-9a-f.:]+/) {
+                split(substr($0, RSTART, RLENGTH), fields, " ")
+                value = (fields[2] ~ /^bytes/) ? $2 : $1
+                counters["aws_proxies_" fields[2] "_total{ip=\\"" fields[3] "\\"}"] += value
+            }
+            END { for (key in counters) print key, counters[key] }
+        ' > $EXPORTER_DIR/metrics.tmp && mv $EXPORTER_DIR/metrics.tmp $EXPORTER_DIR/metrics
+        sleep 15
+    done
+) &
+(cd $EXPORTER_DIR && (python3 -m http.server $EXPORTER_PORT || python -m SimpleHTTPServer $EXPORTER_PORT)) \\
+    > /dev/null 2>&1 &
+
+CONFIGURED=""
+for attempt in $(seq 1 60); do
+    for mac in $(metadata network/interfaces/macs/); do
+        mac=${mac%/}
+        case " $CONFIGURED " in *" $mac "*) continue;; esac
+
+        index=$(metadata network/interfaces/macs/$mac/device-number)
+        cidr_block=$(metadata network/interfaces/macs/$mac/subnet-ipv4-cidr-block)
+        ips=$(metadata network/interfaces/macs/$mac/local-ipv4s)
+        # The ipv6 addresses, in ipv6 mode, are the proxies ips
+        ipv6s=$(metadata network/interfaces/macs/$mac/ipv6s | grep -E '^[0-9a-f:]+$')
+        primary_ip=$(echo "$ips" | head -n 1)
+        IFS=./ read a b c d suffix <<< "$cidr_block"
+        gateway="$a.$b.$c.$((d + 1))"
+
+        if [ "$index" != "0" ]; then
+            echo "auto eth$index" >> /etc/network/interfaces
+            echo "iface eth$index inet dhcp" >> /etc/network/interfaces
+            ifup eth$index
+            echo "40$index eth${index}_rt" >> /etc/iproute2/rt_tables
+        fi
+
+        for ip in $ips; do
+            account $ip
+            if [ "$ip" != "$primary_ip" ]; then
+                ip addr add $ip/$suffix dev eth$index
+            fi
+            if [ "$index" != "0" ]; then
+                ip rule add from $ip lookup eth${index}_rt
+            fi
+        done
+
+        if [ "$index" != "0" ]; then
+            ip route add default via $gateway dev eth$index table eth${index}_rt
+        fi
+
+        if [ -n "$ipv6s" ]; then
+            # The subnet router is reached through the link-local gateway advertised on eth0
+            ipv6_gateway=$(ip -6 route show default | awk '/via/ {print $3; exit}')
+            for ip in $ipv6s; do
+                account $ip
+                ip -6 addr add $ip/128 dev eth$index 2> /dev/null
+                if [ "$index" != "0" ]; then
+                    ip -6 rule add from $ip lookup eth${index}_rt
+                fi
+            done
+            if [ "$index" != "0" ] && [ -n "$ipv6_gateway" ]; then
+                ip -6 route add default via $ipv6_gateway dev eth$index table eth${index}_rt
+            fi
+        fi
+
+        CONFIGURED="$CONFIGURED $mac"
+    done
+    sleep 10
+done
+"""
+
+
+class LaunchTemplates(BaseResources):
+    """Launch templates representation
+
+    Each instances group has a launch template with one version per distinct
+    image, instance type and user data, so that launches only pass the per
+    instance parameters. The templates are kept across fleet deletions to be reused.
+    """
+
+    def __init__(self, ec2, ec2_client, tag_base_name, **kwargs):
+        """Constructor
+
+        Args:
+            ec2 (object): Aws Ec2 session
+            ec2_client (object): Aws ec2 session
+            tag_base_name (string): Tag base name
+            **kwargs: Multiple arguments
+
+        Raises:
+            TypeError: Description
+        """
+        BaseResources.__init__(self, ec2, ec2_client, tag_base_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
+        log_level = kwargs.pop("log_level", logging.WARNING)
+        boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
+
+        if kwargs:
+            raise TypeError("Unexpected **kwargs: %r" % kwargs)
+        self.logger = setup_logger(__name__, log_level, boto_log_level)
+        self.versions = {}
+
+    @staticmethod
+    def get_launch_template_data(instance_group):
+        """Get the launch template data of an instances group
+
+        Args:
+            instance_group (dict): Instances group config
+
+        Returns:
+            dict: Launch template data
+        """
+        return {
+            "ImageId": instance_group["ImageId"],
+            "InstanceType": instance_group["InstanceType"],
+            "DisableApiTermination": False,
+            "InstanceInitiatedShutdownBehavior": "terminate",
+            "UserData": base64.b64encode(USER_DATA.encode("utf-8")).decode("ascii")
+        }
+
+    @staticmethod
+    def get_launch_template_hash(launch_template_data):
+        """Get the hash identifying a launch template version
+
+        Args:
+            launch_template_data (dict): Launch template data
+
+        Returns:
+            string: Hash
+        """
+        return hashlib.sha1(json.dumps(launch_template_data, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    @traced("launch_templates.get_or_create")
+    def get_or_create(self, instance_group, group_index=0):
+        """Get or create the launch template version of an instances group
+
+        Args:
+            instance_group (dict): Instances group config
+            group_index (integer, optional): Instances group index
+
+        Returns:
+            dict: Launch template specification with 'LaunchTemplateId' and 'Version' keys
+        """
+        launch_template_name = self.tag_base_name + "-lt-" + str(group_index)
+        launch_template_data = LaunchTemplates.get_launch_template_data(instance_group)
+        launch_template_hash = LaunchTemplates.get_launch_template_hash(launch_template_data)
+
+        if (launch_template_name, launch_template_hash) in self.versions:
+            return dict(self.versions[(launch_template_name, launch_template_hash)])
+
+        aws_launch_templates = self.ec2_client.describe_launch_templates(
+            Filters=[
+                {
+                    "Name": "launch-template-name",
+                    "Values": [launch_template_name]
+                }
+            ]
+        )["LaunchTemplates"]
+
+        version = None
+        if not aws_launch_templates:
+            aws_launch_template = self.ec2_client.create_launch_template(
+                LaunchTemplateName=launch_template_name,
+                VersionDescription=launch_template_hash,
+                LaunchTemplateData=launch_template_data
+            )["LaunchTemplate"]
+            launch_template_id = aws_launch_template["LaunchTemplateId"]
+            version = aws_launch_template["LatestVersionNumber"]
+        else:
+            launch_template_id = aws_launch_templates[0]["LaunchTemplateId"]
+            # The versions can not be filtered on their description, page through them
+            aws_versions = self.ec2_client.get_paginator("describe_launch_template_versions").paginate(
+                LaunchTemplateId=launch_template_id
+            ).search("LaunchTemplateVersions[]")
+            for aws_version in aws_versions:
+                if aws_version.get("VersionDescription") == launch_template_hash:
+                    version = aws_version["VersionNumber"]
+                    break
+
+            if version is None:
+                version = self.ec2_client.create_launch_template_version(
+                    LaunchTemplateId=launch_template_id,
+                    VersionDescription=launch_template_hash,
+                    LaunchTemplateData=launch_template_data
+                )["LaunchTemplateVersion"]["VersionNumber"]
+
+        self.tracer.current_span().set_attribute("launch_template_id", launch_template_id)
+        self.record_resource(LAUNCH_TEMPLATE, launch_template_id, uid=launch_template_name, attributes={
+            "Version": version,
+            "Hash": launch_template_hash
+        })
+
+        self.logger.info(
+            "The launch template '%s' version %s has been created or already exists",
+            launch_template_name,
+            version
+        )
+
+        self.versions[(launch_template_name, launch_template_hash)] = {
+            "LaunchTemplateId": launch_template_id,
+            "Version": str(version)
+        }
+
+        return dict(self.versions[(launch_template_name, launch_template_hash)])
+
+    @traced("launch_templates.delete")
+    def delete(self):
+        """Delete the fleet launch templates
+        """
+        aws_launch_templates = self.ec2_client.describe_launch_templates(
+            Filters=[
+                {
+                    "Name": "launch-template-name",
+                    "Values": [self.tag_base_name + "-lt-*"]
+                }
+            ]
+        )["LaunchTemplates"]
+
+        for aws_launch_template in aws_launch_templates:
+            self.ec2_client.delete_launch_template(
+                LaunchTemplateId=aws_launch_template["LaunchTemplateId"]
+            )
+            self.forget_resource(LAUNCH_TEMPLATE, aws_launch_template["LaunchTemplateId"])
+            self.tracer.current_span().add_attribute_value(
+                "launch_template_ids", aws_launch_template["LaunchTemplateId"])
+
+            self.logger.info(
+                "The launch template '%s' has been deleted",
+                aws_launch_template["LaunchTemplateName"]
+            )
+
+        self.versions = {}
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import logging
+import re
+import socket
+import time
+
+try:  # Python 3
+    from urllib.error import URLError
+    from urllib.request import urlopen
+except ImportError:  # Python 2
+    from urllib2 import URLError, urlopen
+from .utils import setup_logger, run_concurrently
+
+# Port the proxy instances expose their traffic counters on (see launch_templates.USER_DATA)
+EXPORTER_PORT = 9100
+
+# Per source ip counters exposed by the proxy instances
+COUNTERS = [
+    "bytes_sent",
+    "bytes_received",
+    "connections",
+    "resets",
+    "responses_2xx",
+    "responses_3xx",
+    "responses_4xx",
+    "responses_5xx",
+]
+
+# e.g. aws_proxies_bytes_sent_total{ip="10.0.0.5"} 1234
+METRIC_LINE = re.compile(r'^aws_proxies_([a-z0-9_]+)_total\{ip="([^"]+)"\}\s+([0-9.eE+-]+)\s*$')
+
+
+def parse_metrics(text):
+    """Parse the counters exposed by a proxy instance (Prometheus text format)
+
+    Args:
+        text (string): Exposed metrics
+
+    Returns:
+        dict: Counters indexed by counter name, indexed by source ip
+    """
+    ips_counters = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line.strip())
+        if match is None:
+            continue
+        counter, ip, value = match.groups()
+        ips_counters.setdefault(ip, {})[counter] = int(float(value))
+
+    return ips_counters
+
+
+class MetricsCollector(object):
+    """Proxy instances traffic counters collector
+
+    Every instance exporter is scraped concurrently and the per source ip
+    counters are aggregated into a snapshot, the latest snapshots being kept
+    as a time series to get the rates from.
+    """
+
+    def __init__(self, targets, public_ips=None, **kwargs):
+        """Constructor
+
+        Args:
+            targets (list): Exporters hosts, or (host, port) tuples
+            public_ips (dict, optional): Public ips indexed by private ip, to index the counters by public ip
+            **kwargs: Multiple arguments (timeout, max_workers, max_snapshots...)
+
+        Raises:
+            TypeError: Description
+        """
+        self.targets = [target if isinstance(target, tuple) else (target, EXPORTER_PORT) for target in targets]
+        self.public_ips = public_ips or {}
+        self.timeout = kwargs.pop("timeout", 5)
+        self.max_workers = kwargs.pop("max_workers", 50)
+        log_level = kwargs.pop("log_level", logging.WARNING)
+        max_snapshots = kwargs.pop("max_snapshots", 120)
+
+        if kwargs:
+            raise TypeError("Unexpected **kwargs: %r" % kwargs)
+        self.logger = setup_logger(__name__, log_level)
+
+        self.snapshots = collections.deque(maxlen=max_snapshots)
+
+    def scrape(self, target):
+        """Scrape an exporter
+
+        Args:
+            target (tuple): Exporter host and port
+
+        Returns:
+            dict: Counters indexed by counter name, indexed by source ip
+        """
+        host, port = target
+        if ":" in host:
+            # Ipv6 address
+            host = "[" + host + "]"
+        response = urlopen("http://{0}:{1}/metrics".format(host, port), timeout=self.timeout)
+        try:
+            return parse_metrics(response.read().decode("utf-8"))
+        finally:
+            response.close()
+
+    def collect(self):
+        """Scrape every exporter concurrently into a snapshot
+
+        Returns:
+            dict: Snapshot with 'Timestamp', 'Ips' (counters indexed by ip) and 'Errors' (indexed by
+                'host:port') keys
+        """
+        def scrape(target):
+            try:
+                return self.scrape(target), None
+            except (URLError, socket.error, socket.timeout, ValueError) as e:
+                return None, e
+
+        snapshot = {
+            "Timestamp": time.time(),
+            "Ips": {},
+            "Errors": {}
+        }
+        results = run_concurrently(scrape, self.targets, self.max_workers)
+        for target, (ips_counters, error) in zip(self.targets, results):
+            if error is not None:
+                self.logger.info("The exporter %s:%s can not be scraped (%s)", target[0], target[1], error)
+                snapshot["Errors"]["{0}:{1}".format(*target)] = str(error)
+                continue
+
+            for ip, counters in ips_counters.items():
+                snapshot["Ips"][self.public_ips.get(ip, ip)] = counters
+
+        self.snapshots.append(snapshot)
+
+        return snapshot
+
+    def get_rates(self, previous=None, current=None):
+        """Get the per second rates of the counters between two snapshots
+
+        A counter lower than before (e.g. the instance rebooted) is counted from zero.
+
+        Args:
+            previous (dict, optional): Previous snapshot. Defaults to the one before the latest
+            current (dict, optional): Current snapshot. Defaults to the latest
+
+        Returns:
+            dict: Rates indexed by counter name, indexed by ip (the ips of both snapshots only)
+        """
+        if previous is None or current is None:
+            if len(self.snapshots) < 2:
+                return {}
+            previous, current = self.snapshots[-2], self.snapshots[-1]
+
+        elapsed = current["Timestamp"] - previous["Timestamp"]
+        if elapsed <= 0:
+            return {}
+
+        rates = {}
+        for ip, counters in current["Ips"].items():
+            previous_counters = previous["Ips"].get(ip)
+            if previous_counters is None:
+                continue
+            rates[ip] = {}
+            for counter, value in counters.items():
+                previous_value = previous_counters.get(counter, 0)
+                delta = value - previous_value if value >= previous_value else value
+                rates[ip][counter] = delta / float(elapsed)
+
+        return rates
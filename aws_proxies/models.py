@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""Fleet topology model
+
+The vpcs, subnets, network interfaces, private ips and instances of a fleet are
+held in slot-based objects linked to each other, and indexed by uid, AWS ID,
+cidr block, private ip and public ip so that every lookup is a dict access.
+"""
+from .state import NETWORK_INTERFACE, INSTANCE
+
+
+class Vpc(object):
+    """Vpc
+    """
+    __slots__ = ("vpc_id", "cidr_block", "index", "subnets")
+
+    def __init__(self, vpc_id, cidr_block, index=None):
+        self.vpc_id = vpc_id
+        self.cidr_block = cidr_block
+        self.index = index
+        self.subnets = []
+
+    def __repr__(self):
+        return "Vpc(%r, %r)" % (self.vpc_id, self.cidr_block)
+
+
+class Subnet(object):
+    """Subnet
+    """
+    __slots__ = ("subnet_id", "cidr_block", "availability_zone", "vpc", "enis")
+
+    def __init__(self, subnet_id, cidr_block, availability_zone=None, vpc=None):
+        self.subnet_id = subnet_id
+        self.cidr_block = cidr_block
+        self.availability_zone = availability_zone
+        self.vpc = vpc
+        self.enis = []
+
+    def __repr__(self):
+        return "Subnet(%r, %r, %r)" % (self.subnet_id, self.cidr_block, self.availability_zone)
+
+
+class Eni(object):
+    """Elastic network interface
+    """
+    __slots__ = ("uid", "eni_id", "subnet", "instance", "private_ips")
+
+    def __init__(self, uid, eni_id=None, subnet=None):
+        self.uid = uid
+        self.eni_id = eni_id
+        self.subnet = subnet
+        self.instance = None
+        self.private_ips = []
+
+    def __repr__(self):
+        return "Eni(%r, %r)" % (self.uid, self.eni_id)
+
+
+class PrivateIp(object):
+    """Private ip of a network interface, with its associated public ip if any
+    """
+    __slots__ = ("address", "eni", "primary", "public_ip", "allocation_id")
+
+    def __init__(self, address, eni, primary=False, public_ip=None, allocation_id=None):
+        self.address = address
+        self.eni = eni
+        self.primary = primary
+        self.public_ip = public_ip
+        self.allocation_id = allocation_id
+
+    def __repr__(self):
+        return "PrivateIp(%r, %r)" % (self.address, self.public_ip)
+
+
+class Instance(object):
+    """Instance
+    """
+    __slots__ = ("uid", "instance_id", "availability_zone", "state", "enis")
+
+    def __init__(self, uid, instance_id=None, availability_zone=None, state=None):
+        self.uid = uid
+        self.instance_id = instance_id
+        self.availability_zone = availability_zone
+        self.state = state
+        self.enis = []
+
+    def __repr__(self):
+        return "Instance(%r, %r)" % (self.uid, self.instance_id)
+
+
+class Topology(object):
+    """Fleet topology with its lookup indexes
+    """
+    __slots__ = ("vpcs", "subnets", "subnets_by_cidr_block", "enis", "enis_by_id", "instances",
+                 "instances_by_id", "private_ips", "public_ips")
+
+    def __init__(self):
+        self.vpcs = {}
+        self.subnets = {}
+        self.subnets_by_cidr_block = {}
+        self.enis = {}
+        self.enis_by_id = {}
+        self.instances = {}
+        self.instances_by_id = {}
+        self.private_ips = {}
+        self.public_ips = {}
+
+    @classmethod
+    def from_config(cls, vpcs_config, instances_groups_config=None):
+        """Build a topology from the vpcs config and the instances groups config
+
+        Args:
+            vpcs_config (dict): Vpcs config indexed by vpc ID
+            instances_groups_config (list, optional): Instances groups config
+
+        Returns:
+            object: Topology
+        """
+        topology = cls()
+        for vpc_id, vpc_config in (vpcs_config or {}).items():
+            vpc = topology.add_vpc(vpc_id, vpc_config.get("CidrBlock"), vpc_config.get("Index"))
+            for subnet_config in vpc_config.get("Subnets", []):
+                subnet = topology.add_subnet(vpc, subnet_config.get("SubnetId"), subnet_config["CidrBlock"],
+                                             subnet_config.get("AvailabilityZone"))
+                for eni_config in subnet_config.get("NetworkInterfaces", []):
+                    topology.add_eni(eni_config["uid"], subnet=subnet)
+
+        for instance_group in instances_groups_config or []:
+            for instance_index, instance_config in enumerate(instance_group.get("Instances", [])):
+                instance = topology.add_instance("i-" + str(instance_index),
+                                                 availability_zone=instance_config.get("AvailabilityZone"))
+                for eni_config in instance_config.get("NetworkInterfaces", []):
+                    topology.attach(topology.enis.get(eni_config["uid"]) or topology.add_eni(eni_config["uid"]),
+                                    instance)
+
+        return topology
+
+    def add_vpc(self, vpc_id, cidr_block, index=None):
+        """Add a vpc
+
+        Args:
+            vpc_id (string): Vpc ID
+            cidr_block (string): Cidr block
+            index (integer, optional): Vpc shard index
+
+        Returns:
+            object: Vpc
+        """
+        vpc = Vpc(vpc_id, cidr_block, index)
+        self.vpcs[vpc_id] = vpc
+        return vpc
+
+    def add_subnet(self, vpc, subnet_id, cidr_block, availability_zone=None):
+        """Add a subnet to a vpc
+
+        Args:
+            vpc (object): Vpc
+            subnet_id (string): Subnet ID
+            cidr_block (string): Cidr block
+            availability_zone (string, optional): Availability zone
+
+        Returns:
+            object: Subnet
+        """
+        subnet = Subnet(subnet_id, cidr_block, availability_zone, vpc)
+        vpc.subnets.append(subnet)
+        if subnet_id is not None:
+            self.subnets[subnet_id] = subnet
+        self.subnets_by_cidr_block[cidr_block] = subnet
+        return subnet
+
+    def add_eni(self, uid, eni_id=None, subnet=None):
+        """Add a network interface
+
+        Args:
+            uid (string): Network interface uid
+            eni_id (string, optional): Network interface ID
+            subnet (object, optional): Subnet
+
+        Returns:
+            object: Eni
+        """
+        eni = Eni(uid, subnet=subnet)
+        if subnet is not None:
+            subnet.enis.append(eni)
+        self.enis[uid] = eni
+        self.set_eni_id(eni, eni_id)
+        return eni
+
+    def set_eni_id(self, eni, eni_id):
+        """Set the ID of a network interface
+
+        Args:
+            eni (object): Eni
+            eni_id (string): Network interface ID
+        """
+        if eni.eni_id is not None:
+            self.enis_by_id.pop(eni.eni_id, None)
+        eni.eni_id = eni_id
+        if eni_id is not None:
+            self.enis_by_id[eni_id] = eni
+
+    def move_eni(self, eni, subnet):
+        """Move a network interface to another subnet
+
+        Args:
+            eni (object): Eni
+            subnet (object): Subnet
+        """
+        if eni.subnet is not None:
+            eni.subnet.enis.remove(eni)
+        eni.subnet = subnet
+        subnet.enis.append(eni)
+
+    def add_instance(self, uid, instance_id=None, availability_zone=None, state=None):
+        """Add an instance
+
+        Args:
+            uid (string): Instance uid
+            instance_id (string, optional): Instance ID
+            availability_zone (string, optional): Availability zone
+            state (string, optional): Instance state name
+
+        Returns:
+            object: Instance
+        """
+        instance = Instance(uid, availability_zone=availability_zone, state=state)
+        self.instances[uid] = instance
+        self.set_instance_id(instance, instance_id)
+        return instance
+
+    def set_instance_id(self, instance, instance_id):
+        """Set the ID of an instance
+
+        Args:
+            instance (object): Instance
+            instance_id (string): Instance ID
+        """
+        if instance.instance_id is not None:
+            self.instances_by_id.pop(instance.instance_id, None)
+        instance.instance_id = instance_id
+        if instance_id is not None:
+            self.instances_by_id[instance_id] = instance
+
+    def attach(self, eni, instance):
+        """Attach a network interface to an instance
+
+        Args:
+            eni (object): Eni
+            instance (object): Instance
+        """
+        if eni.instance is not None:
+            eni.instance.enis.remove(eni)
+        eni.instance = instance
+        instance.enis.append(eni)
+
+    def set_private_ips(self, eni, aws_private_ip_addresses, aws_ipv6_addresses=None):
+        """Set the private ips of a network interface, with their public ips
+
+        The ipv6 addresses are indexed as private ips being their own public ip.
+
+        Args:
+            eni (object): Eni
+            aws_private_ip_addresses (list): Described private ip addresses
+            aws_ipv6_addresses (list, optional): Described ipv6 addresses
+        """
+        for private_ip in eni.private_ips:
+            self.private_ips.pop(private_ip.address, None)
+            if private_ip.public_ip is not None:
+                self.public_ips.pop(private_ip.public_ip, None)
+
+        eni.private_ips = []
+        for aws_private_ip_address in aws_private_ip_addresses:
+            association = aws_private_ip_address.get("Association", {})
+            private_ip = PrivateIp(
+                aws_private_ip_address["PrivateIpAddress"],
+                eni,
+                primary=aws_private_ip_address.get("Primary", False),
+                public_ip=association.get("PublicIp"),
+                allocation_id=association.get("AllocationId")
+            )
+            eni.private_ips.append(private_ip)
+            self.private_ips[private_ip.address] = private_ip
+            if private_ip.public_ip is not None:
+                self.public_ips[private_ip.public_ip] = private_ip
+
+        for aws_ipv6_address in aws_ipv6_addresses or []:
+            private_ip = PrivateIp(aws_ipv6_address["Ipv6Address"], eni, public_ip=aws_ipv6_address["Ipv6Address"])
+            eni.private_ips.append(private_ip)
+            self.private_ips[private_ip.address] = private_ip
+            self.public_ips[private_ip.public_ip] = private_ip
+
+    def load_state(self, state_store, fleet):
+        """Set the network interfaces and instances IDs recorded in a state store
+
+        Args:
+            state_store (object): State store
+            fleet (string): Fleet tag base name
+        """
+        for uid, recorded_eni in state_store.get_resources_by_uid(fleet, NETWORK_INTERFACE).items():
+            self.set_eni_id(self.enis.get(uid) or self.add_eni(uid), recorded_eni["ResourceId"])
+
+        for uid, recorded_instance in state_store.get_resources_by_uid(fleet, INSTANCE).items():
+            instance = self.instances.get(uid)
+            if instance is None:
+                instance = self.add_instance(uid)
+            self.set_instance_id(instance, recorded_instance["ResourceId"])
+            for eni_id in (recorded_instance["Attributes"] or {}).get("NetworkInterfaceIds", []):
+                if eni_id in self.enis_by_id:
+                    self.attach(self.enis_by_id[eni_id], instance)
+
+    def load_network_interfaces(self, aws_enis):
+        """Update the network interfaces from their descriptions
+
+        Network interfaces are matched by ID, then by their uid tag.
+
+        Args:
+            aws_enis (list): Described network interfaces
+        """
+        for aws_eni in aws_enis:
+            eni = self.enis_by_id.get(aws_eni["NetworkInterfaceId"])
+            if eni is None:
+                uids = [tag["Value"] for tag in aws_eni.get("TagSet", []) if tag["Key"] == "uid"]
+                if not uids:
+                    continue
+                eni = self.enis.get(uids[0]) or self.add_eni(uids[0])
+                self.set_eni_id(eni, aws_eni["NetworkInterfaceId"])
+
+            subnet = self.subnets.get(aws_eni.get("SubnetId"))
+            if subnet is not None and eni.subnet is not subnet:
+                self.move_eni(eni, subnet)
+
+            attached_instance_id = aws_eni.get("Attachment", {}).get("InstanceId")
+            if attached_instance_id in self.instances_by_id:
+                instance = self.instances_by_id[attached_instance_id]
+                if eni.instance is not instance:
+                    self.attach(eni, instance)
+
+            self.set_private_ips(eni, aws_eni.get("PrivateIpAddresses", []), aws_eni.get("Ipv6Addresses", []))
+
+    def get_proxies_ips(self):
+        """Get the public and private ips pairs
+
+        Returns:
+            list: Tuples of public and private ips
+        """
+        return [(public_ip, private_ip.address) for public_ip, private_ip in self.public_ips.items()]
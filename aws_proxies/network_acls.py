@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from base_resources import BaseResources
+from .base_resources import BaseResources
 import logging
-from utils import setup_logger, filter_resources, tag_with_name_with_suffix
+from .state import NETWORK_ACL
+from .tracing import traced
+from .utils import setup_logger, iter_resources
 
 
 class NetworkAcls(BaseResources):
@@ -21,7 +23,8 @@ class NetworkAcls(BaseResources):
         Raises:
             TypeError: Description
         """
-        BaseResources.__init__(self, ec2, ec2_client, tag_base_name)
+        BaseResources.__init__(self, ec2, ec2_client, tag_base_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
         log_level = kwargs.pop("log_level", logging.WARNING)
         boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
 
@@ -29,6 +32,7 @@ class NetworkAcls(BaseResources):
             raise TypeError("Unexpected **kwargs: %r" % kwargs)
         self.logger = setup_logger(__name__, log_level, boto_log_level)
 
+    @traced("network_acls.get_or_create")
     def get_or_create(self, config):
         """Get or create network acls
 
@@ -38,58 +42,56 @@ class NetworkAcls(BaseResources):
         Returns:
             object: Network acl config
         """
-        created_network_acls = []
-        index = 0
-        for vpc_id, vpc_config in config.iteritems():
-            network_acls = filter_resources(
-                self.ec2.network_acls, "vpc-id", vpc_id)
-
-            if not network_acls:
-                network_acl = self.ec2.create_network_acl(
-                    VpcId=vpc_id
-                )
+        created_network_acls = {}
+        # The network acls of all the vpcs are described at once, the first one of each vpc is used
+        aws_network_acls = {}
+        for aws_network_acl in iter_resources(self.ec2_client, "describe_network_acls", {
+            "vpc-id": list(config.keys())
+        }, projection=["NetworkAclId", "VpcId"]):
+            aws_network_acls.setdefault(aws_network_acl["VpcId"], aws_network_acl)
 
-                network_acl.id
+        index = 0
+        for vpc_id, vpc_config in config.items():
+            if vpc_id not in aws_network_acls:
+                network_acl_id = self.ec2_client.create_network_acl(VpcId=vpc_id)["NetworkAcl"]["NetworkAclId"]
             else:
-                network_acl = self.ec2.NetworkAcl(network_acls[0].id)
+                network_acl_id = aws_network_acls[vpc_id]["NetworkAclId"]
 
                 self.logger.info(
                     "A network acl " +
                     "with ID '%s' and attached to pvc '%s' has been created or already exists",
-                    network_acl.id,
+                    network_acl_id,
                     vpc_id
                 )
 
-            tag_with_name_with_suffix(
-                network_acl, "netacl", index, self.tag_base_name)
+            self.tracer.current_span().add_attribute_value("network_acl_ids", network_acl_id)
+            self.record_resource(NETWORK_ACL, network_acl_id, parent_id=vpc_id)
 
-            created_network_acls.append(
-                {
-                    "NetworkAclId": network_acl.id,
-                }
-            )
+            self.tag(network_acl_id, "netacl", vpc_config.get("Index", index))
+
+            created_network_acls[vpc_id] = {
+                "NetworkAcls": [
+                    {
+                        "NetworkAclId": network_acl_id,
+                    }
+                ]
+            }
 
             index = index + 1
 
-        return {
-            vpc_config["VpcId"]: {
-                "NetworkAcls": created_network_acls
-            }
-        }
+        return created_network_acls
 
+    @traced("network_acls.delete")
     def delete(self):
         """Delete network acls
         """
-        network_acls = filter_resources(
-            self.ec2.network_acls,
-            "tag:Name",
-            self.tag_base_name + '-*'
-        )
-
-        for network_acl in network_acls:
-            if not network_acl.is_default:
-                network_acl.delete()
+        for aws_network_acl in self.iter_fleet_resources(
+                "describe_network_acls", NETWORK_ACL, "network-acl-id", projection=["NetworkAclId", "IsDefault"]):
+            if not aws_network_acl.get("IsDefault"):
+                self.ec2_client.delete_network_acl(NetworkAclId=aws_network_acl["NetworkAclId"])
+                self.forget_resource(NETWORK_ACL, aws_network_acl["NetworkAclId"])
+                self.tracer.current_span().add_attribute_value("network_acl_ids", aws_network_acl["NetworkAclId"])
                 self.logger.info(
                     "The network acl with ID '%s' has been deleted ",
-                    network_acl.id,
+                    aws_network_acl["NetworkAclId"],
                 )
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
-from base_resources import BaseResources
+from .base_resources import BaseResources
+from botocore.exceptions import ClientError
 import logging
-from utils import setup_logger, filter_resources, tag_with_name_with_suffix
+from .state import ADDRESS, NETWORK_INTERFACE
+from .tracing import traced
+from .utils import setup_logger, create_suffix, iter_resources
 
 
 class NetworkInterfaces(BaseResources):
@@ -16,12 +19,19 @@ class NetworkInterfaces(BaseResources):
             ec2 (object): Aws Ec2 session
             ec2_client (object): Aws ec2 session
             tag_base_name (string): Tag base name
-            **kwargs: Multiple arguments
+            **kwargs: Multiple arguments (eip_pool, eni_pool...)
 
         Raises:
             TypeError: Description
         """
-        BaseResources.__init__(self, ec2, ec2_client, tag_base_name)
+        BaseResources.__init__(self, ec2, ec2_client, tag_base_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
+        # Elastic ips pool to take the public ips from and give them back to, instead of allocating
+        # and releasing them
+        self.eip_pool = kwargs.pop("eip_pool", None)
+        # Network interfaces pool to take the network interfaces from, with their elastic ips, instead
+        # of creating them
+        self.eni_pool = kwargs.pop("eni_pool", None)
         log_level = kwargs.pop("log_level", logging.WARNING)
         boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
 
@@ -29,104 +39,412 @@ class NetworkInterfaces(BaseResources):
             raise TypeError("Unexpected **kwargs: %r" % kwargs)
         self.logger = setup_logger(__name__, log_level, boto_log_level)
 
+    @traced("network_interfaces.create")
     def create(self, config):
         """Create network interfaces
 
+        Network interfaces already recorded in the state store (e.g. by an
+        interrupted create) are reused after a single describe call. With a
+        network interfaces pool, the missing network interfaces are taken from
+        the pool when it has some of the subnet and private ips count.
+
         Args:
             config (dict): Vpcs config
         """
-        for vpc_id, vpc_config in config.iteritems():
+        recorded_enis = self.state_store.get_resources_by_uid(self.tag_base_name, NETWORK_INTERFACE)
+        existing_enis_ids = set()
+        if recorded_enis:
+            existing_enis_ids = set(
+                aws_eni["NetworkInterfaceId"] for aws_eni in iter_resources(
+                    self.ec2_client,
+                    "describe_network_interfaces",
+                    {"network-interface-id": [recorded_eni["ResourceId"] for recorded_eni in recorded_enis.values()]},
+                    projection=["NetworkInterfaceId"]
+                )
+            )
+
+        # The network interfaces which are not recorded are looked up by uid in a single describe
+        unknown_enis = [
+            (subnet["SubnetId"], eni["uid"])
+            for vpc_config in config.values()
+            for subnet in vpc_config["Subnets"]
+            for eni in subnet["NetworkInterfaces"]
+            if recorded_enis.get(eni["uid"], {}).get("ResourceId") not in existing_enis_ids
+        ]
+        found_enis = {}
+        if unknown_enis:
+            for aws_eni in iter_resources(self.ec2_client, "describe_network_interfaces", {
+                "subnet-id": sorted(set(subnet_id for subnet_id, uid in unknown_enis)),
+                "tag:uid": sorted(set(uid for subnet_id, uid in unknown_enis))
+            }, projection=["NetworkInterfaceId", "SubnetId", "TagSet"]):
+                for tag in aws_eni.get("TagSet", []):
+                    if tag["Key"] == "uid":
+                        found_enis[(aws_eni["SubnetId"], tag["Value"])] = aws_eni["NetworkInterfaceId"]
+
+        for vpc_id, vpc_config in config.items():
             index = 0
             for subnet in vpc_config["Subnets"]:
-                aws_subnet = self.ec2.Subnet(subnet["SubnetId"])
                 for eni in subnet["NetworkInterfaces"]:
-                    found_eni = filter_resources(
-                        aws_subnet.network_interfaces, "tag-value", eni["uid"])
-                    if not found_eni:
-                        created_eni = aws_subnet.create_network_interface(
-                            SecondaryPrivateIpAddressCount=eni["Ips"][
-                                "SecondaryPrivateIpAddressCount"],
-                        )
-                        tag_with_name_with_suffix(
-                            created_eni, "eni", index, self.tag_base_name)
-
-                        created_eni.create_tags(
-                            Tags=[{
-                                "Key": "uid",
-                                "Value": eni["uid"]
-                            }]
-                        )
-                        index = index + 1
+                    recorded_eni = recorded_enis.get(eni["uid"])
+                    if recorded_eni is not None and recorded_eni["ResourceId"] in existing_enis_ids:
+                        eni_id = recorded_eni["ResourceId"]
+                    else:
+                        eni_id = found_enis.get((subnet["SubnetId"], eni["uid"]))
+                        pool_enis = []
+                        # The pool network interfaces hold secondary private ips, not ipv6 addresses
+                        ipv6_addresses_count = eni["Ips"].get("Ipv6AddressCount", 0)
+                        if eni_id is None and self.eni_pool is not None and not ipv6_addresses_count:
+                            pool_enis = self.eni_pool.acquire(
+                                subnet["SubnetId"], eni["Ips"]["SecondaryPrivateIpAddressCount"] + 1, 1)
+
+                        if pool_enis:
+                            eni_id = self.adopt(pool_enis[0], eni["uid"], index)
+                        elif eni_id is None:
+                            eni_params = {
+                                "SubnetId": subnet["SubnetId"],
+                                "SecondaryPrivateIpAddressCount": eni["Ips"]["SecondaryPrivateIpAddressCount"]
+                            }
+                            if ipv6_addresses_count:
+                                eni_params["Ipv6AddressCount"] = ipv6_addresses_count
+                            eni_id = self.ec2_client.create_network_interface(
+                                **eni_params
+                            )["NetworkInterface"]["NetworkInterfaceId"]
+                            self.tracer.current_span().add_attribute_value("network_interface_ids", eni_id)
+
+                            self.ec2_client.create_tags(
+                                Resources=[eni_id],
+                                Tags=[
+                                    {
+                                        "Key": "Name",
+                                        "Value": self.tag_base_name + "-" + create_suffix("eni", index)
+                                    },
+                                    {
+                                        "Key": "uid",
+                                        "Value": eni["uid"]
+                                    }
+                                ]
+                            )
+                    index = index + 1
+
+                    self.record_resource(NETWORK_INTERFACE, eni_id, uid=eni["uid"], parent_id=subnet["SubnetId"])
 
                     self.logger.info("A network interface '%s' for subnet '%s' has been created or already exists",
                                      eni["uid"],
                                      subnet["SubnetId"]
                                      )
 
+    def adopt(self, pool_eni, uid, index):
+        """Adopt a network interface taken from the network interfaces pool into the fleet
+
+        The network interface is tagged and recorded like a created one, and its
+        elastic ips are recorded for the fleet.
+
+        Args:
+            pool_eni (dict): Pool network interface (see EniPool.acquire)
+            uid (string): Network interface uid
+            index (integer): Network interface index in its vpc
+
+        Returns:
+            string: Network interface ID
+        """
+        self.ec2_client.create_tags(
+            Resources=[pool_eni["NetworkInterfaceId"]],
+            Tags=[
+                {
+                    "Key": "Name",
+                    "Value": self.tag_base_name + "-" + create_suffix("eni", index)
+                },
+                {
+                    "Key": "uid",
+                    "Value": uid
+                }
+            ]
+        )
+        self.record_resource(NETWORK_INTERFACE, pool_eni["NetworkInterfaceId"], uid=uid,
+                             parent_id=pool_eni["SubnetId"])
+        for private_ip in pool_eni["PrivateIpAddresses"]:
+            if private_ip["AllocationId"] is not None:
+                self.record_resource(
+                    ADDRESS, private_ip["AllocationId"], parent_id=pool_eni["NetworkInterfaceId"], attributes={
+                        "PublicIp": private_ip["PublicIp"],
+                        "PrivateIpAddress": private_ip["PrivateIpAddress"]
+                    })
+        self.tracer.current_span().add_attribute_value("pool_network_interface_ids", pool_eni["NetworkInterfaceId"])
+
+        return pool_eni["NetworkInterfaceId"]
+
+    @traced("network_interfaces.associate_public_ips_to_enis")
     def associate_public_ips_to_enis(self):
         """Associate public ips to elastic network interfaces
+
+        Elastic ips allocated but not associated yet (e.g. by an interrupted create)
+        are associated instead of allocating new ones. With an elastic ips pool, the
+        needed elastic ips are taken from the pool at once.
         """
-        aws_enis = list(
-            self.ec2.network_interfaces.filter(
-                Filters=[
-                    {
-                        "Name": "tag:Name",
-                        "Values": [self.tag_base_name + '-*']
-                    }
-                ]
-            )
+        aws_enis = list(self.iter_fleet_resources(
+            "describe_network_interfaces", NETWORK_INTERFACE, "network-interface-id",
+            projection=["NetworkInterfaceId", "PrivateIpAddresses"]))
+
+        pending_allocations = dict(
+            ((address["ParentId"], address["Attributes"].get("PrivateIpAddress")), address)
+            for address in self.state_store.get_resources(self.tag_base_name, ADDRESS)
         )
 
+        pool_addresses = []
+        if self.eip_pool is not None:
+            pool_addresses = self.eip_pool.acquire(len([
+                aws_private_ip_address
+                for aws_eni in aws_enis
+                for aws_private_ip_address in aws_eni['PrivateIpAddresses']
+                if 'Association' not in aws_private_ip_address and
+                (aws_eni['NetworkInterfaceId'], aws_private_ip_address['PrivateIpAddress']) not in pending_allocations
+            ]))
+
         for aws_eni in aws_enis:
-            for aws_private_ip_address in aws_eni.private_ip_addresses:
+            for aws_private_ip_address in aws_eni['PrivateIpAddresses']:
                 msg = "The network interface '{0}' private ip '{1}' has been or is already" \
                     " associated with public ip '{2}'"
 
                 if 'Association' not in aws_private_ip_address:
-                    aws_eip_alloc = self.ec2_client.allocate_address(
-                        Domain='vpc'
-                    )
-                    self.ec2_client.associate_address(
-                        AllocationId=aws_eip_alloc['AllocationId'],
-                        NetworkInterfaceId=aws_eni.id,
-                        PrivateIpAddress=aws_private_ip_address['PrivateIpAddress']
-                    )
+                    with self.tracer.span("allocate_and_associate_address",
+                                          network_interface_id=aws_eni['NetworkInterfaceId'],
+                                          private_ip=aws_private_ip_address['PrivateIpAddress']) as span:
+                        aws_eip_alloc = None
+                        pending_allocation = pending_allocations.get(
+                            (aws_eni['NetworkInterfaceId'], aws_private_ip_address['PrivateIpAddress']))
+                        if pending_allocation is not None:
+                            aws_eip_alloc = {
+                                'AllocationId': pending_allocation["ResourceId"],
+                                'PublicIp': pending_allocation["Attributes"].get("PublicIp")
+                            }
+                            try:
+                                self.ec2_client.associate_address(
+                                    AllocationId=aws_eip_alloc['AllocationId'],
+                                    NetworkInterfaceId=aws_eni['NetworkInterfaceId'],
+                                    PrivateIpAddress=aws_private_ip_address['PrivateIpAddress']
+                                )
+                            except ClientError as e:
+                                self.logger.info(
+                                    "The recorded elastic ip '%s' can not be associated (%s). " +
+                                    "A new one will be allocated",
+                                    aws_eip_alloc['AllocationId'],
+                                    e
+                                )
+                                self.forget_resource(ADDRESS, aws_eip_alloc['AllocationId'])
+                                aws_eip_alloc = None
+
+                        if aws_eip_alloc is None:
+                            if pool_addresses:
+                                aws_eip_alloc = pool_addresses.pop(0)
+                            else:
+                                aws_eip_alloc = self.ec2_client.allocate_address(
+                                    Domain='vpc'
+                                )
+                            # Record the allocation before associating it so that it is not leaked on failure
+                            self.record_resource(
+                                ADDRESS, aws_eip_alloc['AllocationId'], parent_id=aws_eni['NetworkInterfaceId'],
+                                attributes={
+                                    "PublicIp": aws_eip_alloc['PublicIp'],
+                                    "PrivateIpAddress": aws_private_ip_address['PrivateIpAddress']
+                                })
+
+                            self.ec2_client.associate_address(
+                                AllocationId=aws_eip_alloc['AllocationId'],
+                                NetworkInterfaceId=aws_eni['NetworkInterfaceId'],
+                                PrivateIpAddress=aws_private_ip_address['PrivateIpAddress']
+                            )
+
+                        span.set_attribute("allocation_id", aws_eip_alloc['AllocationId'])
+                        span.set_attribute("public_ip", aws_eip_alloc['PublicIp'])
 
                     msg = msg.format(
-                        aws_eni.id,
+                        aws_eni['NetworkInterfaceId'],
                         aws_private_ip_address['PrivateIpAddress'],
                         aws_eip_alloc['PublicIp']
                     )
                 else:
                     msg = msg.format(
-                        aws_eni.id,
+                        aws_eni['NetworkInterfaceId'],
                         aws_private_ip_address['PrivateIpAddress'],
                         aws_private_ip_address['Association']['PublicIp']
                     )
 
+                    if 'AllocationId' in aws_private_ip_address['Association']:
+                        self.record_resource(
+                            ADDRESS, aws_private_ip_address['Association']['AllocationId'],
+                            parent_id=aws_eni['NetworkInterfaceId'],
+                            attributes={
+                                "PublicIp": aws_private_ip_address['Association']['PublicIp'],
+                                "PrivateIpAddress": aws_private_ip_address['PrivateIpAddress']
+                            })
+
                 self.logger.info(msg)
 
+    @traced("network_interfaces.relocate")
+    def relocate(self, enis_uids, subnet_id):
+        """Move network interfaces to another subnet (e.g. of another availability zone)
+
+        A replacement network interface with the same tags, private ips and ipv6
+        addresses counts is created in the subnet, the elastic ips are reassociated
+        to it and the original network interface is deleted. The ipv6 addresses are
+        new ones, from the subnet ipv6 cidr block.
+
+        Args:
+            enis_uids (list): Network interfaces uids
+            subnet_id (string): Destination subnet ID
+        """
+        recorded_enis = self.state_store.get_resources_by_uid(self.tag_base_name, NETWORK_INTERFACE)
+
+        for eni_uid in enis_uids:
+            if eni_uid in recorded_enis:
+                eni_filters = {"network-interface-id": recorded_enis[eni_uid]["ResourceId"]}
+            else:
+                eni_filters = {"tag:uid": eni_uid}
+            aws_eni = next(iter_resources(self.ec2_client, "describe_network_interfaces", eni_filters))
+            eni_id = aws_eni["NetworkInterfaceId"]
+
+            old_private_ips = sorted(aws_eni["PrivateIpAddresses"], key=lambda ip: not ip["Primary"])
+            eni_params = {
+                "SubnetId": subnet_id,
+                "SecondaryPrivateIpAddressCount": len(old_private_ips) - 1
+            }
+            if aws_eni.get("Ipv6Addresses"):
+                eni_params["Ipv6AddressCount"] = len(aws_eni["Ipv6Addresses"])
+            created_eni = self.ec2_client.create_network_interface(**eni_params)["NetworkInterface"]
+            created_eni_id = created_eni["NetworkInterfaceId"]
+            if aws_eni.get("TagSet"):
+                self.ec2_client.create_tags(Resources=[created_eni_id], Tags=aws_eni["TagSet"])
+            new_private_ips = sorted(created_eni["PrivateIpAddresses"], key=lambda ip: not ip["Primary"])
+
+            for old_private_ip, new_private_ip in zip(old_private_ips, new_private_ips):
+                association = old_private_ip.get("Association", {})
+                if "AllocationId" not in association:
+                    continue
+
+                self.ec2_client.associate_address(
+                    AllocationId=association["AllocationId"],
+                    NetworkInterfaceId=created_eni_id,
+                    PrivateIpAddress=new_private_ip["PrivateIpAddress"],
+                    AllowReassociation=True
+                )
+                self.record_resource(
+                    ADDRESS, association["AllocationId"], parent_id=created_eni_id, attributes={
+                        "PublicIp": association["PublicIp"],
+                        "PrivateIpAddress": new_private_ip["PrivateIpAddress"]
+                    })
+
+            self.ec2_client.delete_network_interface(NetworkInterfaceId=eni_id)
+            self.forget_resource(NETWORK_INTERFACE, eni_id)
+            self.record_resource(NETWORK_INTERFACE, created_eni_id, uid=eni_uid, parent_id=subnet_id)
+            self.tracer.current_span().add_attribute_value("network_interface_ids", created_eni_id)
+
+            self.logger.info(
+                "The network interface '%s' has been moved to subnet '%s' as '%s'",
+                eni_id,
+                subnet_id,
+                created_eni_id
+            )
+
+    @traced("network_interfaces.rotate_public_ips")
+    def rotate_public_ips(self):
+        """Replace the elastic ips of the network interfaces with new ones
+
+        Each private ip gets a new elastic ip before the previous one is released,
+        so that the proxies stay reachable during the rotation. With an elastic ips
+        pool, the new elastic ips are taken from the pool. The previous ones are still
+        released, not given back, since the rotation is meant to get fresh ips.
+
+        Returns:
+            list: Tuples of previous and new public ips
+        """
+        eni_ids = [
+            aws_eni["NetworkInterfaceId"] for aws_eni in self.iter_fleet_resources(
+                "describe_network_interfaces", NETWORK_INTERFACE, "network-interface-id",
+                projection=["NetworkInterfaceId"])
+        ]
+
+        aws_addresses = list(iter_resources(self.ec2_client, "describe_addresses", {
+            "network-interface-id": eni_ids
+        }))
+
+        pool_addresses = []
+        if self.eip_pool is not None:
+            pool_addresses = self.eip_pool.acquire(len(aws_addresses))
+
+        rotated_ips = []
+        for aws_public_ip in aws_addresses:
+            if pool_addresses:
+                aws_eip_alloc = pool_addresses.pop(0)
+            else:
+                aws_eip_alloc = self.ec2_client.allocate_address(
+                    Domain='vpc'
+                )
+            self.record_resource(
+                ADDRESS, aws_eip_alloc['AllocationId'], parent_id=aws_public_ip['NetworkInterfaceId'], attributes={
+                    "PublicIp": aws_eip_alloc['PublicIp'],
+                    "PrivateIpAddress": aws_public_ip['PrivateIpAddress']
+                })
+
+            self.ec2_client.associate_address(
+                AllocationId=aws_eip_alloc['AllocationId'],
+                NetworkInterfaceId=aws_public_ip['NetworkInterfaceId'],
+                PrivateIpAddress=aws_public_ip['PrivateIpAddress'],
+                AllowReassociation=True
+            )
+
+            self.ec2_client.release_address(
+                AllocationId=aws_public_ip['AllocationId'],
+            )
+            self.forget_resource(ADDRESS, aws_public_ip['AllocationId'])
+            self.tracer.current_span().add_attribute_value("allocation_ids", aws_eip_alloc['AllocationId'])
+
+            rotated_ips.append((aws_public_ip['PublicIp'], aws_eip_alloc['PublicIp']))
+
+            self.logger.info(
+                "The network interface '%s' private ip '%s' public ip '%s' has been replaced by '%s'",
+                aws_public_ip['NetworkInterfaceId'],
+                aws_public_ip['PrivateIpAddress'],
+                aws_public_ip['PublicIp'],
+                aws_eip_alloc['PublicIp']
+            )
+
+        return rotated_ips
+
+    @traced("network_interfaces.release_public_ips")
     def release_public_ips(self):
         """Dissociate public ips to elastic network interfaces and release ips
+
+        With an elastic ips pool, the elastic ips are given back to the pool instead.
         """
-        aws_enis = filter_resources(
-            self.ec2.network_interfaces, "tag:Name", self.tag_base_name + '-*')
+        eni_ids = [
+            aws_eni["NetworkInterfaceId"] for aws_eni in self.iter_fleet_resources(
+                "describe_network_interfaces", NETWORK_INTERFACE, "network-interface-id",
+                projection=["NetworkInterfaceId"])
+        ]
 
-        eni_ids = []
-        for aws_eni in aws_enis:
-            for aws_private_ip_address in aws_eni.private_ip_addresses:
-                eni_ids.append(aws_eni.id)
+        aws_addresses = list(iter_resources(self.ec2_client, "describe_addresses", {
+            "network-interface-id": eni_ids
+        }))
 
-        aws_addresses = self.ec2_client.describe_addresses(
-            Filters=[
+        if self.eip_pool is not None:
+            recorded_addresses = self.state_store.get_resources(self.tag_base_name, ADDRESS)
+            associated_allocation_ids = set(
+                aws_public_ip['AllocationId'] for aws_public_ip in aws_addresses)
+            # The elastic ips allocated but never associated (e.g. by an interrupted create) are given back too
+            given_back_addresses = aws_addresses + [
                 {
-                    'Name': 'network-interface-id',
-                    'Values': eni_ids
-                },
-            ],
-        )
+                    'AllocationId': address["ResourceId"],
+                    'PublicIp': address["Attributes"].get("PublicIp")
+                }
+                for address in recorded_addresses if address["ResourceId"] not in associated_allocation_ids
+            ]
+            self.eip_pool.give_back(given_back_addresses)
 
-        for aws_public_ip in aws_addresses['Addresses']:
+            for address in given_back_addresses:
+                self.forget_resource(ADDRESS, address['AllocationId'])
+            return
+
+        for aws_public_ip in aws_addresses:
             self.ec2_client.disassociate_address(
                 AssociationId=aws_public_ip['AssociationId']
             )
@@ -134,6 +452,8 @@ class NetworkInterfaces(BaseResources):
             self.ec2_client.release_address(
                 AllocationId=aws_public_ip['AllocationId'],
             )
+            self.tracer.current_span().add_attribute_value("allocation_ids", aws_public_ip['AllocationId'])
+            self.forget_resource(ADDRESS, aws_public_ip['AllocationId'])
 
             self.logger.info(
                 "The public IP '%s' has been dissociated from network interface '%s' and released",
@@ -141,22 +461,37 @@ class NetworkInterfaces(BaseResources):
                 aws_public_ip['NetworkInterfaceId']
             )
 
+        # Release the elastic ips allocated but never associated (e.g. by an interrupted create)
+        for address in self.state_store.get_resources(self.tag_base_name, ADDRESS):
+            try:
+                self.ec2_client.release_address(
+                    AllocationId=address["ResourceId"],
+                )
+                self.logger.info("The unassociated public IP '%s' has been released",
+                                 address["Attributes"].get("PublicIp"))
+            except ClientError as e:
+                self.logger.info("The public IP allocation '%s' can not be released (%s)", address["ResourceId"], e)
+
+            self.forget_resource(ADDRESS, address["ResourceId"])
+
+    @traced("network_interfaces.delete")
     def delete(self):
         """Delete elastic network interfaces
         """
-        aws_enis = filter_resources(
-            self.ec2.network_interfaces, "tag:Name", self.tag_base_name + '-*')
-
-        for aws_eni in aws_enis:
-            if hasattr(aws_eni, 'attachment') and aws_eni.attachment is not None:
-                print aws_eni.attachment
+        for aws_eni in self.iter_fleet_resources(
+                "describe_network_interfaces", NETWORK_INTERFACE, "network-interface-id",
+                projection=["NetworkInterfaceId", "Attachment"]):
+            eni_id = aws_eni["NetworkInterfaceId"]
+            if aws_eni.get("Attachment"):
                 self.ec2_client.detach_network_interface(
-                    AttachmentId=aws_eni.attachment['AttachmentId'],
+                    AttachmentId=aws_eni["Attachment"]["AttachmentId"],
                 )
 
-            aws_eni.delete()
+            self.ec2_client.delete_network_interface(NetworkInterfaceId=eni_id)
+            self.tracer.current_span().add_attribute_value("network_interface_ids", eni_id)
+            self.forget_resource(NETWORK_INTERFACE, eni_id)
 
             self.logger.info(
                 "The network interface '%s' has been detached from instance and deleted",
-                aws_eni.id
+                eni_id
             )
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""Fleet planner
+
+Plans the instances, network interfaces, subnets and vpc shards of a fleet from
+a proxies config, without any AWS call: the images ids must already be resolved
+and the 'auto' availability zones are resolved with an injected function.
+
+The plan is built in a single linear pass over the network interfaces. The
+subnets instances counts are kept in flat lists indexed by shard and zone,
+and the network interfaces are appended to their base vpc subnet as they are
+planned, so that no list is rescanned.
+"""
+from __future__ import division
+import math
+from .utils import get_subnet_cidr_suffix, get_instance_eni_mapping, get_shard_cidr_block, \
+    get_shard_cidr_block_formatting, get_indexed_subnet_cidr_block, get_cidr_block_gateway_ip, \
+    distribute_availability_zones
+
+
+class Planner(object):
+    """Fleet planner
+    """
+
+    def __init__(self, eni_mapping=None, cidr_suffix_ips_number_mapping=None, availability_zones_resolver=None,
+                 eni_pool_size=None):
+        """Constructor
+
+        Args:
+            eni_mapping (list, optional): Instance types network interfaces and private ips counts
+            cidr_suffix_ips_number_mapping (list, optional): Ips counts and subnet cidr suffixes
+            availability_zones_resolver (function, optional): Function returning the available
+                availability zones, used by the 'auto' AvailabilityZones
+            eni_pool_size (integer, optional): Network interfaces kept warm per subnet by the
+                network interfaces pool, which the subnets are sized for
+        """
+        self.eni_mapping = eni_mapping
+        self.cidr_suffix_ips_number_mapping = cidr_suffix_ips_number_mapping
+        self.availability_zones_resolver = availability_zones_resolver
+        self.eni_pool_size = eni_pool_size
+
+    def plan(self, proxies_config):
+        """Plan the fleet
+
+        The first instances config of the proxies config is planned (and enriched
+        with its MinCount, MaxCount and Instances).
+
+        Args:
+            proxies_config (dict): Proxies config
+
+        Returns:
+            dict: Instances groups config ('instances_groups') and base vpcs config,
+                one per vpc shard ('vpcs')
+
+        Raises:
+            ValueError: The instances config is missing the VPCCidrBlock or SecurityGroups property, or
+                a vpc shard subnet needs more ips than the largest cidr block has
+        """
+        instance_config = proxies_config["instances_config"][0]
+
+        if "VPCCidrBlock" not in instance_config:
+            raise ValueError("The instance type config need to have a VPCCidrBlock property")
+
+        if "SecurityGroups" not in instance_config:
+            raise ValueError("The instance type config need to have a SecurityGroups property")
+
+        available_ips = proxies_config["available_ips"]
+        enis_count, eni_ips_count = self.get_instance_enis_capacity(instance_config)
+        instance_possible_ips_count = eni_ips_count * enis_count
+        instances_count = int(math.ceil(available_ips / instance_possible_ips_count))
+
+        instance_config["MinCount"] = instances_count
+        instance_config["MaxCount"] = instances_count
+
+        # In ipv6 mode, the proxies ips are the network interfaces ipv6 addresses: each network
+        # interface only needs its primary private ip and no elastic ip
+        ipv6 = bool(instance_config.get("Ipv6"))
+
+        # Large fleets are sharded across several vpcs, each instance belonging to one shard,
+        # and spread across availability zones, with one subnet per shard and zone
+        shards_count = Planner.get_vpc_shards_count(proxies_config, instances_count)
+        zones_weights = self.get_availability_zones_weights(instance_config)
+        zones_count = len(zones_weights)
+        instances_zones = distribute_availability_zones(zones_weights, instances_count)
+
+        # Private ips an instance takes in its subnet: the proxies ips (only the network interfaces
+        # primary ips in ipv6 mode) and the primary network interface of the fleet instances
+        instance_subnet_ips_count = enis_count if ipv6 else instance_possible_ips_count
+        if instance_config.get("LaunchMode") == "fleet":
+            instance_subnet_ips_count = instance_subnet_ips_count + 1
+
+        subnets_instances_count = [0] * (shards_count * zones_count)
+        instances_shards = []
+        for i in range(0, instances_count):
+            shard_index = i * shards_count // instances_count
+            instances_shards.append(shard_index)
+            subnets_instances_count[shard_index * zones_count + instances_zones[i]] += 1
+
+        subnets = []
+        base_vpcs_config = []
+        for shard_index in range(0, shards_count):
+            shard_cidr_block = get_shard_cidr_block(instance_config["VPCCidrBlock"], shard_index)
+            shard_cidr_block_formatting = get_shard_cidr_block_formatting(
+                instance_config["CidrBlockFormatting"], shard_cidr_block, shard_index)
+            base_vpcs_config.append({
+                "Index": shard_index,
+                "CidrBlock": shard_cidr_block,
+                "CreateInternetGateway": True,
+                "Ipv6": ipv6,
+                "Subnets": [],
+                "SecurityGroups": instance_config["SecurityGroups"]
+            })
+
+            # The shard subnets have the same size so that they can be laid out one after the other
+            subnet_instances_count = max(
+                subnets_instances_count[shard_index * zones_count:(shard_index + 1) * zones_count])
+            if ipv6:
+                subnet_ips_count = subnet_instances_count * enis_count
+            else:
+                subnet_ips_count = min(available_ips, subnet_instances_count * instance_possible_ips_count)
+            if instance_config.get("LaunchMode") == "fleet":
+                # The fleet instances primary network interfaces take one private ip each
+                subnet_ips_count = subnet_ips_count + subnet_instances_count
+            if zones_count > 1:
+                # Room for an instance of another availability zone spilling over to the subnet
+                subnet_ips_count = subnet_ips_count + instance_subnet_ips_count
+            if self.eni_pool_size and not ipv6:
+                # Room for the network interfaces pool, the ipv6 fleets not using it
+                subnet_ips_count = subnet_ips_count + self.eni_pool_size * eni_ips_count
+            subnet_cidr_suffix = get_subnet_cidr_suffix(
+                ips_count=subnet_ips_count,
+                cidr_suffix_ips_number_mapping=self.cidr_suffix_ips_number_mapping)
+
+            for zone_index, (availability_zone, weight) in enumerate(zones_weights):
+                subnet_cidr_block = get_indexed_subnet_cidr_block(
+                    shard_cidr_block_formatting, zone_index, subnet_cidr_suffix)
+                subnets.append({
+                    "VPCCidrBlock": shard_cidr_block,
+                    "CidrBlock": subnet_cidr_block,
+                    "SubnetCidrSuffix": subnet_cidr_suffix,
+                    "GatewayIP": get_cidr_block_gateway_ip(subnet_cidr_block),
+                    "AvailabilityZone": availability_zone,
+                    # Shared by the subnet network interfaces
+                    "Subnet": {
+                        "CidrBlock": subnet_cidr_block,
+                        "AvailabilityZone": availability_zone
+                    },
+                    # Base vpc subnet, only added to its vpc once a network interface uses it
+                    "BaseSubnet": None,
+                    # The subnet ipv6 cidr block is the nth /64 of the vpc one
+                    "Ipv6SubnetIndex": zone_index
+                })
+
+        # Every network interface but the last one has all its ips, the ips counts
+        # dicts are shared between network interfaces
+        full_eni_ips = Planner.get_eni_ips(eni_ips_count, ipv6)
+
+        instances = []
+        possible_ips_remaining = available_ips
+        for i in range(0, instances_count):
+            shard_index = instances_shards[i]
+            subnet = subnets[shard_index * zones_count + instances_zones[i]]
+            if subnet["BaseSubnet"] is None:
+                subnet["BaseSubnet"] = {
+                    "CidrBlock": subnet["CidrBlock"],
+                    "AvailabilityZone": subnet["AvailabilityZone"],
+                    "NetworkInterfaces": []
+                }
+                if ipv6:
+                    subnet["BaseSubnet"]["Ipv6SubnetIndex"] = subnet["Ipv6SubnetIndex"]
+                base_vpcs_config[shard_index]["Subnets"].append(subnet["BaseSubnet"])
+            base_subnet_enis = subnet["BaseSubnet"]["NetworkInterfaces"]
+
+            instance_enis = []
+            instances.append({
+                "NetworkInterfaces": instance_enis,
+                "VpcShard": shard_index,
+                "VPCCidrBlock": subnet["VPCCidrBlock"],
+                "CidrBlock": subnet["CidrBlock"],
+                "SubnetCidrSuffix": subnet["SubnetCidrSuffix"],
+                "GatewayIP": subnet["GatewayIP"],
+                "AvailabilityZone": subnet["AvailabilityZone"]
+            })
+            uid_prefix = "eni-" + str(i) + "-"
+            for j in range(0, enis_count):
+                if possible_ips_remaining > eni_ips_count:
+                    eni_ips = full_eni_ips
+                else:
+                    eni_ips = Planner.get_eni_ips(possible_ips_remaining, ipv6)
+
+                uid = uid_prefix + str(j)
+                instance_enis.append({
+                    "uid": uid,
+                    "Ips": eni_ips,
+                    "Subnet": subnet["Subnet"]
+                })
+                base_subnet_enis.append({
+                    "uid": uid,
+                    "Ips": eni_ips
+                })
+
+                possible_ips_remaining = possible_ips_remaining - eni_ips_count
+                if possible_ips_remaining <= 0:
+                    break
+
+        instance_config["Instances"] = instances
+
+        return {
+            "instances_groups": [instance_config],
+            "vpcs": base_vpcs_config
+        }
+
+    @staticmethod
+    def get_eni_ips(ips_count, ipv6=False):
+        """Get the ips counts of a network interface holding a number of proxies ips
+
+        Args:
+            ips_count (integer): Proxies ips count
+            ipv6 (bool, optional): Ipv6 mode, the proxies ips being ipv6 addresses
+
+        Returns:
+            dict: Secondary private and public ips counts, and ipv6 addresses count in ipv6 mode
+        """
+        if ipv6:
+            return {
+                "SecondaryPrivateIpAddressCount": 0,
+                "SecondaryPublicIpAddressCount": 0,
+                "Ipv6AddressCount": ips_count
+            }
+
+        return {
+            # Not counting the primary private ip address
+            "SecondaryPrivateIpAddressCount": ips_count - 1,
+            # Not counting the primary public ip address
+            "SecondaryPublicIpAddressCount": ips_count - 1,
+        }
+
+    def get_instance_enis_capacity(self, instance_config):
+        """Get the network interfaces count and the private ips count per network interface of an instance
+
+        Fleet launches can pick any of the instance types, so the network interfaces
+        are sized for the smallest one. Fleet instances are launched with their own
+        primary network interface, the proxy network interfaces being attached next to it.
+
+        Args:
+            instance_config (dict): Instance config
+
+        Returns:
+            tuple: Network interfaces count and private ips count per network interface
+        """
+        instance_types = instance_config.get("InstanceTypes") or [instance_config["InstanceType"]]
+        enis_count = None
+        eni_ips_count = None
+        for instance_type in instance_types:
+            instance_eni_mapping = get_instance_eni_mapping(instance_type=instance_type, eni_mapping=self.eni_mapping)
+            if instance_eni_mapping:
+                enis_count = min(enis_count or instance_eni_mapping[0][1], instance_eni_mapping[0][1])
+                eni_ips_count = min(eni_ips_count or instance_eni_mapping[0][2], instance_eni_mapping[0][2])
+        enis_count = enis_count or 1
+        eni_ips_count = eni_ips_count or 1
+
+        if instance_config.get("LaunchMode") == "fleet":
+            enis_count = max(1, enis_count - 1)
+
+        return enis_count, eni_ips_count
+
+    def get_availability_zones_weights(self, instance_config):
+        """Get the availability zones an instances group is spread across, with their weight
+
+        The instance config 'AvailabilityZones' can be a list of zones, a dict of
+        zones weights or 'auto' to use every available zone of the region. Without it
+        the zone is left to EC2.
+
+        Args:
+            instance_config (dict): Instance config
+
+        Returns:
+            list: Tuples of availability zone (or None) and weight
+
+        Raises:
+            ValueError: 'auto' availability zones without availability zones resolver
+        """
+        availability_zones = instance_config.get("AvailabilityZones")
+        if not availability_zones:
+            return [(None, 1)]
+
+        if availability_zones == "auto":
+            if self.availability_zones_resolver is None:
+                raise ValueError("The 'auto' availability zones need an availability zones resolver")
+            availability_zones = self.availability_zones_resolver()
+
+        if isinstance(availability_zones, dict):
+            return sorted(availability_zones.items())
+
+        return [(availability_zone, 1) for availability_zone in availability_zones]
+
+    @staticmethod
+    def get_vpc_shards_count(proxies_config, instances_count):
+        """Get the number of vpcs the fleet is sharded across
+
+        The proxies config 'vpc_shards' sets it explicitly and 'max_ips_per_vpc'
+        derives it from the available ips. There is at most one shard per instance.
+
+        Args:
+            proxies_config (dict): Proxies config
+            instances_count (integer): Instances count
+
+        Returns:
+            integer: Vpc shards count
+        """
+        shards_count = proxies_config.get("vpc_shards", 1)
+        if proxies_config.get("max_ips_per_vpc"):
+            shards_count = max(
+                shards_count,
+                int(math.ceil(proxies_config['available_ips'] / proxies_config["max_ips_per_vpc"]))
+            )
+
+        return max(1, min(shards_count, instances_count))
+
+    @staticmethod
+    def build_base_vpcs_config(instances_config):
+        """Build the base vpcs config, one per vpc shard, from planned instances configs
+
+        Args:
+            instances_config (list): Planned instances configs
+
+        Returns:
+            list: Base vpcs config
+
+        Raises:
+            ValueError: An instances config is missing the VPCCidrBlock or SecurityGroups property
+        """
+        base_vpcs_config = {}
+        subnets_by_cidr_block = {}
+        for instance_type in instances_config:
+
+            if "VPCCidrBlock" not in instance_type:
+                raise ValueError("The instance type config need to have a VPCCidrBlock property")
+
+            if "SecurityGroups" not in instance_type:
+                raise ValueError("The instance type config need to have a SecurityGroups property")
+
+            for instance in instance_type.get("Instances", []):
+                shard_index = instance.get("VpcShard", 0)
+                base_vpc_config = base_vpcs_config.get(shard_index)
+                if base_vpc_config is None:
+                    base_vpc_config = base_vpcs_config[shard_index] = {
+                        "Index": shard_index,
+                        "CidrBlock": instance.get("VPCCidrBlock", instance_type["VPCCidrBlock"]),
+                        "CreateInternetGateway": True,
+                        "Ipv6": bool(instance_type.get("Ipv6")),
+                        "Subnets": [],
+                        "SecurityGroups": instance_type["SecurityGroups"]
+                    }
+
+                for network_interface in instance["NetworkInterfaces"]:
+                    cidr_block = network_interface["Subnet"]["CidrBlock"]
+                    subnet = subnets_by_cidr_block.get(cidr_block)
+                    if subnet is None:
+                        subnet = subnets_by_cidr_block[cidr_block] = {
+                            "CidrBlock": cidr_block,
+                            "AvailabilityZone": network_interface["Subnet"].get("AvailabilityZone"),
+                            "NetworkInterfaces": []
+                        }
+                        if base_vpc_config["Ipv6"]:
+                            subnet["Ipv6SubnetIndex"] = len(base_vpc_config["Subnets"])
+                        base_vpc_config["Subnets"].append(subnet)
+
+                    subnet["NetworkInterfaces"].append({
+                        "uid": network_interface["uid"],
+                        "Ips": network_interface["Ips"]
+                    })
+
+        return [base_vpcs_config[shard_index] for shard_index in sorted(base_vpcs_config)]
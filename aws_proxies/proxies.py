@@ -1,30 +1,49 @@
 # -*- coding: utf-8 -*-
-from __future__ import division
-import boto3
-from instances import Instances
-from internet_gateways import InternetGateways
+from __future__ import division, print_function
+from .images import ImageCache
+import importlib
 import logging
-from network_acls import NetworkAcls
-from network_interfaces import NetworkInterfaces
-import math
-from route_tables import RouteTables
-import settings
-from security_groups import SecurityGroups
-from subnets import Subnets
+from .models import Topology
+from .planner import Planner
+from . import settings
+import socket
+from .state import INSTANCE, ScopedStateStore, SqliteStateStore
 import sys
-from utils import setup_logger, merge_config, get_subnet_cidr_block, \
-    get_vpc_gateway_ip, get_subnet_cidr_suffix, get_instance_eni_mapping, \
-    confirm_proxies_and_infra_creation, confirm_proxies_and_infra_deletion
-from vpcs import Vpcs
+import threading
+import time
+from .tracing import Tracer
+from .utils import setup_logger, merge_config, confirm_proxies_and_infra_creation, \
+    confirm_proxies_and_infra_deletion, run_concurrently, get_fleet_instances_filter, get_cidr_block_gateway_ip, \
+    write_json_atomically, get_network_interface_proxies_ips, iter_resources
+
+# Resources managers modules and classes, imported on first use
+MANAGERS = {
+    "vpcs": ("vpcs", "Vpcs"),
+    "internet_gateways": ("internet_gateways", "InternetGateways"),
+    "subnets": ("subnets", "Subnets"),
+    "security_groups": ("security_groups", "SecurityGroups"),
+    "route_tables": ("route_tables", "RouteTables"),
+    "network_acls": ("network_acls", "NetworkAcls"),
+    "network_interfaces": ("network_interfaces", "NetworkInterfaces"),
+    "instances": ("instances", "Instances"),
+    "inventory": ("inventory", "Inventory"),
+}
+
+# State store fleet suffix under which the fleet generations are recorded, apart from the
+# generations resources so that deleting a generation does not forget them
+GENERATIONS_FLEET_SUFFIX = ".generations"
 
 
 class Proxies(object):
 
-    def __init__(self, profile, **kwargs):
+    def __init__(self, profile=None, **kwargs):
         """Constructor
 
+        Nothing is imported from boto3 nor created on AWS until needed: the session,
+        the ec2 resource and client and the resources managers are created on first use.
+
         Args:
-            profile (string): AWS profile
+            profile (string, optional): AWS profile
             **kwargs: Multiple arguments
 
         Raises:
@@ -37,17 +56,12 @@ class Proxies(object):
         # Setup logger
         self.logger = setup_logger(__name__, self.log_level, self.boto_log_level)
 
-        # Get AWS Session
-        self.session = boto3.Session(profile_name=profile)
-        self.logger.info("AWS Session created")
-
-        # Get AWS EC2 Resource
-        self.ec2 = self.session.resource("ec2")
-        self.logger.info("AWS EC2 resource created")
-
-        # Get AWS EC2 Client
-        self.ec2_client = self.ec2.meta.client
-        self.logger.info("AWS EC2 client created")
+        self.profile = profile
+        self._session = kwargs.pop("session", None)
+        self._ec2 = None
+        self._ec2_client = None
+        self._tagging_client = None
+        self._managers = {}
 
         self.eni_mapping = kwargs.pop("eni_mappings", settings.ENI_MAPPING)
 
@@ -56,13 +70,52 @@ class Proxies(object):
             settings.CIDR_SUFFIX_IPS_NUMBER_MAPPING
         )
 
-        self.tag_base_name = kwargs.pop("tag_base_name", settings.TAG_BASE_NAME)
+        self._tag_base_name = kwargs.pop("tag_base_name", settings.TAG_BASE_NAME)
 
         self.hvm_only_instance_types = kwargs.pop(
             "hvm_only_instance_types",
             settings.HVM_ONLY_INSTANCE_TYPES
         )
 
+        self.tracer = kwargs.pop("tracer", None) or Tracer()
+
+        # Images are looked up by name among these owners only, and the resolved ones are cached
+        self.image_owners = kwargs.pop("image_owners", settings.IMAGE_OWNERS)
+        self.image_cache = kwargs.pop("image_cache", None)
+        if self.image_cache is None:
+            self.image_cache = ImageCache(settings.IMAGE_CACHE_PATH, settings.IMAGE_CACHE_TTL)
+
+        state_store = kwargs.pop("state_store", None)
+        if state_store is None:
+            state_store = SqliteStateStore(settings.STATE_STORE_PATH)
+        # The fleets are recorded per profile and region, the stores being shared (e.g. the default one)
+        self.state_store = state_store
+        if not isinstance(state_store, ScopedStateStore):
+            self.state_store = ScopedStateStore(
+                state_store, lambda: "{0}/{1}".format(self.profile or "", self.session.region_name))
+
+        # The fleet is managed under the tag of its active generation once it has been rolled over
+        self.root_tag_base_name = self._tag_base_name
+        self.tag_base_name = kwargs.pop("generation_tag_base_name", None)
+        self._teardown_thread = None
+
+        # Elastic ips pool, disabled without a size
+        self.eip_pool_size = kwargs.pop("eip_pool_size", settings.EIP_POOL_SIZE)
+        self.eip_pool_name = kwargs.pop("eip_pool_name", None)
+        self.eip_pool_max_size = kwargs.pop("eip_pool_max_size", None)
+        self._eip_pool = None
+
+        # Network interfaces pool, disabled without a size
+        self.eni_pool_size = kwargs.pop("eni_pool_size", settings.ENI_POOL_SIZE)
+        self._eni_pool = None
+
+        self.planner = Planner(
+            eni_mapping=self.eni_mapping,
+            cidr_suffix_ips_number_mapping=self.cidr_suffix_ips_number_mapping,
+            availability_zones_resolver=self.get_availability_zones,
+            eni_pool_size=self.eni_pool_size
+        )
+
         if kwargs:
             raise TypeError("Unexpected **kwargs: %r" % kwargs)
 
@@ -71,26 +124,313 @@ class Proxies(object):
             "instances_groups": []
         }
 
-        resources_params = {
-            "ec2": self.ec2,
-            "ec2_client": self.ec2_client,
-            "tag_base_name": self.tag_base_name,
-            "log_level": self.log_level,
-            "boto_log_level": self.boto_log_level
-        }
+    @property
+    def tag_base_name(self):
+        """Tag base name of the fleet active generation, read from the state store on first use
+
+        Returns:
+            string: Tag base name
+        """
+        if self._tag_base_name is None:
+            self._tag_base_name = self.state_store.get_value(
+                self.root_tag_base_name + GENERATIONS_FLEET_SUFFIX, "active", self.root_tag_base_name)
+        return self._tag_base_name
+
+    @tag_base_name.setter
+    def tag_base_name(self, tag_base_name):
+        self._tag_base_name = tag_base_name
+
+    @property
+    def session(self):
+        """AWS session, created on first use
+
+        Returns:
+            object: Boto3 session
+        """
+        if self._session is None:
+            import boto3
+            self._session = boto3.Session(profile_name=self.profile)
+            self.logger.info("AWS Session created")
+        return self._session
+
+    @property
+    def ec2(self):
+        """AWS EC2 resource, created on first use
+
+        Returns:
+            object: Boto3 ec2 resource
+        """
+        if self._ec2 is None:
+            self._ec2 = self.session.resource("ec2")
+            self.logger.info("AWS EC2 resource created")
+        return self._ec2
+
+    @property
+    def ec2_client(self):
+        """AWS EC2 client, created on first use
+
+        The ec2 resource client is used once the resource exists.
+
+        Returns:
+            object: Boto3 ec2 client
+        """
+        if self._ec2_client is None:
+            if self._ec2 is not None:
+                self._ec2_client = self._ec2.meta.client
+            else:
+                self._ec2_client = self.session.client("ec2")
+            self.logger.info("AWS EC2 client created")
+        return self._ec2_client
+
+    @property
+    def tagging_client(self):
+        """AWS Resource Groups Tagging API client, created on first use
+
+        Returns:
+            object: Boto3 resourcegroupstaggingapi client
+        """
+        if self._tagging_client is None:
+            self._tagging_client = self.session.client("resourcegroupstaggingapi")
+            self.logger.info("AWS Resource Groups Tagging API client created")
+        return self._tagging_client
 
-        self.vpcs = Vpcs(**resources_params)
-        self.internet_gateways = InternetGateways(**resources_params)
-        self.subnets = Subnets(**resources_params)
-        self.security_groups = SecurityGroups(**resources_params)
-        self.route_tables = RouteTables(**resources_params)
-        self.network_acls = NetworkAcls(**resources_params)
-        self.network_interfaces = NetworkInterfaces(**resources_params)
-        self.instances = Instances(**resources_params)
+    def __get_manager(self, name):
+        """Get a resources manager, importing and creating it on first use
+
+        Args:
+            name (string): Manager name (see MANAGERS)
+
+        Returns:
+            object: Resources manager
+        """
+        if name not in self._managers:
+            module_name, class_name = MANAGERS[name]
+            module = importlib.import_module("." + module_name, __name__.rpartition(".")[0])
+            manager_kwargs = {}
+            if name == "network_interfaces":
+                manager_kwargs["eip_pool"] = self.eip_pool
+                manager_kwargs["eni_pool"] = self.eni_pool
+            if name == "inventory":
+                manager_kwargs["tagging_client"] = self.tagging_client
+            self._managers[name] = getattr(module, class_name)(
+                ec2=self.ec2,
+                ec2_client=self.ec2_client,
+                tag_base_name=self.tag_base_name,
+                tracer=self.tracer,
+                state_store=self.state_store,
+                log_level=self.log_level,
+                boto_log_level=self.boto_log_level,
+                **manager_kwargs
+            )
+        return self._managers[name]
+
+    @property
+    def vpcs(self):
+        return self.__get_manager("vpcs")
+
+    @property
+    def internet_gateways(self):
+        return self.__get_manager("internet_gateways")
+
+    @property
+    def subnets(self):
+        return self.__get_manager("subnets")
+
+    @property
+    def security_groups(self):
+        return self.__get_manager("security_groups")
+
+    @property
+    def route_tables(self):
+        return self.__get_manager("route_tables")
+
+    @property
+    def network_acls(self):
+        return self.__get_manager("network_acls")
+
+    @property
+    def network_interfaces(self):
+        return self.__get_manager("network_interfaces")
+
+    @property
+    def instances(self):
+        return self.__get_manager("instances")
+
+    @property
+    def inventory(self):
+        return self.__get_manager("inventory")
+
+    @property
+    def launch_templates(self):
+        return self.instances.launch_templates
+
+    @property
+    def eip_pool(self):
+        """Elastic ips pool, created on first use
+
+        Returns:
+            object: EipPool or None when the pool is disabled (no eip_pool_size)
+        """
+        if self._eip_pool is None and self.eip_pool_size is not None:
+            from .eip_pool import EipPool
+            self._eip_pool = EipPool(
+                ec2=self.ec2,
+                ec2_client=self.ec2_client,
+                tag_base_name=self.tag_base_name,
+                # Shared by the fleet generations
+                pool_name=self.eip_pool_name or self.root_tag_base_name + "-eip-pool",
+                size=self.eip_pool_size,
+                max_size=self.eip_pool_max_size,
+                tracer=self.tracer,
+                state_store=self.state_store,
+                log_level=self.log_level,
+                boto_log_level=self.boto_log_level
+            )
+        return self._eip_pool
+
+    @property
+    def eni_pool(self):
+        """Network interfaces pool, created on first use
+
+        Returns:
+            object: EniPool or None when the pool is disabled (no eni_pool_size)
+        """
+        if self._eni_pool is None and self.eni_pool_size is not None:
+            self._eni_pool = self.__create_eni_pool(self.eni_pool_size)
+        return self._eni_pool
+
+    def __create_eni_pool(self, size):
+        """Create a network interfaces pool
+
+        Args:
+            size (integer): Available network interfaces to keep warm per subnet
+
+        Returns:
+            object: EniPool
+        """
+        from .eni_pool import EniPool
+        return EniPool(
+            ec2=self.ec2,
+            ec2_client=self.ec2_client,
+            tag_base_name=self.tag_base_name,
+            size=size,
+            eip_pool=self.eip_pool,
+            tracer=self.tracer,
+            state_store=self.state_store,
+            log_level=self.log_level,
+            boto_log_level=self.boto_log_level
+        )
+
+    def __refill_eni_pool_in_background(self):
+        """Refill the network interfaces pool, if any, of every fleet subnet in the background
+
+        The pool network interfaces have as many private ips as the fleet full network interfaces.
+        The ipv6 fleets network interfaces are not taken from the pool.
+        """
+        if self.eni_pool is None or not self.config["instances_groups"] or \
+                Proxies.is_ipv6(self.config["instances_groups"]):
+            return
+
+        enis_count, eni_ips_count = self.planner.get_instance_enis_capacity(self.config["instances_groups"][0])
+        subnets_ids = [
+            subnet["SubnetId"] for vpc_config in self.config["vpcs"].values() for subnet in vpc_config["Subnets"]
+        ]
+        self.eni_pool.refill_in_background(subnets_ids, eni_ips_count)
+
+    def get_running_proxies_ips(self, wait=False, silent=True):
+        """Get the public and private ips of the running proxy instances
+
+        Without waiting, this read-only query only builds the ec2 client and makes
+        a describe call for the instances recorded in the state store (or tagged
+        for the fleet), which suits short-lived scripts such as cron jobs.
+
+        Args:
+            wait (bool, optional): Wait for all proxies to be running (see Instances.get_running_proxies_ips)
+            silent (bool, optional): Silent
+
+        Returns:
+            list: Tuples of public and private ips, the ipv6 addresses being both
+        """
+        if wait:
+            return self.instances.get_running_proxies_ips(silent=silent)
+
+        filters = get_fleet_instances_filter(self.state_store, self.tag_base_name)
+        filters["instance-state-name"] = "running"
+        ips = []
+        for instance in iter_resources(self.ec2_client, "describe_instances", filters,
+                                       projection=["NetworkInterfaces"]):
+            for eni in instance.get("NetworkInterfaces", []):
+                ips.extend(get_network_interface_proxies_ips(eni))
+
+        return ips
+
+    def get_metrics_collector(self, port=None, **kwargs):
+        """Get a collector of the running proxy instances traffic counters
+
+        Each instance exporter is scraped on one of its public ips (or ipv6
+        addresses), and the counters are indexed by public ip. The exporter
+        port must be allowed by the security groups for the collector.
+
+        Args:
+            port (integer, optional): Exporters port. Defaults to metrics.EXPORTER_PORT
+            **kwargs: MetricsCollector arguments (timeout, max_workers, max_snapshots...)
+
+        Returns:
+            object: Metrics collector
+        """
+        # Imported on first use to keep the package import fast
+        from .metrics import EXPORTER_PORT, MetricsCollector
+
+        filters = get_fleet_instances_filter(self.state_store, self.tag_base_name)
+        filters["instance-state-name"] = "running"
+        targets = []
+        public_ips = {}
+        for instance in iter_resources(self.ec2_client, "describe_instances", filters,
+                                       projection=["NetworkInterfaces"]):
+            instance_public_ips = []
+            for eni in instance.get("NetworkInterfaces", []):
+                for public_ip, private_ip in get_network_interface_proxies_ips(eni):
+                    public_ips[private_ip] = public_ip
+                    instance_public_ips.append(public_ip)
+            if instance_public_ips:
+                targets.append((instance_public_ips[0], port or EXPORTER_PORT))
+
+        return MetricsCollector(targets, public_ips=public_ips, log_level=self.log_level, **kwargs)
+
+    def get_topology(self):
+        """Get the fleet topology with its lookup indexes
+
+        The topology is built from the vpcs and instances groups config (the ones
+        recorded in the state store by default), then the network interfaces are
+        described once to load their private and public ips.
+
+        Returns:
+            object: Topology
+        """
+        vpcs_config = self.config.get("vpcs") or self.state_store.get_value(self.tag_base_name, "vpcs_config")
+        topology = Topology.from_config(vpcs_config, self.config.get("instances_groups"))
+        topology.load_state(self.state_store, self.tag_base_name)
+
+        if topology.enis_by_id:
+            eni_filters = {
+                "network-interface-id": list(topology.enis_by_id)
+            }
+        else:
+            eni_filters = {
+                "tag:Name": self.tag_base_name + "-*"
+            }
+
+        topology.load_network_interfaces(
+            list(iter_resources(self.ec2_client, "describe_network_interfaces", eni_filters)))
+
+        return topology
 
     def create(self, proxies_config, ask_confirm=True, silent=False):
         """Create proxies and its infrastructure
 
+        The progress is recorded in the state store so that an interrupted
+        create can be continued with resume().
+
         Args:
             proxies_config (dict): Proxies config
 
@@ -106,69 +446,577 @@ class Proxies(object):
         # Delete the proxies infrastructure first
         self.delete(ask_confirm=ask_confirm, silent=silent)
 
-        # Setup proxies instances groups config
-        created_instances_groups_config = self.__setup_instances_groups_config(proxies_config)
+        # Keep the config as given, the instances groups setup enriches it
+        self.state_store.set_value(self.tag_base_name, "create_config", proxies_config)
+        self.state_store.set_value(self.tag_base_name, "create_completed_steps", [])
 
-        self.config["instances_groups"].append(created_instances_groups_config)
+        self.__run_create(proxies_config, ask_confirm=ask_confirm, silent=silent)
 
-        self.check_image_virtualization_against_instance_types(self.config["instances_groups"])
+    def resume(self, silent=False):
+        """Resume an interrupted create
 
-        if ask_confirm:
-            if not confirm_proxies_and_infra_creation(self.config["instances_groups"], proxies_config['available_ips']):
-                sys.exit()
+        The completed steps are skipped and the already created network interfaces,
+        elastic ips and instances are reused.
+
+        Args:
+            silent (bool, optional): Silent
+
+        Raises:
+            ValueError: There is no create to resume
+        """
+        proxies_config = self.state_store.get_value(self.tag_base_name, "create_config")
+        if proxies_config is None:
+            raise ValueError("There is no create to resume for the proxies tagged '{0}'".format(self.tag_base_name))
+
+        self.__run_create(proxies_config, ask_confirm=False, silent=silent)
+
+    def scale(self, available_ips, silent=False):
+        """Scale the proxies to a number of available ips
+
+        More available ips are added with new instances (see scale_out). The
+        proxies are re-created from the last create config with the new number
+        of available ips to have fewer ones, or when the fleet subnets have no
+        room for the new instances.
+
+        Args:
+            available_ips (integer): Available ips
+            silent (bool, optional): Silent
+
+        Raises:
+            ValueError: The proxies have not been created
+        """
+        proxies_config = self.state_store.get_value(self.tag_base_name, "create_config")
+        if proxies_config is None:
+            raise ValueError("There is no create config to scale the proxies tagged '{0}'".format(self.tag_base_name))
+
+        added_ips_count = available_ips - proxies_config["available_ips"]
+        completed_steps = self.state_store.get_value(self.tag_base_name, "create_completed_steps", [])
+        if added_ips_count > 0 and "instances" in completed_steps:
+            instances_groups_config = self.__load_created_config()[2]
+            enis_count, eni_ips_count = self.planner.get_instance_enis_capacity(instances_groups_config[0])
+            instance_ips_count = enis_count * eni_ips_count
+            try:
+                self.scale_out((added_ips_count + instance_ips_count - 1) // instance_ips_count, silent=silent)
+                return
+            except ValueError as e:
+                self.logger.warning("The proxies tagged '%s' can not be scaled out (%s), re-creating them",
+                                    self.tag_base_name, e)
+        elif added_ips_count == 0:
+            return
+
+        proxies_config["available_ips"] = available_ips
+        self.create(proxies_config, ask_confirm=False, silent=silent)
+
+    def __run_create(self, proxies_config, ask_confirm, silent):
+        """Run the create steps which are not completed yet
+
+        Args:
+            proxies_config (dict): Proxies config
+            ask_confirm (bool): Ask confirmation
+            silent (bool): Silent
+        """
+        completed_steps = self.state_store.get_value(self.tag_base_name, "create_completed_steps", [])
+
+        with self.tracer.span("create", available_ips=proxies_config['available_ips'], resumed_steps=completed_steps):
+            # Plan the proxies instances groups and vpcs
+            with self.tracer.span("plan"):
+                plan = self.plan(proxies_config)
+
+            self.config["instances_groups"] = plan["instances_groups"]
+            self.state_store.set_value(self.tag_base_name, "instances_groups_config", self.config["instances_groups"])
+
+            with self.tracer.span("check_image_virtualization_against_instance_types"):
+                self.check_image_virtualization_against_instance_types(self.config["instances_groups"])
+
+            if ask_confirm:
+                if not confirm_proxies_and_infra_creation(self.config["instances_groups"],
+                                                          proxies_config['available_ips']):
+                    sys.exit()
+
+            if not silent:
+                print("\nCreating the vpc and starting the instances. Please wait...")
+
+            # Create VPCS Infrastructure
+            if "vpcs_infrastructure" in completed_steps:
+                self.config["vpcs"] = self.state_store.get_value(self.tag_base_name, "vpcs_config")
+            else:
+                with self.tracer.span("bootstrap_vpcs_infrastructure"):
+                    self.__bootstrap_vpcs_infrastructure(plan["vpcs"])
+                self.state_store.set_value(self.tag_base_name, "vpcs_config", self.config["vpcs"])
+                self.__complete_create_step(completed_steps, "vpcs_infrastructure")
+
+            steps = [
+                # Create network interfaces
+                ("network_interfaces", lambda: self.network_interfaces.create(self.config["vpcs"])),
+                # Associate ips to elastic network interfaces
+                ("public_ips", lambda: self.network_interfaces.associate_public_ips_to_enis()),
+                # Create instances
+                ("instances", lambda: self.instances.create(
+                    self.config['instances_groups'], self.config["vpcs"], self.network_interfaces)),
+            ]
+            # The ipv6 proxies ips are the network interfaces ipv6 addresses, no elastic ip is allocated
+            if Proxies.is_ipv6(self.config["instances_groups"]):
+                steps = [(step, run_step) for step, run_step in steps if step != "public_ips"]
+            for step, run_step in steps:
+                if step not in completed_steps:
+                    run_step()
+                    self.__complete_create_step(completed_steps, step)
+
+        # The elastic ips taken from the pool are replaced out of the critical path
+        if self.eip_pool is not None:
+            self.eip_pool.refill_in_background()
+        self.__refill_eni_pool_in_background()
 
         if not silent:
-            print "\nCreating the vpc and starting the instances. Please wait..."
+            print("\nCreation completed. Instance(s) are booting up.")
+
+    def __load_created_config(self):
+        """Load the config of the created proxies recorded in the state store
+
+        Returns:
+            tuple: Proxies config, vpcs config and instances groups config
+
+        Raises:
+            ValueError: The proxies have not been created
+        """
+        proxies_config = self.state_store.get_value(self.tag_base_name, "create_config")
+        vpcs_config = self.state_store.get_value(self.tag_base_name, "vpcs_config")
+        if proxies_config is None or vpcs_config is None:
+            raise ValueError("There is no created proxies tagged '{0}'".format(self.tag_base_name))
+
+        instances_groups_config = self.state_store.get_value(self.tag_base_name, "instances_groups_config")
+        if instances_groups_config is None:
+            instances_groups_config = self.plan(proxies_config)["instances_groups"]
+        self.config["vpcs"] = vpcs_config
+        self.config["instances_groups"] = instances_groups_config
+
+        return proxies_config, vpcs_config, instances_groups_config
+
+    def reconcile(self):
+        """Replace the failed proxies instances only
 
-        # Create VPCS Infrastructure
-        self.__bootstrap_vpcs_infrastructure(proxies_config['instances_config'])
+        The recorded instances which are gone, stopped or fail their status checks
+        are terminated and launched again with the same network interfaces, so that
+        the replacements keep the private and public ips. The rest of the fleet is
+        left untouched.
 
-        # Create network interfaces
-        self.network_interfaces.create(self.config["vpcs"])
+        Returns:
+            dict: Failure reason of the replaced instances indexed by instance uid
+
+        Raises:
+            ValueError: The proxies have not been created
+        """
+        proxies_config, vpcs_config, instances_groups_config = self.__load_created_config()
 
-        # Associate ips to elastic network interfaces
-        self.network_interfaces.associate_public_ips_to_enis()
+        with self.tracer.span("reconcile"):
+            failed_instances = self.instances.get_failed_instances()
+            if not failed_instances:
+                return failed_instances
 
-        # Create instances
-        self.instances.create(self.config['instances_groups'], self.config["vpcs"])
+            self.logger.warning("Replacing the failed instances %s", failed_instances)
+            self.instances.discard(list(failed_instances))
+            # Only the instances which are not recorded anymore are launched
+            self.instances.create(instances_groups_config, vpcs_config, self.network_interfaces)
+
+        return failed_instances
+
+    def scale_out(self, instances_count, silent=False):
+        """Add instances to the proxies without re-creating them
+
+        The new instances are spread over the fleet subnets and their network
+        interfaces are taken from the network interfaces pool, if any, so that
+        launching them only attaches network interfaces already holding their
+        private and public ips. The pool is refilled in the background afterwards.
+
+        Args:
+            instances_count (integer): Instances to add
+            silent (bool, optional): Silent
+
+        Returns:
+            list: Launched instances config
+
+        Raises:
+            ValueError: The proxies have not been created, or a fleet subnet has not enough
+                free private ips for the new instances
+        """
+        proxies_config, vpcs_config, instances_groups_config = self.__load_created_config()
+
+        instance_group = instances_groups_config[0]
+        ipv6 = Proxies.is_ipv6(instances_groups_config)
+        enis_count, eni_ips_count = self.planner.get_instance_enis_capacity(instance_group)
+        eni_ips = Planner.get_eni_ips(eni_ips_count, ipv6)
+        subnets = [
+            (vpc_config, subnet)
+            for vpc_id, vpc_config in sorted(vpcs_config.items()) for subnet in vpc_config["Subnets"]
+        ]
+
+        with self.tracer.span("scale_out", instances_count=instances_count):
+            first_instance_index = len(instance_group["Instances"])
+            instances_indexes = range(first_instance_index, first_instance_index + instances_count)
+            # Checked before creating anything, the instances network interfaces being created one by one
+            self.__check_subnets_room(
+                instance_group, [subnets[i % len(subnets)][1] for i in instances_indexes], enis_count, eni_ips)
+            for i in instances_indexes:
+                vpc_config, subnet = subnets[i % len(subnets)]
+                instance = {
+                    "NetworkInterfaces": [],
+                    "VpcShard": vpc_config.get("Index", 0),
+                    "VPCCidrBlock": vpc_config["CidrBlock"],
+                    "CidrBlock": subnet["CidrBlock"],
+                    "SubnetCidrSuffix": "/" + subnet["CidrBlock"].split("/")[1],
+                    "GatewayIP": get_cidr_block_gateway_ip(subnet["CidrBlock"]),
+                    "AvailabilityZone": subnet.get("AvailabilityZone")
+                }
+                for j in range(0, enis_count):
+                    uid = "eni-" + str(i) + "-" + str(j)
+                    instance["NetworkInterfaces"].append({
+                        "uid": uid,
+                        "Ips": eni_ips,
+                        "Subnet": {
+                            "CidrBlock": subnet["CidrBlock"],
+                            "AvailabilityZone": subnet.get("AvailabilityZone")
+                        }
+                    })
+                    subnet["NetworkInterfaces"].append({
+                        "uid": uid,
+                        "Ips": eni_ips
+                    })
+                instance_group["Instances"].append(instance)
+
+            instance_group["MinCount"] = instance_group["MaxCount"] = len(instance_group["Instances"])
+            proxies_config["available_ips"] = (
+                proxies_config["available_ips"] + instances_count * enis_count * eni_ips_count)
+
+            self.state_store.set_value(self.tag_base_name, "vpcs_config", vpcs_config)
+            self.state_store.set_value(self.tag_base_name, "instances_groups_config", instances_groups_config)
+            self.state_store.set_value(self.tag_base_name, "create_config", proxies_config)
+
+            # The network interfaces and instances already created are reused
+            self.network_interfaces.create(vpcs_config)
+            if not ipv6:
+                self.network_interfaces.associate_public_ips_to_enis()
+            instances_config = self.instances.create(instances_groups_config, vpcs_config, self.network_interfaces)
+
+        if self.eip_pool is not None:
+            self.eip_pool.refill_in_background()
+        self.__refill_eni_pool_in_background()
 
         if not silent:
-            print "\nCreation completed. Instance(s) are booting up."
+            print("\n{0} instance(s) added. Instance(s) are booting up.".format(len(instances_config)))
+
+        return instances_config
+
+    def __check_subnets_room(self, instance_group, subnets, enis_count, eni_ips):
+        """Check that the fleet subnets have room for the network interfaces of new instances
+
+        The network interfaces available in the pool already hold their private ips.
 
-    def __bootstrap_vpcs_infrastructure(self, instances_config):
+        Args:
+            instance_group (dict): Instances group config
+            subnets (list): Subnet config of each new instance
+            enis_count (integer): Network interfaces count per instance
+            eni_ips (dict): Network interface ips counts
+
+        Raises:
+            ValueError: A subnet has not enough free private ips
+        """
+        eni_private_ips_count = eni_ips["SecondaryPrivateIpAddressCount"] + 1
+        subnets_instances_count = {}
+        for subnet in subnets:
+            subnets_instances_count[subnet["SubnetId"]] = subnets_instances_count.get(subnet["SubnetId"], 0) + 1
+
+        free_ips = self.instances.get_subnets_free_ips(sorted(subnets_instances_count))
+        for subnet_id, subnet_instances_count in sorted(subnets_instances_count.items()):
+            created_enis_count = subnet_instances_count * enis_count
+            if self.eni_pool is not None and not eni_ips.get("Ipv6AddressCount"):
+                created_enis_count = max(
+                    0, created_enis_count - self.eni_pool.available_count(subnet_id, eni_private_ips_count))
+            needed_ips_count = created_enis_count * eni_private_ips_count
+            if instance_group.get("LaunchMode") == "fleet":
+                # The fleet instances primary network interfaces take one private ip each
+                needed_ips_count = needed_ips_count + subnet_instances_count
+
+            if needed_ips_count > free_ips.get(subnet_id, 0):
+                raise ValueError("The subnet '{0}' has {1} free private ips, {2} are needed to add {3} instance(s): "
+                                 "re-create the proxies with the new ips count instead".format(
+                                     subnet_id, free_ips.get(subnet_id, 0), needed_ips_count,
+                                     subnet_instances_count))
+
+    @staticmethod
+    def is_ipv6(instances_groups_config):
+        """Whether the proxies ips are ipv6 addresses
+
+        Args:
+            instances_groups_config (list): Instances groups config
+
+        Returns:
+            bool: An instances group has the Ipv6 property
+        """
+        return any(instances_group.get("Ipv6") for instances_group in instances_groups_config)
+
+    def __complete_create_step(self, completed_steps, step):
+        """Record a create step as completed
+
+        Args:
+            completed_steps (list): Completed steps
+            step (string): Step name
+        """
+        completed_steps.append(step)
+        self.state_store.set_value(self.tag_base_name, "create_completed_steps", completed_steps)
+
+    def __bootstrap_vpcs_infrastructure(self, base_vpcs_config):
         """Bootstrap Vpcs infrastructure
 
+        Each vpc shard infrastructure is bootstrapped concurrently.
+
         Args:
-            instances_config (object): Instances config
+            base_vpcs_config (list): Base vpcs config, one per vpc shard
         """
-        base_vpcs_config = []
+        parent_span = self.tracer.current_span()
 
-        base_vpcs_config.append(AWSProxies.__build_base_vpcs_config(instances_config))
+        def bootstrap_vpc(base_vpc_config):
+            with self.tracer.span("bootstrap_vpc_infrastructure", parent=parent_span,
+                                  cidr_block=base_vpc_config["CidrBlock"]):
+                return self.__bootstrap_vpc_infrastructure(base_vpc_config)
 
-        vpcs_config = self.vpcs.get_or_create(base_vpcs_config)
+        vpcs_config = {}
+        for vpc_config in run_concurrently(bootstrap_vpc, base_vpcs_config):
+            vpcs_config.update(vpc_config)
 
         self.config["vpcs"] = vpcs_config
 
-        internet_gateways = self.internet_gateways.get_or_create(self.config["vpcs"])
-        self.config["vpcs"] = merge_config(self.config["vpcs"], internet_gateways)
+    def __bootstrap_vpc_infrastructure(self, base_vpc_config):
+        """Bootstrap a Vpc infrastructure
+
+        Args:
+            base_vpc_config (dict): Base vpc config
+
+        Returns:
+            dict: Vpc config indexed by vpc ID
+        """
+        vpc_config = self.vpcs.get_or_create([base_vpc_config])
+
+        internet_gateways = self.internet_gateways.get_or_create(vpc_config)
+        vpc_config = merge_config(vpc_config, internet_gateways)
+
+        subnets = self.subnets.get_or_create(vpc_config)
+        vpc_config = merge_config(vpc_config, subnets)
+
+        security_groups = self.security_groups.get_or_create(vpc_config)
+        vpc_config = merge_config(vpc_config, security_groups)
+
+        route_tables = self.route_tables.get_or_create(vpc_config)
+        vpc_config = merge_config(vpc_config, route_tables)
+
+        self.route_tables.reconcile(vpc_config)
+
+        network_acls = self.network_acls.get_or_create(vpc_config)
+        vpc_config = merge_config(vpc_config, network_acls)
+
+        return vpc_config
+
+    def rotate_public_ips(self):
+        """Replace the proxies public ips with new ones
+
+        The elastic ips pool, if any, is refilled in the background afterwards.
+
+        Returns:
+            list: Tuples of previous and new public ips
+        """
+        rotated_ips = self.network_interfaces.rotate_public_ips()
 
-        subnets = self.subnets.get_or_create(self.config["vpcs"])
-        self.config["vpcs"] = merge_config(self.config["vpcs"], subnets)
+        if self.eip_pool is not None:
+            self.eip_pool.refill_in_background()
 
-        security_groups = self.security_groups.get_or_create(self.config["vpcs"])
-        self.config["vpcs"] = merge_config(self.config["vpcs"], security_groups)
+        return rotated_ips
 
-        route_tables = self.route_tables.get_or_create(self.config["vpcs"])
-        self.config["vpcs"] = merge_config(self.config["vpcs"], route_tables)
+    def wait_healthy(self, port=None, timeout=600):
+        """Wait for the proxies to be healthy
+
+        The instances must pass their status checks and, with a port, every
+        public ip must accept TCP connections on that port.
+
+        Args:
+            port (integer, optional): Proxy port to check on every public ip
+            timeout (integer, optional): Seconds to wait
+
+        Raises:
+            ValueError: There is no recorded instance
+            RuntimeError: Public ips still refuse connections after the timeout
+        """
+        instances_ids = self.state_store.get_resource_ids(self.tag_base_name, INSTANCE)
+        if not instances_ids:
+            raise ValueError("There is no instance tagged '{0}' to check".format(self.tag_base_name))
+
+        deadline = time.time() + timeout
+        with self.tracer.span("waiter.instance_status_ok", instance_ids=instances_ids):
+            waiter = self.ec2_client.get_waiter("instance_status_ok")
+            # The instances statuses are described by batches of 100 instances
+            for i in range(0, len(instances_ids), 100):
+                waiter.wait(InstanceIds=instances_ids[i:i + 100], WaiterConfig={
+                    "Delay": 15,
+                    "MaxAttempts": max(1, int((deadline - time.time()) // 15))
+                })
+
+        if port is None:
+            return
+
+        def accepts_connections(public_ip):
+            try:
+                socket.create_connection((public_ip, port), timeout=5).close()
+                return True
+            except (socket.error, socket.timeout):
+                return False
+
+        with self.tracer.span("check_proxies_ports", port=port):
+            pending_ips = sorted(set(public_ip for public_ip, private_ip in self.get_running_proxies_ips()))
+            while True:
+                healthy = run_concurrently(accepts_connections, pending_ips, max_workers=50)
+                pending_ips = [public_ip for public_ip, is_healthy in zip(pending_ips, healthy) if not is_healthy]
+                if not pending_ips:
+                    return
+                if time.time() > deadline:
+                    raise RuntimeError("The proxies {0} do not accept connections on port {1}".format(
+                        ", ".join(pending_ips), port))
+                time.sleep(5)
+
+    def publish_endpoints(self, path):
+        """Publish the running proxies public and private ips to a JSON file
+
+        The file is replaced atomically, so that its readers never see a partial list.
+
+        Args:
+            path (string): JSON file path
+
+        Returns:
+            list: Tuples of public and private ips
+        """
+        ips = self.get_running_proxies_ips()
+        write_json_atomically(path, {
+            "TagBaseName": self.tag_base_name,
+            "PublishedAt": time.time(),
+            "Proxies": ips
+        })
+        self.logger.info("%s proxies endpoints have been published to '%s'", len(ips), path)
+
+        return ips
+
+    def rollover(self, proxies_config=None, endpoints_path=None, health_check_port=None, health_check_timeout=600,
+                 silent=False):
+        """Replace the proxies with a new generation without an availability gap
+
+        A new fleet is created under a generation tag ('<tag base name>.g<n>'),
+        next to the current one. Once its proxies are healthy, the endpoints
+        file, if any, is switched to them and the new generation becomes the
+        active one (for this and the next Proxies objects). The previous
+        generation is then deleted in the background. A new generation which
+        does not get healthy is deleted and the current one is kept.
+
+        Args:
+            proxies_config (dict, optional): Proxies config. Defaults to the current generation one
+            endpoints_path (string, optional): JSON file to publish the new proxies endpoints to
+            health_check_port (integer, optional): Proxy port to check on every public ip
+            health_check_timeout (integer, optional): Seconds to wait for the new generation to be healthy
+            silent (bool, optional): Silent
+
+        Returns:
+            object: Previous generation teardown thread
+
+        Raises:
+            ValueError: There is no proxies config
+        """
+        if proxies_config is None:
+            proxies_config = self.state_store.get_value(self.tag_base_name, "create_config")
+            if proxies_config is None:
+                raise ValueError("There is no create config to roll the proxies tagged '{0}' over".format(
+                    self.tag_base_name))
+
+        generations_fleet = self.root_tag_base_name + GENERATIONS_FLEET_SUFFIX
+        generation = self.state_store.get_value(generations_fleet, "generation", 0) + 1
+        generation_tag_base_name = self.root_tag_base_name + ".g" + str(generation)
+        # Reserve the generation so that a failed rollover does not reuse its tag
+        self.state_store.set_value(generations_fleet, "generation", generation)
+
+        with self.tracer.span("rollover", generation=generation, tag_base_name=generation_tag_base_name):
+            next_proxies = self.__get_generation(generation_tag_base_name)
+            next_proxies.create(proxies_config, ask_confirm=False, silent=silent)
+
+            try:
+                with self.tracer.span("wait_healthy"):
+                    next_proxies.wait_healthy(health_check_port, health_check_timeout)
+            except Exception:
+                self.logger.exception("The proxies generation '%s' is not healthy, deleting it",
+                                      generation_tag_base_name)
+                next_proxies.delete(ask_confirm=False, silent=True, delete_launch_templates=True)
+                raise
+
+            if endpoints_path is not None:
+                next_proxies.publish_endpoints(endpoints_path)
+
+            self.state_store.set_value(generations_fleet, "active", generation_tag_base_name)
+
+        previous_proxies = self.__get_generation(self.tag_base_name)
+
+        # This object now manages the new generation
+        self.tag_base_name = generation_tag_base_name
+        self._managers = {}
+        self._eni_pool = next_proxies._eni_pool
+        self.config = next_proxies.config
+
+        def teardown():
+            try:
+                previous_proxies.delete(ask_confirm=False, silent=True, delete_launch_templates=True)
+            except Exception:
+                self.logger.exception("The proxies generation '%s' deletion failed", previous_proxies.tag_base_name)
+
+        self._teardown_thread = threading.Thread(target=teardown, name="aws-proxies-rollover-teardown")
+        self._teardown_thread.start()
+
+        if not silent:
+            print("\nRolled over to '{0}'. The previous proxies are being deleted.".format(generation_tag_base_name))
 
-        self.route_tables.associate_subnets_to_routes(self.config["vpcs"])
-        self.route_tables.create_ig_route(self.config["vpcs"])
+        return self._teardown_thread
 
-        network_acls = self.network_acls.get_or_create(self.config["vpcs"])
-        self.config["vpcs"] = merge_config(self.config["vpcs"], network_acls)
+    def __get_generation(self, generation_tag_base_name):
+        """Get a Proxies object managing a fleet generation, sharing this object AWS session, state and pools
 
-    def delete(self, ask_confirm=True, silent=False):
+        Args:
+            generation_tag_base_name (string): Generation tag base name
+
+        Returns:
+            object: Proxies
+        """
+        generation_proxies = Proxies(
+            profile=self.profile,
+            session=self.session,
+            log_level=self.log_level,
+            boto_log_level=self.boto_log_level,
+            eni_mappings=self.eni_mapping,
+            cidr_suffix_ips_number_mapping=self.cidr_suffix_ips_number_mapping,
+            tag_base_name=self.root_tag_base_name,
+            generation_tag_base_name=generation_tag_base_name,
+            hvm_only_instance_types=self.hvm_only_instance_types,
+            image_owners=self.image_owners,
+            image_cache=self.image_cache,
+            tracer=self.tracer,
+            state_store=self.state_store,
+            eip_pool_size=self.eip_pool_size,
+            eip_pool_name=self.eip_pool_name,
+            eip_pool_max_size=self.eip_pool_max_size,
+            eni_pool_size=self.eni_pool_size
+        )
+        generation_proxies._eip_pool = self.eip_pool
+        return generation_proxies
+
+    def delete(self, ask_confirm=True, silent=False, delete_launch_templates=False, delete_eip_pool=False):
         """Delete proxies and its infrastructure
+
+        The launch templates are kept to be reused by the next create unless
+        delete_launch_templates is set. Likewise, the elastic ips are given back to
+        the elastic ips pool, if any, unless delete_eip_pool is set. The network
+        interfaces pool is always deleted, its network interfaces being bound to
+        the fleet subnets. The fleet resources missing from the state store are
+        first listed in one Resource Groups Tagging API sweep (see Inventory).
         """
 
         if ask_confirm:
@@ -176,132 +1024,147 @@ class Proxies(object):
                 sys.exit()
 
         if not silent:
-            print "\nDeleting the vpc and terminating the instances. Please wait..."
-
-        self.network_interfaces.release_public_ips()
-        self.instances.terminate()
-        self.network_interfaces.delete()
-        self.security_groups.delete()
-        self.subnets.delete()
-        self.route_tables.delete()
-        self.network_acls.delete()
-        self.internet_gateways.delete()
-        self.vpcs.delete()
+            print("\nDeleting the vpc and terminating the instances. Please wait...")
+
+        with self.tracer.span("delete", tag_base_name=self.tag_base_name):
+            # One Tagging API sweep records the fleet resources missing from the recorded ones
+            self.inventory.discover()
+            self.network_interfaces.release_public_ips()
+            self.instances.terminate()
+            self.instances.delete_placement_groups()
+            if delete_launch_templates:
+                self.launch_templates.delete()
+            # Pool network interfaces recorded by a previous run with a pool block the subnets deletion too
+            eni_pool = self.eni_pool or self.__create_eni_pool(0)
+            if self.eni_pool_size is not None or self.state_store.get_resources(eni_pool.pool_name):
+                eni_pool.delete()
+            if delete_eip_pool and self.eip_pool is not None:
+                self.eip_pool.delete()
+            self.network_interfaces.delete()
+            self.security_groups.delete()
+            self.subnets.delete()
+            self.route_tables.delete()
+            self.network_acls.delete()
+            self.internet_gateways.delete()
+            self.vpcs.delete()
+
+            self.state_store.clear(self.tag_base_name)
 
-    def get_image_id_from_name(self, image_name):
-        """Get AMI image ID from AMI name
+        self.config = {
+            "vpcs": {},
+            "instances_groups": []
+        }
+
+    def get_recorded_resources(self, resource_type=None):
+        """Get the fleet resources recorded in the state store
 
         Args:
-            image_name (string): AMI image name
+            resource_type (string, optional): Only return resources of this type (see the state module)
 
         Returns:
-            string: AMI image ID
+            list: Recorded resources
         """
-        filters = [
-            {
-                "Name": "name",
-                "Values": [
-                    image_name,
+        return self.state_store.get_resources(self.tag_base_name, resource_type)
+
+    def export_trace(self, path):
+        """Export the create and delete phases timeline as a Chrome trace-event JSON file
+
+        Open the file in chrome://tracing or https://ui.perfetto.dev
+
+        Args:
+            path (string): File path
+        """
+        self.tracer.export_chrome_trace(path)
+
+    def get_image(self, image_name=None, image_id=None):
+        """Get the ID and virtualization type of an AMI, from its name or ID
+
+        The names are only looked up among the image_owners images. The images
+        are resolved once per profile and region: they are kept in the image
+        cache, by name and by ID, for the next calls and processes.
+
+        Args:
+            image_name (string, optional): AMI image name
+            image_id (string, optional): AMI image ID, when no name is given
+
+        Returns:
+            dict: Image with 'ImageId' and 'VirtualizationType' keys, None when no single image is found
+        """
+        owners = sorted(self.image_owners or [])
+        cache_prefix = "{0}/{1}/".format(self.profile or "", self.session.region_name)
+        if image_name is not None:
+            cache_key = cache_prefix + "name/{0}/{1}".format(",".join(owners), image_name)
+        else:
+            cache_key = cache_prefix + "id/" + image_id
+
+        image = self.image_cache.get(cache_key)
+        if image is not None:
+            return image
+
+        if image_name is not None:
+            describe_kwargs = {
+                "Filters": [
+                    {
+                        "Name": "name",
+                        "Values": [
+                            image_name,
+                        ]
+                    }
                 ]
             }
-        ]
+            if owners:
+                describe_kwargs["Owners"] = owners
+        else:
+            describe_kwargs = {
+                "ImageIds": [image_id]
+            }
 
-        found_images = list(self.ec2.images.filter(Filters=filters))
+        aws_images = self.ec2_client.describe_images(**describe_kwargs)["Images"]
+        if len(aws_images) != 1:
+            return None
 
-        image_id = None
-        if found_images and len(found_images) == 1:
-            image_id = found_images[0].id
+        image = {
+            "ImageId": aws_images[0]["ImageId"],
+            "VirtualizationType": aws_images[0]["VirtualizationType"]
+        }
+        self.image_cache.update({
+            cache_key: image,
+            cache_prefix + "id/" + image["ImageId"]: image
+        })
 
-        return image_id
+        return image
 
-    def __setup_instances_groups_config(self, proxies_config):
-        """Setup instance groups config
+    def get_image_id_from_name(self, image_name):
+        """Get AMI image ID from AMI name
 
         Args:
-            proxies_config (dict): Proxies config
+            image_name (string): AMI image name
 
         Returns:
-            dict: Created instances config
+            string: AMI image ID
         """
-        created_instance_type_config = []
+        image = self.get_image(image_name=image_name)
 
-        for instance_config in proxies_config['instances_config']:
-            if "ImageName" in instance_config:
-                image_id = self.get_image_id_from_name(
-                    instance_config["ImageName"])
-                instance_config["ImageId"] = image_id
-            elif "ImageId" in instance_config:
-                image_id = instance_config["ImageId"]
-
-            instance_enis_count = 1
-            instance_eni_private_ips_count = 1
-            instance_eni_public_ips_count = 1
-            instance_eni_mapping = get_instance_eni_mapping(
-                instance_type=instance_config["InstanceType"],
-                eni_mapping=self.eni_mapping)
-            if instance_eni_mapping:
-                instance_enis_count = instance_eni_mapping[0][1]
-                instance_eni_private_ips_count = instance_eni_mapping[0][2]
-                instance_eni_public_ips_count = instance_eni_mapping[0][2]
-
-            instance_possible_ips_count = instance_eni_private_ips_count * \
-                instance_enis_count
-
-            instance_per_type_count = int(
-                math.ceil(proxies_config['available_ips'] / instance_possible_ips_count))
-
-            instance_config["MinCount"] = instance_per_type_count
-            instance_config["MaxCount"] = instance_per_type_count
-
-            subnet_cidr_suffix = get_subnet_cidr_suffix(
-                ips_count=proxies_config['available_ips'],
-                cidr_suffix_ips_number_mapping=self.cidr_suffix_ips_number_mapping)
-            subnet_cidr_block = get_subnet_cidr_block(
-                instance_config["CidrBlockFormatting"], 0, subnet_cidr_suffix)
-
-            instance_config["Instances"] = []
-            possible_ips_remaining = proxies_config['available_ips']
-            for i in range(0, instance_per_type_count):
-                instance_config["Instances"].append({
-                    "NetworkInterfaces": [],
-                    "CidrBlock": subnet_cidr_block,
-                    "SubnetCidrSuffix": subnet_cidr_suffix,
-                    'GatewayIP': get_vpc_gateway_ip(instance_config["CidrBlockFormatting"])
-                })
-                for j in range(0, instance_enis_count):
-                    if possible_ips_remaining / instance_eni_private_ips_count > 1:
-                        private_ips_count = instance_eni_private_ips_count
-                    else:
-                        private_ips_count = possible_ips_remaining
-
-                    if possible_ips_remaining / instance_eni_public_ips_count > 1:
-                        public_ips_count = instance_eni_public_ips_count
-                    else:
-                        public_ips_count = possible_ips_remaining
-
-                    instance_config["Instances"][i]["NetworkInterfaces"].append({
-                        "uid": "eni-" + str(i) + "-" + str(j),
-                        "Ips": {},
-                        "Subnet": {
-                            "CidrBlock": subnet_cidr_block
-                        }
+        return image["ImageId"] if image is not None else None
 
-                    })
+    def plan(self, proxies_config):
+        """Plan the fleet without creating anything
 
-                    instance_config["Instances"][i]["NetworkInterfaces"][j]["Ips"] = {
-                        # Not counting the primary private ip address
-                        "SecondaryPrivateIpAddressCount": private_ips_count - 1,
-                        # Not counting the primary public ip address
-                        "SecondaryPublicIpAddressCount": public_ips_count - 1,
-                    }
+        The images names are resolved to images ids first, then the plan is
+        made by the planner (see Planner.plan).
 
-                    possible_ips_remaining = possible_ips_remaining - \
-                        instance_eni_private_ips_count
-                    if possible_ips_remaining <= 0:
-                        break
-            created_instance_type_config = instance_config
+        Args:
+            proxies_config (dict): Proxies config
 
-            return created_instance_type_config
+        Returns:
+            dict: Instances groups config ('instances_groups') and base vpcs config,
+                one per vpc shard ('vpcs')
+        """
+        for instance_config in proxies_config['instances_config']:
+            if "ImageName" in instance_config:
+                instance_config["ImageId"] = self.get_image_id_from_name(instance_config["ImageName"])
+
+        return self.planner.plan(proxies_config)
 
     def check_image_virtualization_against_instance_types(self, instances_groups_config):
         """Check that an image is supported by instance type
@@ -312,8 +1175,10 @@ class Proxies(object):
         """
         for instance_type_config in instances_groups_config:
             try:
-                virtualization_type = self.ec2.Image(
-                    instance_type_config["ImageId"]).virtualization_type
+                image = self.get_image(image_id=instance_type_config["ImageId"])
+                if image is None:
+                    raise Exception("The image {0} does not exist".format(instance_type_config["ImageId"]))
+                virtualization_type = image["VirtualizationType"]
                 prefix_instance_type = instance_type_config["InstanceType"][:2]
 
                 if ((virtualization_type == "hvm" and prefix_instance_type not in self.hvm_only_instance_types) or
@@ -326,58 +1191,22 @@ class Proxies(object):
                             instance_type_config["InstanceType"])
                     )
             except Exception as e:
-                raise ValueError("Error message {0}".format(e.message))
+                raise ValueError("Error message {0}".format(e))
                 break
 
-    @staticmethod
-    def __build_base_vpcs_config(instances_config):
-        """Build the base vpcs config
-
-        Args:
-            instances_config (dict): Instances config
+    def get_availability_zones(self):
+        """Get the names of the available availability zones of the region
 
         Returns:
-            dict: Base vpcs config
+            list: Availability zones names
         """
-        base_vpcs_config = {}
-        for instance_type in instances_config:
-
-            if "VPCCidrBlock" not in instance_type:
-                raise ValueError("The instance type config need to have a VPCCidrBlock property")
-
-            if "SecurityGroups" not in instance_type:
-                raise ValueError("The instance type config need to have a VPCCidrBlock property")
-
-            base_vpcs_config = {
-                "CidrBlock": instance_type["VPCCidrBlock"],
-                "CreateInternetGateway": True,
-                "Subnets": [],
-                "SecurityGroups": instance_type["SecurityGroups"]
-            }
-
-            enis_per_subnet = {}
-            for instance in instance_type["Instances"]:
-                for network_interface in instance["NetworkInterfaces"]:
-                    cidr_block = network_interface["Subnet"]["CidrBlock"]
-
-                    subnet_already_exists = False
-                    for subnet in base_vpcs_config["Subnets"]:
-                        subnet_already_exists = False
-                        if subnet["CidrBlock"] == cidr_block:
-                            subnet_already_exists = True
-
-                    if cidr_block not in enis_per_subnet:
-                        enis_per_subnet[cidr_block] = []
-
-                    enis_per_subnet[cidr_block].append({
-                        "uid": network_interface["uid"],
-                        "Ips": network_interface["Ips"]
-                    })
-
-                    if not subnet_already_exists:
-                        base_vpcs_config["Subnets"].append({
-                            "CidrBlock": network_interface["Subnet"]["CidrBlock"],
-                            "NetworkInterfaces": enis_per_subnet[cidr_block]
-                        })
-
-        return base_vpcs_config
+        aws_availability_zones = self.ec2_client.describe_availability_zones(
+            Filters=[
+                {
+                    "Name": "state",
+                    "Values": ["available"]
+                }
+            ]
+        )["AvailabilityZones"]
+
+        return sorted(aws_availability_zone["ZoneName"] for aws_availability_zone in aws_availability_zones)
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from base_resources import BaseResources
+from .base_resources import BaseResources
 import logging
-from utils import setup_logger, filter_resources, tag_with_name_with_suffix
+from .state import ROUTE_TABLE
+from .tracing import traced
+from .utils import setup_logger, iter_resources
 
 
 class RouteTables(BaseResources):
@@ -21,7 +23,8 @@ class RouteTables(BaseResources):
         Raises:
             TypeError: Description
         """
-        BaseResources.__init__(self, ec2, ec2_client, tag_base_name)
+        BaseResources.__init__(self, ec2, ec2_client, tag_base_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
         log_level = kwargs.pop("log_level", logging.WARNING)
         boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
 
@@ -29,6 +32,7 @@ class RouteTables(BaseResources):
             raise TypeError("Unexpected **kwargs: %r" % kwargs)
         self.logger = setup_logger(__name__, log_level, boto_log_level)
 
+    @traced("route_tables.get_or_create")
     def get_or_create(self, config):
         """Get or create route tables
 
@@ -39,121 +43,226 @@ class RouteTables(BaseResources):
             dict: Security groups configs
         """
 
-        created_route_tables = []
-        index = 0
-        for vpc_id, vpc_config in config.iteritems():
-            route_tables = filter_resources(
-                self.ec2.route_tables, "vpc-id", vpc_id)
+        created_route_tables = {}
+        # The route tables of all the vpcs are described at once, the first one of each vpc is used
+        aws_route_tables = {}
+        for aws_route_table in iter_resources(self.ec2_client, "describe_route_tables", {
+            "vpc-id": list(config.keys())
+        }, projection=["RouteTableId", "VpcId"]):
+            aws_route_tables.setdefault(aws_route_table["VpcId"], aws_route_table)
 
-            if not route_tables:
-                route_table = self.ec2.create_route_table(VpcId=vpc_id)
+        index = 0
+        for vpc_id, vpc_config in config.items():
+            if vpc_id not in aws_route_tables:
+                route_table_id = self.ec2_client.create_route_table(VpcId=vpc_id)["RouteTable"]["RouteTableId"]
             else:
-                route_table = self.ec2.RouteTable(route_tables[0].id)
+                route_table_id = aws_route_tables[vpc_id]["RouteTableId"]
 
                 self.logger.info(
                     "A route table " +
                     "with ID '%s' and attached to vpc '%s' has been created or already exists",
-                    route_table.id,
+                    route_table_id,
                     vpc_id
                 )
 
-            tag_with_name_with_suffix(
-                route_table, "rt", index, self.tag_base_name)
+            self.tracer.current_span().add_attribute_value("route_table_ids", route_table_id)
+            self.record_resource(ROUTE_TABLE, route_table_id, parent_id=vpc_id)
 
-            created_route_tables.append(
-                {
-                    "RouteTableId": route_table.id
-                }
-            )
+            self.tag(route_table_id, "rt", vpc_config.get("Index", index))
 
-            index = index + 1
-        return {
-            vpc_config["VpcId"]: {
-                "RouteTables": created_route_tables
+            created_route_tables[vpc_id] = {
+                "RouteTables": [
+                    {
+                        "RouteTableId": route_table_id
+                    }
+                ]
             }
-        }
 
+            index = index + 1
+        return created_route_tables
+
+    @traced("route_tables.delete")
     def delete(self):
         """Delete route tables
         """
-        route_tables = filter_resources(
-            self.ec2.route_tables,
-            "tag:Name",
-            self.tag_base_name + '-*'
-        )
-
-        for route_table in route_tables:
+        for aws_route_table in self.iter_fleet_resources(
+                "describe_route_tables", ROUTE_TABLE, "route-table-id",
+                projection=["RouteTableId", "Associations", "Routes"]):
+            route_table_id = aws_route_table["RouteTableId"]
             is_main_route_table = True
-            if hasattr(route_table, 'associations'):
-                for association in route_table.associations.all():
-                    if not association.main:
-                        is_main_route_table = False
-                        self.ec2_client.disassociate_route_table(
-                            AssociationId=association.id
-                        )
-
-                        self.logger.info(
-                            "The route table association with ID '%s' has been deleted",
-                            association.id,
-                        )
-
-            for route in route_table.routes:
-                if 'local' != route['GatewayId']:
-                    self.ec2_client.delete_route(
-                        RouteTableId=route_table.id,
-                        DestinationCidrBlock=route['DestinationCidrBlock']
+            for association in aws_route_table.get("Associations", []):
+                if not association.get("Main"):
+                    is_main_route_table = False
+                    self.ec2_client.disassociate_route_table(
+                        AssociationId=association["RouteTableAssociationId"]
                     )
 
                     self.logger.info(
-                        "The route for gateway ID '%s' with cird block '%s' and " +
-                        "associated to route table '%s' has been deleted",
-                        route['GatewayId'],
-                        route['DestinationCidrBlock'],
-                        route_table.id
+                        "The route table association with ID '%s' has been deleted",
+                        association["RouteTableAssociationId"],
                     )
 
+            for route in aws_route_table.get("Routes", []):
+                if 'local' == route.get('GatewayId'):
+                    continue
+
+                for destination_key in ('DestinationCidrBlock', 'DestinationIpv6CidrBlock'):
+                    if destination_key in route:
+                        self.ec2_client.delete_route(**{
+                            "RouteTableId": route_table_id,
+                            destination_key: route[destination_key]
+                        })
+
+                        self.logger.info(
+                            "The route for gateway ID '%s' with cird block '%s' and " +
+                            "associated to route table '%s' has been deleted",
+                            route.get('GatewayId'),
+                            route[destination_key],
+                            route_table_id
+                        )
+
             if not is_main_route_table:
-                route_table.delete()
+                self.ec2_client.delete_route_table(RouteTableId=route_table_id)
+                self.tracer.current_span().add_attribute_value("route_table_ids", route_table_id)
+                self.forget_resource(ROUTE_TABLE, route_table_id)
                 self.logger.info(
                     "The route table with ID '%s' has been deleted",
-                    route_table.id
+                    route_table_id
                 )
 
+    def describe_vpc_route_tables(self, vpc_id):
+        """Describe all the route tables of a vpc in a single call
+
+        Args:
+            vpc_id (string): Vpc ID
+
+        Returns:
+            list: Route tables descriptions
+        """
+        return self.ec2_client.describe_route_tables(
+            Filters=[
+                {
+                    "Name": "vpc-id",
+                    "Values": [vpc_id]
+                }
+            ]
+        )["RouteTables"]
+
+    @traced("route_tables.reconcile")
+    def reconcile(self, config):
+        """Associate the subnets and create the internet gateway routes which are missing
+
+        The route tables of each vpc are described once and only the missing
+        associations and default routes are applied.
+
+        Args:
+            config (dict): Vpcs config
+        """
+        for vpc_id, vpc_config in config.items():
+            aws_route_tables = self.describe_vpc_route_tables(vpc_id)
+            self.__associate_missing_subnets(vpc_config, aws_route_tables)
+            self.__create_missing_ig_routes(vpc_config, aws_route_tables)
+
+    @traced("route_tables.associate_subnets_to_routes")
     def associate_subnets_to_routes(self, config):
         """Associate subnets to routes
 
         Args:
             config (dict): Vpcs config
         """
-        for vpc_id, vpc_config in config.iteritems():
-            for route in vpc_config["RouteTables"]:
-                route_resource = self.ec2.RouteTable(route["RouteTableId"])
-
-                for subnet in vpc_config["Subnets"]:
-                    found_associations = filter_resources(
-                        self.ec2.route_tables, "association.subnet-id", subnet["SubnetId"])
-                    if not found_associations:
-                        route_resource.associate_with_subnet(
-                            SubnetId=subnet["SubnetId"])
+        for vpc_id, vpc_config in config.items():
+            self.__associate_missing_subnets(vpc_config, self.describe_vpc_route_tables(vpc_id))
 
+    @traced("route_tables.create_ig_route")
     def create_ig_route(self, config):
         """Create internet gateway route
 
         Args:
             config (dict): Vpcs config
         """
-        for vpc_id, vpc_config in config.iteritems():
-            for route in vpc_config["RouteTables"]:
-                resource = self.ec2.RouteTable(route["RouteTableId"])
-                for route in resource.routes:
-                    route_exists = False
-                    for ig in vpc_config["InternetGateways"]:
-                        route_exists = False
-                        if ig["InternetGatewayId"] == route["GatewayId"]:
-                            route_exists = True
-                            break
-                        if not route_exists:
-                            resource.create_route(
-                                DestinationCidrBlock="0.0.0.0/0",
-                                GatewayId=ig["InternetGatewayId"],
-                            )
+        for vpc_id, vpc_config in config.items():
+            self.__create_missing_ig_routes(vpc_config, self.describe_vpc_route_tables(vpc_id))
+
+    def __associate_missing_subnets(self, vpc_config, aws_route_tables):
+        """Associate the subnets which are not explicitly associated to a route table yet
+
+        Args:
+            vpc_config (dict): Vpc config
+            aws_route_tables (list): Vpc route tables descriptions
+        """
+        if not vpc_config.get("RouteTables"):
+            return
+
+        associated_subnets_ids = set(
+            association["SubnetId"]
+            for aws_route_table in aws_route_tables
+            for association in aws_route_table.get("Associations", [])
+            if association.get("SubnetId")
+        )
+
+        # A subnet can only be associated to one route table
+        route_table_id = vpc_config["RouteTables"][0]["RouteTableId"]
+        for subnet in vpc_config.get("Subnets", []):
+            if subnet["SubnetId"] not in associated_subnets_ids:
+                self.ec2_client.associate_route_table(
+                    RouteTableId=route_table_id,
+                    SubnetId=subnet["SubnetId"]
+                )
+                associated_subnets_ids.add(subnet["SubnetId"])
+
+                self.logger.info(
+                    "The subnet '%s' has been associated to route table '%s'",
+                    subnet["SubnetId"],
+                    route_table_id
+                )
+
+    def __create_missing_ig_routes(self, vpc_config, aws_route_tables):
+        """Create or fix the default internet gateway routes of the vpc route tables
+
+        The vpcs with an ipv6 cidr block also get a ::/0 route: the proxies accept the
+        clients connections on their ipv6 addresses, which an egress only internet
+        gateway would not let through.
+
+        Args:
+            vpc_config (dict): Vpc config
+            aws_route_tables (list): Vpc route tables descriptions
+        """
+        if not vpc_config.get("InternetGateways"):
+            return
+
+        internet_gateway_id = vpc_config["InternetGateways"][0]["InternetGatewayId"]
+        aws_route_tables_by_id = dict(
+            (aws_route_table["RouteTableId"], aws_route_table) for aws_route_table in aws_route_tables
+        )
+
+        destinations = [("DestinationCidrBlock", "0.0.0.0/0")]
+        if vpc_config.get("Ipv6CidrBlock"):
+            destinations.append(("DestinationIpv6CidrBlock", "::/0"))
+
+        for route_table in vpc_config.get("RouteTables", []):
+            aws_route_table = aws_route_tables_by_id.get(route_table["RouteTableId"], {})
+            for destination_key, destination in destinations:
+                default_routes = [
+                    route for route in aws_route_table.get("Routes", [])
+                    if route.get(destination_key) == destination
+                ]
+                route_params = {
+                    "RouteTableId": route_table["RouteTableId"],
+                    destination_key: destination,
+                    "GatewayId": internet_gateway_id
+                }
+
+                if not default_routes:
+                    self.ec2_client.create_route(**route_params)
+                elif default_routes[0].get("GatewayId") != internet_gateway_id:
+                    # e.g. a blackhole route left by a deleted internet gateway
+                    self.ec2_client.replace_route(**route_params)
+                else:
+                    continue
+
+                self.logger.info(
+                    "The default route '%s' of route table '%s' now goes through internet gateway '%s'",
+                    destination,
+                    route_table["RouteTableId"],
+                    internet_gateway_id
+                )
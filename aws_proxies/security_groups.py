@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
 
-from base_resources import BaseResources
+from .base_resources import BaseResources
+import functools
 import logging
-from utils import setup_logger, filter_resources, tag_with_name_with_suffix
+from .state import SECURITY_GROUP
+from .tracing import traced
+from .utils import setup_logger, iter_resources
+
+# Ip permission source list key and source identifier field
+IP_PERMISSION_SOURCES = [
+    ("IpRanges", "CidrIp"),
+    ("Ipv6Ranges", "CidrIpv6"),
+    ("PrefixListIds", "PrefixListId"),
+    ("UserIdGroupPairs", "GroupId"),
+]
 
 
 class SecurityGroups(BaseResources):
@@ -21,7 +32,8 @@ class SecurityGroups(BaseResources):
         Raises:
             TypeError: Description
         """
-        BaseResources.__init__(self, ec2, ec2_client, tag_base_name)
+        BaseResources.__init__(self, ec2, ec2_client, tag_base_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
         log_level = kwargs.pop("log_level", logging.WARNING)
         boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
 
@@ -29,6 +41,7 @@ class SecurityGroups(BaseResources):
             raise TypeError("Unexpected **kwargs: %r" % kwargs)
         self.logger = setup_logger(__name__, log_level, boto_log_level)
 
+    @traced("security_groups.get_or_create")
     def get_or_create(self, config):
         """Get or create Aws Ec2 security groups
 
@@ -39,113 +52,216 @@ class SecurityGroups(BaseResources):
             dict: Security groups configs
         """
 
-        created_security_groups = []
-        for vpc_id, vpc_config in config.iteritems():
+        created_security_groups = {}
+        # The security groups of all the vpcs are described at once
+        aws_security_groups = dict(
+            ((aws_security_group["VpcId"], aws_security_group["GroupName"]), aws_security_group)
+            for aws_security_group in iter_resources(self.ec2_client, "describe_security_groups", {
+                "vpc-id": [vpc_config["VpcId"] for vpc_config in config.values() if "SecurityGroups" in vpc_config]
+            }, projection=["GroupId", "GroupName", "VpcId", "IpPermissions", "IpPermissionsEgress"])
+        )
+
+        for vpc_id, vpc_config in config.items():
+            created_security_groups[vpc_config["VpcId"]] = {
+                "SecurityGroups": []
+            }
             if "SecurityGroups" in vpc_config:
                 for index, sg in enumerate(vpc_config["SecurityGroups"]):
-                    security_groups = filter_resources(
-                        self.ec2.security_groups, "vpc-id", vpc_config["VpcId"])
-
-                    if not security_groups:
-                        resource = self.ec2.create_security_group(
+                    aws_security_group = aws_security_groups.get((vpc_config["VpcId"], sg["GroupName"]))
+                    if aws_security_group is None:
+                        group_id = self.ec2_client.create_security_group(
                             VpcId=vpc_config["VpcId"],
                             GroupName=sg["GroupName"],
-                            Description=sg["Description"])
-
-                    else:
-                        resource = self.ec2.SecurityGroup(
-                            security_groups[0].id)
+                            Description=sg["Description"])["GroupId"]
+                        # New security groups allow all the outbound traffic only
+                        aws_security_group = {
+                            "GroupId": group_id,
+                            "IpPermissions": [],
+                            "IpPermissionsEgress": [
+                                {
+                                    "IpProtocol": "-1",
+                                    "IpRanges": [
+                                        {
+                                            "CidrIp": "0.0.0.0/0"
+                                        }
+                                    ]
+                                }
+                            ]
+                        }
 
+                    group_id = aws_security_group["GroupId"]
                     if "IngressRules" in sg:
-                        self.authorize_sg_ingress_rules(resource, sg)
+                        self.authorize_sg_ingress_rules(aws_security_group, sg)
 
                     if "EgressRules" in sg:
-                        self.authorize_sg_egress_rules(resource, sg)
+                        self.authorize_sg_egress_rules(aws_security_group, sg)
 
                     self.logger.info(
                         "A security group with group name '%s', " +
                         "with ID '%s' and attached to vpc '%s' has been created or already exists",
                         sg["GroupName"],
-                        resource.id,
+                        group_id,
                         vpc_config["VpcId"]
                     )
 
-                    tag_with_name_with_suffix(
-                        resource, "sg", index, self.tag_base_name)
+                    self.tracer.current_span().add_attribute_value("security_group_ids", group_id)
+                    self.record_resource(SECURITY_GROUP, group_id, parent_id=vpc_config["VpcId"],
+                                         attributes={"GroupName": sg["GroupName"]})
 
-                    created_security_groups.append(
+                    self.tag(group_id, "sg", index)
+
+                    created_security_groups[vpc_config["VpcId"]]["SecurityGroups"].append(
                         {
-                            "SecurityGroupId": resource.id,
+                            "SecurityGroupId": group_id,
                             "GroupName": sg["GroupName"],
                             "Description": sg["Description"],
                         }
                     )
 
-        return {
-            vpc_config["VpcId"]: {
-                "SecurityGroups": created_security_groups
-            }
-        }
-
         return created_security_groups
 
+    @traced("security_groups.delete")
     def delete(self):
         """Delete security groups
         """
-        security_groups = filter_resources(
-            self.ec2.security_groups,
-            "tag:Name",
-            self.tag_base_name + '-*'
-        )
-
-        for security_group in security_groups:
-            if "default" != security_group.group_name:
-                security_group.delete()
+        for aws_security_group in self.iter_fleet_resources(
+                "describe_security_groups", SECURITY_GROUP, "group-id", projection=["GroupId", "GroupName"]):
+            if "default" != aws_security_group["GroupName"]:
+                self.ec2_client.delete_security_group(GroupId=aws_security_group["GroupId"])
+                self.forget_resource(SECURITY_GROUP, aws_security_group["GroupId"])
+                self.tracer.current_span().add_attribute_value("security_group_ids", aws_security_group["GroupId"])
                 self.logger.info(
                     "The security group with ID '%s' has been deleted ",
-                    security_group.id,
+                    aws_security_group["GroupId"],
                 )
 
-    @staticmethod
-    def authorize_sg_ingress_rules(sg, sg_config):
-        """Authorize security group ingress (inbound) rules
+    def authorize_sg_ingress_rules(self, aws_security_group, sg_config):
+        """Reconcile security group ingress (inbound) rules
+
+        Missing rules are authorized in a single call and rules which are not
+        configured anymore are revoked in a single call.
 
         Args:
-            sg (object): Security group resource
+            aws_security_group (dict): Security group description
             sg_config (dict): Security group config
         """
-        for ingress_rule in sg_config["IngressRules"]:
-            for permission in sg.ip_permissions:
-                rule_exists = False
-                if (ingress_rule["IpProtocol"] == permission.get("IpProtocol", None) and
-                        ingress_rule["FromPort"] == permission.get("FromPort", None) and
-                        ingress_rule["ToPort"] == permission.get("ToPort", None) and
-                        ingress_rule["IpRanges"] == permission.get("IpRanges", None)):
-                    rule_exists = True
-                    break
-
-            if not rule_exists:
-                sg.authorize_ingress(
-                    IpPermissions=[ingress_rule])
+        SecurityGroups.reconcile_rules(
+            sg_config["IngressRules"],
+            aws_security_group["IpPermissions"],
+            functools.partial(self.ec2_client.authorize_security_group_ingress, GroupId=aws_security_group["GroupId"]),
+            functools.partial(self.ec2_client.revoke_security_group_ingress, GroupId=aws_security_group["GroupId"])
+        )
 
-    @staticmethod
-    def authorize_sg_egress_rules(sg, sg_config):
-        """Authorize security group egress (outbound) rules
+    def authorize_sg_egress_rules(self, aws_security_group, sg_config):
+        """Reconcile security group egress (outbound) rules
+
+        Missing rules are authorized in a single call and rules which are not
+        configured anymore are revoked in a single call.
 
         Args:
-            sg (object): Security group resource
+            aws_security_group (dict): Security group description
             sg_config (dict): Security group config
         """
-        for egress_rule in sg_config["EgressRules"]:
-            for permission in sg.ip_permissions_egress:
-                rule_exists = False
-                if (egress_rule["IpProtocol"] == permission.get("IpProtocol", None) and
-                        egress_rule["FromPort"] == permission.get("FromPort", None) and
-                        egress_rule["ToPort"] == permission.get("ToPort", None) and
-                        egress_rule["IpRanges"] == permission.get("IpRanges", None)):
-                    rule_exists = True
-                    break
-
-            if not rule_exists:
-                sg.authorize_egress(
-                    IpPermissions=[egress_rule])
+        SecurityGroups.reconcile_rules(
+            sg_config["EgressRules"],
+            aws_security_group["IpPermissionsEgress"],
+            functools.partial(self.ec2_client.authorize_security_group_egress, GroupId=aws_security_group["GroupId"]),
+            functools.partial(self.ec2_client.revoke_security_group_egress, GroupId=aws_security_group["GroupId"])
+        )
+
+    @staticmethod
+    def reconcile_rules(configured_permissions, existing_permissions, authorize, revoke):
+        """Authorize the missing rules and revoke the stale ones
+
+        Args:
+            configured_permissions (list): Configured ip permissions
+            existing_permissions (list): Security group ip permissions
+            authorize (function): Authorize method taking an IpPermissions argument
+            revoke (function): Revoke method taking an IpPermissions argument
+
+        Returns:
+            tuple: Authorized rules and revoked rules sets
+        """
+        missing_rules, stale_rules = SecurityGroups.diff_rules(configured_permissions, existing_permissions)
+
+        if missing_rules:
+            authorize(IpPermissions=SecurityGroups.build_ip_permissions(missing_rules))
+
+        if stale_rules:
+            revoke(IpPermissions=SecurityGroups.build_ip_permissions(stale_rules))
+
+        return missing_rules, stale_rules
+
+    @staticmethod
+    def diff_rules(configured_permissions, existing_permissions):
+        """Get the rules which are missing and the ones which are not configured anymore
+
+        Args:
+            configured_permissions (list): Configured ip permissions
+            existing_permissions (list): Security group ip permissions
+
+        Returns:
+            tuple: Missing rules and stale rules sets
+        """
+        configured_rules = SecurityGroups.normalize_ip_permissions(configured_permissions)
+        existing_rules = SecurityGroups.normalize_ip_permissions(existing_permissions)
+
+        return configured_rules - existing_rules, existing_rules - configured_rules
+
+    @staticmethod
+    def normalize_ip_permissions(ip_permissions):
+        """Normalize ip permissions into a set of hashable rules
+
+        Each rule is a (protocol, from port, to port, source key, source) tuple,
+        with one rule per permission source.
+
+        Args:
+            ip_permissions (list): Ip permissions
+
+        Returns:
+            set: Rules
+        """
+        rules = set()
+        for permission in ip_permissions:
+            protocol = str(permission["IpProtocol"])
+            from_port = permission.get("FromPort", None)
+            to_port = permission.get("ToPort", None)
+            if protocol == "-1":
+                # All traffic rules have no ports
+                from_port = None
+                to_port = None
+
+            for source_key, source_field in IP_PERMISSION_SOURCES:
+                for source in permission.get(source_key, []):
+                    rules.add((protocol, from_port, to_port, source_key, source[source_field]))
+
+        return rules
+
+    @staticmethod
+    def build_ip_permissions(rules):
+        """Build ip permissions from normalized rules, grouping them by protocol and ports
+
+        Args:
+            rules (set): Rules
+
+        Returns:
+            list: Ip permissions
+        """
+        source_fields = dict(IP_PERMISSION_SOURCES)
+        permissions = {}
+        for protocol, from_port, to_port, source_key, source in sorted(rules):
+            key = (protocol, from_port, to_port)
+            if key not in permissions:
+                permissions[key] = {
+                    "IpProtocol": protocol
+                }
+                if from_port is not None:
+                    permissions[key]["FromPort"] = from_port
+                if to_port is not None:
+                    permissions[key]["ToPort"] = to_port
+
+            permissions[key].setdefault(source_key, []).append({
+                source_fields[source_key]: source
+            })
+
+        return [permissions[key] for key in sorted(permissions)]
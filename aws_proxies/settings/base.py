@@ -2,6 +2,24 @@
 
 TAG_BASE_NAME = 'symaps-prod-proxies'
 
+# SQLite database where the fleets topology (vpcs, subnets, enis, eips, instances ids...) is recorded
+STATE_STORE_PATH = '~/.aws_proxies/state.sqlite'
+
+# Owners the images are looked up by name among ('self', account IDs or 'amazon'...). Scoping the
+# lookup avoids searching every public image
+IMAGE_OWNERS = ['self']
+
+# JSON file where the resolved images (ID and virtualization type) are cached, and for how many seconds
+# (a None path keeps the cache in memory only)
+IMAGE_CACHE_PATH = '~/.aws_proxies/images.json'
+IMAGE_CACHE_TTL = 24 * 3600
+
+# Unassociated elastic ips kept warm in a pool which survives the fleet deletions (None disables the pool)
+EIP_POOL_SIZE = None
+
+# Available network interfaces (with their elastic ips) kept warm in each fleet subnet (None disables the pool)
+ENI_POOL_SIZE = None
+
 # Instance Type, Maximum Elastic Network Interfaces, IP Addresses per Interface
 ENI_MAPPING = [
     ('c1.medium', 2, 6),
@@ -0,0 +1,2765 @@
+# -*- coding: utf-8 -*-
+"""Local EC2 simulator
+
+The Ec2Simulator stands in for the EC2 (and Resource Groups Tagging) API of one
+account and region, in memory, to tune and benchmark the concurrency offline.
+The boto3 sessions it creates answer the calls of the operations the package
+uses from botocore's 'before-send' event, with responses serialized from the
+service model: Proxies runs unmodified against it, with the botocore retries,
+paginators, waiters and the ec2 resource.
+
+Every call takes a latency drawn from a configurable distribution, the new
+resources can be missing from the describes for a while (eventual consistency),
+the calls are throttled with the EC2 token buckets (RequestLimitExceeded) and the
+filters values limit, the account quotas and the availability zones capacity are
+enforced. The simulated time can be scaled down, so that the instances boots and
+the waiters take seconds.
+"""
+from __future__ import division
+from botocore import xform_name
+from botocore.awsrequest import AWSResponse
+import copy
+import datetime
+import fnmatch
+import json
+import logging
+import math
+import random
+from . import settings
+from .security_groups import SecurityGroups
+from .state import ADDRESS, INSTANCE, INTERNET_GATEWAY, LAUNCH_TEMPLATE, NETWORK_ACL, NETWORK_INTERFACE, \
+    ROUTE_TABLE, SECURITY_GROUP, SUBNET, VPC
+import threading
+import time
+from .utils import setup_logger, ip_to_int, int_to_ip, merge_dicts, ipv6_to_int, int_to_ipv6
+from xml.sax.saxutils import escape
+
+ACCOUNT_ID = "123456789012"
+
+REGION = "us-east-1"
+
+EC2_XMLNS = "http://ec2.amazonaws.com/doc/2016-11-15/"
+
+# Simulated types which are not fleet resources
+PLACEMENT_GROUP = "placement_group"
+IMAGE = "image"
+AVAILABILITY_ZONE = "availability_zone"
+INSTANCE_STATUS = "instance_status"
+
+# Resources types ID prefix, not found error code and Resource Groups Tagging API ARN type
+RESOURCE_TYPES = {
+    VPC: ("vpc", "InvalidVpcID.NotFound", "vpc"),
+    INTERNET_GATEWAY: ("igw", "InvalidInternetGatewayID.NotFound", "internet-gateway"),
+    SUBNET: ("subnet", "InvalidSubnetID.NotFound", "subnet"),
+    SECURITY_GROUP: ("sg", "InvalidGroup.NotFound", "security-group"),
+    ROUTE_TABLE: ("rtb", "InvalidRouteTableID.NotFound", "route-table"),
+    NETWORK_ACL: ("acl", "InvalidNetworkAclID.NotFound", "network-acl"),
+    NETWORK_INTERFACE: ("eni", "InvalidNetworkInterfaceID.NotFound", "network-interface"),
+    ADDRESS: ("eipalloc", "InvalidAllocationID.NotFound", "elastic-ip"),
+    INSTANCE: ("i", "InvalidInstanceID.NotFound", "instance"),
+    LAUNCH_TEMPLATE: ("lt", "InvalidLaunchTemplateId.NotFound", "launch-template"),
+    PLACEMENT_GROUP: ("pg", "InvalidPlacementGroup.Unknown", "placement-group"),
+    IMAGE: ("ami", "InvalidAMIID.NotFound", "image"),
+}
+
+# Describe filters and the description paths they match, by type. The 'tag:<key>',
+# 'tag-key' and 'tag-value' filters are supported for every type.
+FILTERS = {
+    VPC: {
+        "vpc-id": "VpcId",
+        "cidr": "CidrBlock",
+        "cidrBlock": "CidrBlock",
+        "cidr-block-association.cidr-block": "CidrBlockAssociationSet.CidrBlock",
+        "ipv6-cidr-block-association.ipv6-cidr-block": "Ipv6CidrBlockAssociationSet.Ipv6CidrBlock",
+        "state": "State",
+        "is-default": "IsDefault",
+        "owner-id": "OwnerId",
+    },
+    INTERNET_GATEWAY: {
+        "internet-gateway-id": "InternetGatewayId",
+        "attachment.vpc-id": "Attachments.VpcId",
+        "attachment.state": "Attachments.State",
+        "owner-id": "OwnerId",
+    },
+    SUBNET: {
+        "subnet-id": "SubnetId",
+        "vpc-id": "VpcId",
+        "cidr": "CidrBlock",
+        "cidrBlock": "CidrBlock",
+        "cidr-block": "CidrBlock",
+        "availability-zone": "AvailabilityZone",
+        "availability-zone-id": "AvailabilityZoneId",
+        "default-for-az": "DefaultForAz",
+        "ipv6-cidr-block-association.ipv6-cidr-block": "Ipv6CidrBlockAssociationSet.Ipv6CidrBlock",
+        "state": "State",
+    },
+    SECURITY_GROUP: {
+        "group-id": "GroupId",
+        "group-name": "GroupName",
+        "vpc-id": "VpcId",
+        "description": "Description",
+        "owner-id": "OwnerId",
+    },
+    ROUTE_TABLE: {
+        "route-table-id": "RouteTableId",
+        "vpc-id": "VpcId",
+        "association.main": "Associations.Main",
+        "association.route-table-association-id": "Associations.RouteTableAssociationId",
+        "association.subnet-id": "Associations.SubnetId",
+        "route.destination-cidr-block": "Routes.DestinationCidrBlock",
+        "route.gateway-id": "Routes.GatewayId",
+        "route.state": "Routes.State",
+    },
+    NETWORK_ACL: {
+        "network-acl-id": "NetworkAclId",
+        "vpc-id": "VpcId",
+        "default": "IsDefault",
+        "association.association-id": "Associations.NetworkAclAssociationId",
+        "association.subnet-id": "Associations.SubnetId",
+    },
+    NETWORK_INTERFACE: {
+        "network-interface-id": "NetworkInterfaceId",
+        "subnet-id": "SubnetId",
+        "vpc-id": "VpcId",
+        "availability-zone": "AvailabilityZone",
+        "description": "Description",
+        "group-id": "Groups.GroupId",
+        "interface-type": "InterfaceType",
+        "status": "Status",
+        "private-ip-address": "PrivateIpAddresses.PrivateIpAddress",
+        "addresses.private-ip-address": "PrivateIpAddresses.PrivateIpAddress",
+        "association.allocation-id": "PrivateIpAddresses.Association.AllocationId",
+        "association.public-ip": "PrivateIpAddresses.Association.PublicIp",
+        "ipv6-addresses.ipv6-address": "Ipv6Addresses.Ipv6Address",
+        "attachment.attachment-id": "Attachment.AttachmentId",
+        "attachment.device-index": "Attachment.DeviceIndex",
+        "attachment.instance-id": "Attachment.InstanceId",
+        "attachment.status": "Attachment.Status",
+    },
+    ADDRESS: {
+        "allocation-id": "AllocationId",
+        "association-id": "AssociationId",
+        "domain": "Domain",
+        "instance-id": "InstanceId",
+        "network-interface-id": "NetworkInterfaceId",
+        "network-interface-owner-id": "NetworkInterfaceOwnerId",
+        "private-ip-address": "PrivateIpAddress",
+        "public-ip": "PublicIp",
+    },
+    INSTANCE: {
+        "instance-id": "InstanceId",
+        "instance-state-name": "State.Name",
+        "instance-state-code": "State.Code",
+        "instance-type": "InstanceType",
+        "instance-lifecycle": "InstanceLifecycle",
+        "image-id": "ImageId",
+        "subnet-id": "SubnetId",
+        "vpc-id": "VpcId",
+        "availability-zone": "Placement.AvailabilityZone",
+        "placement-group-name": "Placement.GroupName",
+        "private-ip-address": "PrivateIpAddress",
+        "ip-address": "PublicIpAddress",
+        "network-interface.network-interface-id": "NetworkInterfaces.NetworkInterfaceId",
+        "network-interface.addresses.private-ip-address": "NetworkInterfaces.PrivateIpAddresses.PrivateIpAddress",
+    },
+    LAUNCH_TEMPLATE: {
+        "launch-template-name": "LaunchTemplateName",
+        "create-time": "CreateTime",
+    },
+    PLACEMENT_GROUP: {
+        "group-id": "GroupId",
+        "group-name": "GroupName",
+        "state": "State",
+        "strategy": "Strategy",
+    },
+    IMAGE: {
+        "image-id": "ImageId",
+        "name": "Name",
+        "architecture": "Architecture",
+        "is-public": "Public",
+        "owner-id": "OwnerId",
+        "state": "State",
+        "virtualization-type": "VirtualizationType",
+    },
+    AVAILABILITY_ZONE: {
+        "zone-name": "ZoneName",
+        "zone-id": "ZoneId",
+        "region-name": "RegionName",
+        "state": "State",
+    },
+    INSTANCE_STATUS: {
+        "availability-zone": "AvailabilityZone",
+        "instance-state-name": "InstanceState.Name",
+        "instance-state-code": "InstanceState.Code",
+        "instance-status.status": "InstanceStatus.Status",
+        "system-status.status": "SystemStatus.Status",
+    },
+}
+
+# Filters values accepted per call in all, past which the call fails with FilterLimitExceeded
+MAX_FILTER_VALUES = 200
+
+# Calls latencies distributions (see sample_duration), by operation name, operation verb
+# (e.g. 'Describe') or '*' for the other operations
+LATENCIES = {
+    "*": ("lognormal", 0.15, 0.4),
+    "Describe": ("lognormal", 0.1, 0.5),
+    "AllocateAddress": ("lognormal", 0.25, 0.3),
+    "CreateFleet": ("lognormal", 2.0, 0.3),
+    "CreateVpc": ("lognormal", 0.4, 0.3),
+    "GetResources": ("lognormal", 0.3, 0.4),
+    "RunInstances": ("lognormal", 1.2, 0.3),
+    "TerminateInstances": ("lognormal", 0.4, 0.3),
+}
+
+# Instances lifecycle durations distributions: pending to running, running to status checks
+# passed and shutting-down to terminated
+INSTANCE_BOOT_TIME = ("lognormal", 25, 0.3)
+INSTANCE_STATUS_CHECKS_TIME = ("lognormal", 90, 0.3)
+INSTANCE_SHUTDOWN_TIME = ("lognormal", 40, 0.3)
+
+# Seconds the terminated instances are still described for
+TERMINATED_INSTANCES_RETENTION = 3600
+
+# EC2 API requests token buckets (bucket size, refill rate per second) by actions category
+RATE_LIMITS = {
+    "mutating": (50, 5),
+    "non_mutating": (100, 20),
+    "unfiltered_non_mutating": (50, 10),
+}
+
+# EC2 API resources token buckets (bucket size, refill rate per second), in resources per call
+RESOURCE_RATE_LIMITS = {
+    "RunInstances": (1000, 2),
+    "TerminateInstances": (1000, 20),
+}
+
+# Account quotas (AWS defaults)
+QUOTAS = {
+    "vpcs": 5,
+    "internet_gateways": 5,
+    "addresses": 5,
+    "network_interfaces": 5000,
+    "instances": 20,
+    "security_groups": 2500,
+    "subnets_per_vpc": 200,
+    "route_tables_per_vpc": 200,
+    "routes_per_route_table": 50,
+    "network_acls_per_vpc": 200,
+    "rules_per_security_group": 60,
+    "private_ips_per_network_interface": 50,
+    "tags_per_resource": 50,
+}
+
+# Images owned by the simulated account
+IMAGES = [
+    {
+        "Name": "tinyproxy",
+        "VirtualizationType": "hvm"
+    },
+    {
+        "Name": "tinyproxy-paravirtual",
+        "VirtualizationType": "paravirtual"
+    },
+]
+
+INSTANCE_STATE_CODES = {
+    "pending": 0,
+    "running": 16,
+    "shutting-down": 32,
+    "terminated": 48,
+}
+
+# Public ips allocated to the elastic ips (198.18.0.0/15, reserved for benchmarks)
+PUBLIC_IPS_RANGE = (ip_to_int("198.18.0.0"), 2 ** 17)
+
+
+class SimulatedError(Exception):
+    """Simulated API error response
+    """
+
+    def __init__(self, code, message, status_code=400):
+        """Constructor
+
+        Args:
+            code (string): Error code
+            message (string): Error message
+            status_code (integer, optional): HTTP status code
+        """
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+        self.status_code = status_code
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter, on the simulated clock
+    """
+
+    def __init__(self, capacity, refill_rate):
+        """Constructor
+
+        Args:
+            capacity (integer): Bucket size
+            refill_rate (float): Tokens added per second
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = float(capacity)
+        self.updated_at = 0.0
+
+    def take(self, now, tokens=1):
+        """Take tokens from the bucket
+
+        Args:
+            now (float): Simulated time
+            tokens (integer, optional): Tokens count
+
+        Returns:
+            bool: Whether there were enough tokens
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+        if self.tokens < tokens:
+            return False
+
+        self.tokens = self.tokens - tokens
+        return True
+
+
+class RawResponse(object):
+    """Raw HTTP response body, as read by botocore
+    """
+
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def sample_duration(spec, rng):
+    """Draw a duration from a distribution
+
+    Args:
+        spec (object): Seconds, or ('constant', seconds), ('uniform', low, high),
+            ('lognormal', median, sigma) or ('exponential', mean) tuple
+        rng (object): Random generator
+
+    Returns:
+        float: Seconds
+
+    Raises:
+        ValueError: Unknown distribution
+    """
+    if spec is None:
+        return 0.0
+    if isinstance(spec, (int, float)):
+        return float(spec)
+
+    name, parameters = spec[0], spec[1:]
+    if name == "constant":
+        return float(parameters[0])
+    if name == "uniform":
+        return rng.uniform(parameters[0], parameters[1])
+    if name == "lognormal":
+        return rng.lognormvariate(math.log(parameters[0]), parameters[1])
+    if name == "exponential":
+        return rng.expovariate(1.0 / parameters[0])
+
+    raise ValueError("Unknown distribution '{0}'".format(name))
+
+
+def get_path_values(value, path):
+    """Get the values at a dotted path of a description, flattening the lists
+
+    Args:
+        value (dict): Description
+        path (string): Dotted path (e.g. 'Attachments.VpcId')
+
+    Returns:
+        list: Values
+    """
+    values = [value]
+    for key in path.split("."):
+        next_values = []
+        for item in values:
+            item = item.get(key) if isinstance(item, dict) else None
+            if isinstance(item, list):
+                next_values.extend(item)
+            elif item is not None:
+                next_values.append(item)
+        values = next_values
+
+    return values
+
+
+def format_filter_value(value):
+    """Format a description value as a filter value
+
+    Args:
+        value (object): Value
+
+    Returns:
+        string: Filter value
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def serialize_xml(shape, value, name, parts):
+    """Serialize a value as EC2 query protocol XML, driven by its botocore shape
+
+    Args:
+        shape (object): Botocore shape
+        value (object): Value
+        name (string): Element name
+        parts (list): XML parts, appended to
+    """
+    if value is None:
+        return
+
+    parts.append("<{0}>".format(name))
+    if shape.type_name == "structure":
+        for member_name, member_shape in shape.members.items():
+            if member_name in value:
+                serialize_xml(member_shape, value[member_name],
+                              member_shape.serialization.get("name", member_name), parts)
+    elif shape.type_name == "list":
+        for item in value:
+            serialize_xml(shape.member, item, shape.member.serialization.get("name", "item"), parts)
+    elif shape.type_name == "map":
+        for key, item in value.items():
+            parts.append("<entry>")
+            serialize_xml(shape.key, key, shape.key.serialization.get("name", "key"), parts)
+            serialize_xml(shape.value, item, shape.value.serialization.get("name", "value"), parts)
+            parts.append("</entry>")
+    elif shape.type_name == "boolean":
+        parts.append("true" if value else "false")
+    else:
+        parts.append(escape(u"{0}".format(value)))
+    parts.append("</{0}>".format(name))
+
+
+def build_ec2_response(operation_model, result, request_id):
+    """Build an EC2 response body
+
+    Args:
+        operation_model (object): Botocore operation model
+        result (dict): Operation result
+        request_id (string): Request ID
+
+    Returns:
+        bytes: XML body
+    """
+    name = operation_model.name + "Response"
+    parts = [
+        u'<?xml version="1.0" encoding="UTF-8"?>',
+        u'<{0} xmlns="{1}">'.format(name, EC2_XMLNS),
+        u"<requestId>{0}</requestId>".format(request_id)
+    ]
+    output_shape = operation_model.output_shape
+    if output_shape is not None:
+        for member_name, member_shape in output_shape.members.items():
+            if member_name in result:
+                serialize_xml(member_shape, result[member_name],
+                              member_shape.serialization.get("name", member_name), parts)
+    parts.append(u"</{0}>".format(name))
+
+    return u"".join(parts).encode("utf-8")
+
+
+def build_ec2_error_response(error, request_id):
+    """Build an EC2 error response body
+
+    Args:
+        error (object): Simulated error
+        request_id (string): Request ID
+
+    Returns:
+        bytes: XML body
+    """
+    return (
+        u'<?xml version="1.0" encoding="UTF-8"?>'
+        u"<Response><Errors><Error><Code>{0}</Code><Message>{1}</Message></Error></Errors>"
+        u"<RequestID>{2}</RequestID></Response>"
+    ).format(escape(error.code), escape(error.message), request_id).encode("utf-8")
+
+
+class Ec2Simulator(object):
+    """In memory EC2 account and region
+
+    Only the operations (and filters) used by the package are simulated. The
+    resources are kept as descriptions in the shape of the API responses, the
+    instances, network interfaces and elastic ips ones being completed on the
+    fly from their attachments and associations.
+    """
+
+    def __init__(self, **kwargs):
+        """Constructor
+
+        Args:
+            **kwargs: Multiple arguments (latencies, consistency_delay, rate_limits, quotas, capacity,
+                time_scale, seed...)
+
+        Raises:
+            TypeError: Description
+        """
+        self.region = kwargs.pop("region", REGION)
+        self.availability_zones = kwargs.pop("availability_zones", None) or [
+            self.region + letter for letter in "abcdef"]
+        # Latencies distributions, merged into the default ones (see LATENCIES)
+        self.latencies = merge_dicts(LATENCIES, kwargs.pop("latencies", {}))
+        # Delay distribution during which the created resources are not described yet
+        self.consistency_delay = kwargs.pop("consistency_delay", None)
+        self.instance_boot_time = kwargs.pop("instance_boot_time", INSTANCE_BOOT_TIME)
+        self.instance_status_checks_time = kwargs.pop("instance_status_checks_time", INSTANCE_STATUS_CHECKS_TIME)
+        self.instance_shutdown_time = kwargs.pop("instance_shutdown_time", INSTANCE_SHUTDOWN_TIME)
+        # Token buckets by actions category (see RATE_LIMITS), None disables the throttling
+        rate_limits = kwargs.pop("rate_limits", RATE_LIMITS)
+        resource_rate_limits = kwargs.pop("resource_rate_limits", RESOURCE_RATE_LIMITS)
+        # Probability of a RequestLimitExceeded error on top of the token buckets
+        self.throttle_rate = kwargs.pop("throttle_rate", 0)
+        self.quotas = merge_dicts(QUOTAS, kwargs.pop("quotas", {}))
+        # Instances which can be running at once, by availability zone
+        self.capacity = kwargs.pop("capacity", {})
+        eni_mapping = kwargs.pop("eni_mapping", settings.ENI_MAPPING)
+        images = kwargs.pop("images", IMAGES)
+        # Simulated seconds per real second are 1 / time_scale
+        self.time_scale = kwargs.pop("time_scale", 1.0)
+        seed = kwargs.pop("seed", None)
+        log_level = kwargs.pop("log_level", logging.WARNING)
+
+        if kwargs:
+            raise TypeError("Unexpected **kwargs: %r" % kwargs)
+        self.logger = setup_logger(__name__, log_level)
+
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.started_at = time.time()
+
+        self.buckets = dict(
+            (category, TokenBucket(capacity, refill_rate))
+            for category, (capacity, refill_rate) in (rate_limits or {}).items()
+        )
+        self.resource_buckets = dict(
+            (operation_name, TokenBucket(capacity, refill_rate))
+            for operation_name, (capacity, refill_rate) in (resource_rate_limits or {}).items()
+        )
+        self.max_network_interfaces = dict((instance_type, max_enis) for instance_type, max_enis, ips in eni_mapping)
+
+        self.resources = dict((resource_type, {}) for resource_type in RESOURCE_TYPES)
+        # Elastic ips allocation IDs indexed by network interface ID and private ip
+        self.associations = {}
+        # Alive instances counts, indexed by availability zone
+        self.instances_counts = {}
+        self.terminating_instances = set()
+        self.terminated_instances = []
+
+        self.stats = {
+            "Calls": {},
+            "Throttled": 0,
+            "ConcurrentCalls": 0,
+            "MaxConcurrentCalls": 0
+        }
+
+        for image in images:
+            self.__create_image(image)
+
+    def now(self):
+        """Get the simulated time
+
+        Returns:
+            float: Simulated seconds since the simulator creation
+        """
+        return (time.time() - self.started_at) / self.time_scale
+
+    def sleep(self, seconds):
+        """Sleep for simulated seconds
+
+        Args:
+            seconds (float): Simulated seconds
+        """
+        if seconds > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def create_session(self):
+        """Create a boto3 session answered by the simulator
+
+        Returns:
+            object: Boto3 session
+        """
+        import boto3
+        session = boto3.Session(
+            aws_access_key_id="simulated",
+            aws_secret_access_key="simulated",
+            region_name=self.region
+        )
+        self.register(session.events)
+
+        return session
+
+    def register(self, events):
+        """Answer the EC2 and Tagging API calls of a session or client
+
+        The waiters delays are only scaled for the clients created once registered.
+
+        Args:
+            events (object): Botocore events emitter (e.g. session.events or client.meta.events)
+        """
+        for service_id in ["ec2", "resource-groups-tagging-api"]:
+            events.register("before-parameter-build." + service_id, self.__capture_call)
+            events.register("before-send." + service_id, self.__send)
+        events.register("creating-client-class.ec2", self.__add_client_base_class)
+
+    def get_stats(self):
+        """Get the calls counters
+
+        Returns:
+            dict: Calls counts, errors counts by code and simulated latency indexed by operation name
+                ('Calls'), throttled calls count ('Throttled'), max concurrent calls ('MaxConcurrentCalls')
+                and resources counts by type ('Resources')
+        """
+        with self.lock:
+            stats = copy.deepcopy(self.stats)
+            stats["Resources"] = dict(
+                (resource_type, len(records)) for resource_type, records in self.resources.items())
+        del stats["ConcurrentCalls"]
+
+        return stats
+
+    def call(self, operation_name, params):
+        """Simulate an API call
+
+        Args:
+            operation_name (string): Operation name (e.g. 'DescribeVpcs')
+            params (dict): Operation parameters
+
+        Returns:
+            dict: Operation result
+
+        Raises:
+            SimulatedError: Simulated error response
+        """
+        params = copy.deepcopy(params)
+        with self.lock:
+            calls = self.stats["Calls"].setdefault(operation_name, {
+                "Count": 0,
+                "Errors": {},
+                "Latency": 0.0
+            })
+            calls["Count"] = calls["Count"] + 1
+            self.stats["ConcurrentCalls"] = self.stats["ConcurrentCalls"] + 1
+            self.stats["MaxConcurrentCalls"] = max(self.stats["MaxConcurrentCalls"], self.stats["ConcurrentCalls"])
+            latency = sample_duration(self.__get_latency_spec(operation_name), self.random)
+
+        try:
+            with self.lock:
+                self.__throttle(operation_name, params)
+            self.sleep(latency)
+            with self.lock:
+                calls["Latency"] = calls["Latency"] + latency
+                self.__advance()
+                handler = getattr(self, "_" + xform_name(operation_name), None)
+                if handler is None:
+                    raise SimulatedError(
+                        "InvalidAction", "The action {0} is not valid for this web service.".format(operation_name))
+                return copy.deepcopy(handler(params))
+        except SimulatedError as e:
+            with self.lock:
+                calls["Errors"][e.code] = calls["Errors"].get(e.code, 0) + 1
+            self.logger.info("%s failed with %s: %s", operation_name, e.code, e.message)
+            raise
+        finally:
+            with self.lock:
+                self.stats["ConcurrentCalls"] = self.stats["ConcurrentCalls"] - 1
+
+    def __capture_call(self, params, model, **kwargs):
+        """Keep the parameters of the call being made by the thread, to answer it once sent
+        """
+        self.local.call = (model, params)
+
+    def __send(self, request, **kwargs):
+        """Answer the call being sent by the thread
+
+        Returns:
+            object: Botocore response
+        """
+        operation_model, params = self.local.call
+        request_id = "{0:08x}-{1:04x}-{2:04x}-{3:04x}-{4:012x}".format(
+            *[self.random.getrandbits(bits) for bits in (32, 16, 16, 16, 48)])
+        is_json = operation_model.service_model.protocol == "json"
+        try:
+            result = self.call(operation_model.name, params)
+            status_code = 200
+            if is_json:
+                body = json.dumps(result).encode("utf-8")
+            else:
+                body = build_ec2_response(operation_model, result, request_id)
+        except SimulatedError as e:
+            status_code = e.status_code
+            if is_json:
+                body = json.dumps({"__type": e.code, "Message": e.message}).encode("utf-8")
+            else:
+                body = build_ec2_error_response(e, request_id)
+
+        headers = {
+            "Content-Type": "application/x-amz-json-1.1" if is_json else "text/xml;charset=UTF-8",
+            "x-amzn-RequestId": request_id
+        }
+
+        return AWSResponse(request.url, status_code, headers, RawResponse(body))
+
+    def __add_client_base_class(self, base_classes, **kwargs):
+        """Scale the delays of the EC2 clients waiters to the simulated time
+        """
+        simulator = self
+
+        class SimulatedWaitersClient(object):
+
+            def get_waiter(self, waiter_name):
+                waiter = super(SimulatedWaitersClient, self).get_waiter(waiter_name)
+                waiter.config.delay = waiter.config.delay * simulator.time_scale
+                return waiter
+
+        base_classes.insert(0, SimulatedWaitersClient)
+
+    def __get_latency_spec(self, operation_name):
+        """Get the latency distribution of an operation
+
+        Args:
+            operation_name (string): Operation name
+
+        Returns:
+            object: Latency distribution
+        """
+        if operation_name in self.latencies:
+            return self.latencies[operation_name]
+        verb = xform_name(operation_name).split("_")[0].capitalize()
+        return self.latencies.get(verb, self.latencies.get("*"))
+
+    def __throttle(self, operation_name, params):
+        """Take the call tokens, or reject it
+
+        Args:
+            operation_name (string): Operation name
+            params (dict): Operation parameters
+
+        Raises:
+            SimulatedError: RequestLimitExceeded or RequestResourceCountExceeded
+        """
+        now = self.now()
+        if operation_name.startswith(("Describe", "Get")):
+            category = "non_mutating"
+            if not any(key.endswith(("Ids", "Names", "Filters", "MaxResults")) for key in params):
+                category = "unfiltered_non_mutating"
+        else:
+            category = "mutating"
+
+        bucket = self.buckets.get(category)
+        if (bucket is not None and not bucket.take(now)) or self.random.random() < self.throttle_rate:
+            self.stats["Throttled"] = self.stats["Throttled"] + 1
+            raise SimulatedError("RequestLimitExceeded", "Request limit exceeded.", 503)
+
+        resource_bucket = self.resource_buckets.get("TerminateInstances" if operation_name == "TerminateInstances"
+                                                    else "RunInstances")
+        if resource_bucket is None or operation_name not in ("RunInstances", "CreateFleet", "TerminateInstances"):
+            return
+
+        if operation_name == "RunInstances":
+            resources_count = params.get("MaxCount", 1)
+        elif operation_name == "CreateFleet":
+            resources_count = params["TargetCapacitySpecification"]["TotalTargetCapacity"]
+        else:
+            resources_count = len(params.get("InstanceIds", []))
+        if not resource_bucket.take(now, resources_count):
+            self.stats["Throttled"] = self.stats["Throttled"] + 1
+            raise SimulatedError("RequestResourceCountExceeded", "Request resource count exceeded.")
+
+    def __advance(self):
+        """Apply the instances terminations which are over and forget the old terminated instances
+        """
+        now = self.now()
+        for instance_id in list(self.terminating_instances):
+            record = self.resources[INSTANCE][instance_id]
+            if now < record["TerminatedAt"]:
+                continue
+
+            self.terminating_instances.discard(instance_id)
+            for eni_id in record["NetworkInterfaceIds"]:
+                eni = self.resources[NETWORK_INTERFACE][eni_id]
+                if eni["Attachment"]["DeleteOnTermination"]:
+                    self.__delete_network_interface(eni)
+                else:
+                    eni["Attachment"] = None
+            record["NetworkInterfaceIds"] = []
+            self.terminated_instances.append(instance_id)
+
+        for instance_id in list(self.terminated_instances):
+            if now >= self.resources[INSTANCE][instance_id]["TerminatedAt"] + TERMINATED_INSTANCES_RETENTION:
+                self.terminated_instances.remove(instance_id)
+                del self.resources[INSTANCE][instance_id]
+
+    def __new_id(self, prefix):
+        """Generate a resource ID
+
+        Args:
+            prefix (string): ID prefix
+
+        Returns:
+            string: Resource ID
+        """
+        return "{0}-{1:017x}".format(prefix, self.random.getrandbits(68))
+
+    @staticmethod
+    def __timestamp():
+        """Get the current time as an API timestamp
+
+        Returns:
+            string: ISO 8601 timestamp
+        """
+        return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+    def __check_quota(self, quota, count, code, message):
+        """Reject a resource creation beyond a quota
+
+        Args:
+            quota (string): Quota name (see QUOTAS)
+            count (integer): Resources count with the new ones
+            code (string): Error code
+            message (string): Error message
+
+        Raises:
+            SimulatedError: Quota exceeded
+        """
+        if self.quotas.get(quota) is not None and count > self.quotas[quota]:
+            raise SimulatedError(code, message)
+
+    def __add(self, resource_type, resource_id, description, **attributes):
+        """Add a resource, described once the consistency delay is over
+
+        Args:
+            resource_type (string): Resource type
+            resource_id (string): Resource ID
+            description (dict): Resource description
+            **attributes: Internal attributes
+
+        Returns:
+            dict: Resource record
+        """
+        record = dict(attributes, Description=description, VisibleAt=self.now() + sample_duration(
+            self.consistency_delay, self.random))
+        self.resources[resource_type][resource_id] = record
+
+        return record
+
+    def __get(self, resource_type, resource_id, visible_only=False):
+        """Get a resource
+
+        Args:
+            resource_type (string): Resource type
+            resource_id (string): Resource ID
+            visible_only (bool, optional): Not found during the consistency delay
+
+        Returns:
+            dict: Resource record
+
+        Raises:
+            SimulatedError: Not found
+        """
+        record = self.resources[resource_type].get(resource_id)
+        if record is None or (visible_only and record["VisibleAt"] > self.now()):
+            raise SimulatedError(RESOURCE_TYPES[resource_type][1], "The {0} ID '{1}' does not exist".format(
+                resource_type.replace("_", " "), resource_id))
+
+        return record
+
+    def __find(self, resource_type, **values):
+        """Get the resources whose descriptions have values
+
+        Args:
+            resource_type (string): Resource type
+            **values: Description values
+
+        Returns:
+            list: Resources records
+        """
+        return [
+            record for record in self.resources[resource_type].values()
+            if all(record["Description"].get(key) == value for key, value in values.items())
+        ]
+
+    def __describe(self, resource_type, params, ids_key=None):
+        """Describe the visible resources matching IDs and filters
+
+        Args:
+            resource_type (string): Resource type
+            params (dict): Describe parameters
+            ids_key (string, optional): IDs parameter name
+
+        Returns:
+            list: Resources descriptions
+
+        Raises:
+            SimulatedError: An ID is not found or a filter is invalid
+        """
+        resources_ids = params.get(ids_key) if ids_key else None
+        if resources_ids:
+            records = [self.__get(resource_type, resource_id, visible_only=True)
+                       for resource_id in sorted(set(resources_ids))]
+        else:
+            now = self.now()
+            records = [record for record in self.resources[resource_type].values() if record["VisibleAt"] <= now]
+
+        return self.__filter(resource_type, [self.__build(resource_type, record) for record in records],
+                             params.get("Filters"))
+
+    def __filter(self, filter_type, descriptions, filters):
+        """Select the descriptions matching all the filters
+
+        Args:
+            filter_type (string): Filters type (see FILTERS)
+            descriptions (list): Descriptions
+            filters (list): EC2 filters
+
+        Returns:
+            list: Matching descriptions
+
+        Raises:
+            SimulatedError: Invalid filter, or too many filters values
+        """
+        if sum(len(ec2_filter.get("Values", [])) for ec2_filter in filters or []) > MAX_FILTER_VALUES:
+            raise SimulatedError("FilterLimitExceeded", "The maximum number of filter values specified on a single "
+                                 "call is {0}".format(MAX_FILTER_VALUES))
+
+        for ec2_filter in filters or []:
+            name = ec2_filter["Name"]
+            if not (name.startswith("tag:") or name in ("tag-key", "tag-value") or name in FILTERS[filter_type]):
+                raise SimulatedError("InvalidParameterValue", "The filter '{0}' is invalid".format(name))
+
+            exact_values = set(value for value in ec2_filter.get("Values", []) if not any(
+                wildcard in value for wildcard in "*?["))
+            patterns = [value for value in ec2_filter.get("Values", []) if value not in exact_values]
+
+            matching_descriptions = []
+            for description in descriptions:
+                tags = description.get("Tags", description.get("TagSet", []))
+                if name.startswith("tag:"):
+                    candidates = [tag["Value"] for tag in tags if tag["Key"] == name[4:]]
+                elif name == "tag-key":
+                    candidates = [tag["Key"] for tag in tags]
+                elif name == "tag-value":
+                    candidates = [tag["Value"] for tag in tags]
+                else:
+                    candidates = [format_filter_value(value)
+                                  for value in get_path_values(description, FILTERS[filter_type][name])]
+
+                if any(candidate in exact_values or any(fnmatch.fnmatchcase(candidate, pattern)
+                                                        for pattern in patterns)
+                       for candidate in candidates):
+                    matching_descriptions.append(description)
+            descriptions = matching_descriptions
+
+        return descriptions
+
+    @staticmethod
+    def __paginate(items, params, result_key, result=None):
+        """Page the described items
+
+        Args:
+            items (list): Described items
+            params (dict): Describe parameters (MaxResults and NextToken)
+            result_key (string): Result key of the items
+            result (dict, optional): Result to add the page to
+
+        Returns:
+            dict: Result
+
+        Raises:
+            SimulatedError: Invalid token
+        """
+        result = result if result is not None else {}
+        try:
+            start = int(params.get("NextToken") or 0)
+        except ValueError:
+            raise SimulatedError("InvalidPaginationToken", "The pagination token is invalid.")
+
+        end = len(items)
+        if params.get("MaxResults"):
+            end = min(end, start + params["MaxResults"])
+        result[result_key] = items[start:end]
+        if end < len(items):
+            result["NextToken"] = str(end)
+
+        return result
+
+    def __build(self, resource_type, record):
+        """Build the description of a resource
+
+        Args:
+            resource_type (string): Resource type
+            record (dict): Resource record
+
+        Returns:
+            dict: Resource description
+        """
+        if resource_type == NETWORK_INTERFACE:
+            return self.__build_network_interface(record)
+        if resource_type == ADDRESS:
+            return self.__build_address(record)
+        if resource_type == INSTANCE:
+            return self.__build_instance(record)
+        if resource_type == SECURITY_GROUP:
+            description = copy.deepcopy(record["Description"])
+            description["IpPermissions"] = SecurityGroups.build_ip_permissions(record["IngressRules"])
+            description["IpPermissionsEgress"] = SecurityGroups.build_ip_permissions(record["EgressRules"])
+            return description
+
+        return copy.deepcopy(record["Description"])
+
+    def __build_association(self, allocation_id):
+        """Build the association of an elastic ip to a network interface private ip
+
+        Args:
+            allocation_id (string): Elastic ip allocation ID
+
+        Returns:
+            dict: Association description
+        """
+        address = self.resources[ADDRESS][allocation_id]
+        return {
+            "AllocationId": allocation_id,
+            "AssociationId": address["Association"]["AssociationId"],
+            "IpOwnerId": ACCOUNT_ID,
+            "PublicDnsName": "ec2-{0}.{1}.compute.amazonaws.com".format(
+                address["Description"]["PublicIp"].replace(".", "-"), self.region),
+            "PublicIp": address["Description"]["PublicIp"]
+        }
+
+    def __build_network_interface(self, record):
+        description = copy.deepcopy(record["Description"])
+        eni_id = description["NetworkInterfaceId"]
+        description["PrivateIpAddresses"] = []
+        for index, private_ip in enumerate(record["PrivateIps"]):
+            private_ip_address = {
+                "Primary": index == 0,
+                "PrivateIpAddress": private_ip,
+                "PrivateDnsName": "ip-{0}.ec2.internal".format(private_ip.replace(".", "-"))
+            }
+            allocation_id = self.associations.get((eni_id, private_ip))
+            if allocation_id is not None:
+                private_ip_address["Association"] = self.__build_association(allocation_id)
+                if index == 0:
+                    description["Association"] = self.__build_association(allocation_id)
+            description["PrivateIpAddresses"].append(private_ip_address)
+
+        if record["Attachment"] is not None:
+            description["Attachment"] = dict(record["Attachment"])
+            description["Status"] = "in-use"
+        else:
+            description["Status"] = "available"
+
+        return description
+
+    def __build_address(self, record):
+        description = copy.deepcopy(record["Description"])
+        association = record["Association"]
+        if association is not None:
+            description["AssociationId"] = association["AssociationId"]
+            description["NetworkInterfaceId"] = association["NetworkInterfaceId"]
+            description["NetworkInterfaceOwnerId"] = ACCOUNT_ID
+            description["PrivateIpAddress"] = association["PrivateIpAddress"]
+            attachment = self.resources[NETWORK_INTERFACE][association["NetworkInterfaceId"]]["Attachment"]
+            if attachment is not None:
+                description["InstanceId"] = attachment["InstanceId"]
+
+        return description
+
+    def __get_instance_state(self, record):
+        """Get the state of an instance from its lifecycle times
+
+        Args:
+            record (dict): Instance record
+
+        Returns:
+            string: Instance state name
+        """
+        now = self.now()
+        if record["TerminatedAt"] is not None:
+            return "terminated" if now >= record["TerminatedAt"] else "shutting-down"
+        return "running" if now >= record["RunningAt"] else "pending"
+
+    def __build_instance(self, record):
+        description = copy.deepcopy(record["Description"])
+        state = self.__get_instance_state(record)
+        description["State"] = {
+            "Code": INSTANCE_STATE_CODES[state],
+            "Name": state
+        }
+
+        description["NetworkInterfaces"] = []
+        for eni_id in record["NetworkInterfaceIds"]:
+            eni = self.__build_network_interface(self.resources[NETWORK_INTERFACE][eni_id])
+            description["NetworkInterfaces"].append(eni)
+            if eni["Attachment"]["DeviceIndex"] == 0 and "Association" in eni:
+                description["PublicIpAddress"] = eni["Association"]["PublicIp"]
+                description["PublicDnsName"] = eni["Association"]["PublicDnsName"]
+        description["NetworkInterfaces"].sort(key=lambda eni: eni["Attachment"]["DeviceIndex"])
+
+        return description
+
+    def __create_image(self, image):
+        image_id = image.get("ImageId") or self.__new_id("ami")
+        self.__add(IMAGE, image_id, merge_dicts({
+            "ImageId": image_id,
+            "Architecture": "x86_64",
+            "CreationDate": self.__timestamp(),
+            "Hypervisor": "xen",
+            "ImageType": "machine",
+            "OwnerId": ACCOUNT_ID,
+            "Public": False,
+            "RootDeviceName": "/dev/xvda",
+            "RootDeviceType": "ebs",
+            "State": "available",
+            "VirtualizationType": "hvm",
+            "Tags": []
+        }, image))
+        self.resources[IMAGE][image_id]["VisibleAt"] = 0
+
+    # Availability zones and images
+
+    def _describe_availability_zones(self, params):
+        zone_id_prefix = self.region.split("-")[0] + "".join(part[0] for part in self.region.split("-")[1:-1]) + \
+            self.region.split("-")[-1]
+        availability_zones = [
+            {
+                "ZoneName": zone_name,
+                "ZoneId": "{0}-az{1}".format(zone_id_prefix, index + 1),
+                "State": "available",
+                "RegionName": self.region,
+                "GroupName": self.region,
+                "NetworkBorderGroup": self.region,
+                "OptInStatus": "opt-in-not-required",
+                "ZoneType": "availability-zone",
+                "Messages": []
+            }
+            for index, zone_name in enumerate(self.availability_zones)
+            if not params.get("ZoneNames") or zone_name in params["ZoneNames"]
+        ]
+
+        return {
+            "AvailabilityZones": self.__filter(AVAILABILITY_ZONE, availability_zones, params.get("Filters"))
+        }
+
+    def _describe_images(self, params):
+        images = self.__describe(IMAGE, params, "ImageIds")
+        if params.get("Owners"):
+            owners = set(ACCOUNT_ID if owner == "self" else owner for owner in params["Owners"])
+            images = [image for image in images if image["OwnerId"] in owners]
+
+        return {
+            "Images": images
+        }
+
+    # Vpcs
+
+    def _describe_vpcs(self, params):
+        return self.__paginate(self.__describe(VPC, params, "VpcIds"), params, "Vpcs")
+
+    def _create_vpc(self, params):
+        self.__check_quota("vpcs", len(self.resources[VPC]) + 1, "VpcLimitExceeded",
+                           "The maximum number of VPCs has been reached.")
+        network, size = self.__parse_cidr_block(params["CidrBlock"], "InvalidVpc.Range")
+
+        vpc_id = self.__new_id("vpc")
+        cidr_block = "{0}/{1}".format(int_to_ip(network), params["CidrBlock"].split("/")[1])
+        self.__add(VPC, vpc_id, {
+            "VpcId": vpc_id,
+            "CidrBlock": cidr_block,
+            "CidrBlockAssociationSet": [
+                {
+                    "AssociationId": self.__new_id("vpc-cidr-assoc"),
+                    "CidrBlock": cidr_block,
+                    "CidrBlockState": {
+                        "State": "associated"
+                    }
+                }
+            ],
+            "DhcpOptionsId": self.__new_id("dopt"),
+            "InstanceTenancy": "default",
+            "IsDefault": False,
+            "OwnerId": ACCOUNT_ID,
+            "State": "available",
+            "Tags": []
+        }, Network=network, Size=size)
+        if params.get("AmazonProvidedIpv6CidrBlock"):
+            self.resources[VPC][vpc_id]["Description"]["Ipv6CidrBlockAssociationSet"] = [
+                self.__build_vpc_ipv6_cidr_block_association()]
+
+        # The main route table, the default network acl and the default security group
+        self.__add_route_table(vpc_id, main=True)
+        self.__add_network_acl(vpc_id, default=True)
+        self.__add_security_group(vpc_id, "default", "default VPC security group", default=True)
+
+        return {
+            "Vpc": self.resources[VPC][vpc_id]["Description"]
+        }
+
+    def __build_vpc_ipv6_cidr_block_association(self):
+        """Build the association of a new Amazon provided /56 ipv6 cidr block to a vpc
+
+        Returns:
+            dict: Ipv6 cidr block association description
+        """
+        return {
+            "AssociationId": self.__new_id("vpc-cidr-assoc"),
+            "Ipv6CidrBlock": "2600:1f18:{0:x}:{1:x}00::/56".format(
+                self.random.getrandbits(16), self.random.getrandbits(8)),
+            "Ipv6CidrBlockState": {
+                "State": "associated"
+            },
+            "Ipv6Pool": "Amazon",
+            "NetworkBorderGroup": self.region
+        }
+
+    def _associate_vpc_cidr_block(self, params):
+        vpc = self.__get(VPC, params["VpcId"])
+        if not params.get("AmazonProvidedIpv6CidrBlock"):
+            raise SimulatedError("InvalidParameterCombination",
+                                 "Only the Amazon provided ipv6 cidr blocks are simulated.")
+        if vpc["Description"].get("Ipv6CidrBlockAssociationSet"):
+            raise SimulatedError("CidrLimitExceeded", "This network '{0}' has met its maximum number of allowed "
+                                 "CIDRs: 1".format(params["VpcId"]))
+
+        association = self.__build_vpc_ipv6_cidr_block_association()
+        vpc["Description"]["Ipv6CidrBlockAssociationSet"] = [association]
+
+        return {
+            "Ipv6CidrBlockAssociation": copy.deepcopy(association),
+            "VpcId": params["VpcId"]
+        }
+
+    def _delete_vpc(self, params):
+        vpc_id = params["VpcId"]
+        self.__get(VPC, vpc_id)
+
+        dependencies = (
+            self.__find(SUBNET, VpcId=vpc_id) +
+            [record for record in self.__find(SECURITY_GROUP, VpcId=vpc_id) if not record["Default"]] +
+            [record for record in self.__find(ROUTE_TABLE, VpcId=vpc_id) if not record["Main"]] +
+            [record for record in self.__find(NETWORK_ACL, VpcId=vpc_id) if not record["Description"]["IsDefault"]] +
+            [record for record in self.resources[INTERNET_GATEWAY].values()
+             if any(attachment["VpcId"] == vpc_id for attachment in record["Description"]["Attachments"])]
+        )
+        if dependencies:
+            raise SimulatedError("DependencyViolation",
+                                 "The vpc '{0}' has dependencies and cannot be deleted.".format(vpc_id))
+
+        for resource_type in [SECURITY_GROUP, ROUTE_TABLE, NETWORK_ACL]:
+            for resource_id, record in list(self.resources[resource_type].items()):
+                if record["Description"]["VpcId"] == vpc_id:
+                    del self.resources[resource_type][resource_id]
+        del self.resources[VPC][vpc_id]
+
+        return {
+            "Return": True
+        }
+
+    @staticmethod
+    def __parse_cidr_block(cidr_block, range_error_code):
+        """Parse a vpc or subnet cidr block
+
+        Args:
+            cidr_block (string): Cidr block
+            range_error_code (string): Error code of a block size out of the /16 to /28 range
+
+        Returns:
+            tuple: Network first ip as an integer and ips count
+        """
+        ip, _, suffix = cidr_block.partition("/")
+        if not suffix.isdigit() or not 16 <= int(suffix) <= 28:
+            raise SimulatedError(range_error_code, "The CIDR '{0}' is invalid.".format(cidr_block))
+
+        size = 2 ** (32 - int(suffix))
+        return ip_to_int(ip) & ~(size - 1), size
+
+    # Internet gateways
+
+    def _describe_internet_gateways(self, params):
+        return self.__paginate(
+            self.__describe(INTERNET_GATEWAY, params, "InternetGatewayIds"), params, "InternetGateways")
+
+    def _create_internet_gateway(self, params):
+        self.__check_quota("internet_gateways", len(self.resources[INTERNET_GATEWAY]) + 1,
+                           "InternetGatewayLimitExceeded", "The maximum number of internet gateways has been reached.")
+
+        internet_gateway_id = self.__new_id("igw")
+        self.__add(INTERNET_GATEWAY, internet_gateway_id, {
+            "InternetGatewayId": internet_gateway_id,
+            "Attachments": [],
+            "OwnerId": ACCOUNT_ID,
+            "Tags": []
+        })
+
+        return {
+            "InternetGateway": self.resources[INTERNET_GATEWAY][internet_gateway_id]["Description"]
+        }
+
+    def _attach_internet_gateway(self, params):
+        internet_gateway = self.__get(INTERNET_GATEWAY, params["InternetGatewayId"])
+        self.__get(VPC, params["VpcId"])
+
+        if internet_gateway["Description"]["Attachments"] or self.__get_vpc_internet_gateway(params["VpcId"]):
+            raise SimulatedError("Resource.AlreadyAssociated", "resource {0} is already attached to network {1}".format(
+                params["InternetGatewayId"], params["VpcId"]))
+
+        internet_gateway["Description"]["Attachments"].append({
+            "State": "available",
+            "VpcId": params["VpcId"]
+        })
+
+        return {}
+
+    def _detach_internet_gateway(self, params):
+        internet_gateway = self.__get(INTERNET_GATEWAY, params["InternetGatewayId"])
+        attachments = internet_gateway["Description"]["Attachments"]
+        if not any(attachment["VpcId"] == params["VpcId"] for attachment in attachments):
+            raise SimulatedError("Gateway.NotAttached", "resource {0} is not attached to network {1}".format(
+                params["InternetGatewayId"], params["VpcId"]))
+
+        # The public ips of the vpc network interfaces must be released first
+        for eni_id, private_ip in self.associations:
+            if self.resources[NETWORK_INTERFACE][eni_id]["Description"]["VpcId"] == params["VpcId"]:
+                raise SimulatedError("DependencyViolation", "Network {0} has some mapped public address(es). "
+                                     "Please unmap those public address(es) before detaching the gateway.".format(
+                                         params["VpcId"]))
+
+        internet_gateway["Description"]["Attachments"] = [
+            attachment for attachment in attachments if attachment["VpcId"] != params["VpcId"]]
+
+        return {}
+
+    def _delete_internet_gateway(self, params):
+        internet_gateway = self.__get(INTERNET_GATEWAY, params["InternetGatewayId"])
+        if internet_gateway["Description"]["Attachments"]:
+            raise SimulatedError("DependencyViolation", "The internetGateway '{0}' has dependencies and cannot be "
+                                 "deleted.".format(params["InternetGatewayId"]))
+
+        # The routes through the gateway are left as blackholes
+        for route_table in self.resources[ROUTE_TABLE].values():
+            for route in route_table["Description"]["Routes"]:
+                if route.get("GatewayId") == params["InternetGatewayId"]:
+                    route["State"] = "blackhole"
+        del self.resources[INTERNET_GATEWAY][params["InternetGatewayId"]]
+
+        return {}
+
+    def __get_vpc_internet_gateway(self, vpc_id):
+        """Get the internet gateway attached to a vpc
+
+        Args:
+            vpc_id (string): Vpc ID
+
+        Returns:
+            string: Internet gateway ID, None when there is none
+        """
+        for internet_gateway_id, record in self.resources[INTERNET_GATEWAY].items():
+            if any(attachment["VpcId"] == vpc_id for attachment in record["Description"]["Attachments"]):
+                return internet_gateway_id
+
+        return None
+
+    # Subnets
+
+    def _describe_subnets(self, params):
+        return self.__paginate(self.__describe(SUBNET, params, "SubnetIds"), params, "Subnets")
+
+    def _create_subnet(self, params):
+        vpc = self.__get(VPC, params["VpcId"])
+        network, size = self.__parse_cidr_block(params["CidrBlock"], "InvalidSubnet.Range")
+        if network < vpc["Network"] or network + size > vpc["Network"] + vpc["Size"]:
+            raise SimulatedError("InvalidSubnet.Range", "The CIDR '{0}' is invalid.".format(params["CidrBlock"]))
+
+        vpc_subnets = [record for record in self.resources[SUBNET].values()
+                       if record["Description"]["VpcId"] == params["VpcId"]]
+        for subnet in vpc_subnets:
+            if network < subnet["Network"] + subnet["Size"] and subnet["Network"] < network + size:
+                raise SimulatedError("InvalidSubnet.Conflict", "The CIDR '{0}' conflicts with another subnet".format(
+                    params["CidrBlock"]))
+        self.__check_quota("subnets_per_vpc", len(vpc_subnets) + 1, "SubnetLimitExceeded",
+                           "The maximum number of subnets has been reached.")
+
+        if params.get("Ipv6CidrBlock"):
+            self.__check_subnet_ipv6_cidr_block(vpc, vpc_subnets, params["Ipv6CidrBlock"])
+
+        availability_zone = params.get("AvailabilityZone") or self.random.choice(self.availability_zones)
+        if availability_zone not in self.availability_zones:
+            raise SimulatedError("InvalidParameterValue", "Value ({0}) for parameter availabilityZone is invalid. "
+                                 "Subnets can currently only be created in the following availability zones: "
+                                 "{1}.".format(availability_zone, ", ".join(self.availability_zones)))
+
+        subnet_id = self.__new_id("subnet")
+        self.__add(SUBNET, subnet_id, {
+            "SubnetId": subnet_id,
+            "SubnetArn": "arn:aws:ec2:{0}:{1}:subnet/{2}".format(self.region, ACCOUNT_ID, subnet_id),
+            "VpcId": params["VpcId"],
+            "CidrBlock": "{0}/{1}".format(int_to_ip(network), params["CidrBlock"].split("/")[1]),
+            "AvailabilityZone": availability_zone,
+            "AvailabilityZoneId": self._describe_availability_zones({"ZoneNames": [availability_zone]})[
+                "AvailabilityZones"][0]["ZoneId"],
+            # The first four ips and the last one are reserved
+            "AvailableIpAddressCount": size - 5,
+            "DefaultForAz": False,
+            "MapPublicIpOnLaunch": False,
+            "OwnerId": ACCOUNT_ID,
+            "State": "available",
+            "Tags": []
+        }, Network=network, Size=size, UsedIps=set(), NextIp=network + 4, Ipv6Network=None, NextIpv6=4)
+        if params.get("Ipv6CidrBlock"):
+            self.__set_subnet_ipv6_cidr_block(self.resources[SUBNET][subnet_id], params["Ipv6CidrBlock"])
+
+        # The subnets are associated to the default network acl
+        for network_acl in self.__find(NETWORK_ACL, VpcId=params["VpcId"], IsDefault=True):
+            network_acl["Description"]["Associations"].append({
+                "NetworkAclAssociationId": self.__new_id("aclassoc"),
+                "NetworkAclId": network_acl["Description"]["NetworkAclId"],
+                "SubnetId": subnet_id
+            })
+
+        return {
+            "Subnet": self.resources[SUBNET][subnet_id]["Description"]
+        }
+
+    def __check_subnet_ipv6_cidr_block(self, vpc, vpc_subnets, ipv6_cidr_block):
+        """Check that a subnet ipv6 cidr block is a free /64 of its vpc ipv6 cidr block
+
+        Args:
+            vpc (dict): Vpc record
+            vpc_subnets (list): Vpc subnets records
+            ipv6_cidr_block (string): Subnet ipv6 cidr block
+
+        Raises:
+            SimulatedError: The ipv6 cidr block is invalid or already used
+        """
+        vpc_associations = vpc["Description"].get("Ipv6CidrBlockAssociationSet", [])
+        network, prefix = ipv6_cidr_block.split("/")
+        if not vpc_associations or prefix != "64" or \
+                ipv6_to_int(network) >> 72 != ipv6_to_int(vpc_associations[0]["Ipv6CidrBlock"].split("/")[0]) >> 72:
+            raise SimulatedError("InvalidSubnet.Range", "The CIDR '{0}' is invalid.".format(ipv6_cidr_block))
+        if any(subnet["Ipv6Network"] == ipv6_to_int(network) for subnet in vpc_subnets):
+            raise SimulatedError("InvalidSubnet.Conflict", "The CIDR '{0}' conflicts with another subnet".format(
+                ipv6_cidr_block))
+
+    def __set_subnet_ipv6_cidr_block(self, subnet, ipv6_cidr_block):
+        """Associate an ipv6 cidr block to a subnet
+
+        Args:
+            subnet (dict): Subnet record
+            ipv6_cidr_block (string): Subnet ipv6 cidr block
+
+        Returns:
+            dict: Ipv6 cidr block association description
+        """
+        subnet["Ipv6Network"] = ipv6_to_int(ipv6_cidr_block.split("/")[0])
+        association = {
+            "AssociationId": self.__new_id("subnet-cidr-assoc"),
+            "Ipv6CidrBlock": ipv6_cidr_block,
+            "Ipv6CidrBlockState": {
+                "State": "associated"
+            }
+        }
+        subnet["Description"]["Ipv6CidrBlockAssociationSet"] = [association]
+        subnet["Description"]["AssignIpv6AddressOnCreation"] = False
+
+        return association
+
+    def _associate_subnet_cidr_block(self, params):
+        subnet = self.__get(SUBNET, params["SubnetId"])
+        if subnet["Ipv6Network"] is not None:
+            raise SimulatedError("CidrLimitExceeded", "The subnet '{0}' already has an ipv6 cidr block.".format(
+                params["SubnetId"]))
+        vpc = self.__get(VPC, subnet["Description"]["VpcId"])
+        self.__check_subnet_ipv6_cidr_block(vpc, [
+            record for record in self.resources[SUBNET].values()
+            if record["Description"]["VpcId"] == subnet["Description"]["VpcId"]
+        ], params["Ipv6CidrBlock"])
+
+        return {
+            "Ipv6CidrBlockAssociation": copy.deepcopy(self.__set_subnet_ipv6_cidr_block(
+                subnet, params["Ipv6CidrBlock"])),
+            "SubnetId": params["SubnetId"]
+        }
+
+    def _delete_subnet(self, params):
+        subnet_id = params["SubnetId"]
+        self.__get(SUBNET, subnet_id)
+        if any(record["Description"]["SubnetId"] == subnet_id for record in self.resources[NETWORK_INTERFACE].values()):
+            raise SimulatedError("DependencyViolation",
+                                 "The subnet '{0}' has dependencies and cannot be deleted.".format(subnet_id))
+
+        for resource_type in [ROUTE_TABLE, NETWORK_ACL]:
+            for record in self.resources[resource_type].values():
+                record["Description"]["Associations"] = [
+                    association for association in record["Description"]["Associations"]
+                    if association.get("SubnetId") != subnet_id
+                ]
+        del self.resources[SUBNET][subnet_id]
+
+        return {}
+
+    def __allocate_private_ips(self, subnet, count):
+        """Allocate free private ips of a subnet
+
+        Args:
+            subnet (dict): Subnet record
+            count (integer): Private ips count
+
+        Returns:
+            list: Private ips
+
+        Raises:
+            SimulatedError: Not enough free ips
+        """
+        first_ip, last_ip = subnet["Network"] + 4, subnet["Network"] + subnet["Size"] - 2
+        if subnet["Description"]["AvailableIpAddressCount"] < count:
+            raise SimulatedError("InsufficientFreeAddressesInSubnet",
+                                 "The specified subnet does not have enough free addresses to satisfy the request.")
+
+        private_ips = []
+        while len(private_ips) < count:
+            value = subnet["NextIp"]
+            subnet["NextIp"] = value + 1 if value < last_ip else first_ip
+            if value not in subnet["UsedIps"]:
+                subnet["UsedIps"].add(value)
+                private_ips.append(int_to_ip(value))
+        subnet["Description"]["AvailableIpAddressCount"] = subnet["Description"]["AvailableIpAddressCount"] - count
+
+        return private_ips
+
+    # Security groups
+
+    def _describe_security_groups(self, params):
+        if params.get("GroupNames"):
+            params["Filters"] = (params.get("Filters") or []) + [
+                {
+                    "Name": "group-name",
+                    "Values": params["GroupNames"]
+                }
+            ]
+
+        return self.__paginate(self.__describe(SECURITY_GROUP, params, "GroupIds"), params, "SecurityGroups")
+
+    def _create_security_group(self, params):
+        if "VpcId" not in params:
+            raise SimulatedError("VPCIdNotSpecified", "No default VPC for this user.")
+        self.__get(VPC, params["VpcId"])
+        if self.__find(SECURITY_GROUP, VpcId=params["VpcId"], GroupName=params["GroupName"]):
+            raise SimulatedError("InvalidGroup.Duplicate", "The security group '{0}' already exists for VPC "
+                                 "'{1}'".format(params["GroupName"], params["VpcId"]))
+        self.__check_quota("security_groups", len(self.resources[SECURITY_GROUP]) + 1, "SecurityGroupLimitExceeded",
+                           "The maximum number of security groups has been reached.")
+
+        group_id = self.__add_security_group(params["VpcId"], params["GroupName"], params["Description"])
+
+        return {
+            "GroupId": group_id
+        }
+
+    def __add_security_group(self, vpc_id, group_name, description, default=False):
+        group_id = self.__new_id("sg")
+        self.__add(SECURITY_GROUP, group_id, {
+            "GroupId": group_id,
+            "GroupName": group_name,
+            "Description": description,
+            "OwnerId": ACCOUNT_ID,
+            "VpcId": vpc_id,
+            "Tags": []
+        }, Default=default, EgressRules=set([("-1", None, None, "IpRanges", "0.0.0.0/0")]),
+            IngressRules=set([("-1", None, None, "UserIdGroupPairs", group_id)]) if default else set())
+
+        return group_id
+
+    def _delete_security_group(self, params):
+        security_group = self.__get(SECURITY_GROUP, params["GroupId"])
+        if security_group["Default"]:
+            raise SimulatedError("CannotDelete", "the specified group: \"{0}\" name: \"default\" cannot be deleted by "
+                                 "a user".format(params["GroupId"]))
+        if any(any(group["GroupId"] == params["GroupId"] for group in record["Description"]["Groups"])
+               for record in self.resources[NETWORK_INTERFACE].values()):
+            raise SimulatedError("DependencyViolation", "resource {0} has a dependent object".format(params["GroupId"]))
+        del self.resources[SECURITY_GROUP][params["GroupId"]]
+
+        return {
+            "Return": True
+        }
+
+    def _authorize_security_group_ingress(self, params):
+        return self.__authorize_rules(params, "IngressRules")
+
+    def _authorize_security_group_egress(self, params):
+        return self.__authorize_rules(params, "EgressRules")
+
+    def _revoke_security_group_ingress(self, params):
+        return self.__revoke_rules(params, "IngressRules")
+
+    def _revoke_security_group_egress(self, params):
+        return self.__revoke_rules(params, "EgressRules")
+
+    def __authorize_rules(self, params, rules_key):
+        security_group = self.__get(SECURITY_GROUP, params["GroupId"])
+        rules = SecurityGroups.normalize_ip_permissions(params.get("IpPermissions", []))
+        if rules & security_group[rules_key]:
+            raise SimulatedError("InvalidPermission.Duplicate", "the specified rule already exists")
+        self.__check_quota("rules_per_security_group", len(security_group[rules_key] | rules),
+                           "RulesPerSecurityGroupLimitExceeded", "The maximum number of rules per security group "
+                           "has been reached.")
+        security_group[rules_key] = security_group[rules_key] | rules
+
+        return {
+            "Return": True
+        }
+
+    def __revoke_rules(self, params, rules_key):
+        security_group = self.__get(SECURITY_GROUP, params["GroupId"])
+        rules = SecurityGroups.normalize_ip_permissions(params.get("IpPermissions", []))
+        if rules - security_group[rules_key]:
+            raise SimulatedError("InvalidPermission.NotFound",
+                                 "The specified rule does not exist in this security group.")
+        security_group[rules_key] = security_group[rules_key] - rules
+
+        return {
+            "Return": True
+        }
+
+    # Route tables
+
+    def _describe_route_tables(self, params):
+        return self.__paginate(self.__describe(ROUTE_TABLE, params, "RouteTableIds"), params, "RouteTables")
+
+    def _create_route_table(self, params):
+        self.__get(VPC, params["VpcId"])
+        self.__check_quota("route_tables_per_vpc", len(self.__find(ROUTE_TABLE, VpcId=params["VpcId"])) + 1,
+                           "RouteTableLimitExceeded", "The maximum number of route tables has been reached.")
+        route_table_id = self.__add_route_table(params["VpcId"])
+
+        return {
+            "RouteTable": self.resources[ROUTE_TABLE][route_table_id]["Description"]
+        }
+
+    def __add_route_table(self, vpc_id, main=False):
+        route_table_id = self.__new_id("rtb")
+        associations = []
+        if main:
+            associations.append({
+                "Main": True,
+                "RouteTableAssociationId": self.__new_id("rtbassoc"),
+                "RouteTableId": route_table_id,
+                "AssociationState": {
+                    "State": "associated"
+                }
+            })
+
+        self.__add(ROUTE_TABLE, route_table_id, {
+            "RouteTableId": route_table_id,
+            "VpcId": vpc_id,
+            "Associations": associations,
+            "OwnerId": ACCOUNT_ID,
+            "PropagatingVgws": [],
+            "Routes": [
+                {
+                    "DestinationCidrBlock": self.resources[VPC][vpc_id]["Description"]["CidrBlock"],
+                    "GatewayId": "local",
+                    "Origin": "CreateRouteTable",
+                    "State": "active"
+                }
+            ],
+            "Tags": []
+        }, Main=main)
+
+        return route_table_id
+
+    def _delete_route_table(self, params):
+        route_table = self.__get(ROUTE_TABLE, params["RouteTableId"])
+        if route_table["Description"]["Associations"]:
+            raise SimulatedError("DependencyViolation", "The routeTable '{0}' has dependencies and cannot be "
+                                 "deleted.".format(params["RouteTableId"]))
+        del self.resources[ROUTE_TABLE][params["RouteTableId"]]
+
+        return {}
+
+    def _associate_route_table(self, params):
+        route_table = self.__get(ROUTE_TABLE, params["RouteTableId"])
+        subnet = self.__get(SUBNET, params["SubnetId"])
+        if subnet["Description"]["VpcId"] != route_table["Description"]["VpcId"]:
+            raise SimulatedError("InvalidParameterValue", "Route table {0} and subnet {1} belong to different "
+                                 "networks".format(params["RouteTableId"], params["SubnetId"]))
+        for record in self.resources[ROUTE_TABLE].values():
+            if any(association.get("SubnetId") == params["SubnetId"]
+                   for association in record["Description"]["Associations"]):
+                raise SimulatedError("Resource.AlreadyAssociated", "the specified association for route table {0} "
+                                     "conflicts with an existing association".format(params["RouteTableId"]))
+
+        association_id = self.__new_id("rtbassoc")
+        route_table["Description"]["Associations"].append({
+            "Main": False,
+            "RouteTableAssociationId": association_id,
+            "RouteTableId": params["RouteTableId"],
+            "SubnetId": params["SubnetId"],
+            "AssociationState": {
+                "State": "associated"
+            }
+        })
+
+        return {
+            "AssociationId": association_id,
+            "AssociationState": {
+                "State": "associated"
+            }
+        }
+
+    def _disassociate_route_table(self, params):
+        for record in self.resources[ROUTE_TABLE].values():
+            associations = record["Description"]["Associations"]
+            for association in associations:
+                if association["RouteTableAssociationId"] != params["AssociationId"]:
+                    continue
+                if association["Main"]:
+                    raise SimulatedError("InvalidParameterValue", "cannot disassociate the main route table "
+                                         "association {0}".format(params["AssociationId"]))
+                associations.remove(association)
+                return {}
+
+        raise SimulatedError("InvalidAssociationID.NotFound", "The association ID '{0}' does not exist".format(
+            params["AssociationId"]))
+
+    def __get_route(self, params):
+        """Get a route table and the position of its route to a destination
+
+        Args:
+            params (dict): Route parameters
+
+        Returns:
+            tuple: Route table record and route position (None without a route)
+        """
+        route_table = self.__get(ROUTE_TABLE, params["RouteTableId"])
+        destination_key = "DestinationIpv6CidrBlock" if "DestinationIpv6CidrBlock" in params else \
+            "DestinationCidrBlock"
+        for position, route in enumerate(route_table["Description"]["Routes"]):
+            if route.get(destination_key) == params.get(destination_key):
+                return route_table, position
+
+        return route_table, None
+
+    def __build_route(self, route_table, params):
+        """Build an internet gateway route
+
+        Args:
+            route_table (dict): Route table record
+            params (dict): Route parameters
+
+        Returns:
+            dict: Route description
+
+        Raises:
+            SimulatedError: The gateway is not attached to the route table vpc
+        """
+        self.__get(INTERNET_GATEWAY, params["GatewayId"])
+        if self.__get_vpc_internet_gateway(route_table["Description"]["VpcId"]) != params["GatewayId"]:
+            raise SimulatedError("InvalidParameterValue", "route table {0} and network gateway {1} belong to "
+                                 "different networks".format(params["RouteTableId"], params["GatewayId"]))
+
+        route = {
+            "GatewayId": params["GatewayId"],
+            "Origin": "CreateRoute",
+            "State": "active"
+        }
+        for destination_key in ("DestinationCidrBlock", "DestinationIpv6CidrBlock"):
+            if destination_key in params:
+                route[destination_key] = params[destination_key]
+
+        return route
+
+    def _create_route(self, params):
+        route_table, position = self.__get_route(params)
+        if position is not None:
+            raise SimulatedError("RouteAlreadyExists", "The route identified by {0} already exists.".format(
+                params.get("DestinationCidrBlock") or params.get("DestinationIpv6CidrBlock")))
+        self.__check_quota("routes_per_route_table", len(route_table["Description"]["Routes"]) + 1,
+                           "RouteLimitExceeded", "The maximum number of routes has been reached.")
+        route_table["Description"]["Routes"].append(self.__build_route(route_table, params))
+
+        return {
+            "Return": True
+        }
+
+    def _replace_route(self, params):
+        route_table, position = self.__get_route(params)
+        if position is None:
+            raise SimulatedError("InvalidParameterValue", "There is no route defined for '{0}' in the route "
+                                 "table.".format(params.get("DestinationCidrBlock") or
+                                                 params.get("DestinationIpv6CidrBlock")))
+        route_table["Description"]["Routes"][position] = self.__build_route(route_table, params)
+
+        return {}
+
+    def _delete_route(self, params):
+        route_table, position = self.__get_route(params)
+        if position is None or route_table["Description"]["Routes"][position].get("GatewayId") == "local":
+            raise SimulatedError("InvalidRoute.NotFound", "no route with destination-cidr-block {0} in route table "
+                                 "{1}".format(params.get("DestinationCidrBlock") or
+                                              params.get("DestinationIpv6CidrBlock"), params["RouteTableId"]))
+        del route_table["Description"]["Routes"][position]
+
+        return {}
+
+    # Network acls
+
+    def _describe_network_acls(self, params):
+        return self.__paginate(self.__describe(NETWORK_ACL, params, "NetworkAclIds"), params, "NetworkAcls")
+
+    def _create_network_acl(self, params):
+        self.__get(VPC, params["VpcId"])
+        self.__check_quota("network_acls_per_vpc", len(self.__find(NETWORK_ACL, VpcId=params["VpcId"])) + 1,
+                           "NetworkAclLimitExceeded", "The maximum number of network acls has been reached.")
+        network_acl_id = self.__add_network_acl(params["VpcId"])
+
+        return {
+            "NetworkAcl": self.resources[NETWORK_ACL][network_acl_id]["Description"]
+        }
+
+    def __add_network_acl(self, vpc_id, default=False):
+        network_acl_id = self.__new_id("acl")
+        entries = []
+        for egress in [True, False]:
+            if default:
+                entries.append({
+                    "CidrBlock": "0.0.0.0/0",
+                    "Egress": egress,
+                    "Protocol": "-1",
+                    "RuleAction": "allow",
+                    "RuleNumber": 100
+                })
+            entries.append({
+                "CidrBlock": "0.0.0.0/0",
+                "Egress": egress,
+                "Protocol": "-1",
+                "RuleAction": "deny",
+                "RuleNumber": 32767
+            })
+
+        self.__add(NETWORK_ACL, network_acl_id, {
+            "NetworkAclId": network_acl_id,
+            "VpcId": vpc_id,
+            "Associations": [],
+            "Entries": entries,
+            "IsDefault": default,
+            "OwnerId": ACCOUNT_ID,
+            "Tags": []
+        })
+
+        return network_acl_id
+
+    def _delete_network_acl(self, params):
+        network_acl = self.__get(NETWORK_ACL, params["NetworkAclId"])
+        if network_acl["Description"]["IsDefault"]:
+            raise SimulatedError("InvalidParameterValue", "cannot delete default network ACL {0}".format(
+                params["NetworkAclId"]))
+        if network_acl["Description"]["Associations"]:
+            raise SimulatedError("DependencyViolation", "The networkAcl '{0}' has dependencies and cannot be "
+                                 "deleted.".format(params["NetworkAclId"]))
+        del self.resources[NETWORK_ACL][params["NetworkAclId"]]
+
+        return {}
+
+    # Network interfaces
+
+    def _describe_network_interfaces(self, params):
+        return self.__paginate(
+            self.__describe(NETWORK_INTERFACE, params, "NetworkInterfaceIds"), params, "NetworkInterfaces")
+
+    def _create_network_interface(self, params):
+        subnet = self.__get(SUBNET, params["SubnetId"])
+        eni_id = self.__add_network_interface(
+            subnet, params.get("SecondaryPrivateIpAddressCount", 0), params.get("Groups"),
+            params.get("Description", ""), params.get("Ipv6AddressCount", 0))
+
+        return {
+            "NetworkInterface": self.__build_network_interface(self.resources[NETWORK_INTERFACE][eni_id])
+        }
+
+    def __add_network_interface(self, subnet, secondary_private_ips_count=0, groups_ids=None, description="",
+                                ipv6_addresses_count=0):
+        """Add a network interface to a subnet
+
+        Args:
+            subnet (dict): Subnet record
+            secondary_private_ips_count (integer, optional): Secondary private ips count
+            groups_ids (list, optional): Security groups IDs. Defaults to the vpc default security group
+            description (string, optional): Description
+            ipv6_addresses_count (integer, optional): Ipv6 addresses count, from the subnet ipv6 cidr block
+
+        Returns:
+            string: Network interface ID
+        """
+        vpc_id = subnet["Description"]["VpcId"]
+        self.__check_quota("network_interfaces", len(self.resources[NETWORK_INTERFACE]) + 1,
+                           "NetworkInterfaceLimitExceeded", "The maximum number of network interfaces has been "
+                           "reached.")
+        self.__check_quota("private_ips_per_network_interface", secondary_private_ips_count + 1,
+                           "PrivateIpAddressLimitExceeded", "Number of private addresses will exceed limit.")
+        if ipv6_addresses_count:
+            if subnet["Ipv6Network"] is None:
+                raise SimulatedError("InvalidParameterValue", "You specified ipv6 addresses but the subnet '{0}' "
+                                     "has no ipv6 cidr block.".format(subnet["Description"]["SubnetId"]))
+            # The ipv6 addresses per network interface are limited as the ipv4 ones
+            self.__check_quota("private_ips_per_network_interface", ipv6_addresses_count,
+                               "PrivateIpAddressLimitExceeded", "Number of ipv6 addresses will exceed limit.")
+
+        if groups_ids:
+            groups = [self.__get(SECURITY_GROUP, group_id)["Description"] for group_id in groups_ids]
+        else:
+            groups = [record["Description"] for record in self.__find(SECURITY_GROUP, VpcId=vpc_id)
+                      if record["Default"]]
+        private_ips = self.__allocate_private_ips(subnet, secondary_private_ips_count + 1)
+        # The /64 is never exhausted, the ipv6 addresses are not reused
+        ipv6_addresses = []
+        for index in range(ipv6_addresses_count):
+            ipv6_addresses.append({
+                "Ipv6Address": int_to_ipv6(subnet["Ipv6Network"] + subnet["NextIpv6"])
+            })
+            subnet["NextIpv6"] = subnet["NextIpv6"] + 1
+
+        eni_id = self.__new_id("eni")
+        self.__add(NETWORK_INTERFACE, eni_id, {
+            "NetworkInterfaceId": eni_id,
+            "SubnetId": subnet["Description"]["SubnetId"],
+            "VpcId": vpc_id,
+            "AvailabilityZone": subnet["Description"]["AvailabilityZone"],
+            "Description": description,
+            "Groups": [
+                {
+                    "GroupId": group["GroupId"],
+                    "GroupName": group["GroupName"]
+                }
+                for group in groups
+            ],
+            "InterfaceType": "interface",
+            "MacAddress": ":".join(["0e"] + ["{0:02x}".format(self.random.getrandbits(8)) for index in range(5)]),
+            "OwnerId": ACCOUNT_ID,
+            "PrivateDnsName": "ip-{0}.ec2.internal".format(private_ips[0].replace(".", "-")),
+            "PrivateIpAddress": private_ips[0],
+            "Ipv6Addresses": ipv6_addresses,
+            "RequesterManaged": False,
+            "SourceDestCheck": True,
+            "TagSet": []
+        }, PrivateIps=private_ips, Attachment=None)
+
+        return eni_id
+
+    def _delete_network_interface(self, params):
+        eni = self.__get(NETWORK_INTERFACE, params["NetworkInterfaceId"])
+        if eni["Attachment"] is not None:
+            raise SimulatedError("InvalidNetworkInterface.InUse", "Interface: [{0}] in use.".format(
+                params["NetworkInterfaceId"]))
+        self.__delete_network_interface(eni)
+
+        return {}
+
+    def __delete_network_interface(self, eni):
+        """Delete a network interface, its elastic ips being disassociated
+
+        Args:
+            eni (dict): Network interface record
+        """
+        eni_id = eni["Description"]["NetworkInterfaceId"]
+        subnet = self.resources[SUBNET][eni["Description"]["SubnetId"]]
+        for private_ip in eni["PrivateIps"]:
+            subnet["UsedIps"].discard(ip_to_int(private_ip))
+            allocation_id = self.associations.pop((eni_id, private_ip), None)
+            if allocation_id is not None:
+                self.resources[ADDRESS][allocation_id]["Association"] = None
+        subnet["Description"]["AvailableIpAddressCount"] = \
+            subnet["Description"]["AvailableIpAddressCount"] + len(eni["PrivateIps"])
+        del self.resources[NETWORK_INTERFACE][eni_id]
+
+    def _attach_network_interface(self, params):
+        eni = self.__get(NETWORK_INTERFACE, params["NetworkInterfaceId"])
+        instance = self.__get(INSTANCE, params["InstanceId"])
+        if eni["Attachment"] is not None:
+            raise SimulatedError("InvalidNetworkInterface.InUse", "Interface: [{0}] in use.".format(
+                params["NetworkInterfaceId"]))
+        if self.__get_instance_state(instance) != "running":
+            raise SimulatedError("IncorrectInstanceState", "The instance '{0}' is not in a valid state for this "
+                                 "operation.".format(params["InstanceId"]))
+        if eni["Description"]["AvailabilityZone"] != instance["Description"]["Placement"]["AvailabilityZone"]:
+            raise SimulatedError("InvalidParameterCombination", "You may not attach a network interface to an "
+                                 "instance if they are not in the same availability zone")
+
+        devices_indexes = [self.resources[NETWORK_INTERFACE][eni_id]["Attachment"]["DeviceIndex"]
+                           for eni_id in instance["NetworkInterfaceIds"]]
+        if params["DeviceIndex"] in devices_indexes:
+            raise SimulatedError("InvalidParameterValue", "Instance '{0}' already has an interface attached at "
+                                 "device index '{1}'.".format(params["InstanceId"], params["DeviceIndex"]))
+        self.__check_attachments_limit(instance["Description"]["InstanceType"], len(devices_indexes) + 1)
+
+        attachment_id = self.__attach_network_interface(eni, instance, params["DeviceIndex"])
+
+        return {
+            "AttachmentId": attachment_id,
+            "NetworkCardIndex": 0
+        }
+
+    def __check_attachments_limit(self, instance_type, count):
+        max_enis = self.max_network_interfaces.get(instance_type)
+        if max_enis is not None and count > max_enis:
+            raise SimulatedError("AttachmentLimitExceeded", "Interface count {0} exceeds the limit for {1}".format(
+                count, instance_type))
+
+    def __attach_network_interface(self, eni, instance, device_index, delete_on_termination=False):
+        attachment_id = self.__new_id("eni-attach")
+        eni["Attachment"] = {
+            "AttachmentId": attachment_id,
+            "AttachTime": self.__timestamp(),
+            "DeleteOnTermination": delete_on_termination,
+            "DeviceIndex": device_index,
+            "InstanceId": instance["Description"]["InstanceId"],
+            "InstanceOwnerId": ACCOUNT_ID,
+            "Status": "attached"
+        }
+        instance["NetworkInterfaceIds"].append(eni["Description"]["NetworkInterfaceId"])
+
+        return attachment_id
+
+    def _detach_network_interface(self, params):
+        for eni_id, eni in self.resources[NETWORK_INTERFACE].items():
+            if eni["Attachment"] is None or eni["Attachment"]["AttachmentId"] != params["AttachmentId"]:
+                continue
+            if eni["Attachment"]["DeviceIndex"] == 0:
+                raise SimulatedError("OperationNotPermitted", "The network interface at device index 0 cannot be "
+                                     "detached.")
+            instance = self.resources[INSTANCE][eni["Attachment"]["InstanceId"]]
+            instance["NetworkInterfaceIds"].remove(eni_id)
+            eni["Attachment"] = None
+            return {}
+
+        raise SimulatedError("InvalidAttachmentID.NotFound", "Interface attachment '{0}' does not exist".format(
+            params["AttachmentId"]))
+
+    # Elastic ips
+
+    def _describe_addresses(self, params):
+        if params.get("PublicIps"):
+            params["Filters"] = (params.get("Filters") or []) + [
+                {
+                    "Name": "public-ip",
+                    "Values": params["PublicIps"]
+                }
+            ]
+
+        return {
+            "Addresses": self.__describe(ADDRESS, params, "AllocationIds")
+        }
+
+    def _allocate_address(self, params):
+        self.__check_quota("addresses", len(self.resources[ADDRESS]) + 1, "AddressLimitExceeded",
+                           "The maximum number of addresses has been reached.")
+
+        allocated_public_ips = set(record["Description"]["PublicIp"] for record in self.resources[ADDRESS].values())
+        while True:
+            public_ip = int_to_ip(PUBLIC_IPS_RANGE[0] + self.random.randrange(PUBLIC_IPS_RANGE[1]))
+            if public_ip not in allocated_public_ips:
+                break
+
+        allocation_id = self.__new_id("eipalloc")
+        self.__add(ADDRESS, allocation_id, {
+            "AllocationId": allocation_id,
+            "PublicIp": public_ip,
+            "Domain": "vpc",
+            "NetworkBorderGroup": self.region,
+            "PublicIpv4Pool": "amazon",
+            "Tags": []
+        }, Association=None)
+
+        return {
+            "AllocationId": allocation_id,
+            "PublicIp": public_ip,
+            "Domain": "vpc",
+            "NetworkBorderGroup": self.region,
+            "PublicIpv4Pool": "amazon"
+        }
+
+    def _associate_address(self, params):
+        address = self.__get(ADDRESS, params["AllocationId"])
+        if params.get("NetworkInterfaceId"):
+            eni = self.__get(NETWORK_INTERFACE, params["NetworkInterfaceId"])
+        elif params.get("InstanceId"):
+            instance = self.__get(INSTANCE, params["InstanceId"])
+            eni = [self.resources[NETWORK_INTERFACE][eni_id] for eni_id in instance["NetworkInterfaceIds"]
+                   if self.resources[NETWORK_INTERFACE][eni_id]["Attachment"]["DeviceIndex"] == 0][0]
+        else:
+            raise SimulatedError("MissingParameter", "Either instance ID or network interface ID must be specified.")
+
+        eni_id = eni["Description"]["NetworkInterfaceId"]
+        private_ip = params.get("PrivateIpAddress") or eni["PrivateIps"][0]
+        if private_ip not in eni["PrivateIps"]:
+            raise SimulatedError("InvalidParameterValue", "The private ip '{0}' is not assigned to the network "
+                                 "interface '{1}'".format(private_ip, eni_id))
+        if self.__get_vpc_internet_gateway(eni["Description"]["VpcId"]) is None:
+            raise SimulatedError("Gateway.NotAttached", "Network {0} is not attached to any internet gateway".format(
+                eni["Description"]["VpcId"]))
+        if address["Association"] is not None:
+            if not params.get("AllowReassociation"):
+                raise SimulatedError("Resource.AlreadyAssociated", "resource {0} is already associated with "
+                                     "associate-id {1}".format(params["AllocationId"],
+                                                               address["Association"]["AssociationId"]))
+            del self.associations[(address["Association"]["NetworkInterfaceId"],
+                                   address["Association"]["PrivateIpAddress"])]
+
+        # The elastic ip previously associated to the private ip is disassociated
+        previous_allocation_id = self.associations.get((eni_id, private_ip))
+        if previous_allocation_id is not None:
+            self.resources[ADDRESS][previous_allocation_id]["Association"] = None
+
+        association_id = self.__new_id("eipassoc")
+        address["Association"] = {
+            "AssociationId": association_id,
+            "NetworkInterfaceId": eni_id,
+            "PrivateIpAddress": private_ip
+        }
+        self.associations[(eni_id, private_ip)] = params["AllocationId"]
+
+        return {
+            "AssociationId": association_id
+        }
+
+    def _disassociate_address(self, params):
+        for allocation_id, address in self.resources[ADDRESS].items():
+            association = address["Association"]
+            if association is not None and association["AssociationId"] == params.get("AssociationId"):
+                del self.associations[(association["NetworkInterfaceId"], association["PrivateIpAddress"])]
+                address["Association"] = None
+                return {}
+
+        raise SimulatedError("InvalidAssociationID.NotFound", "The association ID '{0}' does not exist".format(
+            params.get("AssociationId")))
+
+    def _release_address(self, params):
+        address = self.__get(ADDRESS, params["AllocationId"])
+        if address["Association"] is not None:
+            raise SimulatedError("InvalidIPAddress.InUse", "Address {0} is in use.".format(
+                address["Description"]["PublicIp"]))
+        del self.resources[ADDRESS][params["AllocationId"]]
+
+        return {}
+
+    # Tags
+
+    def __get_tagged_resource(self, resource_id):
+        """Get a resource to tag from its ID
+
+        Args:
+            resource_id (string): Resource ID
+
+        Returns:
+            tuple: Resource type and record
+
+        Raises:
+            SimulatedError: Invalid or not found ID
+        """
+        prefix = resource_id.rsplit("-", 1)[0]
+        for resource_type, (id_prefix, not_found_code, arn_type) in RESOURCE_TYPES.items():
+            if prefix == id_prefix:
+                return resource_type, self.__get(resource_type, resource_id)
+
+        raise SimulatedError("InvalidID", "The ID '{0}' is not valid".format(resource_id))
+
+    @staticmethod
+    def __get_tags(record):
+        description = record["Description"]
+        return description["TagSet"] if "TagSet" in description else description["Tags"]
+
+    def _create_tags(self, params):
+        records = [self.__get_tagged_resource(resource_id)[1] for resource_id in params["Resources"]]
+        for record in records:
+            tags = self.__get_tags(record)
+            for tag in params["Tags"]:
+                for existing_tag in tags:
+                    if existing_tag["Key"] == tag["Key"]:
+                        existing_tag["Value"] = tag.get("Value", "")
+                        break
+                else:
+                    tags.append({
+                        "Key": tag["Key"],
+                        "Value": tag.get("Value", "")
+                    })
+            self.__check_quota("tags_per_resource", len(tags), "TagLimitExceeded",
+                               "The maximum number of tags for a resource has been reached.")
+
+        return {}
+
+    def _delete_tags(self, params):
+        records = [self.__get_tagged_resource(resource_id)[1] for resource_id in params["Resources"]]
+        for record in records:
+            tags = self.__get_tags(record)
+            for tag in params.get("Tags") or [{"Key": existing_tag["Key"]} for existing_tag in tags]:
+                tags[:] = [
+                    existing_tag for existing_tag in tags
+                    if existing_tag["Key"] != tag["Key"] or ("Value" in tag and existing_tag["Value"] != tag["Value"])
+                ]
+
+        return {}
+
+    def _get_resources(self, params):
+        resources_types_filters = params.get("ResourceTypeFilters") or []
+        tag_mappings = []
+        for resource_type, (id_prefix, not_found_code, arn_type) in sorted(RESOURCE_TYPES.items()):
+            if resources_types_filters and "ec2" not in resources_types_filters and \
+                    "ec2:" + arn_type not in resources_types_filters:
+                continue
+
+            for resource_id, record in sorted(self.resources[resource_type].items()):
+                tags = self.__get_tags(record)
+                if record["VisibleAt"] > self.now() or not tags:
+                    continue
+                if not all(any(tag["Key"] == tag_filter["Key"] and (
+                        not tag_filter.get("Values") or tag["Value"] in tag_filter["Values"]) for tag in tags)
+                        for tag_filter in params.get("TagFilters") or []):
+                    continue
+
+                tag_mappings.append({
+                    "ResourceARN": "arn:aws:ec2:{0}:{1}:{2}/{3}".format(self.region, ACCOUNT_ID, arn_type, resource_id),
+                    "Tags": copy.deepcopy(tags)
+                })
+
+        start = int(params.get("PaginationToken") or 0)
+        end = min(len(tag_mappings), start + (params.get("ResourcesPerPage") or 50))
+
+        return {
+            "PaginationToken": str(end) if end < len(tag_mappings) else "",
+            "ResourceTagMappingList": tag_mappings[start:end]
+        }
+
+    # Placement groups
+
+    def _describe_placement_groups(self, params):
+        if params.get("GroupNames"):
+            params["Filters"] = (params.get("Filters") or []) + [
+                {
+                    "Name": "group-name",
+                    "Values": params["GroupNames"]
+                }
+            ]
+
+        return {
+            "PlacementGroups": self.__describe(PLACEMENT_GROUP, params, "GroupIds")
+        }
+
+    def _create_placement_group(self, params):
+        if self.__find(PLACEMENT_GROUP, GroupName=params["GroupName"]):
+            raise SimulatedError("InvalidPlacementGroup.Duplicate", "The Placement Group '{0}' already exists.".format(
+                params["GroupName"]))
+        if params.get("Strategy") not in ("cluster", "spread", "partition"):
+            raise SimulatedError("InvalidParameterValue", "Invalid placement strategy '{0}'".format(
+                params.get("Strategy")))
+
+        group_id = self.__new_id("pg")
+        self.__add(PLACEMENT_GROUP, group_id, {
+            "GroupId": group_id,
+            "GroupName": params["GroupName"],
+            "State": "available",
+            "Strategy": params["Strategy"],
+            "Tags": []
+        })
+
+        return {
+            "PlacementGroup": self.resources[PLACEMENT_GROUP][group_id]["Description"]
+        }
+
+    def _delete_placement_group(self, params):
+        placement_groups = self.__find(PLACEMENT_GROUP, GroupName=params["GroupName"])
+        if not placement_groups:
+            raise SimulatedError("InvalidPlacementGroup.Unknown", "The Placement Group '{0}' is unknown.".format(
+                params["GroupName"]))
+        if any(record["Description"]["Placement"]["GroupName"] == params["GroupName"] and
+               self.__get_instance_state(record) != "terminated" for record in self.resources[INSTANCE].values()):
+            raise SimulatedError("InvalidPlacementGroup.InUse", "The Placement Group '{0}' is in use.".format(
+                params["GroupName"]))
+        del self.resources[PLACEMENT_GROUP][placement_groups[0]["Description"]["GroupId"]]
+
+        return {}
+
+    # Launch templates
+
+    def __get_launch_template(self, params):
+        """Get a launch template from its ID or name
+
+        Args:
+            params (dict): Parameters with a LaunchTemplateId or LaunchTemplateName key
+
+        Returns:
+            dict: Launch template record
+        """
+        if params.get("LaunchTemplateId"):
+            return self.__get(LAUNCH_TEMPLATE, params["LaunchTemplateId"])
+
+        launch_templates = self.__find(LAUNCH_TEMPLATE, LaunchTemplateName=params.get("LaunchTemplateName"))
+        if not launch_templates:
+            raise SimulatedError("InvalidLaunchTemplateName.NotFoundException", "At least one of the launch templates "
+                                 "specified in the request does not exist.")
+
+        return launch_templates[0]
+
+    def _describe_launch_templates(self, params):
+        if params.get("LaunchTemplateNames"):
+            for launch_template_name in params["LaunchTemplateNames"]:
+                self.__get_launch_template({"LaunchTemplateName": launch_template_name})
+            params["Filters"] = (params.get("Filters") or []) + [
+                {
+                    "Name": "launch-template-name",
+                    "Values": params["LaunchTemplateNames"]
+                }
+            ]
+
+        return self.__paginate(
+            self.__describe(LAUNCH_TEMPLATE, params, "LaunchTemplateIds"), params, "LaunchTemplates")
+
+    def _create_launch_template(self, params):
+        if self.__find(LAUNCH_TEMPLATE, LaunchTemplateName=params["LaunchTemplateName"]):
+            raise SimulatedError("InvalidLaunchTemplateName.AlreadyExistsException", "Launch template name already in "
+                                 "use.")
+
+        launch_template_id = self.__new_id("lt")
+        launch_template = self.__add(LAUNCH_TEMPLATE, launch_template_id, {
+            "LaunchTemplateId": launch_template_id,
+            "LaunchTemplateName": params["LaunchTemplateName"],
+            "CreateTime": self.__timestamp(),
+            "CreatedBy": "arn:aws:iam::{0}:root".format(ACCOUNT_ID),
+            "DefaultVersionNumber": 1,
+            "LatestVersionNumber": 0,
+            "Tags": []
+        }, Versions=[])
+        self.__add_launch_template_version(launch_template, params)
+
+        return {
+            "LaunchTemplate": launch_template["Description"]
+        }
+
+    def __add_launch_template_version(self, launch_template, params):
+        description = launch_template["Description"]
+        description["LatestVersionNumber"] = description["LatestVersionNumber"] + 1
+        version = {
+            "LaunchTemplateId": description["LaunchTemplateId"],
+            "LaunchTemplateName": description["LaunchTemplateName"],
+            "VersionNumber": description["LatestVersionNumber"],
+            "VersionDescription": params.get("VersionDescription", ""),
+            "CreateTime": self.__timestamp(),
+            "CreatedBy": description["CreatedBy"],
+            "DefaultVersion": description["LatestVersionNumber"] == description["DefaultVersionNumber"],
+            "LaunchTemplateData": params["LaunchTemplateData"]
+        }
+        launch_template["Versions"].append(version)
+
+        return version
+
+    def _create_launch_template_version(self, params):
+        return {
+            "LaunchTemplateVersion": self.__add_launch_template_version(self.__get_launch_template(params), params)
+        }
+
+    def _describe_launch_template_versions(self, params):
+        launch_template = self.__get_launch_template(params)
+        versions = launch_template["Versions"]
+        if params.get("Versions"):
+            versions = [self.__get_launch_template_version(launch_template, version)
+                        for version in params["Versions"]]
+
+        return self.__paginate(versions, params, "LaunchTemplateVersions")
+
+    def __get_launch_template_version(self, launch_template, version):
+        """Get a launch template version
+
+        Args:
+            launch_template (dict): Launch template record
+            version (string): Version number, '$Latest' or '$Default'
+
+        Returns:
+            dict: Launch template version
+        """
+        description = launch_template["Description"]
+        version_number = {
+            "$Latest": description["LatestVersionNumber"],
+            "$Default": description["DefaultVersionNumber"]
+        }.get(version or "$Default", version)
+        for launch_template_version in launch_template["Versions"]:
+            if str(launch_template_version["VersionNumber"]) == str(version_number):
+                return launch_template_version
+
+        raise SimulatedError("InvalidLaunchTemplateId.VersionNotFound", "Could not find launch template version "
+                             "{0}".format(version))
+
+    def _delete_launch_template(self, params):
+        launch_template = self.__get_launch_template(params)
+        del self.resources[LAUNCH_TEMPLATE][launch_template["Description"]["LaunchTemplateId"]]
+
+        return {
+            "LaunchTemplate": launch_template["Description"]
+        }
+
+    # Instances
+
+    def __get_launch_parameters(self, params):
+        """Merge the launch template data into the launch parameters
+
+        Args:
+            params (dict): Launch parameters with an optional LaunchTemplate (or
+                LaunchTemplateSpecification) key
+
+        Returns:
+            dict: Launch parameters
+        """
+        launch_template_specification = params.get("LaunchTemplate") or params.get("LaunchTemplateSpecification")
+        if not launch_template_specification:
+            return params
+
+        launch_template = self.__get_launch_template(launch_template_specification)
+        version = self.__get_launch_template_version(launch_template, launch_template_specification.get("Version"))
+
+        return merge_dicts(version["LaunchTemplateData"], params)
+
+    def __launch_instance(self, launch_parameters, subnet, enis, reservation_id, launch_index=0, lifecycle=None):
+        """Launch an instance
+
+        Args:
+            launch_parameters (dict): Launch parameters (ImageId, InstanceType, Placement...)
+            subnet (dict): Subnet record
+            enis (list): Network interfaces records to attach from device index 0. The instance
+                gets its own primary network interface without any
+            reservation_id (string): Reservation ID
+            launch_index (integer, optional): Instance index in the reservation
+            lifecycle (string, optional): 'spot' for spot instances
+
+        Returns:
+            dict: Instance record
+
+        Raises:
+            SimulatedError: Quota or availability zone capacity exceeded
+        """
+        availability_zone = subnet["Description"]["AvailabilityZone"]
+        self.__check_quota("instances", sum(self.instances_counts.values()) + 1, "InstanceLimitExceeded",
+                           "You have requested more instances than your current instance limit allows for.")
+        if availability_zone in self.capacity and \
+                self.instances_counts.get(availability_zone, 0) + 1 > self.capacity[availability_zone]:
+            raise SimulatedError("InsufficientInstanceCapacity", "We currently do not have sufficient {0} capacity in "
+                                 "the Availability Zone you requested ({1}).".format(
+                                     launch_parameters.get("InstanceType"), availability_zone))
+
+        if not enis:
+            eni_id = self.__add_network_interface(subnet, description="Primary network interface")
+            enis = [self.resources[NETWORK_INTERFACE][eni_id]]
+            delete_on_termination = True
+        else:
+            delete_on_termination = False
+
+        image = self.resources[IMAGE][launch_parameters["ImageId"]]["Description"]
+        now = self.now()
+        instance_id = self.__new_id("i")
+        running_at = now + sample_duration(self.instance_boot_time, self.random)
+        description = {
+            "InstanceId": instance_id,
+            "ImageId": launch_parameters["ImageId"],
+            "InstanceType": launch_parameters.get("InstanceType", "m1.small"),
+            "AmiLaunchIndex": launch_index,
+            "Architecture": image["Architecture"],
+            "EbsOptimized": False,
+            "Hypervisor": "xen",
+            "LaunchTime": self.__timestamp(),
+            "Monitoring": {
+                "State": "disabled"
+            },
+            "Placement": {
+                "AvailabilityZone": availability_zone,
+                "GroupName": (launch_parameters.get("Placement") or {}).get("GroupName", ""),
+                "Tenancy": "default"
+            },
+            "PrivateDnsName": enis[0]["Description"]["PrivateDnsName"],
+            "PrivateIpAddress": enis[0]["PrivateIps"][0],
+            "RootDeviceName": image["RootDeviceName"],
+            "RootDeviceType": image["RootDeviceType"],
+            "SecurityGroups": enis[0]["Description"]["Groups"],
+            "SourceDestCheck": True,
+            "SubnetId": subnet["Description"]["SubnetId"],
+            "VirtualizationType": image["VirtualizationType"],
+            "VpcId": subnet["Description"]["VpcId"],
+            "Tags": []
+        }
+        if lifecycle == "spot":
+            description["InstanceLifecycle"] = "spot"
+
+        instance = self.__add(INSTANCE, instance_id, description, ReservationId=reservation_id, NetworkInterfaceIds=[],
+                              RunningAt=running_at, TerminatedAt=None,
+                              StatusOkAt=running_at + sample_duration(self.instance_status_checks_time, self.random))
+        for device_index, eni in enumerate(enis):
+            self.__attach_network_interface(eni, instance, device_index, delete_on_termination)
+        self.instances_counts[availability_zone] = self.instances_counts.get(availability_zone, 0) + 1
+
+        return instance
+
+    def __check_launch_parameters(self, launch_parameters):
+        """Check the image, instance type and placement group of a launch
+
+        Args:
+            launch_parameters (dict): Launch parameters
+
+        Raises:
+            SimulatedError: Invalid parameters
+        """
+        if not launch_parameters.get("ImageId"):
+            raise SimulatedError("MissingParameter", "The request must contain the parameter ImageId")
+        self.__get(IMAGE, launch_parameters["ImageId"])
+
+        group_name = (launch_parameters.get("Placement") or {}).get("GroupName")
+        if group_name and not self.__find(PLACEMENT_GROUP, GroupName=group_name):
+            raise SimulatedError("InvalidPlacementGroup.Unknown", "The Placement Group '{0}' is unknown.".format(
+                group_name))
+
+    def _run_instances(self, params):
+        launch_parameters = self.__get_launch_parameters(params)
+        self.__check_launch_parameters(launch_parameters)
+        instance_type = launch_parameters.get("InstanceType", "m1.small")
+
+        enis = []
+        network_interfaces = sorted(launch_parameters.get("NetworkInterfaces") or [],
+                                    key=lambda network_interface: network_interface.get("DeviceIndex", 0))
+        for network_interface in network_interfaces:
+            if not network_interface.get("NetworkInterfaceId"):
+                raise SimulatedError("InvalidParameterCombination", "Only existing network interfaces can be attached "
+                                     "at launch by the simulator")
+            eni = self.__get(NETWORK_INTERFACE, network_interface["NetworkInterfaceId"])
+            if eni["Attachment"] is not None:
+                raise SimulatedError("InvalidNetworkInterface.InUse", "Interface: [{0}] in use.".format(
+                    network_interface["NetworkInterfaceId"]))
+            if enis and eni["Description"]["AvailabilityZone"] != enis[0]["Description"]["AvailabilityZone"]:
+                raise SimulatedError("InvalidParameterCombination", "The network interfaces must be in the same "
+                                     "availability zone")
+            enis.append(eni)
+
+        if enis:
+            if params["MaxCount"] > 1:
+                raise SimulatedError("InvalidParameterCombination", "Network interfaces and an instance-level "
+                                     "count greater than 1 may not be specified on the same request.")
+            self.__check_attachments_limit(instance_type, len(enis))
+            subnet = self.resources[SUBNET][enis[0]["Description"]["SubnetId"]]
+        elif launch_parameters.get("SubnetId"):
+            subnet = self.__get(SUBNET, launch_parameters["SubnetId"])
+        else:
+            raise SimulatedError("VPCIdNotSpecified", "No default VPC for this user.")
+
+        reservation_id = self.__new_id("r")
+        instances = []
+        for launch_index in range(params["MaxCount"]):
+            try:
+                instances.append(self.__launch_instance(launch_parameters, subnet, enis, reservation_id, launch_index))
+            except SimulatedError:
+                # The launch fails when less than MinCount instances can be launched
+                if launch_index >= params["MinCount"]:
+                    break
+                for instance in instances:
+                    self.__terminate_instance(instance, now=True)
+                raise
+
+        return {
+            "ReservationId": reservation_id,
+            "OwnerId": ACCOUNT_ID,
+            "Groups": [],
+            "Instances": [self.__build_instance(instance) for instance in instances]
+        }
+
+    def _create_fleet(self, params):
+        if params.get("Type") != "instant":
+            raise SimulatedError("InvalidParameterValue", "Only the instant fleets are simulated")
+
+        launch_template_config = params["LaunchTemplateConfigs"][0]
+        launch_template_specification = launch_template_config["LaunchTemplateSpecification"]
+        overrides = launch_template_config.get("Overrides") or [{}]
+        target_capacity = params["TargetCapacitySpecification"]
+        on_demand_count = target_capacity.get("OnDemandTargetCapacity", 0)
+        lifecycles = ["on-demand"] * on_demand_count + ["spot"] * (
+            target_capacity["TotalTargetCapacity"] - on_demand_count)
+
+        reservation_id = self.__new_id("r")
+        launched_instances = {}
+        errors = {}
+        for launch_index, lifecycle in enumerate(lifecycles):
+            # The pools with the most spare capacity first, spreading the instances across them
+            candidates = sorted(
+                enumerate(overrides),
+                key=lambda position_override: (
+                    -self.__get_spare_capacity(position_override[1]),
+                    sum(len(instances_ids) for (position, launched_lifecycle), instances_ids
+                        in launched_instances.items() if position == position_override[0]),
+                    position_override[0]
+                )
+            )
+            for position, override in candidates:
+                launch_parameters = self.__get_launch_parameters(dict(override, LaunchTemplateSpecification=dict(
+                    launch_template_specification)))
+                try:
+                    self.__check_launch_parameters(launch_parameters)
+                    subnet = self.__get(SUBNET, launch_parameters["SubnetId"])
+                    instance = self.__launch_instance(
+                        launch_parameters, subnet, [], reservation_id, launch_index, lifecycle)
+                except SimulatedError as e:
+                    errors[(position, lifecycle, e.code)] = e.message
+                    continue
+
+                launched_instances.setdefault((position, lifecycle), []).append(instance["Description"]["InstanceId"])
+                break
+
+        return {
+            "FleetId": "fleet-" + self.__new_id("x")[2:],
+            "Errors": [
+                {
+                    "LaunchTemplateAndOverrides": {
+                        "LaunchTemplateSpecification": launch_template_specification,
+                        "Overrides": overrides[position]
+                    },
+                    "Lifecycle": lifecycle,
+                    "ErrorCode": code,
+                    "ErrorMessage": message
+                }
+                for (position, lifecycle, code), message in sorted(errors.items())
+            ],
+            "Instances": [
+                {
+                    "LaunchTemplateAndOverrides": {
+                        "LaunchTemplateSpecification": launch_template_specification,
+                        "Overrides": overrides[position]
+                    },
+                    "Lifecycle": lifecycle,
+                    "InstanceIds": instances_ids,
+                    "InstanceType": self.__get_launch_parameters(dict(
+                        overrides[position], LaunchTemplateSpecification=launch_template_specification)).get(
+                            "InstanceType")
+                }
+                for (position, lifecycle), instances_ids in sorted(launched_instances.items())
+            ]
+        }
+
+    def __get_spare_capacity(self, override):
+        """Get the count of instances which can still be launched in the availability zone of a fleet override
+
+        Args:
+            override (dict): Fleet override
+
+        Returns:
+            float: Instances count, infinite without a capacity limit
+        """
+        subnet = self.resources[SUBNET].get(override.get("SubnetId"))
+        if subnet is None:
+            return float("-inf")
+
+        availability_zone = subnet["Description"]["AvailabilityZone"]
+        if availability_zone not in self.capacity:
+            return float("inf")
+
+        return self.capacity[availability_zone] - self.instances_counts.get(availability_zone, 0)
+
+    def _terminate_instances(self, params):
+        instances = [self.__get(INSTANCE, instance_id) for instance_id in params["InstanceIds"]]
+
+        terminating_instances = []
+        for instance in instances:
+            previous_state = self.__get_instance_state(instance)
+            self.__terminate_instance(instance)
+            current_state = self.__get_instance_state(instance)
+            terminating_instances.append({
+                "InstanceId": instance["Description"]["InstanceId"],
+                "PreviousState": {
+                    "Code": INSTANCE_STATE_CODES[previous_state],
+                    "Name": previous_state
+                },
+                "CurrentState": {
+                    "Code": INSTANCE_STATE_CODES[current_state],
+                    "Name": current_state
+                }
+            })
+
+        return {
+            "TerminatingInstances": terminating_instances
+        }
+
+    def __terminate_instance(self, instance, now=False):
+        """Start the termination of an instance
+
+        Args:
+            instance (dict): Instance record
+            now (bool, optional): Terminate it at once (e.g. a failed launch)
+        """
+        if instance["TerminatedAt"] is not None:
+            return
+
+        instance["TerminatedAt"] = self.now() + (0 if now else sample_duration(
+            self.instance_shutdown_time, self.random))
+        availability_zone = instance["Description"]["Placement"]["AvailabilityZone"]
+        self.instances_counts[availability_zone] = self.instances_counts[availability_zone] - 1
+        self.terminating_instances.add(instance["Description"]["InstanceId"])
+        if now:
+            self.__advance()
+
+    def _describe_instances(self, params):
+        reservations = {}
+        reservations_ids = []
+        for description in self.__describe(INSTANCE, params, "InstanceIds"):
+            reservation_id = self.resources[INSTANCE][description["InstanceId"]]["ReservationId"]
+            if reservation_id not in reservations:
+                reservations_ids.append(reservation_id)
+                reservations[reservation_id] = {
+                    "ReservationId": reservation_id,
+                    "OwnerId": ACCOUNT_ID,
+                    "Groups": [],
+                    "Instances": []
+                }
+            reservations[reservation_id]["Instances"].append(description)
+
+        return self.__paginate(
+            [reservations[reservation_id] for reservation_id in reservations_ids], params, "Reservations")
+
+    def _describe_instance_status(self, params):
+        now = self.now()
+        instances_statuses = []
+        for description in self.__describe(INSTANCE, {"InstanceIds": params.get("InstanceIds")}, "InstanceIds"):
+            if description["State"]["Name"] != "running" and not params.get("IncludeAllInstances"):
+                continue
+
+            status = "not-applicable"
+            if description["State"]["Name"] == "running":
+                status = "ok" if now >= self.resources[INSTANCE][description["InstanceId"]]["StatusOkAt"] \
+                    else "initializing"
+            instances_statuses.append({
+                "InstanceId": description["InstanceId"],
+                "AvailabilityZone": description["Placement"]["AvailabilityZone"],
+                "InstanceState": description["State"],
+                "InstanceStatus": {
+                    "Status": status,
+                    "Details": [
+                        {
+                            "Name": "reachability",
+                            "Status": {"ok": "passed"}.get(status, status)
+                        }
+                    ]
+                },
+                "SystemStatus": {
+                    "Status": status,
+                    "Details": [
+                        {
+                            "Name": "reachability",
+                            "Status": {"ok": "passed"}.get(status, status)
+                        }
+                    ]
+                }
+            })
+
+        return self.__paginate(self.__filter(INSTANCE_STATUS, instances_statuses, params.get("Filters")),
+                               params, "InstanceStatuses")
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+VPC = "vpc"
+INTERNET_GATEWAY = "internet_gateway"
+SUBNET = "subnet"
+SECURITY_GROUP = "security_group"
+ROUTE_TABLE = "route_table"
+NETWORK_ACL = "network_acl"
+NETWORK_INTERFACE = "network_interface"
+ADDRESS = "address"
+INSTANCE = "instance"
+LAUNCH_TEMPLATE = "launch_template"
+
+
+class StateStore(object):
+    """Base fleet state store
+
+    A fleet is identified by its tag base name. Every resource recorded for a
+    fleet is keyed by its type and its AWS ID, and can carry the uid used in
+    the proxies config, a parent resource ID and JSON serializable attributes.
+    JSON serializable values (such as a create progress) can also be stored by key.
+    Subclass it to plug another backend.
+    """
+
+    def record_resource(self, fleet, resource_type, resource_id, uid=None, parent_id=None, attributes=None):
+        """Record (or update) a fleet resource
+
+        Args:
+            fleet (string): Fleet tag base name
+            resource_type (string): Resource type
+            resource_id (string): AWS resource ID
+            uid (string, optional): Proxies config uid
+            parent_id (string, optional): Parent AWS resource ID
+            attributes (dict, optional): Resource attributes
+        """
+        raise NotImplementedError()
+
+    def get_resources(self, fleet, resource_type=None):
+        """Get the recorded fleet resources
+
+        Args:
+            fleet (string): Fleet tag base name
+            resource_type (string, optional): Only return resources of this type
+
+        Returns:
+            list: Resources dicts with 'ResourceType', 'ResourceId', 'Uid', 'ParentId' and
+                'Attributes' keys, in recording order
+        """
+        raise NotImplementedError()
+
+    def remove_resource(self, fleet, resource_type, resource_id):
+        """Forget a fleet resource
+
+        Args:
+            fleet (string): Fleet tag base name
+            resource_type (string): Resource type
+            resource_id (string): AWS resource ID
+        """
+        raise NotImplementedError()
+
+    def set_value(self, fleet, key, value):
+        """Store a fleet value
+
+        Args:
+            fleet (string): Fleet tag base name
+            key (string): Value key
+            value (object): JSON serializable value
+        """
+        raise NotImplementedError()
+
+    def get_value(self, fleet, key, default=None):
+        """Get a fleet value
+
+        Args:
+            fleet (string): Fleet tag base name
+            key (string): Value key
+            default (object, optional): Returned when no value is stored
+
+        Returns:
+            object: Value
+        """
+        raise NotImplementedError()
+
+    def clear(self, fleet):
+        """Forget every resource and value of a fleet
+
+        Args:
+            fleet (string): Fleet tag base name
+        """
+        raise NotImplementedError()
+
+    def get_resource_ids(self, fleet, resource_type):
+        """Get the recorded fleet resources IDs of a type
+
+        Args:
+            fleet (string): Fleet tag base name
+            resource_type (string): Resource type
+
+        Returns:
+            list: AWS resources IDs
+        """
+        return [resource["ResourceId"] for resource in self.get_resources(fleet, resource_type)]
+
+    def get_resources_by_uid(self, fleet, resource_type):
+        """Get the recorded fleet resources of a type indexed by uid
+
+        Args:
+            fleet (string): Fleet tag base name
+            resource_type (string): Resource type
+
+        Returns:
+            dict: Resources indexed by uid
+        """
+        return dict(
+            (resource["Uid"], resource)
+            for resource in self.get_resources(fleet, resource_type)
+            if resource["Uid"] is not None
+        )
+
+
+class MemoryStateStore(StateStore):
+    """In memory state store, lost when the process exits
+    """
+
+    def __init__(self):
+        """Constructor
+        """
+        self._resources = {}
+        self._values = {}
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def record_resource(self, fleet, resource_type, resource_id, uid=None, parent_id=None, attributes=None):
+        with self._lock:
+            key = (resource_type, resource_id)
+            fleet_resources = self._resources.setdefault(fleet, {})
+            if key in fleet_resources:
+                sequence = fleet_resources[key][0]
+            else:
+                self._sequence = self._sequence + 1
+                sequence = self._sequence
+
+            fleet_resources[key] = (sequence, {
+                "ResourceType": resource_type,
+                "ResourceId": resource_id,
+                "Uid": uid,
+                "ParentId": parent_id,
+                "Attributes": dict(attributes or {})
+            })
+
+    def get_resources(self, fleet, resource_type=None):
+        with self._lock:
+            resources = sorted(self._resources.get(fleet, {}).values(), key=lambda item: item[0])
+        return [
+            dict(resource) for sequence, resource in resources
+            if resource_type is None or resource["ResourceType"] == resource_type
+        ]
+
+    def remove_resource(self, fleet, resource_type, resource_id):
+        with self._lock:
+            self._resources.get(fleet, {}).pop((resource_type, resource_id), None)
+
+    def set_value(self, fleet, key, value):
+        # Round trip through JSON to behave like the persisted stores
+        with self._lock:
+            self._values.setdefault(fleet, {})[key] = json.dumps(value)
+
+    def get_value(self, fleet, key, default=None):
+        with self._lock:
+            value = self._values.get(fleet, {}).get(key)
+        if value is None:
+            return default
+        return json.loads(value)
+
+    def clear(self, fleet):
+        with self._lock:
+            self._resources.pop(fleet, None)
+            self._values.pop(fleet, None)
+
+
+class SqliteStateStore(StateStore):
+    """SQLite state store persisted on disk
+    """
+
+    def __init__(self, path):
+        """Constructor
+
+        Args:
+            path (string): SQLite database file path. Parent directories are created
+                on first use
+        """
+        self.path = os.path.expanduser(path)
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Get the database connection, creating the database schema if needed
+
+        Returns:
+            object: SQLite connection
+        """
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS resources ("
+                "fleet TEXT NOT NULL, "
+                "resource_type TEXT NOT NULL, "
+                "resource_id TEXT NOT NULL, "
+                "uid TEXT, "
+                "parent_id TEXT, "
+                "attributes TEXT, "
+                "created_at REAL, "
+                "PRIMARY KEY (fleet, resource_type, resource_id))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS fleet_values ("
+                "fleet TEXT NOT NULL, "
+                "key TEXT NOT NULL, "
+                "value TEXT, "
+                "PRIMARY KEY (fleet, key))"
+            )
+            self._connection.commit()
+
+        return self._connection
+
+    def record_resource(self, fleet, resource_type, resource_id, uid=None, parent_id=None, attributes=None):
+        with self._lock:
+            connection = self._connect()
+            updated = connection.execute(
+                "UPDATE resources SET uid = ?, parent_id = ?, attributes = ? "
+                "WHERE fleet = ? AND resource_type = ? AND resource_id = ?",
+                (uid, parent_id, json.dumps(attributes or {}), fleet, resource_type, resource_id)
+            ).rowcount
+            if not updated:
+                connection.execute(
+                    "INSERT INTO resources VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (fleet, resource_type, resource_id, uid, parent_id, json.dumps(attributes or {}), time.time())
+                )
+            connection.commit()
+
+    def get_resources(self, fleet, resource_type=None):
+        query = "SELECT resource_type, resource_id, uid, parent_id, attributes FROM resources WHERE fleet = ?"
+        params = [fleet]
+        if resource_type is not None:
+            query = query + " AND resource_type = ?"
+            params.append(resource_type)
+        query = query + " ORDER BY rowid"
+
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+
+        return [
+            {
+                "ResourceType": row[0],
+                "ResourceId": row[1],
+                "Uid": row[2],
+                "ParentId": row[3],
+                "Attributes": json.loads(row[4] or "{}")
+            }
+            for row in rows
+        ]
+
+    def remove_resource(self, fleet, resource_type, resource_id):
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "DELETE FROM resources WHERE fleet = ? AND resource_type = ? AND resource_id = ?",
+                (fleet, resource_type, resource_id)
+            )
+            connection.commit()
+
+    def set_value(self, fleet, key, value):
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO fleet_values VALUES (?, ?, ?)",
+                (fleet, key, json.dumps(value))
+            )
+            connection.commit()
+
+    def get_value(self, fleet, key, default=None):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value FROM fleet_values WHERE fleet = ? AND key = ?",
+                (fleet, key)
+            ).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def clear(self, fleet):
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM resources WHERE fleet = ?", (fleet,))
+            connection.execute("DELETE FROM fleet_values WHERE fleet = ?", (fleet,))
+            connection.commit()
+
+
+class ScopedStateStore(StateStore):
+    """State store keeping the fleets of a scope (e.g. an AWS profile and region) apart in another store
+
+    The fleets are stored as '<scope>/<fleet>', so that the fleets sharing a tag
+    base name in other accounts or regions do not overwrite each other's records.
+    """
+
+    def __init__(self, state_store, scope):
+        """Constructor
+
+        Args:
+            state_store (object): Wrapped state store
+            scope (string or function): Scope, or function returning it, only called on first use
+        """
+        self.state_store = state_store
+        self._scope = scope
+
+    def get_scoped_fleet(self, fleet):
+        """Get the name a fleet is stored under in the wrapped store
+
+        Args:
+            fleet (string): Fleet tag base name
+
+        Returns:
+            string: Scoped fleet name
+        """
+        if callable(self._scope):
+            self._scope = self._scope()
+        return self._scope + "/" + fleet
+
+    def record_resource(self, fleet, resource_type, resource_id, uid=None, parent_id=None, attributes=None):
+        self.state_store.record_resource(self.get_scoped_fleet(fleet), resource_type, resource_id, uid=uid,
+                                         parent_id=parent_id, attributes=attributes)
+
+    def get_resources(self, fleet, resource_type=None):
+        return self.state_store.get_resources(self.get_scoped_fleet(fleet), resource_type)
+
+    def remove_resource(self, fleet, resource_type, resource_id):
+        self.state_store.remove_resource(self.get_scoped_fleet(fleet), resource_type, resource_id)
+
+    def set_value(self, fleet, key, value):
+        self.state_store.set_value(self.get_scoped_fleet(fleet), key, value)
+
+    def get_value(self, fleet, key, default=None):
+        return self.state_store.get_value(self.get_scoped_fleet(fleet), key, default)
+
+    def clear(self, fleet):
+        self.state_store.clear(self.get_scoped_fleet(fleet))
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from base_resources import BaseResources
+from .base_resources import BaseResources
 import logging
-from utils import setup_logger, filter_resources, tag_with_name_with_suffix
+from .state import SUBNET
+from .tracing import traced
+from .utils import setup_logger, iter_resources, get_ipv6_subnet_cidr_block
 
 
 class Subnets(BaseResources):
@@ -21,7 +23,8 @@ class Subnets(BaseResources):
         Raises:
             TypeError: Description
         """
-        BaseResources.__init__(self, ec2, ec2_client, tag_base_name)
+        BaseResources.__init__(self, ec2, ec2_client, tag_base_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
         log_level = kwargs.pop("log_level", logging.WARNING)
         boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
 
@@ -29,6 +32,7 @@ class Subnets(BaseResources):
             raise TypeError("Unexpected **kwargs: %r" % kwargs)
         self.logger = setup_logger(__name__, log_level, boto_log_level)
 
+    @traced("subnets.get_or_create")
     def get_or_create(self, config):
         """Get or create Aws Ec2 subnets
 
@@ -38,55 +42,80 @@ class Subnets(BaseResources):
         Returns:
             dict: Subnets configs
         """
-        created_subnets = []
-        for vpc_id, vpc_config in config.iteritems():
+        created_subnets = {}
+        # The subnets of all the vpcs are described at once
+        aws_subnets = dict(
+            ((aws_subnet["VpcId"], aws_subnet["CidrBlock"]), aws_subnet)
+            for aws_subnet in iter_resources(self.ec2_client, "describe_subnets", {
+                "vpc-id": [vpc_config["VpcId"] for vpc_config in config.values() if "Subnets" in vpc_config]
+            }, projection=["SubnetId", "VpcId", "CidrBlock", "AvailabilityZone", "Ipv6CidrBlockAssociationSet"])
+        )
+
+        for vpc_id, vpc_config in config.items():
+            created_subnets[vpc_config["VpcId"]] = {
+                "Subnets": []
+            }
             if "Subnets" in vpc_config:
                 for index, subnet_config in enumerate(vpc_config["Subnets"]):
-                    subnets = filter_resources(
-                        self.ec2.subnets, "cidrBlock", subnet_config["CidrBlock"])
-
-                    if not subnets:
-                        subnet = self.ec2.create_subnet(
-                            VpcId=vpc_config["VpcId"], CidrBlock=subnet_config["CidrBlock"])
-                    else:
-                        subnet = self.ec2.Subnet(subnets[0].id)
+                    aws_subnet = aws_subnets.get((vpc_config["VpcId"], subnet_config["CidrBlock"]))
+
+                    # In ipv6 mode, every subnet gets the /64 of the vpc ipv6 cidr block at its index
+                    ipv6_cidr_block = None
+                    if vpc_config.get("Ipv6CidrBlock"):
+                        ipv6_cidr_block = get_ipv6_subnet_cidr_block(
+                            vpc_config["Ipv6CidrBlock"], subnet_config.get("Ipv6SubnetIndex", index))
+
+                    if aws_subnet is None:
+                        subnet_params = {
+                            "VpcId": vpc_config["VpcId"],
+                            "CidrBlock": subnet_config["CidrBlock"]
+                        }
+                        if subnet_config.get("AvailabilityZone"):
+                            subnet_params["AvailabilityZone"] = subnet_config["AvailabilityZone"]
+                        if ipv6_cidr_block:
+                            subnet_params["Ipv6CidrBlock"] = ipv6_cidr_block
+
+                        aws_subnet = self.ec2_client.create_subnet(**subnet_params)["Subnet"]
+                    elif ipv6_cidr_block and not any(
+                            association["Ipv6CidrBlockState"]["State"] in ("associating", "associated")
+                            for association in aws_subnet.get("Ipv6CidrBlockAssociationSet", [])):
+                        self.ec2_client.associate_subnet_cidr_block(
+                            SubnetId=aws_subnet["SubnetId"], Ipv6CidrBlock=ipv6_cidr_block)
 
                     self.logger.info(
                         "A subnet with ID '%s', " +
                         "cidr block '%s' and attached to vpc '%s' has been created or already exists",
-                        subnet.id,
+                        aws_subnet["SubnetId"],
                         subnet_config["CidrBlock"],
                         vpc_config["VpcId"]
                     )
 
-                    tag_with_name_with_suffix(
-                        subnet, "subnet", index, self.tag_base_name)
+                    self.tracer.current_span().add_attribute_value("subnet_ids", aws_subnet["SubnetId"])
+                    self.record_resource(SUBNET, aws_subnet["SubnetId"], parent_id=vpc_config["VpcId"],
+                                         attributes={"CidrBlock": subnet_config["CidrBlock"]})
 
-                    created_subnets.append(
-                        {
-                            "SubnetId": subnet.id,
-                            "CidrBlock": subnet_config["CidrBlock"],
-                            "NetworkInterfaces": subnet_config["NetworkInterfaces"]
-                        }
-                    )
+                    self.tag(aws_subnet["SubnetId"], "subnet", index)
 
-        return {
-            vpc_config["VpcId"]: {
-                "Subnets": created_subnets
-            }
-        }
+                    created_subnet = {
+                        "SubnetId": aws_subnet["SubnetId"],
+                        "CidrBlock": subnet_config["CidrBlock"],
+                        "AvailabilityZone": aws_subnet["AvailabilityZone"],
+                        "NetworkInterfaces": subnet_config["NetworkInterfaces"]
+                    }
+                    if ipv6_cidr_block:
+                        created_subnet["Ipv6CidrBlock"] = ipv6_cidr_block
+                    created_subnets[vpc_config["VpcId"]]["Subnets"].append(created_subnet)
 
-    def delete(self):
-        subnets = filter_resources(
-            self.ec2.subnets,
-            "tag:Name",
-            self.tag_base_name + '-*'
-        )
+        return created_subnets
 
-        for subnet in subnets:
-            subnet.delete()
+    @traced("subnets.delete")
+    def delete(self):
+        for aws_subnet in self.iter_fleet_resources("describe_subnets", SUBNET, "subnet-id", projection=["SubnetId"]):
+            self.ec2_client.delete_subnet(SubnetId=aws_subnet["SubnetId"])
+            self.forget_resource(SUBNET, aws_subnet["SubnetId"])
+            self.tracer.current_span().add_attribute_value("subnet_ids", aws_subnet["SubnetId"])
 
             self.logger.info(
                 "The subnet with ID '%s' has been deleted ",
-                subnet.id,
+                aws_subnet["SubnetId"],
             )
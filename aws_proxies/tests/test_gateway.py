@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""Gateway tests, against local stand-in upstream proxies"""
+import asyncio
+import json
+import os
+import socket
+from aws_proxies.gateway import Gateway, build_head, get_header, read_head
+
+
+class StandInProxy(object):
+    """Local upstream proxy answering the plain HTTP requests itself and echoing the tunnels
+    """
+
+    def __init__(self, name, host="127.0.0.1", port=0):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.server = None
+        self.connections_count = 0
+        self.requests_count = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.connections_count = self.connections_count + 1
+        try:
+            while True:
+                head = await read_head(reader)
+                if head is None:
+                    break
+                request_line, headers = head
+                method = request_line.split(" ", 1)[0]
+                self.requests_count = self.requests_count + 1
+                await reader.readexactly(int(get_header(headers, "content-length") or 0))
+                if method == "CONNECT":
+                    writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+                    while True:
+                        data = await reader.read(1024)
+                        if not data:
+                            break
+                        writer.write(data.upper())
+                        await writer.drain()
+                    break
+
+                body = self.name.encode("ascii")
+                writer.write(build_head("HTTP/1.1 200 OK", [
+                    ("Content-Length", str(len(body))),
+                    ("Connection", "keep-alive")
+                ]) + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def get_closed_port():
+    """Get a local port nothing listens to"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+async def start_gateway(gateway):
+    server = await gateway.start("127.0.0.1", 0)
+    return server.sockets[0].getsockname()[1]
+
+
+async def get(gateway_port, url="http://example.com/", keep_alive=False):
+    """Send a plain HTTP request through the gateway on a new connection
+
+    Returns:
+        tuple: Status line and body
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", gateway_port)
+    try:
+        return await send(reader, writer, url, keep_alive)
+    finally:
+        writer.close()
+
+
+async def send(reader, writer, url="http://example.com/", keep_alive=True):
+    writer.write(build_head("GET " + url + " HTTP/1.1", [
+        ("Host", "example.com"),
+        ("Connection", "keep-alive" if keep_alive else "close")
+    ]))
+    status_line, headers = await read_head(reader)
+    body = await reader.readexactly(int(get_header(headers, "content-length")))
+    return status_line, body.decode("ascii")
+
+
+def run(coroutine_function, *proxies_names):
+    """Run a test coroutine with started stand-in proxies, stopping them afterwards"""
+    async def main():
+        proxies = [await StandInProxy(name).start() for name in proxies_names]
+        try:
+            await coroutine_function(*proxies)
+        finally:
+            for proxy in proxies:
+                await proxy.stop()
+
+    asyncio.run(main())
+
+
+def test_round_robin():
+    async def main(proxy_a, proxy_b):
+        gateway = Gateway(upstreams=[("127.0.0.1", proxy_a.port), ("127.0.0.1", proxy_b.port)])
+        gateway_port = await start_gateway(gateway)
+        try:
+            bodies = [(await get(gateway_port))[1] for i in range(4)]
+        finally:
+            await gateway.stop()
+
+        assert sorted(bodies) == ["a", "a", "b", "b"]
+        assert bodies[0] != bodies[1] and bodies[0] == bodies[2] and bodies[1] == bodies[3]
+
+    run(main, "a", "b")
+
+
+def test_upstream_ejection_and_retry():
+    async def main(proxy):
+        closed_port = get_closed_port()
+        gateway = Gateway(upstreams=[("127.0.0.1", closed_port), ("127.0.0.1", proxy.port)],
+                          max_failures=2, ejection_time=60)
+        gateway_port = await start_gateway(gateway)
+        try:
+            # The requests picking the closed upstream are retried on the other one
+            responses = [await get(gateway_port) for i in range(6)]
+        finally:
+            await gateway.stop()
+
+        assert responses == [("HTTP/1.1 200 OK", "a")] * 6
+        closed_stats, proxy_stats = gateway.get_stats()
+        # Ejected after 2 consecutive failures, and so not picked anymore
+        assert closed_stats["Failures"] == 2
+        assert closed_stats["Ejected"]
+        assert proxy_stats["Failures"] == 0
+        assert proxy.requests_count == 6
+
+    run(main, "a")
+
+
+def test_all_upstreams_down():
+    async def main():
+        gateway = Gateway(upstreams=[("127.0.0.1", get_closed_port())], retries=1)
+        gateway_port = await start_gateway(gateway)
+        try:
+            status_line, body = await get(gateway_port)
+        finally:
+            await gateway.stop()
+
+        assert status_line == "HTTP/1.1 502 Bad Gateway"
+
+    run(main)
+
+
+def test_client_dropping_request():
+    async def main(proxy):
+        gateway = Gateway(upstreams=[("127.0.0.1", proxy.port)], max_failures=1, ejection_time=60)
+        gateway_port = await start_gateway(gateway)
+        try:
+            # The client closes its connection before sending the whole request body
+            reader, writer = await asyncio.open_connection("127.0.0.1", gateway_port)
+            writer.write(build_head("POST http://example.com/ HTTP/1.1", [
+                ("Host", "example.com"),
+                ("Content-Length", "100")
+            ]) + b"partial")
+            await writer.drain()
+            writer.close()
+            await asyncio.sleep(0.1)
+            stats = gateway.get_stats()[0]
+            response = await get(gateway_port)
+        finally:
+            await gateway.stop()
+
+        # Not an upstream failure
+        assert stats["Failures"] == 0
+        assert not stats["Ejected"]
+        assert response == ("HTTP/1.1 200 OK", "a")
+
+    run(main, "a")
+
+
+def test_connect_tunnel():
+    async def main(proxy):
+        gateway = Gateway(upstreams=[("127.0.0.1", proxy.port)])
+        gateway_port = await start_gateway(gateway)
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", gateway_port)
+            writer.write(build_head("CONNECT example.com:443 HTTP/1.1", [("Host", "example.com:443")]))
+            status_line, headers = await read_head(reader)
+            writer.write(b"hello")
+            echoed = await reader.readexactly(5)
+            writer.write_eof()
+            remaining = await reader.read()
+            writer.close()
+        finally:
+            await gateway.stop()
+
+        assert status_line == "HTTP/1.1 200 Connection established"
+        assert echoed == b"HELLO"
+        assert remaining == b""
+
+    run(main, "a")
+
+
+def test_keep_alive_reuse():
+    async def main(proxy):
+        gateway = Gateway(upstreams=[("127.0.0.1", proxy.port)])
+        gateway_port = await start_gateway(gateway)
+        try:
+            # Separate client connections, and several requests on one client connection
+            responses = [await get(gateway_port) for i in range(3)]
+            reader, writer = await asyncio.open_connection("127.0.0.1", gateway_port)
+            responses.extend([await send(reader, writer) for i in range(3)])
+            writer.close()
+            stats = gateway.get_stats()[0]
+        finally:
+            await gateway.stop()
+
+        assert responses == [("HTTP/1.1 200 OK", "a")] * 6
+        # The upstream connection is kept idle between the requests
+        assert proxy.connections_count == 1
+        assert proxy.requests_count == 6
+        assert stats["IdleConnections"] == 1
+
+    run(main, "a")
+
+
+def test_endpoints_reload(tmp_path):
+    endpoints_path = str(tmp_path / "proxies.json")
+
+    def publish(ips, mtime):
+        with open(endpoints_path, "w") as f:
+            json.dump({"Proxies": [[public_ip, "10.0.0.1"] for public_ip in ips]}, f)
+        os.utime(endpoints_path, (mtime, mtime))
+
+    async def main():
+        # The endpoints file only has public ips, so the stand-in proxies listen to the same port
+        # of two loopback addresses
+        proxy_b = await StandInProxy("b", "127.0.0.2").start()
+        proxy_a = await StandInProxy("a", "127.0.0.1", proxy_b.port).start()
+        publish(["127.0.0.1"], 1000)
+        gateway = Gateway(endpoints_path=endpoints_path, upstream_port=proxy_a.port, reload_interval=0.05)
+        gateway_port = await start_gateway(gateway)
+        try:
+            assert (await get(gateway_port))[1] == "a"
+            upstream = gateway.upstreams[0]
+            assert not gateway.reload_endpoints()
+
+            # The upstreams still there keep their state
+            publish(["127.0.0.1", "127.0.0.2"], 2000)
+            assert gateway.reload_endpoints()
+            assert [upstream.host for upstream in gateway.upstreams] == ["127.0.0.1", "127.0.0.2"]
+            assert gateway.upstreams[0] is upstream
+            assert upstream.requests_count == 1
+
+            # Reloaded in the background
+            publish(["127.0.0.2"], 3000)
+            await asyncio.sleep(0.5)
+            assert [upstream.host for upstream in gateway.upstreams] == ["127.0.0.2"]
+            assert (await get(gateway_port))[1] == "b"
+
+            # A missing file keeps the upstreams
+            os.remove(endpoints_path)
+            assert not gateway.reload_endpoints()
+            assert [upstream.host for upstream in gateway.upstreams] == ["127.0.0.2"]
+        finally:
+            await gateway.stop()
+            await proxy_a.stop()
+            await proxy_b.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Metrics collector tests, against a local HTTP exporter"""
+import socket
+import threading
+
+try:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import pytest
+from aws_proxies.metrics import MetricsCollector, parse_metrics
+
+METRICS = """# HELP aws_proxies_bytes_sent_total Bytes sent per source ip
+# TYPE aws_proxies_bytes_sent_total counter
+aws_proxies_bytes_sent_total{ip="10.0.0.5"} 1234
+aws_proxies_bytes_received_total{ip="10.0.0.5"} 5.6e+03
+aws_proxies_responses_2xx_total{ip="10.0.0.5"} 7
+aws_proxies_bytes_sent_total{ip="10.0.0.6"} 0
+node_load1 0.5
+aws_proxies_bytes_sent_total 12
+"""
+
+
+class ExporterHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def exporter():
+    """Local exporter serving its 'metrics' attribute"""
+    server = HTTPServer(("127.0.0.1", 0), ExporterHandler)
+    server.metrics = ""
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_closed_port():
+    """Get a local port nothing listens to"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def get_counters(ip, bytes_sent, responses_2xx):
+    return ('aws_proxies_bytes_sent_total{{ip="{0}"}} {1}\n'
+            'aws_proxies_responses_2xx_total{{ip="{0}"}} {2}\n').format(ip, bytes_sent, responses_2xx)
+
+
+def test_parse_metrics():
+    assert parse_metrics(METRICS) == {
+        "10.0.0.5": {
+            "bytes_sent": 1234,
+            "bytes_received": 5600,
+            "responses_2xx": 7
+        },
+        "10.0.0.6": {
+            "bytes_sent": 0
+        }
+    }
+    assert parse_metrics("") == {}
+
+
+def test_collect(exporter):
+    exporter.metrics = METRICS
+    closed_port = get_closed_port()
+    collector = MetricsCollector(
+        [("127.0.0.1", exporter.server_address[1]), ("127.0.0.1", closed_port)],
+        public_ips={"10.0.0.5": "54.0.0.5"},
+        timeout=2
+    )
+
+    snapshot = collector.collect()
+
+    # The counters are indexed by public ip when it is known
+    assert snapshot["Ips"] == {
+        "54.0.0.5": {
+            "bytes_sent": 1234,
+            "bytes_received": 5600,
+            "responses_2xx": 7
+        },
+        "10.0.0.6": {
+            "bytes_sent": 0
+        }
+    }
+    assert list(snapshot["Errors"]) == ["127.0.0.1:{0}".format(closed_port)]
+    assert list(collector.snapshots) == [snapshot]
+
+
+def test_get_rates(exporter):
+    collector = MetricsCollector([("127.0.0.1", exporter.server_address[1])], max_snapshots=2)
+    assert collector.get_rates() == {}
+
+    exporter.metrics = get_counters("10.0.0.5", 1000, 10)
+    first_snapshot = collector.collect()
+    exporter.metrics = get_counters("10.0.0.5", 3000, 30) + get_counters("10.0.0.6", 100, 1)
+    second_snapshot = collector.collect()
+    # The rates are computed on the snapshots timestamps
+    first_snapshot["Timestamp"] = second_snapshot["Timestamp"] - 10
+
+    # The ips missing from the previous snapshot have no rates yet
+    assert collector.get_rates() == {
+        "10.0.0.5": {
+            "bytes_sent": 200.0,
+            "responses_2xx": 2.0
+        }
+    }
+
+    exporter.metrics = get_counters("10.0.0.5", 500, 5) + get_counters("10.0.0.6", 600, 1)
+    third_snapshot = collector.collect()
+    third_snapshot["Timestamp"] = second_snapshot["Timestamp"] + 5
+
+    # The counters reset (e.g. by a reboot) count from zero
+    assert collector.get_rates() == {
+        "10.0.0.5": {
+            "bytes_sent": 100.0,
+            "responses_2xx": 1.0
+        },
+        "10.0.0.6": {
+            "bytes_sent": 100.0,
+            "responses_2xx": 0.0
+        }
+    }
+    assert list(collector.snapshots) == [second_snapshot, third_snapshot]
+
+    # Snapshots taken at the same time have no rates
+    assert collector.get_rates(third_snapshot, third_snapshot) == {}
+    assert collector.get_rates(first_snapshot, third_snapshot)["10.0.0.5"]["bytes_sent"] == 500 / 15.0
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Proxies tests, against the local EC2 simulator"""
+from botocore.exceptions import ClientError
+import pytest
+from aws_proxies.eip_pool import EipPool
+from aws_proxies.images import ImageCache
+from aws_proxies.proxies import Proxies
+from aws_proxies.simulator import Ec2Simulator
+from aws_proxies.state import INSTANCE, MemoryStateStore
+from aws_proxies.utils import iter_resources
+
+# Simulated resources which outlive a deletion: the terminated instances, for a while, and the images
+KEPT_RESOURCES_TYPES = ["image", "instance"]
+
+
+def get_proxies_config(available_ips, availability_zones=("us-east-1a", "us-east-1b")):
+    return {
+        "available_ips": available_ips,
+        "instances_config": [
+            {
+                "InstanceType": "t2.medium",
+                "ImageName": "tinyproxy",
+                "VPCCidrBlock": "15.0.0.0/16",
+                "CidrBlockFormatting": "15.0.\\{0\\}.\\{1\\}",
+                "AvailabilityZones": list(availability_zones),
+                "SecurityGroups": [
+                    {
+                        "GroupName": "default",
+                        "Description": "Security group for proxies",
+                        "IngressRules": [
+                            {
+                                "IpProtocol": "tcp",
+                                "FromPort": 8888,
+                                "ToPort": 8888,
+                                "IpRanges": [
+                                    {
+                                        "CidrIp": "0.0.0.0/0"
+                                    },
+                                ]
+                            },
+                        ]
+                    }
+                ]
+            }
+        ]
+    }
+
+
+def create_proxies(simulator, state_store=None):
+    return Proxies(session=simulator.create_session(), state_store=state_store or MemoryStateStore(),
+                   image_cache=ImageCache())
+
+
+def get_leftover_resources(simulator):
+    return dict(
+        (resource_type, count) for resource_type, count in simulator.get_stats()["Resources"].items()
+        if count and resource_type not in KEPT_RESOURCES_TYPES
+    )
+
+
+def get_errors_count(simulator, code):
+    return sum(calls["Errors"].get(code, 0) for calls in simulator.get_stats()["Calls"].values())
+
+
+def test_create_delete_round_trip():
+    simulator = Ec2Simulator(time_scale=0.001, quotas={"addresses": 100}, seed=1)
+    proxies = create_proxies(simulator)
+
+    proxies.create(get_proxies_config(24), ask_confirm=False, silent=True)
+
+    ips = proxies.get_running_proxies_ips(wait=True)
+    assert len(ips) == 24
+    assert len(set(public_ip for public_ip, private_ip in ips)) == 24
+    assert all(private_ip.startswith("15.0.") for public_ip, private_ip in ips)
+    assert simulator.get_stats()["Resources"]["instance"] == 2
+
+    proxies.delete(ask_confirm=False, silent=True, delete_launch_templates=True)
+
+    assert get_leftover_resources(simulator) == {}
+    assert proxies.get_running_proxies_ips() == []
+    assert proxies.get_recorded_resources() == []
+
+
+def test_regions_kept_apart():
+    # The same tag base name, and state store, in two regions
+    state_store = MemoryStateStore()
+    simulator_a = Ec2Simulator(time_scale=0.001, quotas={"addresses": 100}, seed=1)
+    simulator_b = Ec2Simulator(time_scale=0.001, quotas={"addresses": 100}, seed=2, region="eu-west-1")
+
+    create_proxies(simulator_a, state_store).create(get_proxies_config(12), ask_confirm=False, silent=True)
+    create_proxies(simulator_b, state_store).create(
+        get_proxies_config(6, ["eu-west-1a"]), ask_confirm=False, silent=True)
+
+    proxies_a = create_proxies(simulator_a, state_store)
+    assert len(proxies_a.get_running_proxies_ips(wait=True)) == 12
+    proxies_a.delete(ask_confirm=False, silent=True, delete_launch_templates=True)
+    assert get_leftover_resources(simulator_a) == {}
+
+    proxies_b = create_proxies(simulator_b, state_store)
+    assert len(proxies_b.get_running_proxies_ips(wait=True)) == 6
+    proxies_b.delete(ask_confirm=False, silent=True, delete_launch_templates=True)
+    assert get_leftover_resources(simulator_b) == {}
+
+
+def test_scale():
+    simulator = Ec2Simulator(time_scale=0.001, quotas={"addresses": 100}, seed=1)
+    proxies = create_proxies(simulator)
+    proxies.create(get_proxies_config(12), ask_confirm=False, silent=True)
+    instances_ids = set(proxies.state_store.get_resource_ids(proxies.tag_base_name, INSTANCE))
+
+    # Scaled out, the running instances being kept
+    proxies.scale(20, silent=True)
+    scaled_out_instances_ids = set(proxies.state_store.get_resource_ids(proxies.tag_base_name, INSTANCE))
+    assert instances_ids < scaled_out_instances_ids
+    assert len(proxies.get_running_proxies_ips(wait=True)) >= 20
+
+    # Re-created with fewer ips
+    proxies.scale(6, silent=True)
+    assert len(proxies.get_running_proxies_ips(wait=True)) == 6
+    assert not scaled_out_instances_ids & set(proxies.state_store.get_resource_ids(proxies.tag_base_name, INSTANCE))
+
+    proxies.delete(ask_confirm=False, silent=True, delete_launch_templates=True)
+    assert get_leftover_resources(simulator) == {}
+
+
+def test_delete_with_partial_sweep():
+    simulator = Ec2Simulator(time_scale=0.001, quotas={"addresses": 100}, seed=1)
+    create_proxies(simulator).create(get_proxies_config(24), ask_confirm=False, silent=True)
+
+    # Deleted from another state store, the Tagging API missing resources
+    proxies = create_proxies(simulator)
+    sweep = proxies.inventory.sweep
+    proxies.inventory.sweep = lambda: [(resource_type, resources_ids[:1]) for resource_type, resources_ids in sweep()]
+    proxies.delete(ask_confirm=False, silent=True, delete_launch_templates=True)
+
+    assert get_leftover_resources(simulator) == {}
+
+
+def test_throttling_retry():
+    simulator = Ec2Simulator(time_scale=0.001, quotas={"addresses": 100}, throttle_rate=0.05, seed=1)
+    proxies = create_proxies(simulator)
+
+    proxies.create(get_proxies_config(12), ask_confirm=False, silent=True)
+    assert len(proxies.get_running_proxies_ips(wait=True)) == 12
+    proxies.delete(ask_confirm=False, silent=True, delete_launch_templates=True)
+
+    # The throttled calls are retried by botocore
+    assert simulator.get_stats()["Throttled"] > 0
+    assert get_errors_count(simulator, "RequestLimitExceeded") == simulator.get_stats()["Throttled"]
+    assert get_leftover_resources(simulator) == {}
+
+
+def test_quota_exceeded():
+    # 5 elastic ips at most, the AWS default
+    simulator = Ec2Simulator(time_scale=0.001, seed=1)
+    proxies = create_proxies(simulator)
+
+    with pytest.raises(ClientError) as excinfo:
+        proxies.create(get_proxies_config(24), ask_confirm=False, silent=True)
+    assert excinfo.value.response["Error"]["Code"] == "AddressLimitExceeded"
+    assert simulator.get_stats()["Resources"]["address"] == 5
+
+    # The partially created proxies are deleted
+    proxies.delete(ask_confirm=False, silent=True, delete_launch_templates=True)
+    assert get_leftover_resources(simulator) == {}
+
+
+def test_eip_pool_quota_exceeded():
+    # 5 elastic ips at most, the AWS default
+    simulator = Ec2Simulator(time_scale=0.001, seed=1)
+    session = simulator.create_session()
+    eip_pool = EipPool(session.resource("ec2"), session.client("ec2"), "proxies", size=10,
+                       state_store=MemoryStateStore())
+
+    with pytest.raises(ClientError) as excinfo:
+        eip_pool.refill()
+    assert excinfo.value.response["Error"]["Code"] == "AddressLimitExceeded"
+
+    # The elastic ips allocated before the failure are tagged, and pooled
+    assert eip_pool.available_count() == 5
+    assert len(eip_pool.get_addresses()) == 5
+    eip_pool.delete()
+    assert get_leftover_resources(simulator) == {}
+
+
+def test_filter_limit_exceeded():
+    simulator = Ec2Simulator(time_scale=0.001, seed=1)
+    ec2_client = simulator.create_session().client("ec2")
+    instances_ids = ["i-{0:017x}".format(i) for i in range(450)]
+
+    with pytest.raises(ClientError) as excinfo:
+        ec2_client.describe_instances(Filters=[
+            {
+                "Name": "instance-id",
+                "Values": instances_ids[:200]
+            },
+            {
+                "Name": "instance-state-name",
+                "Values": ["running"]
+            }
+        ])
+    assert excinfo.value.response["Error"]["Code"] == "FilterLimitExceeded"
+    assert excinfo.value.response["ResponseMetadata"]["HTTPStatusCode"] == 400
+
+    # iter_resources splits the filter values across calls
+    assert list(iter_resources(ec2_client, "describe_instances", {
+        "instance-id": instances_ids,
+        "instance-state-name": "running"
+    })) == []
+    assert simulator.get_stats()["Calls"]["DescribeInstances"]["Count"] == 4
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+# Finished spans kept by default, the oldest ones being dropped first
+MAX_SPANS = 10000
+
+
+class Span(object):
+    """Traced span representation
+    """
+
+    def __init__(self, span_id, name, parent_id=None, attributes=None):
+        """Constructor
+
+        Args:
+            span_id (integer): Span ID
+            name (string): Span name
+            parent_id (integer, optional): Parent span ID
+            attributes (dict, optional): Span attributes
+        """
+        self.span_id = span_id
+        self.name = name
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.thread_id = threading.current_thread().ident
+        self.detached = False
+        self.start = None
+        self.end = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        """Set a span attribute
+
+        Args:
+            key (string): Attribute name
+            value (object): Attribute value (must be JSON serializable)
+        """
+        self.attributes[key] = value
+
+    def add_attribute_value(self, key, value):
+        """Append a value to a list attribute
+
+        Args:
+            key (string): Attribute name
+            value (object): Value to append
+        """
+        self.attributes.setdefault(key, []).append(value)
+
+    @property
+    def duration(self):
+        """Span duration in seconds
+
+        Returns:
+            float: Duration or None if the span is not finished
+        """
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+
+class NullSpan(object):
+    """Span used when tracing is disabled or no span is active
+    """
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def add_attribute_value(self, key, value):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer(object):
+    """Span based tracer which can be exported as a Chrome trace-event file
+    """
+
+    def __init__(self, enabled=True, max_spans=MAX_SPANS):
+        """Constructor
+
+        Args:
+            enabled (bool, optional): Record spans
+            max_spans (integer, optional): Maximum number of finished spans kept, all of them with None
+        """
+        self.enabled = enabled
+        self.max_spans = max_spans
+        self.spans = []
+        self.origin = time.time()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        """Get the active spans stack of the current thread
+
+        Returns:
+            list: Active spans
+        """
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def current_span(self):
+        """Get the innermost active span of the current thread
+
+        Returns:
+            object: Span or NullSpan
+        """
+        stack = self._stack()
+        if stack:
+            return stack[-1]
+        return NULL_SPAN
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        """Trace a block of code
+
+        Args:
+            name (string): Span name
+            parent (object, optional): Parent span. Defaults to the current
+                thread active span; pass it explicitly for work handed to
+                other threads
+            **attributes: Span attributes
+
+        Yields:
+            object: Span
+        """
+        if not self.enabled:
+            yield NULL_SPAN
+            return
+
+        if parent is None:
+            parent = self.current_span()
+
+        with self._lock:
+            span_id = next(self._ids)
+
+        span = Span(span_id, name, parent.span_id, attributes)
+        stack = self._stack()
+        stack.append(span)
+        span.start = time.time()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.end = time.time()
+            stack.pop()
+            with self._lock:
+                self.spans.append(span)
+                if self.max_spans is not None and len(self.spans) > self.max_spans:
+                    del self.spans[:len(self.spans) - self.max_spans]
+
+    @contextmanager
+    def detached_span(self, name, parent=None, **attributes):
+        """Trace a block of code without binding the span to the current thread
+
+        Use it for code interleaved on a same thread, such as asyncio tasks, where
+        the thread active spans stack does not reflect the nesting. Detached spans
+        are never implicit parents and are exported as Chrome async events.
+
+        Args:
+            name (string): Span name
+            parent (object, optional): Parent span
+            **attributes: Span attributes
+
+        Yields:
+            object: Span
+        """
+        if not self.enabled:
+            yield NULL_SPAN
+            return
+
+        with self._lock:
+            span_id = next(self._ids)
+
+        span = Span(span_id, name, (parent or NULL_SPAN).span_id, attributes)
+        span.detached = True
+        span.start = time.time()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.end = time.time()
+            with self._lock:
+                self.spans.append(span)
+                if self.max_spans is not None and len(self.spans) > self.max_spans:
+                    del self.spans[:len(self.spans) - self.max_spans]
+
+    def clear(self):
+        """Forget every finished span
+        """
+        with self._lock:
+            self.spans = []
+
+    def to_chrome_trace(self):
+        """Convert finished spans to Chrome trace-event format
+
+        Returns:
+            dict: Chrome trace (load it in chrome://tracing or Perfetto)
+        """
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+
+        spans_by_id = dict((span.span_id, span) for span in spans)
+        events = []
+        for span in spans:
+            args = dict(span.attributes)
+            args["span_id"] = span.span_id
+            args["parent_id"] = span.parent_id
+            if span.error is not None:
+                args["error"] = span.error
+
+            start = int((span.start - self.origin) * 1e6)
+            if span.detached:
+                # Detached spans can overlap on a same thread
+                for phase, ts in (("b", start), ("e", int((span.end - self.origin) * 1e6))):
+                    events.append({
+                        "name": span.name,
+                        "cat": "aws_proxies.async",
+                        "ph": phase,
+                        "id": span.span_id,
+                        "ts": ts,
+                        "pid": pid,
+                        "tid": span.thread_id,
+                        "args": args if phase == "b" else {}
+                    })
+                continue
+
+            events.append({
+                "name": span.name,
+                "cat": "aws_proxies",
+                "ph": "X",
+                "ts": start,
+                "dur": int((span.end - span.start) * 1e6),
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": args
+            })
+
+            # Nesting is implicit on a same thread. Link children running on
+            # other threads to their parent with flow events.
+            parent = spans_by_id.get(span.parent_id)
+            if parent is not None and parent.thread_id != span.thread_id:
+                events.append({
+                    "name": span.name,
+                    "cat": "aws_proxies.flow",
+                    "ph": "s",
+                    "id": span.span_id,
+                    "ts": start,
+                    "pid": pid,
+                    "tid": parent.thread_id
+                })
+                events.append({
+                    "name": span.name,
+                    "cat": "aws_proxies.flow",
+                    "ph": "f",
+                    "bp": "e",
+                    "id": span.span_id,
+                    "ts": start,
+                    "pid": pid,
+                    "tid": span.thread_id
+                })
+
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms"
+        }
+
+    def export_chrome_trace(self, path):
+        """Write finished spans to a Chrome trace-event JSON file
+
+        Args:
+            path (string): File path
+        """
+        with open(path, "w") as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
+
+
+def traced(name):
+    """Decorate a resources method so that each call is traced in a span
+
+    The decorated object needs a 'tracer' attribute.
+
+    Args:
+        name (string): Span name
+
+    Returns:
+        function: Decorator
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.tracer.span(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
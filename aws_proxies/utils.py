@@ -1,7 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import binascii
+import json
 import logging
+import os
+import socket
+from .state import INSTANCE
 import sys
+import tempfile
+
+try:  # Python 2
+    input = raw_input
+except NameError:
+    pass
 
 
 def setup_logger(name, level=logging.WARNING, boto_logging_level=logging.WARNING):
@@ -47,7 +58,7 @@ def create_suffix(suffix, index):
 # Taken from:
 # http://stackoverflow.com/questions/3041986/python-command-line-yes-no-input
 def query_yes_no(question, default="yes"):
-    """Ask a yes/no question via raw_input() and return their answer.
+    """Ask a yes/no question via input() and return their answer.
 
     "question" is a string that is presented to the user.
     "default" is the presumed answer if the user just hits <Enter>.
@@ -69,7 +80,7 @@ def query_yes_no(question, default="yes"):
 
     while True:
         sys.stdout.write(question + prompt)
-        choice = raw_input().lower()
+        choice = input().lower()
         if default is not None and choice == "":
             return valid[default]
         elif choice in valid:
@@ -132,44 +143,147 @@ def merge_dicts(*dict_args):
 
 
 def merge_config(conf1, conf2):
-    """Merge cconfig
+    """Merge a config indexed by resource ID into another one, in place
+
+    The entries of conf2 update the conf1 entries with the same key, the
+    other entries of both configs are kept.
 
     Args:
-        conf1 (dict): First configuration
+        conf1 (dict): First configuration, updated
         conf2 (dict): Second configuration
 
     Returns:
-        dict: Merge config
+        dict: Merged config (conf1)
     """
-    new_conf = {}
-    for key, value in conf2.iteritems():
+    for key, value in conf2.items():
         if key in conf1:
-            new_conf[key] = merge_dicts(conf1[key], value)
+            conf1[key].update(value)
+        else:
+            conf1[key] = value
 
-    return new_conf
+    return conf1
 
 
-def filter_resources(resource, filter_name, filter_value):
-        """Filter AWS resources
+# Response keys of the describe operations resources descriptions
+DESCRIBE_RESULT_KEYS = {
+    "describe_addresses": "Addresses",
+    "describe_instances": "Reservations",
+    "describe_internet_gateways": "InternetGateways",
+    "describe_network_acls": "NetworkAcls",
+    "describe_network_interfaces": "NetworkInterfaces",
+    "describe_route_tables": "RouteTables",
+    "describe_security_groups": "SecurityGroups",
+    "describe_subnets": "Subnets",
+    "describe_vpcs": "Vpcs",
+}
 
-        Args:
-            resource (object): EC2 resource
-            filter_name (string): Filter name
-            filter_value (string/list): Filter value(s)
+# EC2 rejects the calls with more filters values in all (FilterLimitExceeded)
+MAX_FILTER_VALUES = 200
 
-        Returns:
-            List: Filtered AWS resources
-        """
-        values = [filter_value]
-        if type(filter_value) is list:
-            values = filter_value
 
-        filters = [{
+def build_filters(filters):
+    """Build EC2 filters
+
+    Args:
+        filters (dict): Filter value(s) indexed by filter name
+
+    Returns:
+        list: EC2 filters
+    """
+    return [
+        {
             "Name": filter_name,
-            "Values": values
-        }]
+            "Values": filter_value if isinstance(filter_value, list) else [filter_value]
+        }
+        for filter_name, filter_value in sorted(filters.items())
+    ]
+
+
+def iter_filters_batches(filters):
+    """Split EC2 filters into batches of filters with at most MAX_FILTER_VALUES values in all
+
+    The values of the filter which has the most (e.g. the recorded resources IDs)
+    are split across the batches, the other filters being repeated in each one.
+
+    Args:
+        filters (dict): Filter value(s) indexed by filter name
 
-        return list(resource.filter(Filters=filters))
+    Yields:
+        list: EC2 filters
+
+    Raises:
+        ValueError: The other filters leave no room for the split filter values
+    """
+    filters = dict(
+        (filter_name, filter_value if isinstance(filter_value, list) else [filter_value])
+        for filter_name, filter_value in filters.items()
+    )
+    values_count = sum(len(filter_values) for filter_values in filters.values())
+    if values_count <= MAX_FILTER_VALUES:
+        yield build_filters(filters)
+        return
+
+    batched_filter_name = max(sorted(filters), key=lambda filter_name: len(filters[filter_name]))
+    batched_filter_values = filters[batched_filter_name]
+    batch_size = MAX_FILTER_VALUES - (values_count - len(batched_filter_values))
+    if batch_size <= 0:
+        raise ValueError("Only the filter '{0}' can be split, the other filters have more than {1} values".format(
+            batched_filter_name, MAX_FILTER_VALUES - 1))
+
+    for start in range(0, len(batched_filter_values), batch_size):
+        filters[batched_filter_name] = batched_filter_values[start:start + batch_size]
+        yield build_filters(filters)
+
+
+def iter_resources(ec2_client, operation, filters=None, page_size=None, projection=None):
+    """Iterate over the descriptions of EC2 resources, page by page
+
+    The filters are combined in a single call (the resources must match them
+    all) and the pages are only requested as the iteration goes. With more
+    filters values than EC2 accepts, the filter with the most values is split
+    into several calls, so that it must match a single-valued attribute (e.g. an
+    ID) for no resource to be yielded twice. The instances are yielded out of
+    their reservations.
+
+    Args:
+        ec2_client (object): Aws ec2 client
+        operation (string): Describe operation (see DESCRIBE_RESULT_KEYS)
+        filters (dict, optional): Filter value(s) indexed by filter name. A filter without values matches nothing
+        page_size (integer, optional): Resources per page
+        projection (list, optional): Description keys to keep. Defaults to the whole descriptions
+
+    Yields:
+        dict: Resource description
+    """
+    if filters:
+        if any(filter_value == [] for filter_value in filters.values()):
+            return
+        filters_batches = iter_filters_batches(filters)
+    else:
+        filters_batches = [None]
+
+    result_key = DESCRIBE_RESULT_KEYS[operation]
+    for filters_batch in filters_batches:
+        params = {}
+        if filters_batch is not None:
+            params["Filters"] = filters_batch
+
+        if ec2_client.can_paginate(operation):
+            if page_size:
+                params["PaginationConfig"] = {
+                    "PageSize": page_size
+                }
+            pages = ec2_client.get_paginator(operation).paginate(**params)
+        else:
+            pages = [getattr(ec2_client, operation)(**params)]
+
+        for page in pages:
+            for description in page.get(result_key, []):
+                for resource in (description["Instances"] if result_key == "Reservations" else [description]):
+                    if projection is None:
+                        yield resource
+                    else:
+                        yield dict((key, resource[key]) for key in projection if key in resource)
 
 
 def create_name_tag_for_resource(resource, tag_base_name, suffix=""):
@@ -245,6 +359,9 @@ def get_subnet_cidr_suffix(ips_count, cidr_suffix_ips_number_mapping):
 
         Returns:
             string: subnet cidr suffix
+
+        Raises:
+            ValueError: The ips count exceeds the largest subnet of the mapping
         """
         cidr_suffix = "/28"
         if cidr_suffix_ips_number_mapping is not None:
@@ -252,6 +369,11 @@ def get_subnet_cidr_suffix(ips_count, cidr_suffix_ips_number_mapping):
                 if item[0] > ips_count:
                     cidr_suffix = item[1]
                     break
+            else:
+                raise ValueError(
+                    "{0} ips do not fit in a subnet, the largest one ({1}) having {2} ips: shard the fleet "
+                    "across more vpcs with 'max_ips_per_vpc' or 'vpc_shards'".format(
+                        ips_count, cidr_suffix_ips_number_mapping[-1][1], cidr_suffix_ips_number_mapping[-1][0]))
 
         return cidr_suffix
 
@@ -273,3 +395,275 @@ def get_instance_eni_mapping(instance_type, eni_mapping):
             item for item in eni_mapping if item[0] == instance_type]
     return instance_eni_mapping
 
+
+def ip_to_int(ip):
+    """Convert an ipv4 address to an integer
+
+    Args:
+        ip (string): Ipv4 address
+
+    Returns:
+        integer: Ip as an integer
+    """
+    octets = [int(octet) for octet in ip.split(".")]
+    return (octets[0] << 24) + (octets[1] << 16) + (octets[2] << 8) + octets[3]
+
+
+def int_to_ip(value):
+    """Convert an integer to an ipv4 address
+
+    Args:
+        value (integer): Ip as an integer
+
+    Returns:
+        string: Ipv4 address
+    """
+    return ".".join(str((value >> shift) & 255) for shift in (24, 16, 8, 0))
+
+
+def ipv6_to_int(ip):
+    """Convert an ipv6 address to an integer
+
+    Args:
+        ip (string): Ipv6 address
+
+    Returns:
+        integer: Ip as an integer
+    """
+    return int(binascii.hexlify(socket.inet_pton(socket.AF_INET6, ip)), 16)
+
+
+def int_to_ipv6(value):
+    """Convert an integer to a compressed ipv6 address
+
+    Args:
+        value (integer): Ip as an integer
+
+    Returns:
+        string: Ipv6 address
+    """
+    return socket.inet_ntop(socket.AF_INET6, binascii.unhexlify("{0:032x}".format(value)))
+
+
+def get_ipv6_subnet_cidr_block(vpc_ipv6_cidr_block, subnet_index):
+    """Get the /64 ipv6 cidr block of the nth subnet of a vpc
+
+    Args:
+        vpc_ipv6_cidr_block (string): Vpc ipv6 cidr block, e.g. '2600:1f18:abc:de00::/56'
+        subnet_index (integer): Subnet index
+
+    Returns:
+        string: Subnet ipv6 cidr block, e.g. '2600:1f18:abc:de01::/64'
+
+    Raises:
+        ValueError: The subnet does not fit in the vpc ipv6 cidr block
+    """
+    network, prefix = vpc_ipv6_cidr_block.split("/")
+    if subnet_index >> (64 - int(prefix)):
+        raise ValueError("The subnet {0} does not fit in {1}".format(subnet_index, vpc_ipv6_cidr_block))
+
+    return int_to_ipv6(ipv6_to_int(network) + (subnet_index << 64)) + "/64"
+
+
+def get_network_interface_proxies_ips(aws_eni):
+    """Get the proxies ips of a described network interface
+
+    Each private ip associated to an elastic ip is a proxy ip, and so is each
+    ipv6 address, which is both the public and the private ip.
+
+    Args:
+        aws_eni (dict): Described network interface
+
+    Returns:
+        list: Tuples of public and private ips
+    """
+    ips = []
+    for aws_private_ip_address in aws_eni.get("PrivateIpAddresses", []):
+        if "Association" in aws_private_ip_address:
+            ips.append((aws_private_ip_address["Association"]["PublicIp"], aws_private_ip_address["PrivateIpAddress"]))
+    for aws_ipv6_address in aws_eni.get("Ipv6Addresses", []):
+        ips.append((aws_ipv6_address["Ipv6Address"], aws_ipv6_address["Ipv6Address"]))
+
+    return ips
+
+
+def get_shard_cidr_block(cidr_block, shard_index):
+    """Get the cidr block of a vpc shard
+
+    The shards cidr blocks are the blocks of the same size following the base one,
+    e.g. 15.0.0.0/16, 15.1.0.0/16, 15.2.0.0/16...
+
+    Args:
+        cidr_block (string): Base (first shard) cidr block
+        shard_index (integer): Shard index
+
+    Returns:
+        string: Shard cidr block
+    """
+    network, prefix = cidr_block.split("/")
+    block_size = 1 << (32 - int(prefix))
+    network_int = ip_to_int(network) & ~(block_size - 1) & 0xFFFFFFFF
+    shard_network_int = network_int + shard_index * block_size
+    if shard_network_int > 0xFFFFFFFF:
+        raise ValueError("The cidr block {0} can not be sharded {1} times".format(cidr_block, shard_index + 1))
+
+    return "{0}/{1}".format(int_to_ip(shard_network_int), prefix)
+
+
+def get_shard_cidr_block_formatting(cidr_block_formatting, shard_cidr_block, shard_index):
+    """Get the cidr block formatting of a vpc shard
+
+    Args:
+        cidr_block_formatting (string): Base (first shard) cidr block formatting, e.g. '15.0.\\{0\\}.\\{1\\}'
+        shard_cidr_block (string): Shard cidr block
+        shard_index (integer): Shard index
+
+    Returns:
+        string: Shard cidr block formatting, e.g. '15.1.\\{0\\}.\\{1\\}'
+
+    Raises:
+        ValueError: The shard cidr block is smaller than a /16
+    """
+    if shard_index == 0:
+        return cidr_block_formatting
+
+    network, prefix = shard_cidr_block.split("/")
+    if int(prefix) > 16:
+        raise ValueError("Only vpcs cidr blocks of /16 or larger can be sharded, got {0}".format(shard_cidr_block))
+
+    octets = network.split(".")
+    return octets[0] + "." + octets[1] + ".\\{0\\}.\\{1\\}"
+
+
+def get_indexed_subnet_cidr_block(cidr_block_formatting, subnet_index, subnet_suffix):
+    """Get the cidr block of the nth subnet of a given size in a vpc
+
+    Args:
+        cidr_block_formatting (string): Cidr block formating
+        subnet_index (integer): Subnet index
+        subnet_suffix (string): subnet suffix
+
+    Returns:
+        string: Subnet cidr block
+
+    Raises:
+        ValueError: The subnet does not fit in the cidr block formatting
+    """
+    block_size = 1 << (32 - int(subnet_suffix.lstrip("/")))
+    offset = subnet_index * block_size
+    if offset >> 16:
+        raise ValueError("The subnet {0} of size {1} does not fit in {2}".format(
+            subnet_index, subnet_suffix, cidr_block_formatting))
+
+    return cidr_block_formatting.replace(
+        "\\", "").format(offset >> 8, offset & 255) + subnet_suffix
+
+
+def get_cidr_block_gateway_ip(cidr_block):
+    """Get the gateway (router) ip of a subnet, the first ip after its network address
+
+    Args:
+        cidr_block (string): Subnet cidr block
+
+    Returns:
+        string: Gateway ip
+    """
+    return int_to_ip(ip_to_int(cidr_block.split("/")[0]) + 1)
+
+
+def distribute_availability_zones(zones_weights, count):
+    """Distribute items across availability zones using a smooth weighted round-robin
+
+    Args:
+        zones_weights (list): Tuples of availability zone and weight
+        count (integer): Items count
+
+    Returns:
+        list: Zone index of each item
+    """
+    total_weight = sum(weight for zone, weight in zones_weights)
+    current_weights = [0] * len(zones_weights)
+    distribution = []
+    for i in range(0, count):
+        for zone_index, (zone, weight) in enumerate(zones_weights):
+            current_weights[zone_index] += weight
+        selected_index = current_weights.index(max(current_weights))
+        current_weights[selected_index] -= total_weight
+        distribution.append(selected_index)
+
+    return distribution
+
+
+def run_concurrently(func, items, max_workers=None):
+    """Call a function on every item from a thread pool
+
+    Args:
+        func (function): Function taking an item
+        items (list): Items
+        max_workers (integer, optional): Maximum number of threads. Defaults to one per item
+
+    Returns:
+        list: Results, in the items order
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+
+    # Imported on first use to keep the package import fast
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(min(len(items), max_workers or len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_fleet_instances_filter(state_store, tag_base_name):
+    """Get the filter matching the fleet instances
+
+    The instances IDs recorded in the state store are used when there are
+    some, otherwise the instances are matched by tag name.
+
+    Args:
+        state_store (object): State store
+        tag_base_name (string): Tag base name
+
+    Returns:
+        dict: Filter value(s) indexed by filter name (see iter_resources)
+    """
+    instances_ids = state_store.get_resource_ids(tag_base_name, INSTANCE)
+    if instances_ids:
+        return {
+            "instance-id": instances_ids
+        }
+
+    return {
+        "tag:Name": tag_base_name + '-*'
+    }
+
+
+def write_json_atomically(path, data):
+    """Write a JSON file atomically
+
+    The data is written to a temporary file of the same directory which then
+    replaces the file, so that readers see either the previous or the new content.
+
+    Args:
+        path (string): File path
+        data (object): JSON serializable data
+    """
+    path = os.path.expanduser(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        # os.rename does not replace an existing file on Windows
+        getattr(os, "replace", os.rename)(temporary_path, path)
+    except Exception:
+        os.remove(temporary_path)
+        raise
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
-from base_resources import BaseResources
+from .base_resources import BaseResources
 import logging
-from utils import setup_logger, filter_resources, tag_with_name_with_suffix
+from .state import VPC
+import time
+from .tracing import traced
+from .utils import setup_logger, iter_resources
 
 
 class Vpcs(BaseResources):
@@ -21,7 +24,8 @@ class Vpcs(BaseResources):
         Raises:
             TypeError: Description
         """
-        BaseResources.__init__(self, ec2, ec2_client, tag_base_name)
+        BaseResources.__init__(self, ec2, ec2_client, tag_base_name,
+                               kwargs.pop("tracer", None), kwargs.pop("state_store", None))
         log_level = kwargs.pop("log_level", logging.WARNING)
         boto_log_level = kwargs.pop("boto_log_level", logging.WARNING)
 
@@ -29,6 +33,7 @@ class Vpcs(BaseResources):
             raise TypeError("Unexpected **kwargs: %r" % kwargs)
         self.logger = setup_logger(__name__, log_level, boto_log_level)
 
+    @traced("vpcs.get_or_create")
     def get_or_create(self, config):
         """Get or create Aws Ec2 vpcs
 
@@ -41,40 +46,89 @@ class Vpcs(BaseResources):
 
         created_vpcs = {}
         for index, vpc_config in enumerate(config):
-            vpcs = filter_resources(
-                self.ec2.vpcs, "cidrBlock", vpc_config["CidrBlock"])
-
-            if not vpcs:
-                vpc = self.ec2.create_vpc(CidrBlock=vpc_config["CidrBlock"])
-            else:
-                vpc = self.ec2.Vpc(vpcs[0].id)
+            # Only the fleet vpcs are reused, other vpcs (e.g. of another fleet generation) can have the cidr block
+            aws_vpc = next(iter_resources(self.ec2_client, "describe_vpcs", {
+                "cidrBlock": vpc_config["CidrBlock"],
+                "tag:Name": self.tag_base_name + "-vpc-*"
+            }, projection=["VpcId", "Ipv6CidrBlockAssociationSet"]), None)
+
+            if aws_vpc is None:
+                vpc_params = {
+                    "CidrBlock": vpc_config["CidrBlock"]
+                }
+                if vpc_config.get("Ipv6"):
+                    vpc_params["AmazonProvidedIpv6CidrBlock"] = True
+                aws_vpc = self.ec2_client.create_vpc(**vpc_params)["Vpc"]
+            vpc_id = aws_vpc["VpcId"]
+
+            if vpc_config.get("Ipv6"):
+                vpc_config["Ipv6CidrBlock"] = self.__get_or_associate_ipv6_cidr_block(aws_vpc)
 
             self.logger.info("A vpc with ID '%s' and cidr block '%s' has been created or already exists",
-                             vpc.vpc_id,
+                             vpc_id,
                              vpc_config["CidrBlock"]
                              )
 
-            tag_with_name_with_suffix(
-                vpc, "vpc", index, self.tag_base_name)
+            self.tag(vpc_id, "vpc", vpc_config.get("Index", index))
+
+            self.tracer.current_span().add_attribute_value("vpc_ids", vpc_id)
+
+            self.record_resource(VPC, vpc_id, attributes={"CidrBlock": vpc_config["CidrBlock"]})
 
-            vpc_config["VpcId"] = vpc.vpc_id
-            created_vpcs[vpc.vpc_id] = vpc_config
+            vpc_config["VpcId"] = vpc_id
+            created_vpcs[vpc_id] = vpc_config
 
         return created_vpcs
 
+    def __get_or_associate_ipv6_cidr_block(self, aws_vpc, timeout=300):
+        """Get the Amazon provided ipv6 cidr block of a vpc, associating one if it has none
+
+        The association is asynchronous, the vpc is described until it completes.
+
+        Args:
+            aws_vpc (dict): Vpc description
+            timeout (integer, optional): Seconds to wait for the association
+
+        Returns:
+            string: Vpc /56 ipv6 cidr block
+
+        Raises:
+            RuntimeError: The ipv6 cidr block has not been associated in time
+        """
+        vpc_id = aws_vpc["VpcId"]
+        associations = [association for association in aws_vpc.get("Ipv6CidrBlockAssociationSet", [])
+                        if association["Ipv6CidrBlockState"]["State"] in ("associating", "associated")]
+        if not associations:
+            associations = [self.ec2_client.associate_vpc_cidr_block(
+                VpcId=vpc_id, AmazonProvidedIpv6CidrBlock=True)["Ipv6CidrBlockAssociation"]]
+
+        deadline = time.time() + timeout
+        while associations[0]["Ipv6CidrBlockState"]["State"] != "associated":
+            if time.time() > deadline:
+                raise RuntimeError("The vpc '%s' ipv6 cidr block has not been associated in time" % vpc_id)
+            time.sleep(2)
+            aws_vpc = next(iter_resources(self.ec2_client, "describe_vpcs", {
+                "vpc-id": vpc_id
+            }, projection=["Ipv6CidrBlockAssociationSet"]), {})
+            associations = [association for association in aws_vpc.get("Ipv6CidrBlockAssociationSet", [])
+                            if association["Ipv6CidrBlockState"]["State"] in ("associating", "associated")] \
+                or associations
+
+        self.logger.info("The vpc '%s' has the ipv6 cidr block '%s'",
+                         vpc_id, associations[0]["Ipv6CidrBlock"])
+
+        return associations[0]["Ipv6CidrBlock"]
+
+    @traced("vpcs.delete")
     def delete(self):
         """Delete Vpcs
         """
-        vpcs = filter_resources(
-            self.ec2.vpcs,
-            "tag:Name",
-            self.tag_base_name + '-*'
-        )
-
-        for vpc in vpcs:
-            vpc.delete()
+        for aws_vpc in self.iter_fleet_resources("describe_vpcs", VPC, "vpc-id", projection=["VpcId"]):
+            self.ec2_client.delete_vpc(VpcId=aws_vpc["VpcId"])
+            self.forget_resource(VPC, aws_vpc["VpcId"])
+            self.tracer.current_span().add_attribute_value("vpc_ids", aws_vpc["VpcId"])
 
             self.logger.info(
                 "The vpc with ID '%s' has been deleted ",
-                vpc.id,
+                aws_vpc["VpcId"],
             )
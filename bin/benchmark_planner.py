@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the fleet planner
+
+The planner runs without any AWS access: the images ids are given and the
+availability zones are listed in the instances config.
+
+Usage:
+    python bin/benchmark_planner.py [--runs 5] [--ips 1000 10000 100000]
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aws_proxies import settings  # noqa: E402
+from aws_proxies.planner import Planner  # noqa: E402
+
+INSTANCES_CONFIG = {
+    "InstanceType": "t2.medium",
+    "ImageId": "ami-00000000",
+    "VPCCidrBlock": "15.0.0.0/16",
+    "CidrBlockFormatting": "15.0.\\{0\\}.\\{1\\}",
+    "SecurityGroups": [
+        {
+            "GroupName": "proxies",
+            "Description": "Security group for proxies"
+        }
+    ]
+}
+
+SCENARIOS = [
+    ("t2.medium, 50000 ips per vpc", "t2.medium", {"max_ips_per_vpc": 50000}, {}),
+    ("t2.medium, 3 zones, 1000 ips per vpc", "t2.medium", {"max_ips_per_vpc": 1000},
+     {"AvailabilityZones": ["us-east-1a", "us-east-1b", "us-east-1c"]}),
+    ("t2.nano, 3 zones, 1000 ips per vpc", "t2.nano", {"max_ips_per_vpc": 1000},
+     {"AvailabilityZones": ["us-east-1a", "us-east-1b", "us-east-1c"]}),
+]
+
+
+def run_scenario(planner, available_ips, instance_type, proxies_extra_config, instances_extra_config):
+    """Plan a fleet
+
+    Args:
+        planner (object): Planner
+        available_ips (integer): Available ips
+        instance_type (string): Instance type
+        proxies_extra_config (dict): Proxies config additional keys
+        instances_extra_config (dict): Instances config additional keys
+
+    Returns:
+        tuple: Elapsed seconds and planned network interfaces count
+    """
+    instances_config = copy.deepcopy(INSTANCES_CONFIG)
+    instances_config["InstanceType"] = instance_type
+    instances_config.update(instances_extra_config)
+    proxies_config = {
+        "available_ips": available_ips,
+        "instances_config": [instances_config]
+    }
+    proxies_config.update(proxies_extra_config)
+
+    start = time.time()
+    plan = planner.plan(proxies_config)
+    elapsed = time.time() - start
+
+    enis_count = sum(
+        len(subnet["NetworkInterfaces"]) for vpc_config in plan["vpcs"] for subnet in vpc_config["Subnets"]
+    )
+    return elapsed, enis_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fleet planner")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per scenario")
+    parser.add_argument("--ips", type=int, nargs="+", default=[1000, 10000, 100000], help="Available ips")
+    args = parser.parse_args()
+
+    planner = Planner(
+        eni_mapping=settings.ENI_MAPPING,
+        cidr_suffix_ips_number_mapping=settings.CIDR_SUFFIX_IPS_NUMBER_MAPPING
+    )
+
+    print("{0:<40} {1:>8} {2:>8} {3:>10} {4:>11}".format("scenario", "ips", "enis", "min (ms)", "median (ms)"))
+    for name, instance_type, proxies_extra_config, instances_extra_config in SCENARIOS:
+        for available_ips in args.ips:
+            results = [
+                run_scenario(planner, available_ips, instance_type, proxies_extra_config, instances_extra_config)
+                for i in range(args.runs)
+            ]
+            timings = sorted(elapsed for elapsed, enis_count in results)
+            print("{0:<40} {1:>8} {2:>8} {3:>10.1f} {4:>11.1f}".format(
+                name,
+                available_ips,
+                results[0][1],
+                timings[0] * 1000,
+                timings[len(timings) // 2] * 1000
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark the aws_proxies import and startup time
+
+Each scenario runs in a fresh interpreter so that nothing is already imported.
+No AWS call is made, only the session, clients and managers are built.
+
+Usage:
+    python bin/benchmark_startup.py [--runs 10] [--profile default]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = [
+    (
+        "import aws_proxies.proxies",
+        "import aws_proxies.proxies"
+    ),
+    (
+        "Proxies()",
+        "from aws_proxies.proxies import Proxies\n"
+        "Proxies({profile!r})"
+    ),
+    (
+        "Proxies().ec2_client (read-only queries)",
+        "from aws_proxies.proxies import Proxies\n"
+        "Proxies({profile!r}).ec2_client"
+    ),
+    (
+        "Proxies() with every manager",
+        "from aws_proxies.proxies import Proxies, MANAGERS\n"
+        "proxies = Proxies({profile!r})\n"
+        "for name in MANAGERS:\n"
+        "    getattr(proxies, name)"
+    ),
+]
+
+TIMER = """import time
+start = time.time()
+{code}
+elapsed = time.time() - start
+import sys
+sys.stdout.write("%f %d" % (elapsed, "boto3" in sys.modules))
+"""
+
+
+def run_scenario(code, profile):
+    """Run a scenario in a fresh interpreter
+
+    Args:
+        code (string): Scenario code
+        profile (string): AWS profile
+
+    Returns:
+        tuple: Elapsed seconds and whether boto3 was imported
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    output = subprocess.check_output(
+        [sys.executable, "-c", TIMER.format(code=code.format(profile=profile))],
+        env=env
+    )
+    elapsed, boto3_imported = output.decode("ascii").split()
+    return float(elapsed), boto3_imported == "1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the aws_proxies import and startup time")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per scenario")
+    parser.add_argument("--profile", default=None, help="AWS profile")
+    args = parser.parse_args()
+
+    print("{0:<45} {1:>10} {2:>10} {3:>8}".format("scenario", "min (ms)", "median (ms)", "boto3"))
+    for name, code in SCENARIOS:
+        results = [run_scenario(code, args.profile) for i in range(args.runs)]
+        timings = sorted(elapsed for elapsed, boto3_imported in results)
+        print("{0:<45} {1:>10.1f} {2:>10.1f} {3:>8}".format(
+            name,
+            timings[0] * 1000,
+            timings[len(timings) // 2] * 1000,
+            "yes" if results[0][1] else "no"
+        ))
+
+
+if __name__ == "__main__":
+    main()
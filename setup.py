@@ -51,6 +51,7 @@ setup(
         'Programming Language :: Python :: 2',
         'Programming Language :: Python :: 2.6',
         'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3',
     ],
 
     # What does your project relate to?
@@ -77,5 +78,14 @@ setup(
     extras_require={
         'dev': ['pytest'],
         'test': ['pytest'],
+        'async': ['aiobotocore'],
+    },
+
+    # To provide executable scripts, use entry points in preference to the
+    # "scripts" keyword.
+    entry_points={
+        'console_scripts': [
+            'aws-proxies=aws_proxies.cli:main',
+        ],
     },
 )
\ No newline at end of file